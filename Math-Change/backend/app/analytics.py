@@ -0,0 +1,54 @@
+import os
+import time
+
+from .cache import TTLCache
+from .database import supabase
+from .metrics import cache_lookup
+from .shared_cache import shared_cache
+
+ANALYTICS_TREND_DAYS = int(os.environ.get("ANALYTICS_TREND_DAYS", "30"))
+ANALYTICS_RECENT_GAMES = int(os.environ.get("ANALYTICS_RECENT_GAMES", "10"))
+
+# Analytics of a user only change when their games do, so an entry lives until
+# the next save or deletion of one of their games (invalidate_user_analytics).
+# With a shared cache backend the invalidation reaches every worker through
+# pub/sub; the TTL bounds how stale another worker's copy can be otherwise.
+analytics_cache = TTLCache(
+    maxsize=int(os.environ.get("ANALYTICS_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("ANALYTICS_CACHE_TTL", "3600")),
+)
+# When each user was last invalidated, so a computation that was already
+# running during the write does not store its result
+_invalidated = TTLCache(maxsize=analytics_cache.maxsize, ttl=300)
+
+
+async def get_user_analytics(user_id: str) -> dict:
+    """Fixed-size analytics payload of one user, see user_analytics() in schema.sql."""
+    cached = analytics_cache.get(user_id)
+    cache_lookup("analytics", cached is not None)
+    if cached is not None:
+        return cached
+    started = time.time()
+    res = await supabase.rpc(
+        "user_analytics",
+        {"p_user_id": user_id, "p_trend_days": ANALYTICS_TREND_DAYS, "p_recent": ANALYTICS_RECENT_GAMES},
+    ).execute()
+    data = res.data
+    invalidated_at = _invalidated.get(user_id)
+    if invalidated_at is None or invalidated_at < started:
+        analytics_cache.set(user_id, data)
+    return data
+
+
+def _drop_local(user_id: str) -> None:
+    _invalidated.set(user_id, time.time())
+    analytics_cache.delete(user_id)
+
+
+shared_cache.on_invalidate("analytics", _drop_local)
+
+
+async def invalidate_user_analytics(user_id: str) -> None:
+    """Drop the cached analytics of this user in every worker (call after their games change)."""
+    if user_id:
+        await shared_cache.invalidate("analytics", user_id)
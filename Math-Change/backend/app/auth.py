@@ -6,26 +6,48 @@ from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
 import os
 from dotenv import load_dotenv
-import httpx
 import uuid
 import json
+import time
+import hashlib
+import logging
 from .database import supabase
+from .cache import TTLCache
+from .keys import GoogleKeyStore, GOOGLE_KEYS_URL
+from .shared_cache import shared_cache
+from .metrics import TOKEN_VERIFICATIONS, cache_lookup
+from .tracing import tracing
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Configuration
 SECRET_KEY = os.environ.get("SECRET_KEY", "supersecretkey_change_me_in_prod")
 ALGORITHM = "HS256"
 # Firebase Project ID from env or fallback
 FIREBASE_PROJECT_ID = os.environ.get("FIREBASE_PROJECT_ID", "fast-ingles")
-GOOGLE_KEYS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
 
 # Constants for Legacy Config (Maintained for main.py imports)
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7 # 1 week
 
-# Cache for Google Public Keys
-_google_keys_cache = {}
-_google_keys_expire = 0
+# Google Public Keys (parsed per kid, refreshed in the background, see keys.py).
+# With a shared cache backend one worker fetches them for all.
+google_keys = GoogleKeyStore(GOOGLE_KEYS_URL, shared=shared_cache)
+
+# Verified-identity cache of this worker: sha256(token) -> (firebase claims,
+# users row). Entries never outlive the token's own `exp`, and are dropped
+# explicitly when the user row changes (see invalidate_user). With a shared
+# cache backend, verified tokens ("token:<sha256>" -> claims and user id) and
+# user rows ("user:<id>") are kept there too, so a token verified by one
+# worker is not verified again by the others.
+identity_cache = TTLCache(
+    maxsize=int(os.environ.get("TOKEN_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("TOKEN_CACHE_TTL", "300")),
+)
+# When each user was last invalidated, so a users row read before the write
+# (a request already in flight) is not cached after it
+_invalidated = TTLCache(maxsize=identity_cache.maxsize, ttl=300)
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
@@ -48,41 +70,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_google_keys():
-    global _google_keys_cache, _google_keys_expire
-    now = datetime.utcnow().timestamp()
-    
-    if _google_keys_cache and now < _google_keys_expire:
-        return _google_keys_cache
-        
-    try:
-        response = httpx.get(GOOGLE_KEYS_URL)
-        if response.status_code == 200:
-            # Cache-Control: public, max-age=24475, must-revalidate, no-transform
-            cache_control = response.headers.get("Cache-Control", "")
-            max_age = 3600 # Default 1 hour
-            
-            if "max-age=" in cache_control:
-                try:
-                    parts = cache_control.split(",")
-                    for part in parts:
-                        if "max-age=" in part:
-                            max_age = int(part.strip().split("=")[1])
-                except Exception:
-                    pass
-            
-            _google_keys_cache = response.json()
-            _google_keys_expire = now + max_age
-            return _google_keys_cache
-    except Exception as e:
-        print(f"Error fetching Google keys: {e}")
-        # If fetch fails but we have stale cache, return it
-        if _google_keys_cache:
-            return _google_keys_cache
-            
-    return {}
-
-def verify_firebase_token(token: str):
+async def verify_firebase_token(token: str):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="No se pudo validar las credenciales de Firebase",
@@ -94,20 +82,14 @@ def verify_firebase_token(token: str):
         header = jwt.get_unverified_header(token)
         kid = header.get("kid")
         if not kid:
-            print("No kid found in token header")
+            logger.debug("No kid found in token header")
             raise credentials_exception
             
-        keys = get_google_keys()
-        if kid not in keys:
-            print(f"Key ID {kid} not found in Google keys")
-            # Force refresh just in case
-            global _google_keys_expire
-            _google_keys_expire = 0
-            keys = get_google_keys()
-            if kid not in keys:
-                raise credentials_exception
-        
-        public_key = keys[kid]
+        # Unknown kids trigger at most one shared refetch (rotation), see GoogleKeyStore
+        public_key = await google_keys.get_key(kid)
+        if public_key is None:
+            logger.warning("Key ID %s not found in Google keys", kid)
+            raise credentials_exception
         
         # Decode and verify
         # Audience must be our Firebase Project ID
@@ -122,17 +104,92 @@ def verify_firebase_token(token: str):
         return payload
         
     except JWTError as e:
-        print(f"JWT Verification Error: {e}")
+        logger.debug("JWT verification failed: %s", e)
         raise credentials_exception
     except Exception as e:
-        print(f"Token Verification Error: {e}")
+        logger.warning("Token verification failed: %s", e)
         raise credentials_exception
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
+def _token_key(token: str) -> str:
+    # Never keep raw bearer tokens in memory longer than needed
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def _stale(user_id: str, fetched_at: float) -> bool:
+    invalidated_at = _invalidated.get(user_id)
+    return invalidated_at is not None and invalidated_at >= fetched_at
+
+async def _cache_identity(token: str, firebase_payload: dict, user: dict, fetched_at: float) -> dict:
+    if _stale(user.get("id"), fetched_at):
+        return user
+    ttl = min(firebase_payload.get("exp", 0) - time.time(), identity_cache.ttl)
+    token_key = _token_key(token)
+    identity_cache.set(token_key, (firebase_payload, user), ttl=ttl, tag=user.get("id"))
+    if shared_cache.shared:
+        await shared_cache.set(f"token:{token_key}", {"claims": firebase_payload, "user_id": user.get("id")}, ttl=ttl)
+        await shared_cache.set(f"user:{user.get('id')}", user, ttl=identity_cache.ttl)
+    return user
+
+async def _shared_identity(token_key: str) -> Optional[dict]:
+    """Identity verified by another worker: its claims and the shared users row (or a PK lookup)."""
+    entry = await shared_cache.get(f"token:{token_key}")
+    if entry is None:
+        return None
+    user_id = entry["user_id"]
+    fetched_at = time.time()
+    user = await shared_cache.get(f"user:{user_id}")
+    if user is None:
+        res = await supabase.table("users").select("*").eq("id", user_id).execute()
+        if not res.data:
+            return None
+        user = res.data[0]
+        if _stale(user_id, fetched_at):
+            return user
+        await shared_cache.set(f"user:{user_id}", user, ttl=identity_cache.ttl)
+    if _stale(user_id, fetched_at):
+        return user
+    ttl = entry["claims"].get("exp", 0) - time.time()
+    identity_cache.set(token_key, (entry["claims"], user), ttl=ttl, tag=user_id)
+    return user
+
+async def invalidate_user(user_id: str) -> None:
+    """Drop every cached identity of this user, in every worker (call after the users row changes)."""
+    if user_id:
+        if shared_cache.shared:
+            await shared_cache.delete(f"user:{user_id}")
+        await shared_cache.invalidate("user", user_id)
+
+def _drop_local(user_id: str) -> None:
+    _invalidated.set(user_id, time.time())
+    identity_cache.invalidate_tag(user_id)
+
+shared_cache.on_invalidate("user", _drop_local)
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     # This logic now handles Firebase ID Tokens
+
+    # 0. Cached identity for this exact token (already verified, not expired)
+    cached = identity_cache.get(_token_key(token))
+    cache_lookup("identity", cached is not None)
+    if cached is not None:
+        return dict(cached[1])
+    if shared_cache.shared:
+        try:
+            user = await _shared_identity(_token_key(token))
+        except Exception as e:
+            logger.warning("Shared identity lookup failed: %s", e)
+            user = None
+        cache_lookup("shared_identity", user is not None)
+        if user is not None:
+            return dict(user)
     
     # 1. Verify Token
-    firebase_payload = verify_firebase_token(token)
+    try:
+        with tracing.span("auth.verify_token"):
+            firebase_payload = await verify_firebase_token(token)
+    except HTTPException:
+        TOKEN_VERIFICATIONS.labels("rejected").inc()
+        raise
+    TOKEN_VERIFICATIONS.labels("valid").inc()
     
     email = firebase_payload.get("email")
     if not email:
@@ -145,11 +202,12 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
     # 3. Find or Create User in Database
     # We use EMAIL to link to existing users from the old system
     try:
-        res = supabase.table("users").select("*").eq("email", email).execute()
+        fetched_at = time.time()
+        res = await supabase.table("users").select("*").eq("email", email).execute()
         
         if res.data and len(res.data) > 0:
             # User exists
-            return res.data[0]
+            return dict(await _cache_identity(token, firebase_payload, res.data[0], fetched_at))
         else:
             # JIT Provisioning: Create user if they don't exist
             # Note: We generate a new UUID for our DB ID, distinct from Firebase UID
@@ -173,21 +231,21 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
                 "unlockedLevel": 0
             }
             
-            insert_res = supabase.table("users").insert(new_user).execute()
+            insert_res = await supabase.table("users").insert(new_user).execute()
             
             if insert_res.data:
-                return insert_res.data[0]
+                return dict(await _cache_identity(token, firebase_payload, insert_res.data[0], fetched_at))
             else:
                 raise HTTPException(status_code=500, detail="Error creando usuario local")
                 
     except Exception as e:
-        print(f"DB Error in get_current_user: {e}")
+        logger.exception("Database error in get_current_user")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error de base de datos"
         )
 
-def get_admin_user(current_user: dict = Depends(get_current_user)):
+async def get_admin_user(current_user: dict = Depends(get_current_user)):
     if current_user.get("role") != "ADMIN":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -0,0 +1,46 @@
+import logging
+from typing import Dict, List
+
+from .images import RENDITION_FORMATS, RENDITION_SIZES
+from .storage import public_url, storage
+
+logger = logging.getLogger(__name__)
+
+# Avatar objects are content-addressed, their bytes never change
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def avatar_prefix(user_id: str) -> str:
+    return f"avatars/{user_id}/"
+
+
+def rendition_names() -> List[str]:
+    """
+    Object names of one avatar, e.g. ["64.webp", "64.avif", ..., "500.webp"].
+    The largest WEBP is last: it is uploaded after all the others and its
+    existence marks the avatar as complete.
+    """
+    names = [f"{size}.{ext}" for size in sorted(RENDITION_SIZES) for ext in RENDITION_FORMATS]
+    marker = f"{max(RENDITION_SIZES)}.webp"
+    names.remove(marker)
+    return names + [marker]
+
+
+def rendition_urls(base_key: str) -> Dict[str, Dict[str, str]]:
+    # {"webp": {"64": url, "128": url, "500": url}, "avif": {...}}
+    return {
+        ext: {str(size): public_url(f"{base_key}{size}.{ext}") for size in sorted(RENDITION_SIZES)}
+        for ext in RENDITION_FORMATS
+    }
+
+
+async def delete_previous_avatars(user_id: str, keep_prefix: str) -> None:
+    """Remove the user's older avatar objects (runs after the response is sent)."""
+    try:
+        deleted = await storage.delete_prefix(avatar_prefix(user_id), keep_prefix=keep_prefix)
+        # Single-file avatars from before renditions: <user_id>_<uuid4>.webp at the bucket root
+        deleted += await storage.delete_prefix(f"{user_id}_")
+        if deleted:
+            logger.debug("Deleted %d previous avatar objects of user %s", deleted, user_id)
+    except Exception as e:
+        logger.warning("Could not clean up previous avatars of user %s: %s", user_id, e)
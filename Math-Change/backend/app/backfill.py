@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from .database import supabase
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 200
+
+
+class ProgressBackfill:
+    """
+    Rebuilds user_category_progress from the scores history by calling
+    backfill_progress() (schema.sql) one batch of users at a time. Each batch
+    commits together with its checkpoint in maintenance_checkpoints, so a run
+    that is stopped or crashes, from the CLI or the admin endpoint, continues
+    with the next batch when started again.
+    """
+
+    def __init__(self):
+        self.status = {"running": False}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def run(
+        self,
+        batch_size: int = BACKFILL_BATCH_SIZE,
+        restart: bool = False,
+        report: Optional[Callable[[dict], None]] = None,
+    ) -> dict:
+        started = time.monotonic()
+        self.status = {
+            "running": True,
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "users_processed": 0,
+            "rows_written": 0,
+            "last_id": None,
+        }
+        try:
+            while True:
+                res = await supabase.rpc(
+                    "backfill_progress", {"p_batch_size": batch_size, "p_restart": restart}
+                ).execute()
+                restart = False  # only the first batch resets the checkpoint
+                batch = res.data[0]
+                elapsed = max(time.monotonic() - started, 1e-9)
+                self.status["users_processed"] += batch["users_processed"]
+                self.status["rows_written"] += batch["rows_written"]
+                self.status["last_id"] = batch["last_id"] or self.status["last_id"]
+                self.status["users_per_sec"] = round(self.status["users_processed"] / elapsed, 1)
+                self.status["rows_per_sec"] = round(self.status["rows_written"] / elapsed, 1)
+                if report:
+                    report(self.status)
+                if batch["done"]:
+                    break
+        except Exception as e:
+            self.status["error"] = str(e)
+            raise
+        finally:
+            self.status["running"] = False
+            self.status["finished_at"] = datetime.now(timezone.utc).isoformat()
+        return self.status
+
+    def start(self, batch_size: int = BACKFILL_BATCH_SIZE, restart: bool = False) -> bool:
+        """Run in the background of this worker. False if a run is already in progress."""
+        if self.running:
+            return False
+        self._task = asyncio.create_task(self._run_logged(batch_size, restart))
+        return True
+
+    async def _run_logged(self, batch_size: int, restart: bool) -> None:
+        try:
+            await self.run(batch_size, restart)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("Progress backfill stopped: %s", e)
+
+    async def stop(self) -> None:
+        if self.running:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+
+progress_backfill = ProgressBackfill()
@@ -0,0 +1,105 @@
+import csv
+import io
+import json
+import logging
+import os
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+
+from .database import supabase
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched per database round-trip. Memory used by an export is about one
+# page, whatever the total row count: each page is released before the next
+# one is fetched, and the response it came in is freed by refcounting
+# (SupabaseMetricsTransport breaks httpx's response/stream cycle).
+EXPORT_PAGE_SIZE = int(os.environ.get("EXPORT_PAGE_SIZE", "1000"))
+
+# Exported columns per table. Never `*`: users.password must not leave the database.
+EXPORT_COLUMNS: Dict[str, List[str]] = {
+    "scores": ["id", "user", "user_id", "score", "correctCount", "errorCount", "avgTime", "date", "category", "difficulty"],
+    "users": ["id", "username", "email", "role", "status", "avatar", "createdAt", "lastLogin", "unlockedLevel"],
+}
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+def _select(columns: List[str]) -> str:
+    # Quote every column: camelCase names and "user" need it in PostgREST
+    return ",".join(f'"{column}"' for column in columns)
+
+
+async def iter_pages(
+    table: str,
+    page_size: int = EXPORT_PAGE_SIZE,
+    apply_filters: Optional[Callable] = None,
+) -> AsyncIterator[List[dict]]:
+    """
+    Walk a table in primary key order, one page at a time. Each page starts
+    after the last id of the previous one (keyset), so page N costs the same
+    index range scan as page 1 and nothing accumulates between pages.
+    """
+    last_id = None
+    while True:
+        query = supabase.table(table).select(_select(EXPORT_COLUMNS[table]))
+        if apply_filters:
+            query = apply_filters(query)
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        res = await query.order("id").limit(page_size).execute()
+        rows = res.data or []
+        del res
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1]["id"]
+        # Not held while the next page is fetched
+        del rows
+
+
+def ndjson_chunk(rows: List[dict]) -> bytes:
+    return "".join(json.dumps(row, separators=(",", ":"), default=str) + "\n" for row in rows).encode()
+
+
+def csv_chunk(rows: List[dict], columns: List[str], header: bool = False) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+    if header:
+        writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
+
+
+async def stream_export(
+    table: str,
+    fmt: str,
+    page_size: int = EXPORT_PAGE_SIZE,
+    apply_filters: Optional[Callable] = None,
+) -> AsyncIterator[bytes]:
+    """Encoded export body, yielded one page at a time for a StreamingResponse."""
+    columns = EXPORT_COLUMNS[table]
+    if fmt == "csv":
+        # Header even for an empty export
+        yield csv_chunk([], columns, header=True)
+    try:
+        async for rows in iter_pages(table, page_size, apply_filters):
+            chunk = ndjson_chunk(rows) if fmt == "ndjson" else csv_chunk(rows, columns)
+            del rows
+            yield chunk
+            del chunk
+    except Exception as e:
+        # Headers (200) are already sent: the client sees a truncated file
+        logger.exception("Export of %s aborted: %s", table, e)
+        raise
+
+
+def export_headers(table: str, fmt: str) -> dict:
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato inválido: {fmt}")
+    return {"Content-Disposition": f'attachment; filename="{table}.{fmt}"'}
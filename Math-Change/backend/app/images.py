@@ -0,0 +1,249 @@
+import asyncio
+import contextlib
+import functools
+import hashlib
+import io
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+from fastapi import UploadFile
+from fastapi.responses import JSONResponse
+from PIL import Image, ImageOps, features
+
+from .metrics import IMAGE_PROCESSING, IMAGE_QUEUE_WAIT, IMAGE_REJECTED
+from .profiling import profiler, sample_job
+from .tracing import tracing
+
+# Avatar processing configuration
+AVATAR_MAX_BYTES = int(os.environ.get("AVATAR_MAX_BYTES", str(10 * 1024 * 1024)))  # 10 MB
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", str(os.cpu_count() or 1)))
+# Uploads allowed to wait for a free worker before we answer 503
+IMAGE_QUEUE_LIMIT = int(os.environ.get("IMAGE_QUEUE_LIMIT", str(IMAGE_WORKERS * 4)))
+READ_CHUNK_SIZE = 64 * 1024
+# Multipart boundaries and part headers around the file in the request body
+UPLOAD_OVERHEAD_BYTES = 64 * 1024
+
+
+class ImageTooLarge(Exception):
+    pass
+
+
+class ImagePoolBusy(Exception):
+    pass
+
+
+# Square renditions produced for every avatar (px). The frontend picks the
+# smallest that fits: 64 for lists/leaderboards, 128 for headers, 500 for the profile.
+RENDITION_SIZES = (64, 128, 500)
+AVIF_SUPPORTED = features.check("avif")
+RENDITION_FORMATS = {"webp": ("WEBP", "image/webp", {"quality": 80})}
+if AVIF_SUPPORTED:
+    RENDITION_FORMATS["avif"] = ("AVIF", "image/avif", {"quality": 60})
+
+
+# (step, start_ns, end_ns) of the job running in this pool process, returned
+# by _timed so the API process can add them to the request's trace
+_steps: List[Tuple[str, int, int]] = []
+
+
+@contextlib.contextmanager
+def _step(name: str):
+    started = time.time_ns()
+    try:
+        yield
+    finally:
+        _steps.append((name, started, time.time_ns()))
+
+
+def render_avatar(content: bytes, sizes=RENDITION_SIZES) -> List[Tuple[str, str, bytes]]:
+    """
+    Decode once, center-crop to a square and encode every rendition.
+    Returns [(name, content_type, data)] with names like "64.webp".
+    Runs inside a worker process: must stay a picklable top-level function.
+    """
+    largest = max(sizes)
+    with _step("decode"):
+        image = Image.open(io.BytesIO(content))
+        # JPEG only: let libjpeg decode at 1/2, 1/4 or 1/8 scale, never below the
+        # target size. A 12MP photo is decoded at ~1000px instead of 4000px.
+        image.draft("RGB", (largest, largest))
+        image.load()
+
+    # Convert to RGB
+    if image.mode != "RGB":
+        with _step("convert"):
+            image = image.convert("RGB")
+
+    # Resize/Crop once to the largest size, smaller renditions derive from it
+    with _step("fit"):
+        image = ImageOps.fit(image, (largest, largest), method=Image.Resampling.LANCZOS)
+
+    renditions = []
+    for size in sorted(sizes, reverse=True):
+        if size == largest:
+            resized = image
+        else:
+            with _step(f"resize_{size}"):
+                resized = image.resize((size, size), Image.Resampling.LANCZOS)
+        for ext, (pil_format, content_type, options) in RENDITION_FORMATS.items():
+            with _step(f"encode_{size}.{ext}"):
+                buffer = io.BytesIO()
+                resized.save(buffer, format=pil_format, **options)
+            renditions.append((f"{size}.{ext}", content_type, buffer.getvalue()))
+    return renditions
+
+
+async def read_upload(file: UploadFile, max_bytes: int = AVATAR_MAX_BYTES) -> Tuple[bytes, str]:
+    """
+    Read an upload in chunks, refusing anything above max_bytes.
+    Returns the content and its sha256 hex digest, hashed chunk by chunk.
+    """
+    if file.size is not None and file.size > max_bytes:
+        raise ImageTooLarge()
+    buffer = bytearray()
+    digest = hashlib.sha256()
+    while True:
+        chunk = await file.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer.extend(chunk)
+        if len(buffer) > max_bytes:
+            raise ImageTooLarge()
+        digest.update(chunk)
+    return bytes(buffer), digest.hexdigest()
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware answering 413 to a POST to `path` whose body is larger
+    than max_bytes (plus the multipart overhead) before it is received:
+    Starlette parses the form, spooling the whole file to disk, before the
+    route and its dependencies run, so read_upload only sees an oversized
+    file once it was all uploaded. A Content-Length over the limit is refused
+    without reading the body; a chunked body is counted as it arrives.
+    read_upload keeps checking the file itself.
+    """
+
+    def __init__(self, app, path: str, max_bytes: int, detail: str):
+        self.app = app
+        self.path = path
+        self.limit = max_bytes + UPLOAD_OVERHEAD_BYTES
+        self.detail = detail
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] != self.path:
+            await self.app(scope, receive, send)
+            return
+        length = None
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                length = value
+                break
+        if length is not None:
+            # Validated by the server (h11/httptools) before the app is called
+            if int(length) > self.limit:
+                await self._reject(scope, receive, send)
+                return
+            await self.app(scope, receive, send)
+            return
+
+        received = 0
+        too_large = False
+
+        async def counted_receive():
+            nonlocal received, too_large
+            if too_large:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.limit:
+                    # Stop the form parser without reading the rest
+                    too_large = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def limited_send(message):
+            # The parser's error (400) is answered as what it is: too large
+            if not too_large:
+                await send(message)
+            elif message["type"] == "http.response.start":
+                await self._reject(scope, receive, send)
+
+        await self.app(scope, counted_receive, limited_send)
+
+    async def _reject(self, scope, receive, send):
+        await JSONResponse({"detail": self.detail}, status_code=413)(scope, receive, send)
+
+
+def _timed(fn, *args, profile_interval=None):
+    # Runs in the pool process: its metrics, spans and stack samples would not
+    # reach the API process, the duration, the timed steps and the stacks are
+    # returned instead
+    _steps.clear()
+    started = time.perf_counter()
+    stacks, result = sample_job(profile_interval, fn, *args)
+    return time.perf_counter() - started, list(_steps), stacks, result
+
+
+class ImageProcessor:
+    """
+    Bounded process pool for Pillow work, so decoding and resizing never run on
+    the event loop. At most `workers + queue_limit` jobs are accepted at once;
+    beyond that submit() raises ImagePoolBusy and the route answers 503.
+    """
+
+    def __init__(self, workers: int = IMAGE_WORKERS, queue_limit: int = IMAGE_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.pending = 0
+        self.rejected = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def start(self) -> None:
+        if self._executor is None:
+            # spawn: workers must not inherit the event loop or open sockets of the API process
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def submit(self, fn, *args):
+        if self.pending >= self.workers + self.queue_limit:
+            self.rejected += 1
+            IMAGE_REJECTED.inc()
+            raise ImagePoolBusy()
+        self.start()
+        self.pending += 1
+        started = time.perf_counter()
+        with tracing.span(f"image.{fn.__name__}", {"image.pending": self.pending}):
+            job = functools.partial(_timed, fn, *args, profile_interval=profiler.pool_interval())
+            try:
+                elapsed, steps, stacks, result = await asyncio.get_running_loop().run_in_executor(self._executor, job)
+            finally:
+                self.pending -= 1
+            tracing.record_steps("pillow", steps)
+            if stacks:
+                profiler.add_pool_stacks(stacks)
+        # What is not Pillow work was spent waiting for a worker (and pickling)
+        IMAGE_PROCESSING.labels(fn.__name__).observe(elapsed)
+        IMAGE_QUEUE_WAIT.observe(max(time.perf_counter() - started - elapsed, 0.0))
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_limit": self.queue_limit,
+            "pending": self.pending,
+            "rejected": self.rejected,
+        }
+
+
+image_processor = ImageProcessor()
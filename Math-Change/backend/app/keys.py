@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import os
+import time
+from typing import TYPE_CHECKING, Dict, Optional
+
+import httpx
+from jose import jwk
+
+from .metrics import GOOGLE_KEY_FETCHES
+from .tracing import tracing
+
+logger = logging.getLogger(__name__)
+
+if TYPE_CHECKING:
+    from .shared_cache import CacheBackend
+
+GOOGLE_KEYS_URL = (
+    os.environ.get("GOOGLE_KEYS_URL")
+    or "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+)
+# Shared cache keys: the certificates with their expiry, and the fetch lock
+SHARED_KEYS = "google_keys"
+SHARED_LOCK = "google_keys:lock"
+
+
+def parse_max_age(cache_control: str, default: int) -> int:
+    # Cache-Control: public, max-age=24475, must-revalidate, no-transform
+    for part in cache_control.split(","):
+        part = part.strip()
+        if part.startswith("max-age="):
+            try:
+                return int(part.split("=", 1)[1])
+            except ValueError:
+                break
+    return default
+
+
+class GoogleKeyStore:
+    """
+    Google's Firebase signing keys, parsed once per `kid` and refreshed off the
+    request path.
+
+    - A background task (start/stop) refreshes the keys `refresh_margin` seconds
+      before the Cache-Control max-age runs out, so requests never wait on it.
+    - refresh() is single-flight: concurrent callers share one in-progress fetch.
+    - An unknown `kid` triggers at most one refetch per `min_refresh_interval`,
+      so a burst of tokens signed with a rotated (or bogus) key cannot stampede
+      Google.
+    - With a shared cache backend, the certificates are published there: a
+      worker takes a copy still valid beyond `refresh_margin` instead of
+      fetching, and only the worker holding the fetch lock calls Google.
+    """
+
+    def __init__(
+        self,
+        url: str = GOOGLE_KEYS_URL,
+        refresh_margin: float = 300.0,
+        min_refresh_interval: float = 30.0,
+        default_max_age: int = 3600,
+        timeout: float = 10.0,
+        shared: Optional["CacheBackend"] = None,
+    ):
+        self.url = url
+        self.refresh_margin = refresh_margin
+        self.min_refresh_interval = min_refresh_interval
+        self.default_max_age = default_max_age
+        self.timeout = timeout
+        self.shared = shared if shared is not None and shared.shared else None
+        self._keys: Dict[str, jwk.Key] = {}
+        self._expires_at = 0.0
+        self._last_fetch = 0.0
+        self._inflight: Optional[asyncio.Task] = None
+        self._refresher: Optional[asyncio.Task] = None
+        self.fetch_count = 0
+        self.shared_loads = 0
+
+    @property
+    def fresh(self) -> bool:
+        return bool(self._keys) and time.time() < self._expires_at
+
+    async def get_key(self, kid: str) -> Optional[jwk.Key]:
+        if not self.fresh:
+            await self.refresh()
+        key = self._keys.get(kid)
+        if key is None and time.time() - self._last_fetch >= self.min_refresh_interval:
+            # Unknown kid: Google may have rotated its keys since our last fetch
+            await self.refresh(kid)
+            key = self._keys.get(kid)
+        return key
+
+    async def refresh(self, kid: Optional[str] = None) -> None:
+        loop = asyncio.get_running_loop()
+        task = self._inflight
+        if task is None or task.done() or task.get_loop() is not loop:
+            task = loop.create_task(self._load(kid))
+            self._inflight = task
+        # shield: a cancelled caller must not cancel the fetch other callers wait on
+        await asyncio.shield(task)
+
+    async def _load(self, kid: Optional[str] = None) -> None:
+        if self.shared is not None:
+            if await self._load_shared(kid):
+                self._last_fetch = time.time()
+                return
+            if await self.shared.add(SHARED_LOCK, self.shared.origin, ttl=self.timeout):
+                try:
+                    await self._fetch()
+                finally:
+                    # Only our own lock: after `timeout` it may have expired and been taken by another worker
+                    await self.shared.delete_if(SHARED_LOCK, self.shared.origin)
+                return
+            # Another worker is fetching: wait for its copy instead of calling Google too
+            deadline = time.time() + self.timeout
+            while time.time() < deadline:
+                await asyncio.sleep(0.1)
+                if await self.shared.get(SHARED_LOCK) is None:
+                    # Fetch finished (the kid may still be unknown: a bogus token)
+                    if await self._load_shared(None):
+                        self._last_fetch = time.time()
+                        return
+                    break
+        await self._fetch()
+
+    async def _load_shared(self, kid: Optional[str]) -> bool:
+        entry = await self.shared.get(SHARED_KEYS)
+        if entry is None or (kid is not None and kid not in entry["certs"]):
+            return False
+        remaining = entry["expires_at"] - time.time()
+        # Near its expiry the copy is due for a refresh: only good enough with no keys at all
+        if remaining <= 0 or (remaining <= self.refresh_margin and self._keys):
+            return False
+        self._keys = {k: jwk.construct(pem, algorithm="RS256") for k, pem in entry["certs"].items()}
+        self._expires_at = entry["expires_at"]
+        self.shared_loads += 1
+        GOOGLE_KEY_FETCHES.labels("shared").inc()
+        return True
+
+    async def _fetch(self) -> None:
+        self.fetch_count += 1
+        GOOGLE_KEY_FETCHES.labels("google").inc()
+        try:
+            with tracing.span("google_keys.fetch", {"url.full": self.url}):
+                async with httpx.AsyncClient(timeout=self.timeout) as client:
+                    response = await client.get(self.url)
+            response.raise_for_status()
+            certs = response.json()
+            # Parse every PEM certificate once; jose accepts the Key objects directly
+            keys = {kid: jwk.construct(pem, algorithm="RS256") for kid, pem in certs.items()}
+            max_age = parse_max_age(response.headers.get("Cache-Control", ""), self.default_max_age)
+            self._keys = keys
+            self._expires_at = time.time() + max_age
+            if self.shared is not None:
+                await self.shared.set(SHARED_KEYS, {"certs": certs, "expires_at": self._expires_at}, ttl=max_age)
+        except Exception as e:
+            logger.error("Error fetching Google keys: %s", e)
+            # Keep serving the stale keys for a short while rather than failing every login
+            if self._keys:
+                self._expires_at = time.time() + self.min_refresh_interval
+        finally:
+            self._last_fetch = time.time()
+
+    async def run_refresher(self) -> None:
+        while True:
+            if self._expires_at - time.time() <= self.refresh_margin:
+                await self.refresh()
+            delay = max(self._expires_at - self.refresh_margin - time.time(), self.min_refresh_interval)
+            await asyncio.sleep(delay)
+
+    def start(self) -> None:
+        """Start the background refresher on the running event loop."""
+        if self._refresher is None or self._refresher.done():
+            self._refresher = asyncio.get_running_loop().create_task(self.run_refresher())
+
+    async def stop(self) -> None:
+        if self._refresher is not None:
+            self._refresher.cancel()
+            try:
+                await self._refresher
+            except asyncio.CancelledError:
+                pass
+            self._refresher = None
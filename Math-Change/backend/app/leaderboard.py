@@ -0,0 +1,156 @@
+import base64
+import json
+import re
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from fastapi import HTTPException
+
+# Columns returned by the leaderboard. Keep this narrow: the leaderboard never
+# needs the full row and every extra column is paid for on every page.
+LEADERBOARD_COLUMNS = 'id,"user",score,"correctCount","errorCount","avgTime",date,category,difficulty'
+
+# Rolling windows accepted by GET /leaderboard (window=...)
+WINDOWS = {
+    "day": timedelta(days=1),
+    "week": timedelta(days=7),
+    "month": timedelta(days=30),
+    "all": None,
+}
+
+MAX_PAGE_SIZE = 100
+
+# Materialized rankings (leaderboard_entries, kept up to date by record_score)
+RANKING_COLUMNS = "user_id,total_score,games,best_score,users(username,avatar)"
+RANKING_PERIODS = ("day", "week", "all")
+ALL_TIME_START = "1970-01-01"
+
+
+def window_start(window: str) -> Optional[str]:
+    """Translate a window name into the ISO timestamp the query filters on."""
+    if window not in WINDOWS:
+        raise HTTPException(status_code=400, detail=f"Ventana inválida: {window}")
+    delta = WINDOWS[window]
+    if delta is None:
+        return None
+    return (datetime.now(timezone.utc) - delta).isoformat()
+
+
+def _cursor_id(value) -> str:
+    # Cursors come from the client and end up inside PostgREST `or=(...)`
+    # filters: only values rebuilt here (a UUID, an ISO timestamp) go there.
+    return str(uuid.UUID(str(value)))
+
+
+def _cursor_date(value) -> str:
+    # Python 3.9's fromisoformat only takes 3 or 6 fractional digits, PostgREST
+    # drops trailing zeros: pad them to 6 (same instant)
+    value = str(value).replace("Z", "+00:00")
+    value = re.sub(r"\.(\d{1,6})(?=[+-]|$)", lambda m: "." + m.group(1).ljust(6, "0"), value, count=1)
+    return datetime.fromisoformat(value).isoformat()
+
+
+def encode_cursor(row: dict, rank: int) -> str:
+    # The cursor carries the sort key of the last row (score, date, id) plus the
+    # rank reached so far, so the next page continues the ranking without OFFSET.
+    payload = {"s": row["score"], "d": row["date"], "i": row["id"], "r": rank}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return {"s": int(payload["s"]), "d": _cursor_date(payload["d"]), "i": _cursor_id(payload["i"]),
+                "r": int(payload["r"])}
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
+def encode_ranking_cursor(row: dict, rank: int) -> str:
+    payload = {"t": row["total_score"], "u": row["user_id"], "r": rank}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_ranking_cursor(cursor: str) -> dict:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return {"t": int(payload["t"]), "u": _cursor_id(payload["u"]), "r": int(payload["r"])}
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
+def encode_history_cursor(row: dict, rank: int) -> str:
+    payload = {"d": row["date"], "i": row["id"], "r": rank}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_history_cursor(cursor: str) -> dict:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return {"d": _cursor_date(payload["d"]), "i": _cursor_id(payload["i"]), "r": int(payload["r"])}
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
+def history_keyset_filter(cursor: dict) -> str:
+    """PostgREST `or` filter for games after the cursor in (date DESC, id DESC) order."""
+    d, i = cursor["d"], cursor["i"]
+    return f'date.lt."{d}",and(date.eq."{d}",id.lt.{i})'
+
+
+def keyset_filter(cursor: dict) -> str:
+    """
+    PostgREST `or` filter selecting rows strictly after the cursor in
+    (score DESC, date DESC, id DESC) order. Values are quoted because ISO dates
+    contain ':' and '+', which PostgREST treats as reserved inside `or=(...)`.
+    """
+    s, d, i = cursor["s"], cursor["d"], cursor["i"]
+    return (
+        f'score.lt.{s},'
+        f'and(score.eq.{s},date.lt."{d}"),'
+        f'and(score.eq.{s},date.eq."{d}",id.lt.{i})'
+    )
+
+
+def ranking_keyset_filter(cursor: dict) -> str:
+    """PostgREST `or` filter for rows after the cursor in (total_score DESC, user_id DESC) order."""
+    t, u = cursor["t"], cursor["u"]
+    return f"total_score.lt.{t},and(total_score.eq.{t},user_id.lt.{u})"
+
+
+def ranking_board(category: Optional[str], difficulty: Optional[str]) -> str:
+    """Board key of leaderboard_entries: rankings exist per category OR per difficulty, not both."""
+    if category and difficulty:
+        raise HTTPException(status_code=400, detail="Elige categoría o dificultad, no ambas")
+    if category:
+        return f"category:{category}"
+    if difficulty:
+        return f"difficulty:{difficulty}"
+    return "global"
+
+
+def period_start(period: str, today: Optional[date] = None) -> str:
+    """First UTC day of the current period, as stored in leaderboard_entries.period_start."""
+    if period not in RANKING_PERIODS:
+        raise HTTPException(status_code=400, detail=f"Periodo inválido: {period}")
+    if period == "all":
+        return ALL_TIME_START
+    today = today or datetime.now(timezone.utc).date()
+    if period == "week":
+        # ISO weeks, like date_trunc('week', ...) in leaderboard_slots()
+        today -= timedelta(days=today.weekday())
+    return today.isoformat()
+
+
+def build_page(rows: list, limit: int, start_rank: int, encode: Callable[[dict, int], str] = encode_cursor) -> dict:
+    """Attach ranks to a page fetched with limit + 1 rows and compute next_cursor."""
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    for offset, row in enumerate(rows, start=1):
+        row["rank"] = start_rank + offset
+
+    next_cursor = None
+    if has_more and rows:
+        next_cursor = encode(rows[-1], rows[-1]["rank"])
+    return {"items": rows, "next_cursor": next_cursor}
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import os
+import signal
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Seconds a worker keeps serving after SIGTERM while /health/ready answers 503,
+# so the load balancer takes it out of rotation before uvicorn stops accepting
+# connections (then in-flight requests get GRACEFUL_TIMEOUT to finish, serve.py)
+SHUTDOWN_DELAY = float(os.environ.get("SHUTDOWN_DELAY", "0"))
+# Time limit of each dependency check, at startup and in /health/ready
+PROBE_TIMEOUT = float(os.environ.get("PROBE_TIMEOUT", "3"))
+
+Check = Callable[[], Awaitable[None]]
+
+
+class Lifecycle:
+    """
+    State of this worker for the health endpoints: "starting" until the
+    lifespan warm-up is done, "ready", then "draining" from the first SIGTERM
+    and "stopping" once uvicorn runs the shutdown.
+
+    Dependency checks are registered with check(); probe() runs them all
+    concurrently. A failing `required` check makes the worker not ready (no
+    database or no Google keys: every request would fail); an optional one
+    (S3 for avatars, the shared cache) is only reported.
+    """
+
+    def __init__(self, shutdown_delay: float = SHUTDOWN_DELAY, probe_timeout: float = PROBE_TIMEOUT):
+        self.shutdown_delay = shutdown_delay
+        self.probe_timeout = probe_timeout
+        self.state = "starting"
+        self.started_at = time.time()
+        self._checks: Dict[str, tuple] = {}
+        self._previous_handler = None
+
+    def check(self, name: str, required: bool = True) -> Callable[[Check], Check]:
+        def register(fn: Check) -> Check:
+            self._checks[name] = (fn, required)
+            return fn
+
+        return register
+
+    async def _run(self, fn: Check) -> dict:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(fn(), timeout=self.probe_timeout)
+            result = {"ok": True}
+        except asyncio.TimeoutError:
+            result = {"ok": False, "error": f"timeout after {self.probe_timeout}s"}
+        except Exception as e:
+            result = {"ok": False, "error": str(e) or type(e).__name__}
+        result["ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return result
+
+    async def probe(self) -> dict:
+        """Run every check. Returns {"ok": all required checks passed, "checks": {...}}."""
+        names = list(self._checks)
+        results = await asyncio.gather(*[self._run(self._checks[name][0]) for name in names])
+        checks = {}
+        ok = True
+        for name, result in zip(names, results):
+            result["required"] = self._checks[name][1]
+            checks[name] = result
+            if result["required"] and not result["ok"]:
+                ok = False
+        return {"ok": ok, "checks": checks}
+
+    async def warm_up(self) -> None:
+        """
+        First probe, before the worker accepts traffic: opens the pooled
+        connections and loads the keys. Failures are logged, not fatal;
+        readiness keeps reporting them until the dependency is back.
+        """
+        report = await self.probe()
+        for name, result in report["checks"].items():
+            if not result["ok"]:
+                logger.warning("Warm-up of %s failed: %s", name, result["error"])
+        self.state = "ready"
+
+    def uptime(self) -> float:
+        return round(time.time() - self.started_at, 1)
+
+    def install_signal_handlers(self) -> None:
+        """
+        Put the worker in "draining" on SIGTERM, and only pass the signal on
+        to uvicorn (which stops accepting and drains) after shutdown_delay.
+        """
+        # Signal handlers can only be set from the main thread (not under TestClient)
+        if threading.current_thread() is not threading.main_thread():
+            return
+        self._previous_handler = signal.getsignal(signal.SIGTERM)
+        signal.signal(signal.SIGTERM, self._on_sigterm)
+
+    def restore_signal_handlers(self) -> None:
+        if self._previous_handler is not None and signal.getsignal(signal.SIGTERM) == self._on_sigterm:
+            signal.signal(signal.SIGTERM, self._previous_handler)
+        self._previous_handler = None
+
+    def _on_sigterm(self, sig, frame) -> None:
+        if self.state == "draining" or self.shutdown_delay <= 0:
+            self.state = "draining"
+            self._forward(sig, frame)
+            return
+        self.state = "draining"
+        logger.info("SIGTERM received: draining for %ss before closing", self.shutdown_delay)
+        timer = threading.Timer(self.shutdown_delay, self._forward, (sig, frame))
+        timer.daemon = True
+        timer.start()
+
+    def _forward(self, sig, frame) -> None:
+        previous: Optional[Callable] = self._previous_handler
+        if callable(previous):
+            previous(sig, frame)
+        else:
+            # No server handler (SIG_DFL): terminate like the signal would have
+            signal.signal(sig, signal.SIG_DFL)
+            os.kill(os.getpid(), sig)
+
+
+lifecycle = Lifecycle()
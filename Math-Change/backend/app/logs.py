@@ -0,0 +1,244 @@
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import time
+import traceback
+import uuid
+from typing import Optional
+
+from .metrics import LOG_RECORDS_DROPPED
+
+# Level of the app and of uvicorn; LOG_LEVELS overrides single loggers,
+# e.g. "app.auth=debug,app.access=warning"
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "info").upper()
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "")
+# json: one object per line for the log driver; text: readable, for development
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()
+# Fraction of requests whose DEBUG records are kept (when LOG_LEVEL=debug)
+LOG_DEBUG_SAMPLE = float(os.environ.get("LOG_DEBUG_SAMPLE", "0.01"))
+# Records waiting for the writer thread; beyond that new ones are dropped, never waited for
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+
+# Libraries logging every HTTP call at INFO; LOG_LEVELS can still lower them
+QUIET_LOGGERS = ("httpx", "httpcore", "hpack", "botocore", "boto3", "urllib3")
+
+REQUEST_ID_HEADER = "X-Request-ID"
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+# Whether the DEBUG records of the current request are kept (decided once per request)
+debug_sampled_var: contextvars.ContextVar[Optional[bool]] = contextvars.ContextVar("debug_sampled", default=None)
+
+# Attributes every LogRecord has: anything else came in `extra=` and is logged as a field
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+access_logger = logging.getLogger("app.access")
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + ".%03dZ" % record.msecs,
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s [%(request_id)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        record.request_id = getattr(record, "request_id", None) or "-"
+        return super().format(record)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Runs on the calling thread: stamps the request id and drops the DEBUG
+    records of requests that were not sampled, before anything is queued.
+    """
+
+    def __init__(self, sample: float = LOG_DEBUG_SAMPLE):
+        super().__init__()
+        self.sample = sample
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        if record.levelno <= logging.DEBUG:
+            sampled = debug_sampled_var.get()
+            if sampled is None:  # outside a request: sample record by record
+                sampled = random.random() < self.sample
+            return sampled
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the writer thread (QueueListener). Formatting and the
+    write to stdout happen there, so a slow log driver never blocks the event
+    loop; when the queue is full the record is dropped and counted.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only freeze the message (its args may change after this call), in
+        # place: this is the root's only handler. JSON and tracebacks are
+        # rendered by the writer thread
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED.inc()
+
+
+_handler: Optional[NonBlockingQueueHandler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+_writer: Optional[logging.Handler] = None
+
+
+def setup_logging(
+    level: str = LOG_LEVEL,
+    levels: str = LOG_LEVELS,
+    fmt: str = LOG_FORMAT,
+    sample: float = LOG_DEBUG_SAMPLE,
+    queue_size: int = LOG_QUEUE_SIZE,
+    stream=None,
+) -> None:
+    """
+    Route the root logger (app.* and uvicorn.*) through one non-blocking
+    queue handler and a writer thread. Safe to call again: replaces the
+    previous setup (the last call wins, as in tests and benchmarks).
+    """
+    global _handler, _listener, _writer
+    shutdown_logging()
+
+    _writer = logging.StreamHandler(stream or sys.stdout)
+    _writer.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    _handler = NonBlockingQueueHandler(log_queue)
+    _handler.addFilter(ContextFilter(sample))
+    _listener = logging.handlers.QueueListener(log_queue, _writer, respect_handler_level=False)
+    _listener.start()
+
+    root = logging.getLogger()
+    root.handlers = [_handler]
+    root.setLevel(level.upper())
+    # uvicorn configures its own stdout handlers; send its records through ours
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        logger = logging.getLogger(name)
+        logger.handlers = []
+        logger.propagate = True
+    # Replaced by app.access, which carries the request id and the duration
+    logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
+    # One INFO record per Supabase call otherwise (timed by app/metrics.py already)
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(logging.WARNING)
+    for item in filter(None, (part.strip() for part in levels.split(","))):
+        name, _, value = item.partition("=")
+        logging.getLogger(name.strip()).setLevel(value.strip().upper())
+
+
+def shutdown_logging() -> None:
+    """Write what is still queued and stop the writer thread; later records are written directly."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+        root = logging.getLogger()
+        if _handler in root.handlers:
+            root.handlers = [_writer]
+
+
+def stats() -> dict:
+    return {
+        "queued": _handler.queue.qsize() if _handler else 0,
+        "dropped": _handler.dropped if _handler else 0,
+    }
+
+
+def new_request_id(header: Optional[str]) -> str:
+    # Keep the proxy's id (Traefik, the frontend) when it is safe to log
+    if header and _VALID_REQUEST_ID.match(header):
+        return header
+    return uuid.uuid4().hex
+
+
+class RequestContextMiddleware:
+    """
+    ASGI middleware giving every request an id (X-Request-ID from the client
+    or a new one, echoed in the response), deciding whether its DEBUG records
+    are sampled, and writing one access record when the response is done.
+    """
+
+    def __init__(self, app, sample: Optional[float] = None):
+        self.app = app
+        self.sample = LOG_DEBUG_SAMPLE if sample is None else sample
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        header = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                header = value.decode("latin-1")
+                break
+        request_id = new_request_id(header)
+        id_token = request_id_var.set(request_id)
+        sampled_token = debug_sampled_var.set(random.random() < self.sample)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (REQUEST_ID_HEADER.lower().encode(), request_id.encode())
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            if access_logger.isEnabledFor(logging.INFO):
+                access_logger.info(
+                    "%s %s %s",
+                    scope["method"],
+                    scope["path"],
+                    status,
+                    extra={
+                        "method": scope["method"],
+                        "path": scope["path"],
+                        "status": status,
+                        "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+                    },
+                )
+            request_id_var.reset(id_token)
+            debug_sampled_var.reset(sampled_token)
@@ -1,30 +1,98 @@
-from fastapi import FastAPI, HTTPException, Body, Depends, UploadFile, File
+from fastapi import FastAPI, HTTPException, Body, Depends, UploadFile, File, Query, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from typing import List, Optional
 import os
 from dotenv import load_dotenv
-from supabase import create_client, Client
 from pydantic import BaseModel
-from .models import User, UserCreate, UserLogin, ScoreRecord
-
-from .database import supabase
-from .auth import verify_password, get_password_hash, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, get_current_user, get_admin_user
+from .models import User, UserCreate, UserLogin, ScoreRecord, ScoreBatch
+
+from .database import supabase, close_database
+from .auth import verify_password, get_password_hash, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, get_current_user, get_admin_user, invalidate_user, identity_cache, google_keys
+from .images import image_processor, render_avatar, read_upload, ImagePoolBusy, ImageTooLarge, UploadLimitMiddleware, AVATAR_MAX_BYTES, RENDITION_SIZES
+from .storage import storage, s3_configured, S3_BUCKET_NAME
+from .avatars import IMMUTABLE_CACHE_CONTROL, avatar_prefix, rendition_names, rendition_urls, delete_previous_avatars
+from .leaderboard import (
+    LEADERBOARD_COLUMNS, MAX_PAGE_SIZE, window_start, decode_cursor, keyset_filter, build_page,
+    decode_history_cursor, encode_history_cursor, history_keyset_filter,
+    RANKING_COLUMNS, ranking_board, period_start, decode_ranking_cursor, encode_ranking_cursor, ranking_keyset_filter,
+)
+from .exports import EXPORT_FORMATS, stream_export, export_headers
+from .backfill import progress_backfill, BACKFILL_BATCH_SIZE
+from .partitions import partition_maintenance
+from .score_buffer import ScoreBuffer
+from .analytics import get_user_analytics, invalidate_user_analytics, analytics_cache
+from .response_cache import response_cache
+from .shared_cache import shared_cache
+from .lifecycle import lifecycle
+from .metrics import METRICS_TOKEN, MetricsMiddleware, mark_process_dead, render as render_metrics
+from .logs import RequestContextMiddleware, setup_logging, shutdown_logging, stats as logging_stats
+from .tracing import TracingMiddleware, tracing
+from .profiling import PROFILE_HEADER, PROFILE_MAX_SECONDS, PROFILE_TOKEN_TTL, ProfilingMiddleware, profiler, render as render_stacks
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 import uuid
-import boto3
-import io
-from PIL import Image, ImageOps
+import asyncio
+import logging
 
 load_dotenv()
 
-# S3 Configuration - MUST be set via environment variables
-S3_ACCESS_KEY = os.environ.get("S3_ACCESS_KEY")
-S3_SECRET_KEY = os.environ.get("S3_SECRET_KEY")
-S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL")
-S3_BUCKET_NAME = os.environ.get("S3_BUCKET_NAME")
-S3_REGION = os.environ.get("S3_REGION", "us-east-1")
+# JSON lines on stdout through a queue and a writer thread (LOG_LEVEL, LOG_FORMAT, app/logs.py)
+setup_logging()
+logger = logging.getLogger(__name__)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Validate Supabase
+    if not supabase:
+        raise RuntimeError("Supabase connection failed")
+
+    # Warn about S3 config (non-fatal, only affects avatar upload)
+    if not s3_configured():
+        logger.warning("S3 configuration incomplete, avatar upload will fail. "
+                       "Set S3_ACCESS_KEY, S3_SECRET_KEY, S3_ENDPOINT_URL, S3_BUCKET_NAME in environment.")
+
+    # Only with TRACE_EXPORTER=otlp|file; started first so the warm-up calls are traced too
+    tracing.start()
+    # With CACHE_URL=redis://..., listens for invalidations published by other workers
+    shared_cache.start()
+    # Receives the "profile" messages of POST /admin/profile sent by any worker
+    profiler.start(shared_cache)
+    image_processor.start()
+    # Opens the database and S3 connections and loads the Google keys before
+    # uvicorn accepts the first request of this worker
+    await lifecycle.warm_up()
+    # Keeps the Firebase signing keys fresh in the background
+    google_keys.start()
+    # Creates the upcoming monthly partitions of scores and applies the retention policy
+    partition_maintenance.start()
+    # Group commit of POST /scores, only with SCORE_WRITE_BEHIND=true
+    score_buffer.start()
+    lifecycle.install_signal_handlers()
+    try:
+        yield
+    finally:
+        lifecycle.state = "stopping"
+        lifecycle.restore_signal_handlers()
+        # Queued games are written before the database client closes
+        await score_buffer.stop()
+        await google_keys.stop()
+        await progress_backfill.stop()
+        await partition_maintenance.stop()
+        await shared_cache.stop()
+        await close_database()
+        image_processor.shutdown()
+        storage.shutdown()
+        mark_process_dead()
+        tracing.stop()
+        # Last: writes what is still queued, including the records of the shutdown
+        shutdown_logging()
+
+app = FastAPI(lifespan=lifespan)
+
+AVATAR_TOO_LARGE = f"La imagen supera el máximo de {AVATAR_MAX_BYTES // (1024 * 1024)} MB."
+# Oversized avatars are refused before the multipart body is received and spooled
+app.add_middleware(UploadLimitMiddleware, path="/upload-avatar", max_bytes=AVATAR_MAX_BYTES, detail=AVATAR_TOO_LARGE)
 
 # SEC-004: Security Headers Middleware
 # Can be disabled if handled by a Reverse Proxy (e.g., Traefik/Nginx)
@@ -51,19 +119,70 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.on_event("startup")
-def check_connections():
-    # Validate Supabase
-    if not supabase:
-        raise RuntimeError("Supabase connection failed")
-    
-    # Warn about S3 config (non-fatal, only affects avatar upload)
-    if not all([S3_ACCESS_KEY, S3_SECRET_KEY, S3_ENDPOINT_URL, S3_BUCKET_NAME]):
-        print("WARNING: S3 configuration incomplete. Avatar upload will fail.")
-        print("Set S3_ACCESS_KEY, S3_SECRET_KEY, S3_ENDPOINT_URL, S3_BUCKET_NAME in environment.")
+# Latency per route and status, requests in flight (GET /metrics)
+app.add_middleware(MetricsMiddleware)
+# Request span with child spans of its Supabase, S3, Google key and Pillow work (TRACE_EXPORTER)
+app.add_middleware(TracingMiddleware)
+# Single requests flagged with X-Profile, request counting of POST /admin/profile
+app.add_middleware(ProfilingMiddleware)
+# Outermost: request id (X-Request-ID) on every log record and one access record per request
+app.add_middleware(RequestContextMiddleware)
+
+async def write_scores(games: List[dict]) -> List[dict]:
+    # Each game carries its user_id, so one call writes games of many users
+    res = await supabase.rpc("record_scores", {"p_user_id": None, "p_scores": games}).execute()
+    return res.data or []
+
+score_buffer = ScoreBuffer(write_scores)
+
+# --- HEALTH ---
+
+@lifecycle.check("database")
+async def check_database():
+    await supabase.table("users").select("id").limit(1).execute()
+
+@lifecycle.check("google_keys")
+async def check_google_keys():
+    # Without the signing keys no token can be verified
+    if not google_keys.fresh:
+        await google_keys.refresh()
+    if not google_keys.fresh:
+        raise RuntimeError("Google signing keys not loaded")
+
+@lifecycle.check("storage", required=False)
+async def check_storage():
+    # Only avatar uploads need S3
+    if not s3_configured():
+        raise RuntimeError("S3 not configured")
+    await storage.call("head_bucket", Bucket=S3_BUCKET_NAME)
+
+@lifecycle.check("shared_cache", required=False)
+async def check_shared_cache():
+    # Requests fall back to the database without it
+    await shared_cache.ping()
+
+@app.get("/health/live")
+async def liveness():
+    """The worker's event loop answers. No dependency is checked: restarting would not fix them."""
+    return {"status": lifecycle.state, "pid": os.getpid(), "uptime": lifecycle.uptime()}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    """Prometheus exposition: HTTP, Supabase, S3, image pool, caches (every worker added up)."""
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Token de métricas inválido")
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/health/ready")
+async def readiness():
+    """Whether this worker should receive traffic: warmed up, not draining, dependencies reachable."""
+    report = await lifecycle.probe() if lifecycle.state == "ready" else {"ok": False, "checks": {}}
+    body = {"status": lifecycle.state, "pid": os.getpid(), **report}
+    return JSONResponse(body, status_code=200 if report["ok"] else 503)
 
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Math-Change Backend API"}
 
 # --- USERS ---
@@ -72,12 +191,12 @@ def read_root():
 # Authentication is now handled via Firebase Auth.
 
 @app.get("/users")
-def get_all_users(admin_user: dict = Depends(get_admin_user)):
-    res = supabase.table("users").select("*").execute()
+async def get_all_users(admin_user: dict = Depends(get_admin_user)):
+    res = await supabase.table("users").select("*").execute()
     return res.data
 
 @app.post("/users")
-def save_user(user: dict = Body(...), current_user: dict = Depends(get_current_user)):
+async def save_user(user: dict = Body(...), current_user: dict = Depends(get_current_user)):
     user_id = user.get("id")
     if not user_id:
         raise HTTPException(status_code=400, detail="User ID required")
@@ -96,168 +215,388 @@ def save_user(user: dict = Body(...), current_user: dict = Depends(get_current_u
         # Ideally unlockedLevel logic should be backend-side in /scores endpoint.
 
     # Upsert
-    res = supabase.table("users").upsert(user).execute()
+    res = await supabase.table("users").upsert(user).execute()
+    await invalidate_user(user_id)
+    await response_cache.bump(user_id)
     return res.data[0] if res.data else {}
 
 @app.delete("/users/{user_id}")
-def delete_user(user_id: str, current_user: dict = Depends(get_admin_user)):
+async def delete_user(user_id: str, current_user: dict = Depends(get_admin_user)):
     # Only admins can delete (enforced by get_admin_user dependency)
-    res = supabase.table("users").delete().eq("id", user_id).execute()
+    res = await supabase.table("users").delete().eq("id", user_id).execute()
+    await invalidate_user(user_id)
+    await response_cache.bump(user_id)
     if not res.data:
         raise HTTPException(status_code=404, detail="Usuario no encontrado o ya eliminado")
     return {"message": "Usuario eliminado correctamente", "id": user_id}
 
+# --- ADMIN ---
+
+@app.get("/admin/cache/stats")
+async def get_cache_stats(admin_user: dict = Depends(get_admin_user)):
+    return {
+        "identity": identity_cache.stats(),
+        "analytics": analytics_cache.stats(),
+        "responses": response_cache.stats(),
+        "shared": shared_cache.stats(),
+        "logging": logging_stats(),
+    }
+
+@app.post("/admin/profile")
+async def profile_workers(
+    seconds: float = Query(10, gt=0),
+    requests: Optional[int] = Query(None, ge=1),
+    admin_user: dict = Depends(get_admin_user),
+):
+    """
+    Sample the stacks of every worker (and of the image pool) for `seconds`,
+    or until the workers served `requests` requests, and return them as
+    collapsed stacks for a flame graph (flamegraph.pl, speedscope).
+    Reaches every worker only with CACHE_URL=redis://...
+    """
+    if seconds > PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"Como máximo {PROFILE_MAX_SECONDS:.0f} segundos de perfil")
+    if profiler.active:
+        raise HTTPException(status_code=409, detail="Ya hay un perfil en curso")
+    profile_id = await profiler.begin(seconds, requests)
+    stacks, summary = await profiler.collect(profile_id, seconds)
+    if not summary["workers"]:
+        raise HTTPException(status_code=503, detail="Ningún worker respondió a la petición de perfil")
+    return Response(stacks, media_type="text/plain", headers={
+        "Content-Disposition": f'attachment; filename="profile-{profile_id}.folded"',
+        "X-Profile-Workers": str(len(summary["workers"])),
+        "X-Profile-Samples": str(sum(worker["samples"] for worker in summary["workers"])),
+    })
+
+@app.post("/admin/profile/requests")
+async def create_request_profile(admin_user: dict = Depends(get_admin_user)):
+    """One-use token: the request sent with it in X-Profile is profiled on its own, on any route."""
+    token = await profiler.issue_token()
+    return {"token": token, "header": PROFILE_HEADER, "expires_in": PROFILE_TOKEN_TTL}
+
+@app.get("/admin/profile/requests/{token}")
+async def get_request_profile(token: str, admin_user: dict = Depends(get_admin_user)):
+    """Collapsed stacks of the request sent with this token."""
+    result = await profiler.request_result(token)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado (petición no recibida o caducada)")
+    return Response(render_stacks(result["stacks"]), media_type="text/plain", headers={
+        "Content-Disposition": f'attachment; filename="request-{token[:8]}.folded"',
+        "X-Profile-Request": f'{result["method"]} {result["path"]} {result["status"]}',
+        "X-Profile-Duration-Ms": str(result["duration_ms"]),
+        "X-Profile-Samples": str(result["samples"]),
+    })
+
+@app.get("/admin/scores/buffer")
+async def get_score_buffer_stats(admin_user: dict = Depends(get_admin_user)):
+    """Write-behind queue of POST /scores: queue depth, flush sizes and flush latency."""
+    return score_buffer.stats()
+
+@app.get("/admin/stats")
+async def get_admin_stats(admin_user: dict = Depends(get_admin_user)):
+    """Global counters of the admin panel, without downloading the scores."""
+    # "estimated": exact below PostgREST's threshold, the planner's estimate above it
+    res = await supabase.table("scores").select("id", count="estimated", head=True).execute()
+    # Last 30 days from the daily rollups (score_activity() in schema.sql)
+    res_activity = await supabase.rpc("score_activity", {"p_days": 30}).execute()
+    return {"total_games": res.count or 0, "last_30_days": res_activity.data}
+
+@app.post("/admin/progress/backfill")
+async def start_progress_backfill(
+    batch_size: int = Query(BACKFILL_BATCH_SIZE, ge=1, le=5000),
+    restart: bool = False,
+    admin_user: dict = Depends(get_admin_user)
+):
+    """
+    Recompute user_category_progress from the scores history in the background.
+    Resumes from the last committed batch unless restart=true.
+    """
+    if not progress_backfill.start(batch_size, restart):
+        raise HTTPException(status_code=409, detail="El backfill ya está en ejecución")
+    return progress_backfill.status
+
+@app.get("/admin/progress/backfill")
+async def get_progress_backfill(admin_user: dict = Depends(get_admin_user)):
+    return progress_backfill.status
+
+@app.post("/admin/scores/partitions")
+async def run_partition_maintenance(admin_user: dict = Depends(get_admin_user)):
+    """Create the upcoming monthly partitions of scores and archive expired months now."""
+    return await partition_maintenance.run_once()
+
+@app.get("/admin/scores/partitions")
+async def get_partition_maintenance(admin_user: dict = Depends(get_admin_user)):
+    return partition_maintenance.last_run
+
+@app.get("/admin/export/users")
+async def export_users(format: str = "ndjson", admin_user: dict = Depends(get_admin_user)):
+    """All users as NDJSON or CSV, streamed page by page (no password column)."""
+    headers = export_headers("users", format)
+    return StreamingResponse(stream_export("users", format), media_type=EXPORT_FORMATS[format], headers=headers)
+
+@app.get("/admin/export/scores")
+async def export_scores(
+    format: str = "ndjson",
+    user_id: Optional[str] = None,
+    admin_user: dict = Depends(get_admin_user)
+):
+    """Score history as NDJSON or CSV, streamed page by page; memory stays flat for any row count."""
+    headers = export_headers("scores", format)
+    apply_filters = (lambda query: query.eq("user_id", user_id)) if user_id else None
+    return StreamingResponse(
+        stream_export("scores", format, apply_filters=apply_filters),
+        media_type=EXPORT_FORMATS[format],
+        headers=headers,
+    )
+
 # --- SCORES ---
 
+async def fetch_user_scores(user_id: str) -> list:
+    # Index scan on scores_user_date_idx (user_id, date DESC)
+    res = await supabase.table("scores").select("*").eq("user_id", user_id).order("date", desc=True).execute()
+    return res.data
+
 @app.get("/scores")
-def get_scores(user: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+async def get_scores(
+    request: Request,
+    user_id: Optional[str] = None,
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    if user_id:
+        # Cached until that user's next write, with ETag/304 (app/response_cache.py)
+        return await response_cache.respond(request, user_id, "scores", lambda: fetch_user_scores(user_id))
+
+    # Games of every user: admins only, newest first, one keyset page at a time
+    # (scores_date_idx). Whole-table dumps go through /admin/export/scores.
+    if current_user.get("role") != "ADMIN":
+        raise HTTPException(status_code=403, detail="Acceso denegado: Se requieren privilegios de administrador")
     query = supabase.table("scores").select("*")
-    if user:
-        # Case insensitive match using ilike
-        query = query.ilike("user", user)
-    
-    res = query.execute()
-    return res.data
+    start_rank = 0
+    if cursor:
+        position = decode_history_cursor(cursor)
+        query = query.or_(history_keyset_filter(position))
+        start_rank = position["r"]
+    res = await query.order("date", desc=True).order("id", desc=True).limit(limit + 1).execute()
+    return build_page(res.data or [], limit, start_rank, encode=encode_history_cursor)
+
+@app.get("/users/{user_id}/analytics")
+async def get_analytics(user_id: str, current_user: dict = Depends(get_current_user)):
+    """
+    Per-category and per-difficulty accuracy, average time, daily trend, streaks
+    and latest games of one user ("me" for the current one). Aggregated in SQL
+    (user_analytics() in schema.sql): the payload does not grow with the number
+    of games. Cached per user until their next saved or deleted game.
+    """
+    if user_id == "me":
+        user_id = current_user.get("id")
+    if user_id != current_user.get("id") and current_user.get("role") != "ADMIN":
+        raise HTTPException(status_code=403, detail="No tienes permiso para ver las estadísticas de este usuario")
+    return await get_user_analytics(user_id)
+
+@app.get("/users/me/scores")
+async def get_my_scores(request: Request, current_user: dict = Depends(get_current_user)):
+    """Game history of the current user, newest first."""
+    user_id = current_user.get("id")
+    return await response_cache.respond(request, user_id, "scores", lambda: fetch_user_scores(user_id))
+
+@app.get("/leaderboard")
+async def get_leaderboard(
+    category: Optional[str] = None,
+    difficulty: Optional[str] = None,
+    window: str = "all",
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Top-N games ranked server-side by (score DESC, date DESC, id DESC).
+    Paginated with an opaque keyset cursor so every page costs the same,
+    no matter how deep the client scrolls or how large `scores` grows.
+    """
+    query = supabase.table("scores").select(LEADERBOARD_COLUMNS)
+    if category:
+        query = query.eq("category", category)
+    if difficulty:
+        query = query.eq("difficulty", difficulty)
+
+    since = window_start(window)
+    if since:
+        query = query.gte("date", since)
+
+    start_rank = 0
+    if cursor:
+        position = decode_cursor(cursor)
+        query = query.or_(keyset_filter(position))
+        start_rank = position["r"]
+
+    # Fetch one extra row to know whether another page exists
+    res = await (
+        query.order("score", desc=True)
+        .order("date", desc=True)
+        .order("id", desc=True)
+        .limit(limit + 1)
+        .execute()
+    )
+    return build_page(res.data or [], limit, start_rank)
+
+@app.get("/leaderboard/rankings")
+async def get_rankings(
+    category: Optional[str] = None,
+    difficulty: Optional[str] = None,
+    period: str = "week",
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Users ranked by total points in the current day, week or all time, read
+    from the materialized leaderboard_entries instead of aggregating scores.
+    """
+    query = (
+        supabase.table("leaderboard_entries")
+        .select(RANKING_COLUMNS)
+        .eq("board", ranking_board(category, difficulty))
+        .eq("period", period)
+        .eq("period_start", period_start(period))
+    )
+
+    start_rank = 0
+    if cursor:
+        position = decode_ranking_cursor(cursor)
+        query = query.or_(ranking_keyset_filter(position))
+        start_rank = position["r"]
+
+    res = await (
+        query.order("total_score", desc=True)
+        .order("user_id", desc=True)
+        .limit(limit + 1)
+        .execute()
+    )
+    return build_page(res.data or [], limit, start_rank, encode=encode_ranking_cursor)
+
+@app.get("/leaderboard/rankings/me")
+async def get_my_ranking(
+    category: Optional[str] = None,
+    difficulty: Optional[str] = None,
+    period: str = "week",
+    current_user: dict = Depends(get_current_user)
+):
+    """Rank of the current user, e.g. #1234 in multiplication this week. rank is null if unranked."""
+    res = await supabase.rpc("leaderboard_rank", {
+        "p_board": ranking_board(category, difficulty),
+        "p_period": period,
+        "p_period_start": period_start(period),
+        "p_user_id": current_user.get("id"),
+    }).execute()
+    if not res.data:
+        return {"rank": None, "total_score": 0, "games": 0, "best_score": 0}
+    return res.data[0]
+
+@app.post("/admin/leaderboard/rebuild")
+async def rebuild_rankings(
+    recent_days: int = Query(14, ge=1, le=366),
+    admin_user: dict = Depends(get_admin_user)
+):
+    """Recompute leaderboard_entries from scores (after imports, deletions or manual fixes)."""
+    res = await supabase.rpc("rebuild_leaderboard", {"p_recent_days": recent_days}).execute()
+    return {"success": True, "entries": res.data}
 
 @app.post("/scores")
-def save_score(record: ScoreRecord, current_user: dict = Depends(get_current_user)):
+async def save_score(record: ScoreRecord, current_user: dict = Depends(get_current_user)):
     # Use model_dump for Pydantic v2 compatibility
     data = record.model_dump() if hasattr(record, 'model_dump') else record.dict()
     # FORCE UUID: Frontend sends timestamp (Date.now()) which may fail if DB expects UUID
     data["id"] = str(uuid.uuid4())
         
-    print(f"DEBUG: Attempting to save score: {data}")
+    logger.debug("Saving score %s", data["id"], extra={"user_id": current_user.get("id"), "category": data.get("category")})
     
     try:
-        # 1. Save Score Record
-        res = supabase.table("scores").insert(data).execute()
-        print(f"DEBUG: Save score success: {res.data}")
-        
-        # 2. Upsert Category Progress (Stats)
-        # We need the user ID. 'current_user' has it.
-        user_id = current_user.get("id")
-        category = record.category
-        
-        if user_id and category:
-            # Calculate stats to add
-            # Note: Postgres upsert needs to handle the increment. 
-            # Supabase/PostgREST doesn't support "increment on conflict" easily in one call via JS client syntax usually,
-            # BUT we can call a stored procedure OR do two steps (read, calc, update).
-            # For simplicity and robustness without migration of SPs, we will do Read-Modify-Write transaction logic here.
-            # Ideally, RLS or DB Trigger is best, but we are doing logic in API.
-            
-            # Fetch existing
-            existing = supabase.table("user_category_progress").select("*").eq("user_id", user_id).eq("category", category).execute()
-            
-            current_stats = existing.data[0] if existing.data else {
-                "user_id": user_id,
-                "category": category,
-                "total_games": 0,
-                "total_score": 0,
-                "total_correct": 0,
-                "total_errors": 0,
-                "total_time_seconds": 0.0,
-                "unlocked_level": 0
-            }
-            
-            # Update values
-            new_stats = {
-                "user_id": user_id,
-                "category": category,
-                "total_games": current_stats.get("total_games", 0) + 1,
-                "total_score": current_stats.get("total_score", 0) + record.score,
-                "total_correct": current_stats.get("total_correct", 0) + record.correctCount,
-                "total_errors": current_stats.get("total_errors", 0) + record.errorCount,
-                "total_time_seconds": current_stats.get("total_time_seconds", 0.0) + (record.avgTime * (record.correctCount + record.errorCount)), # approx total time
-                "last_played_at": datetime.utcnow().isoformat()
-            }
-            
-            # Preserve unlocked_level if not provided (it is handled by separate endpoint usually, but let's keep it safe)
-            if "unlocked_level" not in new_stats and "unlocked_level" in current_stats:
-                new_stats["unlocked_level"] = current_stats["unlocked_level"]
-                
-            # Upsert
-            supabase.table("user_category_progress").upsert(new_stats, on_conflict="user_id, category").execute()
+        # Insert the score and increment the category stats (user_category_progress)
+        # and the rankings (leaderboard_entries) atomically in one database call.
+        # See record_score() in schema.sql.
+        if score_buffer.enabled:
+            # Write-behind: written together with the other games arriving now,
+            # answered after that write committed (app/score_buffer.py)
+            saved = await score_buffer.submit(current_user.get("id"), data)
+            return {**data, "id": saved.get("id"), "duplicate": saved.get("duplicate", False)}
+        if record.idempotency_key:
+            # Keyed games go through the batch path so a later replay of the
+            # same game (offline queue) is recognised as a duplicate.
+            res = await supabase.rpc("record_scores", {"p_user_id": current_user.get("id"), "p_scores": [data]}).execute()
+            saved = res.data[0] if res.data else {}
+            return {**data, "id": saved.get("id"), "duplicate": saved.get("duplicate", False)}
+        res = await supabase.rpc("record_score", {"p_user_id": current_user.get("id"), "p_score": data}).execute()
+        logger.debug("Saved score %s", data["id"])
 
         return res.data[0] if res.data else {}
     except Exception as e:
-        print(f"ERROR: Failed to save score: {e}")
+        logger.exception("Failed to save score %s", data["id"])
         # Continue to raise HTTP exception so frontend handles it? 
         # Or return empty to avoid crash? Better to raise to see in Network tab.
         raise HTTPException(status_code=500, detail=f"Database Insert Error: {str(e)}")
+    finally:
+        # After the write, so a concurrent read cannot cache the old totals
+        await invalidate_user_analytics(current_user.get("id"))
+        await response_cache.bump(current_user.get("id"))
+
+# Offline clients replay their queue in batches of at most this many games
+SCORE_BATCH_MAX = int(os.environ.get("SCORE_BATCH_MAX", "1000"))
+
+@app.post("/scores/batch")
+async def save_scores_batch(batch: ScoreBatch, current_user: dict = Depends(get_current_user)):
+    """
+    Save many games of the current user at once (classrooms replaying the games
+    queued while offline). One database call: a multi-row insert plus one
+    progress upsert per category, see record_scores() in schema.sql. Games whose
+    idempotency_key was already accepted are reported as duplicates and not saved
+    again, so a batch can be retried safely.
+    """
+    if not batch.scores:
+        return {"accepted": 0, "duplicates": 0, "results": []}
+    if len(batch.scores) > SCORE_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Como máximo {SCORE_BATCH_MAX} partidas por envío")
+
+    games = []
+    for record in batch.scores:
+        data = record.model_dump() if hasattr(record, 'model_dump') else record.dict()
+        data["id"] = str(uuid.uuid4())
+        games.append(data)
+
+    try:
+        res = await supabase.rpc("record_scores", {"p_user_id": current_user.get("id"), "p_scores": games}).execute()
+    except Exception as e:
+        logger.exception("Failed to save a batch of %d scores", len(games))
+        raise HTTPException(status_code=500, detail=f"Database Insert Error: {str(e)}")
+    finally:
+        await invalidate_user_analytics(current_user.get("id"))
+        await response_cache.bump(current_user.get("id"))
+
+    results = res.data or []
+    duplicates = sum(1 for r in results if r.get("duplicate"))
+    return {"accepted": len(results) - duplicates, "duplicates": duplicates, "results": results}
 
 @app.get("/users/me/progress")
-def get_my_progress(current_user: dict = Depends(get_current_user)):
+async def get_my_progress(request: Request, current_user: dict = Depends(get_current_user)):
+    # Primary key lookup. Totals are maintained by record_score() on every save;
+    # history from before that is loaded by the progress backfill
+    # (POST /admin/progress/backfill or backfill_progress.py).
     user_id = current_user.get("id")
-    username = current_user.get("username")
-    
-    res = supabase.table("user_category_progress").select("*").eq("user_id", user_id).execute()
-    
-    # AUTO-MIGRATION: If no progress records but user has scores, calculate from history
-    if not res.data and username:
-        scores_res = supabase.table("scores").select("*").ilike("user", username).execute()
-        
-        if scores_res.data:
-            # Group scores by category and calculate stats
-            category_stats = {}
-            difficulty_order = ['easy', 'easy_medium', 'medium', 'medium_hard', 'hard']
-            
-            for score in scores_res.data:
-                cat = score.get("category")
-                if not cat:
-                    continue
-                    
-                if cat not in category_stats:
-                    category_stats[cat] = {
-                        "total_games": 0,
-                        "total_score": 0,
-                        "total_correct": 0,
-                        "total_errors": 0,
-                        "max_difficulty_passed": -1  # Track highest difficulty with >= 60%
-                    }
-                
-                stats = category_stats[cat]
-                stats["total_games"] += 1
-                stats["total_score"] += score.get("score", 0)
-                stats["total_correct"] += score.get("correctCount", 0)
-                stats["total_errors"] += score.get("errorCount", 0)
-                
-                # Check if this score unlocks a level (>= 60%)
-                if score.get("score", 0) >= 60:
-                    diff = score.get("difficulty", "easy")
-                    if diff in difficulty_order:
-                        diff_idx = difficulty_order.index(diff)
-                        if diff_idx > stats["max_difficulty_passed"]:
-                            stats["max_difficulty_passed"] = diff_idx
-            
-            # Insert calculated progress records
-            for cat, stats in category_stats.items():
-                # unlocked_level = max_difficulty_passed + 1 (they passed level X, so X+1 is their current max)
-                unlocked = stats["max_difficulty_passed"] + 1 if stats["max_difficulty_passed"] >= 0 else 0
-                
-                progress_data = {
-                    "user_id": user_id,
-                    "category": cat,
-                    "unlocked_level": unlocked,
-                    "total_games": stats["total_games"],
-                    "total_score": stats["total_score"],
-                    "total_correct": stats["total_correct"],
-                    "total_errors": stats["total_errors"]
-                }
-                supabase.table("user_category_progress").upsert(progress_data, on_conflict="user_id, category").execute()
-            
-            # Re-fetch after migration
-            res = supabase.table("user_category_progress").select("*").eq("user_id", user_id).execute()
-    
-    return res.data
+
+    async def fetch():
+        res = await supabase.table("user_category_progress").select("*").eq("user_id", user_id).execute()
+        return res.data
+
+    return await response_cache.respond(request, user_id, "progress", fetch)
 
 from .models import CategoryLevelUpdate
 @app.patch("/users/me/progress/level")
-def update_level_progress(update: CategoryLevelUpdate, current_user: dict = Depends(get_current_user)):
+async def update_level_progress(update: CategoryLevelUpdate, current_user: dict = Depends(get_current_user)):
     user_id = current_user.get("id")
     
     # Check existing to ensure we don't downgrade
-    existing = supabase.table("user_category_progress").select("unlocked_level").eq("user_id", user_id).eq("category", update.category).execute()
+    existing = await supabase.table("user_category_progress").select("unlocked_level").eq("user_id", user_id).eq("category", update.category).execute()
     
     current_level = 0
     if existing.data:
@@ -271,133 +610,140 @@ def update_level_progress(update: CategoryLevelUpdate, current_user: dict = Depe
             "updated_at": datetime.utcnow().isoformat()
         }
         # Upsert to handle if row doesn't exist yet
-        res = supabase.table("user_category_progress").upsert(data, on_conflict="user_id, category").execute()
+        res = await supabase.table("user_category_progress").upsert(data, on_conflict="user_id, category").execute()
+        await response_cache.bump(user_id)
         return res.data
     
     return {"message": "Level not updated (already higher or equal)"}
 
 @app.delete("/scores")
-def delete_scores(scope: str = "all", current_user: dict = Depends(get_current_user)):
+async def delete_scores(scope: str = "all", current_user: dict = Depends(get_current_user)):
     """
     Delete scores for the current user.
     scope: 'all' (default) deletes the entire history.
     """
     try:
-        # Scores are linked by 'user' column which corresponds to username
-        # TODO: Ideally should link by ID, but current schema uses username.
-        username = current_user.get("username")
-        if not username:
+        user_id = current_user.get("id")
+        if not user_id:
              raise HTTPException(status_code=400, detail="Cannot identify user for deletion")
 
-        query = supabase.table("scores").delete().eq("user", username)
-        
         # future: if scope == 'partial' ... logic
+
+        # The games, their rollups and the user's rankings in one transaction,
+        # see delete_user_scores() in schema.sql
+        res = await supabase.rpc("delete_user_scores", {"p_user_id": user_id}).execute()
+        await invalidate_user_analytics(user_id)
+        await response_cache.bump(user_id)
+        return {"message": "Historial eliminado correctamente", "count": res.data or 0}
         
-        res = query.execute()
-        return {"message": "Historial eliminado correctamente", "count": len(res.data) if res.data else 0}
-        
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error deleting score {score_id}: {e}")
+        logger.exception("Error deleting scores of user %s", current_user.get("id"))
         raise HTTPException(status_code=500, detail=f"Error eliminando score: {str(e)}")
 
 @app.delete("/scores/{score_id}")
-def delete_score_by_id(score_id: str, current_user: dict = Depends(get_current_user)):
+async def delete_score_by_id(score_id: str, current_user: dict = Depends(get_current_user)):
     """
     Delete a specific score by ID.
     """
     try:
         # Verify ownership
         # We need to check if the score belongs to the current user
-        # Since RLS isn't strictly enforced for service role, we do it manually or assume 'user' column matches username
-        username = current_user.get("username")
-        
-        # Verify first
-        existing = supabase.table("scores").select("user").eq("id", score_id).execute()
+        # Since RLS isn't strictly enforced for service role, we do it manually
+        existing = await supabase.table("scores").select("user_id").eq("id", score_id).execute()
         if not existing.data:
             raise HTTPException(status_code=404, detail="Puntuación no encontrada")
             
-        if existing.data[0]["user"] != username and current_user.get("role") != "ADMIN":
+        if existing.data[0]["user_id"] != current_user.get("id") and current_user.get("role") != "ADMIN":
              raise HTTPException(status_code=403, detail="No tienes permiso para eliminar esta puntuación")
 
-        res = supabase.table("scores").delete().eq("id", score_id).execute()
+        owner = existing.data[0]["user_id"]
+        if owner:
+            # Also recounts that day of the owner's rollups and their rankings
+            await supabase.rpc("delete_user_scores", {"p_user_id": owner, "p_score_id": score_id}).execute()
+        else:
+            # Games without a user count towards no rollup or ranking
+            await supabase.table("scores").delete().eq("id", score_id).execute()
+        await invalidate_user_analytics(owner)
+        await response_cache.bump(owner)
         return {"message": "Puntuación eliminada", "id": score_id}
         
     except HTTPException as he:
         raise he
     except Exception as e:
-        print(f"Error deleting score {score_id}: {e}")
+        logger.exception("Error deleting score %s", score_id)
         raise HTTPException(status_code=500, detail=f"Error eliminando: {str(e)}")
 
 # --- CURRENT USER & AVATAR ---
 
 @app.get("/users/me")
-def get_me(current_user: dict = Depends(get_current_user)):
-    return current_user
+async def get_me(request: Request, current_user: dict = Depends(get_current_user)):
+    # Already loaded (or cached) by get_current_user: only the ETag/304 is added
+    return response_cache.conditional(request, current_user)
 
 @app.post("/upload-avatar")
-async def upload_avatar(file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
+async def upload_avatar(background_tasks: BackgroundTasks, file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
     # Validate file type
     if not file.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="Solo se permiten imágenes")
 
+    if not s3_configured():
+        raise HTTPException(status_code=503, detail="Configuración S3 incompleta.")
+
+    user_id = current_user["id"]
+
     try:
-        # Read file content
-        content = await file.read()
-        image = Image.open(io.BytesIO(content))
-        
-        # Convert to RGB
-        if image.mode in ('RGBA', 'P'):
-             image = image.convert('RGB')
-             
-        # Resize/Crop
-        image = ImageOps.fit(image, (500, 500), method=Image.Resampling.LANCZOS)
-        
-        # Save to WebP buffer
-        buffer = io.BytesIO()
-        image.save(buffer, format="WEBP", quality=80, optimize=True)
-        buffer.seek(0)
-        
-        file_extension = "webp"
-        content_type = "image/webp"
-        
-    except Exception as img_err:
-        print(f"Image processing failed: {img_err}")
-        raise HTTPException(status_code=422, detail="Error procesando la imagen.")
+        # Read in chunks with a size cap (hashing as we go); UploadLimitMiddleware
+        # already refused bodies announced or streamed above it
+        content, digest = await read_upload(file)
+    except ImageTooLarge:
+        raise HTTPException(status_code=413, detail=AVATAR_TOO_LARGE)
+
+    # Content-addressed layout: avatars/<user>/<sha256 of the original>/<size>.<ext>
+    # Re-uploading the same photo finds its renditions already in the bucket.
+    user_prefix = avatar_prefix(user_id)
+    base_key = f"{user_prefix}{digest[:32]}/"
+    names = rendition_names()
+
+    logger.debug("Starting avatar upload", extra={"user_id": user_id, "bytes": len(content)})
 
-    filename = f"{current_user['id']}_{uuid.uuid4()}.{file_extension}"
-    
-    # DEBUG LOGS
-    print(f"DEBUG: Starting upload for user {current_user['id']}")
-    print(f"DEBUG: Bucket={S3_BUCKET_NAME}, Endpoint={S3_ENDPOINT_URL}")
-    
-    if not all([S3_ACCESS_KEY, S3_SECRET_KEY, S3_ENDPOINT_URL, S3_BUCKET_NAME]):
-        raise HTTPException(status_code=503, detail="Configuración S3 incompleta.")
-    
     try:
-        s3 = boto3.client('s3',
-                          endpoint_url=S3_ENDPOINT_URL,
-                          aws_access_key_id=S3_ACCESS_KEY,
-                          aws_secret_access_key=S3_SECRET_KEY,
-                          region_name=S3_REGION)
-
-        # Force ACL public-read if supported by MinIO config
-        # extra_args = {'ACL': 'public-read', 'ContentType': content_type}
-        # S3/MinIO logic: ensure the bucket policy is public or ACL is set. 
-        # We will try setting ContentType at least.
-        
-        s3.upload_fileobj(
-            buffer,
-            S3_BUCKET_NAME,
-            filename,
-            ExtraArgs={'ContentType': content_type}
-        )
-        
-        # Construct URL
-        base_url = S3_ENDPOINT_URL.rstrip('/')
-        url = f"{base_url}/{S3_BUCKET_NAME}/{filename}"
-        print(f"DEBUG: Upload success: {url}")
-        return {"success": True, "url": url}
-        
+        deduplicated = await storage.exists(base_key + names[-1])
+        if not deduplicated:
+            try:
+                # Decode/resize/encode every rendition in the process pool
+                renditions = await image_processor.submit(render_avatar, content)
+            except ImagePoolBusy:
+                raise HTTPException(status_code=503, detail="Servidor ocupado procesando imágenes, inténtalo de nuevo.", headers={"Retry-After": "2"})
+            except Exception as img_err:
+                logger.warning("Image processing failed: %s", img_err, extra={"user_id": user_id})
+                raise HTTPException(status_code=422, detail="Error procesando la imagen.")
+
+            # Object names never change content, so browsers/CDNs may cache them forever.
+            # The marker rendition goes last: it only exists once the others do.
+            by_name = {name: (content_type, data) for name, content_type, data in renditions}
+            await asyncio.gather(*[
+                storage.put_object(base_key + name, by_name[name][1], by_name[name][0], cache_control=IMMUTABLE_CACHE_CONTROL)
+                for name in names[:-1]
+            ])
+            marker_type, marker_data = by_name[names[-1]]
+            await storage.put_object(base_key + names[-1], marker_data, marker_type, cache_control=IMMUTABLE_CACHE_CONTROL)
+
+        urls = rendition_urls(base_key)
+        url = urls["webp"][str(max(RENDITION_SIZES))]
+
+        # Persist the new avatar before dropping the previous objects of this user
+        await supabase.table("users").update({"avatar": url}).eq("id", user_id).execute()
+        await invalidate_user(user_id)
+        await response_cache.bump(user_id)
+        background_tasks.add_task(delete_previous_avatars, user_id, base_key)
+
+        logger.debug("Avatar uploaded", extra={"user_id": user_id, "deduplicated": deduplicated})
+        return {"success": True, "url": url, "renditions": urls, "deduplicated": deduplicated}
+
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"CRITICAL S3 ERROR: {e}")
+        logger.exception("Avatar upload failed", extra={"user_id": user_id})
         raise HTTPException(status_code=500, detail=f"Error subiendo imagen: {str(e)}")
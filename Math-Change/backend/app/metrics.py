@@ -0,0 +1,223 @@
+import os
+import time
+from typing import Tuple
+from urllib.parse import unquote
+
+import httpx
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+    multiprocess,
+)
+
+from .tracing import tracing
+
+# Several uvicorn workers (serve.py): every process writes its samples to
+# PROMETHEUS_MULTIPROC_DIR and /metrics, answered by any of them, adds them up
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+# Bearer token required on /metrics (empty = open; keep it internal then)
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+# Seconds. Default buckets stop at 10s: exports and avatar uploads take longer
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+HTTP_REQUESTS = Histogram(
+    "http_request_duration_seconds",
+    "Time until the last byte of the response, per route template",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "Requests being handled",
+    ["method"],
+    multiprocess_mode="livesum",
+)
+SUPABASE_REQUESTS = Histogram(
+    "supabase_request_duration_seconds",
+    "PostgREST calls until their body is read, per table (or rpc function) and operation",
+    ["table", "operation", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+S3_REQUESTS = Histogram(
+    "s3_request_duration_seconds",
+    "boto3 calls on the S3 thread pool, queueing included",
+    ["operation", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+S3_UPLOAD_BYTES = Counter("s3_upload_bytes", "Bytes sent with PutObject")
+IMAGE_PROCESSING = Histogram(
+    "image_processing_seconds",
+    "Pillow work inside the process pool, per function",
+    ["function"],
+    buckets=LATENCY_BUCKETS,
+)
+IMAGE_QUEUE_WAIT = Histogram(
+    "image_queue_wait_seconds",
+    "Time a job waited for a free image worker (and pickling)",
+    buckets=LATENCY_BUCKETS,
+)
+IMAGE_REJECTED = Counter("image_jobs_rejected", "Jobs refused with 503 because the image pool was full")
+CACHE_LOOKUPS = Counter(
+    "cache_lookups",
+    "Cache lookups: identity (verified tokens of this worker), shared_identity, responses, analytics",
+    ["cache", "result"],
+)
+TOKEN_VERIFICATIONS = Counter(
+    "auth_token_verifications",
+    "Firebase tokens verified against Google's keys (identity cache misses)",
+    ["result"],
+)
+LOG_RECORDS_DROPPED = Counter("log_records_dropped", "Log records dropped because the log queue was full")
+GOOGLE_KEY_FETCHES = Counter(
+    "google_key_fetches",
+    "Loads of Google's signing keys: from Google or from the shared cache",
+    ["source"],
+)
+
+
+def cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def render() -> Tuple[bytes, str]:
+    """Exposition of every metric, added up across workers in multiprocess mode."""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead() -> None:
+    """Drop this worker's live gauges from the shared files (lifespan shutdown)."""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every request until its last body chunk is sent,
+    labelled with the route template (/users/{user_id}/analytics) so the
+    series stay bounded. Paths matching no route are grouped as "unmatched".
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        status = "500"
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        in_flight = HTTP_IN_FLIGHT.labels(method)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUESTS.labels(method, path, status).observe(time.perf_counter() - started)
+
+
+def postgrest_call(request: httpx.Request) -> Tuple[str, str]:
+    """(table or function, operation) of a PostgREST request: /rest/v1/scores, /rest/v1/rpc/record_score."""
+    parts = unquote(request.url.path).split("/rest/v1/", 1)
+    if len(parts) < 2:
+        return "other", request.method.lower()
+    resource = parts[1].strip("/")
+    if resource.startswith("rpc/"):
+        return resource[4:], "rpc"
+    method = request.method
+    if method == "GET":
+        return resource, "select"
+    if method == "HEAD":
+        return resource, "count"
+    if method == "POST":
+        merge = "merge-duplicates" in request.headers.get("prefer", "")
+        return resource, "upsert" if merge else "insert"
+    return resource, {"PATCH": "update", "DELETE": "delete"}.get(method, method.lower())
+
+
+class _TimedStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, done):
+        self._stream = stream
+        self._done = done
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._done is not None:
+                self._done()
+                self._done = None
+
+
+_CLOSED_STREAM = httpx.ByteStream(b"")
+
+
+class SupabaseMetricsTransport(httpx.AsyncBaseTransport):
+    """
+    Wraps the transport of the Supabase httpx client: every table and rpc
+    call of the app goes through it, so they are all measured (and traced,
+    with TRACE_EXPORTER set) without touching the call sites. A call ends
+    when its body has been read.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        table, operation = postgrest_call(request)
+        span = None
+        if tracing.enabled:
+            span = tracing.start_span(
+                f"supabase {operation} {table}",
+                {"db.system": "postgresql", "db.collection.name": table, "db.operation.name": operation},
+            )
+        started = time.perf_counter()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except Exception as e:
+            SUPABASE_REQUESTS.labels(table, operation, "error").observe(time.perf_counter() - started)
+            if span is not None:
+                span.record_exception(e)
+                span.set_status(tracing.error_status())
+                span.end()
+            raise
+        status = str(response.status_code)
+
+        def done() -> None:
+            SUPABASE_REQUESTS.labels(table, operation, status).observe(time.perf_counter() - started)
+            if span is not None:
+                span.set_attribute("http.response.status_code", response.status_code)
+                span.end()
+            # httpx wraps this stream in one pointing back at the response: a cycle
+            # only a full GC collects, body included. The body is read, so drop it.
+            response.stream = _CLOSED_STREAM
+
+        response.stream = _TimedStream(response.stream, done)
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
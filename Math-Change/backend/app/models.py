@@ -45,6 +45,10 @@ class ScoreRecord(BaseModel):
     date: str
     category: Optional[str] = None
     difficulty: Optional[str] = None
+    idempotency_key: Optional[str] = None # Client key of the game: a replay with the same key is not saved twice
+
+class ScoreBatch(BaseModel):
+    scores: List[ScoreRecord]
 
 class CategoryProgress(BaseModel):
     category: str
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from .database import supabase
+
+logger = logging.getLogger(__name__)
+
+# Monthly partitions of scores created ahead of time (ensure_score_partitions)
+PARTITION_MONTHS_AHEAD = int(os.environ.get("SCORES_PARTITION_MONTHS_AHEAD", "3"))
+# Retention: 0 keeps every month. Otherwise months older than this many full
+# months are summarised per user (score_monthly_summaries) and detached from
+# scores; detached tables are dropped only with SCORES_RETENTION_DROP=true.
+RETENTION_MONTHS = int(os.environ.get("SCORES_RETENTION_MONTHS", "0"))
+RETENTION_DROP = os.environ.get("SCORES_RETENTION_DROP", "false").lower() == "true"
+MAINTENANCE_INTERVAL = float(os.environ.get("SCORES_PARTITION_CHECK_INTERVAL", "21600"))
+# Idempotency keys of POST /scores/batch older than this are purged; a client
+# replaying a game queued for longer would save it again.
+IDEMPOTENCY_TTL_DAYS = int(os.environ.get("SCORE_IDEMPOTENCY_TTL_DAYS", "30"))
+
+
+class PartitionMaintenance:
+    """
+    Keeps the monthly partitions of scores ahead of the calendar and applies
+    the retention policy, from a background task of every worker (the SQL
+    functions serialise concurrent runs). Games dated in a month without a
+    partition still save, into scores_default, and are moved out when the
+    month gets its partition. The same pass purges expired idempotency keys.
+    """
+
+    def __init__(self, interval: float = MAINTENANCE_INTERVAL):
+        self.interval = interval
+        self.last_run: dict = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self) -> dict:
+        res = await supabase.rpc("ensure_score_partitions", {"p_months_ahead": PARTITION_MONTHS_AHEAD}).execute()
+        archived = []
+        if RETENTION_MONTHS > 0:
+            # One partition per call: each detach holds its lock only briefly
+            while True:
+                res_archive = await supabase.rpc(
+                    "archive_score_partition", {"p_keep_months": RETENTION_MONTHS, "p_drop": RETENTION_DROP}
+                ).execute()
+                if not res_archive.data:
+                    break
+                archived.append(res_archive.data[0])
+        cutoff = datetime.now(timezone.utc) - timedelta(days=IDEMPOTENCY_TTL_DAYS)
+        await supabase.table("score_idempotency_keys").delete().lt("created_at", cutoff.isoformat()).execute()
+        self.last_run = {
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "partitions_created": res.data,
+            "archived": archived,
+            "retention_months": RETENTION_MONTHS or None,
+        }
+        return self.last_run
+
+    async def run_forever(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.exception("Score partition maintenance failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run_forever())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+partition_maintenance = PartitionMaintenance()
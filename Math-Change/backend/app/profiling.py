@@ -0,0 +1,355 @@
+import asyncio
+import contextvars
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import TYPE_CHECKING, Callable, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    from .shared_cache import CacheBackend
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two samples of the stacks while a profile runs
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.005"))
+# Finer for a single request (X-Profile), which lasts a few milliseconds
+PROFILE_REQUEST_INTERVAL = float(os.environ.get("PROFILE_REQUEST_INTERVAL", "0.001"))
+# Longest profile of the workers an admin may start
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", "60"))
+# Seconds a token for X-Profile (and the profile of that request) is kept
+PROFILE_TOKEN_TTL = float(os.environ.get("PROFILE_TOKEN_TTL", "600"))
+
+PROFILE_HEADER = "X-Profile"
+# Workers answer within this after the profile ends (pub/sub + writing their stacks)
+COLLECT_GRACE = 5.0
+
+# Top frames of threads waiting for work: counted as idle, left out of the stacks
+IDLE_FRAMES = {
+    "selectors:EpollSelector.select",
+    "selectors:KqueueSelector.select",
+    "selectors:PollSelector.select",
+    "selectors:SelectSelector.select",
+    "threading:Condition.wait",
+    "threading:Event.wait",
+    "queue:Queue.get",
+    "concurrent.futures.thread:_worker",
+    "asyncio.runners:Runner.run",
+    "asyncio.base_events:BaseEventLoop.run_until_complete",
+}
+
+Stacks = Dict[str, int]
+
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def collapse(frame) -> Tuple[str, ...]:
+    """Frames of a stack, outermost first."""
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    names.reverse()
+    return tuple(names)
+
+
+def in_request(scope) -> Callable:
+    """Sample filter: the stack runs code of this request (a frame holds its ASGI scope)."""
+
+    def keep(frame) -> bool:
+        while frame is not None:
+            if "scope" in frame.f_code.co_varnames and frame.f_locals.get("scope") is scope:
+                return True
+            frame = frame.f_back
+        return False
+
+    return keep
+
+
+def render(stacks: Stacks) -> str:
+    """Collapsed-stack format ("a;b;c 42" per line), read by flamegraph.pl, speedscope and inferno."""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+
+class StackSampler:
+    """
+    Daemon thread taking the stacks of this process' threads every `interval`
+    seconds and counting them as collapsed stacks, prefixed with the thread
+    name (MainThread is the event loop). Nothing runs between samples; each
+    one walks the stacks of every thread while holding the GIL. With
+    `thread`, only that thread is sampled and its stacks are not prefixed.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL, keep: Optional[Callable] = None, thread: Optional[int] = None):
+        self.interval = interval
+        self.keep = keep
+        self.thread = thread
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.idle = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # Threads of the samplers running in this process: never sampled themselves
+    _running = set()
+
+    def start(self) -> "StackSampler":
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return self.stacks
+
+    def merge(self, stacks: Stacks, prefix: str) -> None:
+        for stack, count in stacks.items():
+            self.stacks[f"{prefix};{stack}"] += count
+
+    def _run(self) -> None:
+        StackSampler._running.add(threading.get_ident())
+        try:
+            self._sample()
+        finally:
+            StackSampler._running.discard(threading.get_ident())
+
+    def _sample(self) -> None:
+        names: Dict[int, str] = {}
+        while not self._stop.wait(self.interval):
+            self.samples += 1
+            for ident, frame in sys._current_frames().items():
+                if ident in StackSampler._running or (self.thread is not None and ident != self.thread):
+                    continue
+                if self.keep is not None and not self.keep(frame):
+                    continue
+                stack = collapse(frame)
+                if stack[-1] in IDLE_FRAMES:
+                    self.idle += 1
+                    continue
+                if self.thread is None:
+                    if ident not in names:
+                        names = {t.ident: t.name for t in threading.enumerate()}
+                    stack = (names.get(ident, str(ident)),) + stack
+                self.stacks[";".join(stack)] += 1
+
+
+# Sampler of the request flagged with X-Profile that is running in this context
+_request_sampler: contextvars.ContextVar[Optional[StackSampler]] = contextvars.ContextVar("request_sampler", default=None)
+
+
+class Profiler:
+    """
+    Profiles of the running workers on demand (POST /admin/profile).
+
+    begin() publishes a "profile" message on the invalidation bus of the
+    shared cache; every worker receiving it samples its own stacks for the
+    requested seconds, or until the workers together served the requested
+    number of requests, and writes them to the shared cache. collect() adds
+    them up. With CACHE_URL=memory only the worker answering is profiled.
+
+    Image jobs are sampled inside the pool process while a profile runs and
+    merged under "image-pool".
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL, max_seconds: float = PROFILE_MAX_SECONDS):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.shared: Optional["CacheBackend"] = None
+        self.active: Optional[str] = None
+        self._sampler: Optional[StackSampler] = None
+        self._request_limit = 0
+        self._done: Optional[asyncio.Event] = None
+        self._tasks = set()
+
+    def start(self, shared: "CacheBackend") -> None:
+        if self.shared is None:
+            shared.on_invalidate("profile", self._on_profile)
+            shared.on_invalidate("profile_stop", self._on_stop)
+        self.shared = shared
+
+    async def begin(self, seconds: float, requests: Optional[int] = None) -> str:
+        profile_id = uuid.uuid4().hex[:16]
+        # Delivered to this worker too, synchronously
+        await self.shared.invalidate("profile", f"{profile_id}:{seconds}:{requests or 0}")
+        return profile_id
+
+    def _on_profile(self, key: str) -> None:
+        profile_id, seconds, requests = key.split(":")
+        task = asyncio.get_running_loop().create_task(self._run(profile_id, float(seconds), int(requests)))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _on_stop(self, profile_id: str) -> None:
+        if self.active == profile_id and self._done is not None:
+            self._done.set()
+
+    async def _run(self, profile_id: str, seconds: float, requests: int) -> None:
+        if self.active is not None:
+            logger.warning("Profile %s ignored: profile %s is running", profile_id, self.active)
+            return
+        self.active = profile_id
+        worker = await self.shared.incr(f"profile:{profile_id}:workers")
+        self._request_limit = requests
+        self._done = asyncio.Event()
+        self._sampler = StackSampler(self.interval).start()
+        started = time.perf_counter()
+        logger.info("Profiling for %ss (%s requests)", seconds, requests or "any")
+        try:
+            await asyncio.wait_for(self._done.wait(), timeout=min(seconds, self.max_seconds))
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            sampler, self._sampler = self._sampler, None
+            stacks = sampler.stop()
+            self.active = None
+        result = {
+            "pid": os.getpid(),
+            "seconds": round(time.perf_counter() - started, 3),
+            "samples": sampler.samples,
+            "idle": sampler.idle,
+            "stacks": dict(stacks),
+        }
+        await self.shared.set(f"profile:{profile_id}:{worker}", result, ttl=PROFILE_TOKEN_TTL)
+        await self.shared.incr(f"profile:{profile_id}:done")
+
+    async def request_done(self) -> None:
+        """Called after every request while a profile limited to N requests runs."""
+        profile_id = self.active
+        if not profile_id or not self._request_limit:
+            return
+        served = await self.shared.incr(f"profile:{profile_id}:requests")
+        if served == self._request_limit:
+            await self.shared.invalidate("profile_stop", profile_id)
+
+    async def collect(self, profile_id: str, seconds: float) -> Tuple[str, dict]:
+        """Wait for every worker's stacks and add them up: (collapsed stacks, summary)."""
+        deadline = time.monotonic() + min(seconds, self.max_seconds) + COLLECT_GRACE
+        prefix = f"profile:{profile_id}"
+        workers = done = 0
+        while time.monotonic() < deadline:
+            workers = await self.shared.get(f"{prefix}:workers") or 0
+            done = await self.shared.get(f"{prefix}:done") or 0
+            if workers and done >= workers:
+                break
+            await asyncio.sleep(0.1)
+        total: Counter = Counter()
+        summary = {"id": profile_id, "workers": [], "missing": max(workers - done, 0)}
+        for n in range(1, workers + 1):
+            result = await self.shared.get(f"{prefix}:{n}")
+            if result is None:
+                continue
+            total.update(result.pop("stacks"))
+            summary["workers"].append(result)
+            await self.shared.delete(f"{prefix}:{n}")
+        for key in ("workers", "done", "requests"):
+            await self.shared.delete(f"{prefix}:{key}")
+        return render(total), summary
+
+    # --- single requests (X-Profile) ---
+
+    async def issue_token(self) -> str:
+        token = uuid.uuid4().hex
+        await self.shared.set(f"profile:token:{token}", 1, ttl=PROFILE_TOKEN_TTL)
+        return token
+
+    async def claim(self, token: str) -> bool:
+        """A token is good for one request, in any worker."""
+        # One atomic get-and-delete: of two requests racing with the same token, one wins
+        return await self.shared.pop(f"profile:token:{token}") is not None
+
+    async def request_result(self, token: str) -> Optional[dict]:
+        return await self.shared.get(f"profile:request:{token}")
+
+    # --- image pool ---
+
+    def pool_interval(self) -> Optional[float]:
+        """Sampling interval for an image job submitted now, None if nothing is profiled."""
+        request = _request_sampler.get()
+        if request is not None:
+            return request.interval
+        return self.interval if self._sampler is not None else None
+
+    def add_pool_stacks(self, stacks: Stacks) -> None:
+        for sampler in (self._sampler, _request_sampler.get()):
+            if sampler is not None:
+                sampler.merge(stacks, "image-pool")
+
+
+profiler = Profiler()
+
+
+def sample_job(interval: Optional[float], fn, *args) -> Tuple[Optional[Stacks], object]:
+    """Run fn(*args) in this thread (of a pool process), sampled if `interval` is set: (stacks, result)."""
+    if interval is None:
+        return None, fn(*args)
+    sampler = StackSampler(interval, thread=threading.get_ident()).start()
+    try:
+        result = fn(*args)
+    finally:
+        sampler.stop()
+    return dict(sampler.stacks), result
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware for profiling. A request carrying X-Profile with a token
+    from POST /admin/profile/requests is sampled on its own (only stacks
+    running its code), the result kept for GET /admin/profile/requests/{token}.
+    While a profile limited to N requests runs, it counts the requests served.
+    Other requests only pay a header lookup.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = None
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                token = value.decode("latin-1")
+                break
+        if token is None or not await profiler.claim(token):
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                if profiler.active:
+                    await profiler.request_done()
+            return
+
+        sampler = StackSampler(PROFILE_REQUEST_INTERVAL, keep=in_request(scope)).start()
+        sampler_token = _request_sampler.set(sampler)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request_sampler.reset(sampler_token)
+            stacks = sampler.stop()
+            result = {
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+                "samples": sampler.samples,
+                "stacks": dict(stacks),
+            }
+            await profiler.shared.set(f"profile:request:{token}", result, ttl=PROFILE_TOKEN_TTL)
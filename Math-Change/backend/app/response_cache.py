@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import time
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+from .metrics import cache_lookup
+from .shared_cache import CacheBackend, MemoryBackend, new_version, shared_cache
+
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE", "true").lower() == "true"
+# Bounds how long a response can outlive a write when the cache is not shared
+# (CACHE_URL=memory and several workers: each one only sees its own bumps)
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "60"))
+# Larger bodies (long game histories) still get an ETag but are not stored
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", "262144"))
+
+
+def _etag(body: bytes) -> str:
+    # Strong validator: derived from the exact bytes sent
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def _matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison: W/"x" matches "x"
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in candidates)
+
+
+class ResponseCache:
+    """
+    Cache of the JSON responses a user polls between screens
+    (GET /users/me/progress, /scores...), keyed by user, endpoint and that user's
+    version. Every write to the user's data calls bump(), which gives them a
+    new version: every entry cached under the old one stops matching at once
+    and ages out of the LRU.
+
+    Responses carry a strong ETag computed from the body. A request whose
+    If-None-Match matches the cached entry gets 304 without any database call.
+    Entries and versions live in the shared cache backend: with a shared one,
+    a write on any worker invalidates the user's responses on all of them.
+    """
+
+    def __init__(
+        self,
+        backend: Optional[CacheBackend] = None,
+        ttl: float = RESPONSE_CACHE_TTL,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+        enabled: bool = RESPONSE_CACHE_ENABLED,
+    ):
+        self.backend = backend or MemoryBackend()
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.bumps = 0
+
+    async def version(self, user_id: Hashable) -> int:
+        key = f"v:{user_id}"
+        version = await self.backend.get(key)
+        if version is None:
+            # See new_version(): never a value an old entry may be cached under
+            await self.backend.add(key, time.time_ns())
+            version = await self.backend.get(key) or 0
+        return version
+
+    async def bump(self, user_id: Optional[Hashable]) -> None:
+        """Invalidate every cached response of this user (call after their data changes)."""
+        if user_id:
+            self.bumps += 1
+            await new_version(self.backend, f"v:{user_id}")
+
+    async def respond(
+        self,
+        request: Request,
+        user_id: Hashable,
+        endpoint: str,
+        fetch: Callable[[], Awaitable[Any]],
+    ) -> Response:
+        """
+        The response of `fetch()` for this user and endpoint (include the
+        query parameters that change the result in `endpoint`): from the cache
+        when the user's version has not changed, 304 when the client already
+        has it.
+        """
+        if not self.enabled:
+            return self._response(request, self._render(await fetch()))
+        version = await self.version(user_id)
+        key = f"r:{user_id}:{endpoint}:{version}"
+        cached = await self.backend.get(key)
+        if cached is not None:
+            self.hits += 1
+            cache_lookup("responses", True)
+            etag, text = cached
+            body = text.encode("utf-8")
+        else:
+            self.misses += 1
+            cache_lookup("responses", False)
+            body = self._render(await fetch())
+            etag = _etag(body)
+            # Stored under the version read BEFORE fetching: if a write bumps
+            # it meanwhile, this possibly older body is never served again
+            if len(body) <= self.max_bytes:
+                await self.backend.set(key, [etag, body.decode("utf-8")], ttl=self.ttl)
+        return self._response(request, body, etag)
+
+    def conditional(self, request: Request, data: Any) -> Response:
+        """ETag/304 for data the handler already has in memory (nothing stored)."""
+        return self._response(request, self._render(data))
+
+    @staticmethod
+    def _render(data: Any) -> bytes:
+        # Same bytes as FastAPI's default JSONResponse
+        return json.dumps(
+            jsonable_encoder(data), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+        ).encode("utf-8")
+
+    def _response(self, request: Request, body: bytes, etag: Optional[str] = None) -> Response:
+        etag = etag or _etag(body)
+        # no-cache: the browser keeps the copy but revalidates it on every call
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Authorization"}
+        if _matches(request.headers.get("if-none-match"), etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "not_modified": self.not_modified,
+            "bumps": self.bumps,
+            "storage": self.backend.stats(),
+        }
+
+
+response_cache = ResponseCache(shared_cache)
@@ -0,0 +1,83 @@
+import asyncio
+import os
+import re
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, List, Optional, Tuple
+
+from .database import supabase
+
+# Days per rebuild_score_daily_rollups() call, and calls running at once. Each
+# call locks scores against saves (SHARE lock) only while its chunk is rebuilt.
+ROLLUP_CHUNK_DAYS = int(os.environ.get("ROLLUP_CHUNK_DAYS", "7"))
+ROLLUP_WORKERS = int(os.environ.get("ROLLUP_WORKERS", "4"))
+
+
+def _parse_day(value: str) -> date:
+    """UTC day of a PostgREST timestamp (fractional seconds dropped: Python 3.9 wants exactly 3 or 6 digits)."""
+    parsed = datetime.fromisoformat(re.sub(r"\.\d+", "", value.replace("Z", "+00:00")))
+    return (parsed.astimezone(timezone.utc) if parsed.tzinfo else parsed).date()
+
+
+async def history_range() -> Optional[Tuple[date, date]]:
+    """First and last UTC day with games in scores, None if there are none."""
+    days = []
+    for desc in (False, True):
+        res = await supabase.table("scores").select("date").order("date", desc=desc).limit(1).execute()
+        if not res.data:
+            return None
+        days.append(_parse_day(res.data[0]["date"]))
+    return days[0], days[1]
+
+
+def chunks(start: date, end: date, chunk_days: int = ROLLUP_CHUNK_DAYS) -> List[Tuple[date, date]]:
+    """[start, end] split into consecutive ranges of at most chunk_days days."""
+    ranges = []
+    while start <= end:
+        last = min(start + timedelta(days=chunk_days - 1), end)
+        ranges.append((start, last))
+        start = last + timedelta(days=1)
+    return ranges
+
+
+async def rebuild_rollups(
+    start: date,
+    end: date,
+    chunk_days: int = ROLLUP_CHUNK_DAYS,
+    workers: int = ROLLUP_WORKERS,
+    report: Optional[Callable[[dict], None]] = None,
+) -> dict:
+    """
+    Recompute score_daily_rollups for every user from start to end (UTC days,
+    inclusive) with rebuild_score_daily_rollups(), `workers` chunks at a time.
+    Each chunk commits on its own, so an interrupted run can simply be
+    started again.
+    """
+    ranges = chunks(start, end, chunk_days)
+    semaphore = asyncio.Semaphore(workers)
+    started = time.monotonic()
+    status = {"chunks": len(ranges), "chunks_done": 0, "rows_written": 0}
+
+    async def rebuild_chunk(first: date, last: date) -> None:
+        async with semaphore:
+            res = await supabase.rpc(
+                "rebuild_score_daily_rollups", {"p_from": first.isoformat(), "p_to": last.isoformat()}
+            ).execute()
+        status["chunks_done"] += 1
+        status["rows_written"] += res.data or 0
+        status["last_chunk"] = f"{first.isoformat()}..{last.isoformat()}"
+        status["elapsed_seconds"] = round(time.monotonic() - started, 2)
+        if report:
+            report(status)
+
+    await asyncio.gather(*(rebuild_chunk(first, last) for first, last in ranges))
+    status["elapsed_seconds"] = round(time.monotonic() - started, 2)
+    return status
+
+
+async def check_rollups(start: date, end: date, limit: int = 100) -> List[dict]:
+    """Rollup rows of [start, end] that differ from scores (at most `limit`), see check_score_daily_rollups()."""
+    res = await supabase.rpc(
+        "check_score_daily_rollups", {"p_from": start.isoformat(), "p_to": end.isoformat(), "p_limit": limit}
+    ).execute()
+    return res.data or []
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import os
+import statistics
+import time
+from collections import deque
+from typing import Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Off by default: every POST /scores is its own record_score() call
+SCORE_WRITE_BEHIND = os.environ.get("SCORE_WRITE_BEHIND", "false").lower() == "true"
+# A flush waits at most this long for more games after the first one...
+SCORE_FLUSH_INTERVAL_MS = float(os.environ.get("SCORE_FLUSH_INTERVAL_MS", "5"))
+# ...or until this many games are waiting
+SCORE_FLUSH_MAX = int(os.environ.get("SCORE_FLUSH_MAX", "200"))
+# Games waiting beyond this make new requests wait to enter the queue
+SCORE_QUEUE_LIMIT = int(os.environ.get("SCORE_QUEUE_LIMIT", "5000"))
+
+Writer = Callable[[List[dict]], Awaitable[List[dict]]]
+
+
+class ScoreBuffer:
+    """
+    Write-behind queue for POST /scores (group commit). When a class ends,
+    hundreds of games arrive together; instead of one record_score() call
+    each, requests queue their game and one task writes everything waiting
+    with a single record_scores() call: one multi-row insert and one summed
+    upsert per (user, category) and ranking slot. While a flush is in the
+    database the next games accumulate, so batches grow with the load.
+
+    Each request is answered only after the call that wrote its game
+    returned, i.e. after the commit: nothing acknowledged is lost if the
+    worker dies. If a batch fails, its games are retried one by one so a bad
+    game only fails its own request.
+    """
+
+    def __init__(
+        self,
+        write: Writer,
+        max_items: int = SCORE_FLUSH_MAX,
+        max_wait_ms: float = SCORE_FLUSH_INTERVAL_MS,
+        limit: int = SCORE_QUEUE_LIMIT,
+        enabled: bool = SCORE_WRITE_BEHIND,
+    ):
+        self.enabled = enabled
+        self.max_items = max_items
+        self.max_wait = max_wait_ms / 1000
+        self.limit = limit
+        self._write = write
+        self._queue: Optional[asyncio.Queue] = None
+        self._full: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.games = 0
+        self.errors = 0
+        self.max_flush_size = 0
+        self._sizes: deque = deque(maxlen=1000)  # games per flush, recent flushes
+        self._latencies: deque = deque(maxlen=1000)  # ms per flush, recent flushes
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def submit(self, user_id: Optional[str], game: dict) -> dict:
+        """Queue one game and wait until it is written. Returns its record_scores() row."""
+        game = dict(game, user_id=user_id)
+        if not self.running:
+            return (await self._write_batch([game]))[0]
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((game, future))
+        if self._queue.qsize() >= self.max_items:
+            self._full.set()
+        return await future
+
+    async def _write_batch(self, games: List[dict]) -> List[dict]:
+        started = time.perf_counter()
+        try:
+            rows = await self._write(games)
+        except Exception:
+            self.errors += 1
+            raise
+        if len(rows) != len(games):
+            self.errors += 1
+            raise RuntimeError(f"record_scores returned {len(rows)} rows for {len(games)} games")
+        self.flushes += 1
+        self.games += len(games)
+        self.max_flush_size = max(self.max_flush_size, len(games))
+        self._sizes.append(len(games))
+        self._latencies.append((time.perf_counter() - started) * 1000)
+        return rows
+
+    async def _flush(self, batch: list) -> None:
+        try:
+            rows = await self._write_batch([game for game, _ in batch])
+        except Exception as e:
+            if len(batch) > 1:
+                logger.error("Score flush of %d games failed, retrying one by one: %s", len(batch), e)
+                for item in batch:
+                    await self._flush([item])
+                return
+            future = batch[0][1]
+            if not future.done():
+                future.set_exception(e)
+            return
+        for (_, future), row in zip(batch, rows):
+            if not future.done():
+                future.set_result(row)
+
+    async def _run(self) -> None:
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            if self._queue.qsize() < self.max_items - 1:
+                # Give the rest of the class a few milliseconds to finish too
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.max_wait)
+                except asyncio.TimeoutError:
+                    pass
+            batch = [item]
+            stopping = False
+            while len(batch) < self.max_items and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+            if stopping:
+                return
+
+    def start(self) -> None:
+        if self.enabled and not self.running:
+            self._queue = asyncio.Queue(maxsize=self.limit)
+            self._full = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Write every game already queued, then stop."""
+        if self.running:
+            await self._queue.put(None)
+            self._full.set()
+            await self._task
+            # Games that entered the queue after the stop marker
+            while not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is not None:
+                    await self._flush([item])
+        self._task = None
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+        return {
+            "enabled": self.enabled,
+            "running": self.running,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "flushes": self.flushes,
+            "games": self.games,
+            "errors": self.errors,
+            "flush_size_avg": round(statistics.mean(self._sizes), 1) if self._sizes else None,
+            "flush_size_max": self.max_flush_size,
+            "flush_latency_ms_p50": round(statistics.median(latencies), 2) if latencies else None,
+            "flush_latency_ms_p99": round(latencies[max(int(len(latencies) * 0.99) - 1, 0)], 2) if latencies else None,
+            "max_items": self.max_items,
+            "max_wait_ms": self.max_wait * 1000,
+        }
@@ -0,0 +1,321 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+import redis.asyncio as redis
+
+from .cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Empty or "memory": every worker keeps its own caches (one uvicorn process).
+# redis://host:6379/0 (or any server speaking the Redis protocol): workers and
+# containers share cached keys, identities and responses, and invalidations
+# reach all of them through pub/sub.
+CACHE_URL = os.environ.get("CACHE_URL", "memory")
+CACHE_PREFIX = os.environ.get("CACHE_PREFIX", "math-change:")
+CACHE_MEMORY_SIZE = int(os.environ.get("CACHE_MEMORY_SIZE", "10000"))
+
+Handler = Callable[[str], None]
+
+# Compare-and-delete in one round-trip: nothing can take the key between the check and the DEL
+DELETE_IF_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Get-and-delete in one round-trip (GETDEL without needing Redis 6.2): one caller gets the value
+POP_SCRIPT = """
+local value = redis.call('GET', KEYS[1])
+if value then
+    redis.call('DEL', KEYS[1])
+end
+return value
+"""
+
+
+class CacheBackend:
+    """
+    Key-value storage shared by the caches of the API (response bodies and
+    versions, Google keys, verified tokens, user rows), plus the invalidation
+    bus: invalidate(kind, key) runs the handlers registered for `kind` in this
+    worker and, on a shared backend, in every other one. The handlers drop the
+    local copies (identity_cache, analytics_cache) that live in each worker.
+    Values must be JSON-serialisable.
+    """
+
+    shared = False
+
+    def __init__(self):
+        self.origin = uuid.uuid4().hex  # this worker, to skip its own messages
+        self._handlers: Dict[str, List[Handler]] = {}
+
+    async def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+    async def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """Set only if the key does not exist. True if this call set it."""
+        raise NotImplementedError
+
+    async def incr(self, key: str) -> int:
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    async def delete_if(self, key: str, value: Any) -> bool:
+        """Delete only if the key still holds `value` (a lock we own). True if this call deleted it."""
+        raise NotImplementedError
+
+    async def pop(self, key: str) -> Optional[Any]:
+        """Delete the key and return its value. Of concurrent calls, only one gets it."""
+        raise NotImplementedError
+
+    async def ping(self) -> None:
+        """Raise if the backend cannot be reached (readiness probe)."""
+
+    def on_invalidate(self, kind: str, handler: Handler) -> None:
+        self._handlers.setdefault(kind, []).append(handler)
+
+    async def invalidate(self, kind: str, key: str) -> None:
+        self._dispatch(kind, key)
+        await self.publish(kind, key)
+
+    def _dispatch(self, kind: str, key: str) -> None:
+        for handler in self._handlers.get(kind, []):
+            try:
+                handler(key)
+            except Exception as e:
+                logger.exception("Cache invalidation handler for %s failed: %s", kind, e)
+
+    async def publish(self, kind: str, key: str) -> None:
+        pass
+
+    def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {}
+
+
+class MemoryBackend(CacheBackend):
+    """In-process LRU (TTLCache): nothing is shared, the default."""
+
+    def __init__(self, maxsize: int = CACHE_MEMORY_SIZE):
+        super().__init__()
+        # Entries without a TTL (versions) never expire; the LRU bound still applies
+        self._cache = TTLCache(maxsize=maxsize, ttl=float("inf"))
+
+    async def get(self, key: str) -> Optional[Any]:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self._cache.set(key, value, ttl=ttl)
+
+    async def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        # No await between the check and the set: atomic on the event loop
+        if self._cache.get(key) is not None:
+            return False
+        self._cache.set(key, value, ttl=ttl)
+        return True
+
+    async def incr(self, key: str) -> int:
+        value = (self._cache.get(key) or 0) + 1
+        self._cache.set(key, value)
+        return value
+
+    async def delete(self, key: str) -> None:
+        self._cache.delete(key)
+
+    async def delete_if(self, key: str, value: Any) -> bool:
+        if self._cache.get(key) != value:
+            return False
+        self._cache.delete(key)
+        return True
+
+    async def pop(self, key: str) -> Optional[Any]:
+        value = self._cache.get(key)
+        self._cache.delete(key)
+        return value
+
+    def stats(self) -> dict:
+        return {"backend": "memory", **self._cache.stats()}
+
+
+class RedisBackend(CacheBackend):
+    """
+    Any server speaking the Redis protocol (Redis, Valkey, KeyDB...). Keys are
+    prefixed with CACHE_PREFIX. A cache that cannot be reached must not take
+    the API down: failed reads are misses and failed writes are logged, so
+    requests fall back to the database.
+    """
+
+    shared = True
+
+    def __init__(self, url: str, prefix: str = CACHE_PREFIX):
+        super().__init__()
+        self.url = url
+        self.prefix = prefix
+        self.channel = f"{prefix}invalidate"
+        self._redis = redis.Redis.from_url(url)
+        self._listener: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.received = 0
+
+    def _failed(self, action: str, e: Exception) -> None:
+        self.errors += 1
+        logger.error("Shared cache %s failed: %s", action, e)
+
+    async def get(self, key: str) -> Optional[Any]:
+        try:
+            raw = await self._redis.get(self.prefix + key)
+        except Exception as e:
+            self._failed("get", e)
+            return None
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    @staticmethod
+    def _px(ttl: Optional[float]) -> Optional[int]:
+        # Redis wants a positive integer; no TTL (or inf) means no expiry
+        if ttl is None or ttl == float("inf"):
+            return None
+        return max(int(ttl * 1000), 1)
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        if ttl is not None and ttl <= 0:
+            return
+        try:
+            await self._redis.set(self.prefix + key, json.dumps(value), px=self._px(ttl))
+        except Exception as e:
+            self._failed("set", e)
+
+    async def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        try:
+            return bool(await self._redis.set(self.prefix + key, json.dumps(value), px=self._px(ttl), nx=True))
+        except Exception as e:
+            self._failed("add", e)
+            return False
+
+    async def incr(self, key: str) -> int:
+        try:
+            return await self._redis.incr(self.prefix + key)
+        except Exception as e:
+            self._failed("incr", e)
+            return 0
+
+    async def delete(self, key: str) -> None:
+        try:
+            await self._redis.delete(self.prefix + key)
+        except Exception as e:
+            self._failed("delete", e)
+
+    async def delete_if(self, key: str, value: Any) -> bool:
+        try:
+            return bool(await self._redis.eval(DELETE_IF_SCRIPT, 1, self.prefix + key, json.dumps(value)))
+        except Exception as e:
+            self._failed("delete_if", e)
+            return False
+
+    async def pop(self, key: str) -> Optional[Any]:
+        try:
+            raw = await self._redis.eval(POP_SCRIPT, 1, self.prefix + key)
+        except Exception as e:
+            self._failed("pop", e)
+            return None
+        return None if raw is None else json.loads(raw)
+
+    async def ping(self) -> None:
+        await self._redis.ping()
+
+    async def publish(self, kind: str, key: str) -> None:
+        message = json.dumps({"origin": self.origin, "kind": kind, "key": key})
+        try:
+            await self._redis.publish(self.channel, message)
+        except Exception as e:
+            self._failed("publish", e)
+
+    async def _listen(self) -> None:
+        while True:
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.channel)
+                async for message in pubsub.listen():
+                    data = json.loads(message["data"])
+                    if data.get("origin") != self.origin:
+                        self.received += 1
+                        self._dispatch(data["kind"], data["key"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Messages published while disconnected are lost: the local
+                # copies they were meant to drop still expire with their TTL
+                self._failed("subscription", e)
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    def start(self) -> None:
+        """Subscribe to the invalidation channel on the running event loop."""
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        await self._redis.aclose()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "backend": "redis",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "errors": self.errors,
+            "invalidations_received": self.received,
+            "subscribed": self._listener is not None and not self._listener.done(),
+        }
+
+
+def create_backend(url: str = CACHE_URL) -> CacheBackend:
+    if not url or url == "memory":
+        return MemoryBackend()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url)
+    raise RuntimeError(f"Unsupported CACHE_URL: {url}")
+
+
+shared_cache = create_backend()
+
+
+async def new_version(backend: CacheBackend, key: str) -> int:
+    """
+    Increment a version counter. A counter that is missing (never set, or
+    evicted) restarts from the current time in nanoseconds rather than from
+    1, so it never repeats a value entries may still be cached under.
+    """
+    await backend.add(key, time.time_ns())
+    return await backend.incr(key)
@@ -0,0 +1,160 @@
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+
+from .metrics import S3_REQUESTS, S3_UPLOAD_BYTES
+from .tracing import tracing
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# S3 Configuration - MUST be set via environment variables
+S3_ACCESS_KEY = os.environ.get("S3_ACCESS_KEY")
+S3_SECRET_KEY = os.environ.get("S3_SECRET_KEY")
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL")
+S3_BUCKET_NAME = os.environ.get("S3_BUCKET_NAME")
+S3_REGION = os.environ.get("S3_REGION", "us-east-1")
+# Concurrent S3 requests per worker (HTTP connections kept in the pool)
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get("S3_MAX_POOL_CONNECTIONS", "50"))
+
+
+def s3_configured() -> bool:
+    return all([S3_ACCESS_KEY, S3_SECRET_KEY, S3_ENDPOINT_URL, S3_BUCKET_NAME])
+
+
+class S3Storage:
+    """
+    One process-wide S3 client. boto3 clients are thread-safe (sessions are
+    not), so the client is built once, with a connection pool, and every upload
+    reuses its credentials, endpoint resolution and kept-alive TLS connections.
+    Blocking boto3 calls run on a dedicated thread pool sized like the
+    connection pool, never on the event loop.
+    """
+
+    def __init__(self, max_pool_connections: int = S3_MAX_POOL_CONNECTIONS):
+        self.max_pool_connections = max_pool_connections
+        self._client = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = boto3.session.Session().client(
+                        "s3",
+                        endpoint_url=S3_ENDPOINT_URL,
+                        aws_access_key_id=S3_ACCESS_KEY,
+                        aws_secret_access_key=S3_SECRET_KEY,
+                        region_name=S3_REGION,
+                        config=Config(
+                            max_pool_connections=self.max_pool_connections,
+                            retries={"max_attempts": 3, "mode": "standard"},
+                            connect_timeout=5,
+                            read_timeout=30,
+                        ),
+                    )
+        return self._client
+
+    async def start(self) -> None:
+        """Build the client at startup and open a first connection to the bucket."""
+        if not s3_configured():
+            return
+        try:
+            await self.call("head_bucket", Bucket=S3_BUCKET_NAME)
+        except Exception as e:
+            logger.warning("S3 bucket check failed: %s", e)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._client = None
+
+    async def run(self, fn, *args, **kwargs):
+        """Run a blocking function off the event loop, on the S3 thread pool."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_pool_connections, thread_name_prefix="s3")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    async def call(self, operation: str, **kwargs):
+        """Run a boto3 client operation (e.g. "put_object") off the event loop."""
+        started = time.perf_counter()
+        status = "error"
+        span = None
+        if tracing.enabled:
+            span = tracing.start_span(
+                f"s3.{operation}", {"aws.s3.bucket": kwargs.get("Bucket", ""), "aws.s3.key": kwargs.get("Key", "")}
+            )
+        try:
+            result = await self.run(getattr(self.client, operation), **kwargs)
+            status = "ok"
+            return result
+        except ClientError as e:
+            status = e.response.get("Error", {}).get("Code", "error")
+            raise
+        finally:
+            S3_REQUESTS.labels(operation, status).observe(time.perf_counter() - started)
+            if span is not None:
+                # S3 error codes (404 of exists()) are answers, not failures of the call
+                span.set_attribute("aws.s3.status", status)
+                if status == "error":
+                    span.set_status(tracing.error_status())
+                span.end()
+
+    async def put_object(self, key: str, body: bytes, content_type: str, cache_control: Optional[str] = None) -> str:
+        # Avatars are a few KB after encoding: one PutObject is a single request,
+        # multipart would only add round-trips (parts must be >= 5 MB).
+        extra = {"CacheControl": cache_control} if cache_control else {}
+        await self.call("put_object", Bucket=S3_BUCKET_NAME, Key=key, Body=body, ContentType=content_type, **extra)
+        S3_UPLOAD_BYTES.inc(len(body))
+        return public_url(key)
+
+    async def exists(self, key: str) -> bool:
+        try:
+            await self.call("head_object", Bucket=S3_BUCKET_NAME, Key=key)
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    async def delete_prefix(self, prefix: str, keep_prefix: Optional[str] = None) -> int:
+        """Delete every object under `prefix`, except those under `keep_prefix`."""
+        with tracing.span("s3.delete_prefix", {"aws.s3.bucket": S3_BUCKET_NAME or "", "aws.s3.prefix": prefix}):
+            return await self.run(self._delete_prefix, prefix, keep_prefix)
+
+    def _delete_prefix(self, prefix: str, keep_prefix: Optional[str]) -> int:
+        deleted = 0
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=S3_BUCKET_NAME, Prefix=prefix):
+            keys = [
+                {"Key": obj["Key"]}
+                for obj in page.get("Contents", [])
+                if not (keep_prefix and obj["Key"].startswith(keep_prefix))
+            ]
+            if keys:
+                # list_objects_v2 pages hold at most 1000 keys, the delete_objects limit
+                self.client.delete_objects(Bucket=S3_BUCKET_NAME, Delete={"Objects": keys, "Quiet": True})
+                deleted += len(keys)
+        return deleted
+
+
+def public_url(key: str) -> str:
+    base_url = S3_ENDPOINT_URL.rstrip('/')
+    return f"{base_url}/{S3_BUCKET_NAME}/{key}"
+
+
+storage = S3Storage()
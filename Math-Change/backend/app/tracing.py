@@ -0,0 +1,171 @@
+import contextlib
+import logging
+import os
+from typing import Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Empty: tracing off, OpenTelemetry is not even imported and span() is a shared no-op.
+# otlp: OTLP/HTTP to OTEL_EXPORTER_OTLP_ENDPOINT (a local collector, default http://localhost:4318)
+# file: one JSON span per line appended to TRACE_FILE
+TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "").strip().lower()
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces.jsonl")
+# Fraction of requests traced; a request arriving with a sampled traceparent is always traced
+TRACE_SAMPLE = float(os.environ.get("TRACE_SAMPLE", "1.0"))
+SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME", "math-change-api")
+
+TRACE_HEADER = "X-Trace-ID"
+
+_NO_SPAN = contextlib.nullcontext()
+
+
+class Tracing:
+    """
+    Opt-in OpenTelemetry spans: one per request (TracingMiddleware) with
+    children for Supabase calls, Google key fetches, token verification,
+    Pillow steps and S3 calls. Call sites use span() / start_span(), which
+    cost one attribute check while tracing is off.
+    """
+
+    def __init__(self, exporter: str = TRACE_EXPORTER, sample: float = TRACE_SAMPLE, path: str = TRACE_FILE):
+        self.exporter = exporter
+        self.sample = sample
+        self.path = path
+        self._provider = None
+        self._tracer = None
+        self._propagator = None
+        self._file = None
+        self._trace = None  # opentelemetry.trace, once started
+
+    @property
+    def enabled(self) -> bool:
+        return self._tracer is not None
+
+    def start(self) -> None:
+        if not self.exporter or self._tracer is not None:
+            return
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+        from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+        from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapPropagator
+
+        if self.exporter == "otlp":
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+            exporter = OTLPSpanExporter()
+        elif self.exporter == "file":
+            self._file = open(self.path, "a", encoding="utf-8")
+            exporter = ConsoleSpanExporter(out=self._file, formatter=lambda span: span.to_json(indent=None) + "\n")
+        else:
+            raise RuntimeError(f"Unknown TRACE_EXPORTER {self.exporter!r} (otlp, file)")
+
+        self._provider = TracerProvider(
+            resource=Resource.create({"service.name": SERVICE_NAME, "service.instance.id": str(os.getpid())}),
+            sampler=ParentBased(TraceIdRatioBased(self.sample)),
+        )
+        # Spans are exported in batches by a background thread, never on the request path
+        self._provider.add_span_processor(BatchSpanProcessor(exporter))
+        self._tracer = self._provider.get_tracer("app")
+        self._propagator = TraceContextTextMapPropagator()
+        self._trace = trace
+        logger.info("Tracing enabled: %s exporter, sample %s", self.exporter, self.sample)
+
+    def stop(self) -> None:
+        """Export the spans still buffered (lifespan shutdown)."""
+        if self._provider is not None:
+            self._provider.shutdown()
+            self._provider = None
+            self._tracer = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def span(self, name: str, attributes: Optional[dict] = None):
+        """Context manager: a child span of the current one, or a no-op while tracing is off."""
+        if self._tracer is None:
+            return _NO_SPAN
+        return self._tracer.start_as_current_span(name, attributes=attributes)
+
+    def start_span(self, name: str, attributes: Optional[dict] = None):
+        """A child span ended by the caller (span.end()), or None while tracing is off."""
+        if self._tracer is None:
+            return None
+        return self._tracer.start_span(name, attributes=attributes)
+
+    def record(self, name: str, start_ns: int, end_ns: int, attributes: Optional[dict] = None) -> None:
+        """A child span of the current one timed elsewhere, e.g. in the image pool process."""
+        if self._tracer is not None:
+            self._tracer.start_span(name, attributes=attributes, start_time=start_ns).end(end_time=end_ns)
+
+    def record_steps(self, prefix: str, steps: Iterable[Tuple[str, int, int]]) -> None:
+        if self._tracer is None:
+            return
+        for name, start_ns, end_ns in steps:
+            self.record(f"{prefix}.{name}", start_ns, end_ns)
+
+    def error_status(self):
+        return self._trace.Status(self._trace.StatusCode.ERROR)
+
+    def request_span(self, scope):
+        """Root span of an HTTP request, continuing the caller's trace when it sent a traceparent."""
+        carrier = {}
+        for name, value in scope["headers"]:
+            if name in (b"traceparent", b"tracestate"):
+                carrier[name.decode()] = value.decode("latin-1")
+        context = self._propagator.extract(carrier) if carrier else None
+        return self._tracer.start_as_current_span(
+            scope["method"],
+            context=context,
+            kind=self._trace.SpanKind.SERVER,
+            attributes={"http.request.method": scope["method"], "url.path": scope["path"]},
+        )
+
+
+tracing = Tracing()
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware opening the request span, renamed to the route template
+    once routing is done, and returning its trace id in X-Trace-ID. With
+    tracing off it only forwards the call.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not tracing.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        from .logs import request_id_var
+
+        with tracing.request_span(scope) as span:
+            trace_id = format(span.get_span_context().trace_id, "032x")
+            request_id = request_id_var.get()
+            if request_id:
+                span.set_attribute("request.id", request_id)
+            status = 500
+
+            async def send_with_trace(message):
+                nonlocal status
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (TRACE_HEADER.lower().encode(), trace_id.encode())
+                    ]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_trace)
+            finally:
+                route = getattr(scope.get("route"), "path", None)
+                if route:
+                    span.update_name(f"{scope['method']} {route}")
+                    span.set_attribute("http.route", route)
+                span.set_attribute("http.response.status_code", status)
+                if status >= 500:
+                    span.set_status(tracing.error_status())
@@ -0,0 +1,41 @@
+import argparse
+import asyncio
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.backfill import progress_backfill, BACKFILL_BATCH_SIZE  # noqa: E402
+from app.database import close_database  # noqa: E402
+
+# Fills user_category_progress from the scores history, in batches of users.
+# Safe to stop at any time (Ctrl+C): the next run continues after the last
+# committed batch. --restart recomputes everybody from the beginning.
+#
+# Usage: python backfill_progress.py [--batch-size 200] [--restart]
+
+
+def report(status: dict) -> None:
+    print(
+        f"  users={status['users_processed']:>8}  rows={status['rows_written']:>8}  "
+        f"{status['users_per_sec']:>8.1f} users/s  {status['rows_per_sec']:>8.1f} rows/s  "
+        f"last_id={status['last_id']}"
+    )
+
+
+async def main(batch_size: int, restart: bool) -> None:
+    try:
+        status = await progress_backfill.run(batch_size, restart, report=report)
+        print(f"Backfill complete: {status['users_processed']} users, {status['rows_written']} progress rows "
+              f"({status['rows_per_sec']} rows/s).")
+    finally:
+        await close_database()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill user_category_progress from scores")
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE)
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start over")
+    args = parser.parse_args()
+    print("Backfilling category progress (resuming from the last checkpoint)..." if not args.restart
+          else "Backfilling category progress from the beginning...")
+    asyncio.run(main(args.batch_size, args.restart))
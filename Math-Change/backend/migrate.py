@@ -0,0 +1,289 @@
+import argparse
+import hashlib
+import os
+import re
+import sys
+import time
+
+import psycopg2
+from psycopg2 import errors
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Versioned schema migrations.
+#
+# migrations/NNNN_<name>.sql are applied in version order and recorded in
+# schema_migrations, so every database (Supabase, a local container, the test
+# schemas) can tell which ones it still needs. Each file runs in ONE
+# transaction and is recorded in that same transaction: it is applied
+# completely or not at all.
+#
+# A file whose first line is `-- migrate:no-transaction` runs statement by
+# statement in autocommit instead. This is required for CREATE INDEX
+# CONCURRENTLY, and for long backfills that commit in batches, so writes to a
+# live table are never blocked for the whole build. Such a file is recorded
+# only after its last statement; every statement in it must therefore be safe
+# to run again (IF NOT EXISTS, guarded DO blocks...), since a failure halfway
+# re-runs it from the top.
+#
+# Every statement runs with lock_timeout: DDL that cannot get its lock in time
+# fails fast instead of queueing all reads and writes of the table behind it,
+# and is retried with backoff.
+#
+# schema.sql is the resulting schema in one file, for a fresh database from
+# the Supabase SQL editor; tests/test_migrations.py checks both stay identical.
+#
+# Usage:
+#   python migrate.py [--dsn postgresql://...] [--dry-run] [--target VERSION]
+# Without --dsn: DATABASE_URL, else the Supabase hosts of setup_db.py.
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+NO_TRANSACTION = "-- migrate:no-transaction"
+FILENAME_PATTERN = re.compile(r"^(\d{4})_(\w+)\.sql$")
+
+LOCK_TIMEOUT = os.getenv("MIGRATION_LOCK_TIMEOUT", "5s")
+LOCK_RETRIES = int(os.getenv("MIGRATION_LOCK_RETRIES", "5"))
+# Any other session running migrations on the same database waits on this key
+ADVISORY_LOCK_KEY = 7201301
+
+VERSION_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    checksum TEXT NOT NULL,
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    duration_ms INTEGER
+);
+ALTER TABLE schema_migrations ENABLE ROW LEVEL SECURITY;
+"""
+
+CONCURRENT_INDEX_PATTERN = re.compile(
+    r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE
+)
+
+
+class Migration:
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+        with open(path, "r") as f:
+            self.sql = f.read()
+        self.checksum = hashlib.sha256(self.sql.encode()).hexdigest()
+        self.transactional = not self.sql.lstrip().startswith(NO_TRANSACTION)
+
+    def __repr__(self):
+        return f"{self.version:04d}_{self.name}"
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    migrations = []
+    for filename in sorted(os.listdir(directory)):
+        match = FILENAME_PATTERN.match(filename)
+        if match:
+            migrations.append(Migration(int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f"Duplicate migration version in {directory}")
+    return migrations
+
+
+def split_statements(sql):
+    """
+    Split a SQL file on the semicolons that end a statement. Semicolons inside
+    quotes, dollar-quoted bodies ($$ ... $$, $tag$ ... $tag$) and comments are
+    kept. Statements made only of comments are dropped.
+    """
+    statements = []
+    current = []
+    quote = None  # closing delimiter we are inside of: ', " or $tag$
+    i = 0
+    while i < len(sql):
+        if quote:
+            end = sql.find(quote, i)
+            end = len(sql) if end == -1 else end + len(quote)
+            current.append(sql[i:end])
+            i = end
+            quote = None
+            continue
+        c = sql[i]
+        if sql.startswith("--", i):
+            end = sql.find("\n", i)
+            end = len(sql) if end == -1 else end
+            current.append(sql[i:end])
+            i = end
+        elif sql.startswith("/*", i):
+            end = sql.find("*/", i)
+            end = len(sql) if end == -1 else end + 2
+            current.append(sql[i:end])
+            i = end
+        elif c in ("'", '"'):
+            quote = c
+            current.append(c)
+            i += 1
+        elif c == "$" and re.match(r"\$\w*\$", sql[i:]):
+            quote = re.match(r"\$\w*\$", sql[i:]).group(0)
+            current.append(quote)
+            i += len(quote)
+        elif c == ";":
+            statements.append("".join(current))
+            current = []
+            i += 1
+        else:
+            current.append(c)
+            i += 1
+    statements.append("".join(current))
+    return [s.strip() for s in statements if _strip_comments(s).strip()]
+
+
+def _strip_comments(statement):
+    return re.sub(r"--[^\n]*|/\*.*?\*/", "", statement, flags=re.DOTALL)
+
+
+def connect(dsn=None):
+    dsn = dsn or os.getenv("DATABASE_URL")
+    if dsn:
+        return psycopg2.connect(dsn)
+    from setup_db import get_connection
+    return get_connection()
+
+
+def applied_versions(cur):
+    cur.execute("SELECT to_regclass('schema_migrations')")
+    if cur.fetchone()[0] is None:
+        return {}
+    cur.execute("SELECT version, checksum FROM schema_migrations")
+    return dict(cur.fetchall())
+
+
+def pending_migrations(cur, migrations, target=None):
+    applied = applied_versions(cur)
+    for m in migrations:
+        if m.version in applied and applied[m.version] != m.checksum:
+            print(f"WARNING: {m} changed after it was applied (checksum mismatch); it is not re-run.")
+    return [m for m in migrations if m.version not in applied and (target is None or m.version <= target)]
+
+
+def _with_lock_retries(conn, action, description):
+    """Run action(); on a lock timeout roll back and retry with backoff."""
+    for attempt in range(1, LOCK_RETRIES + 1):
+        try:
+            return action()
+        except errors.LockNotAvailable:
+            if not conn.autocommit:
+                conn.rollback()
+            if attempt == LOCK_RETRIES:
+                raise
+            wait = 2 ** attempt
+            print(f"   lock_timeout ({LOCK_TIMEOUT}) on {description}, retrying in {wait}s ({attempt}/{LOCK_RETRIES})")
+            time.sleep(wait)
+
+
+def _drop_invalid_index(cur, statement):
+    # An interrupted CREATE INDEX CONCURRENTLY leaves an INVALID index behind,
+    # which IF NOT EXISTS would then silently keep: drop it and build again.
+    match = CONCURRENT_INDEX_PATTERN.search(statement)
+    if not match:
+        return
+    cur.execute(
+        """
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.oid = to_regclass(%s) AND NOT i.indisvalid
+        """,
+        (match.group(1),),
+    )
+    if cur.fetchone():
+        print(f"   dropping invalid index {match.group(1)} left by an interrupted build")
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {match.group(1)}")
+
+
+def _record(cur, migration, duration_ms):
+    cur.execute(
+        "INSERT INTO schema_migrations (version, name, checksum, duration_ms) VALUES (%s, %s, %s, %s)",
+        (migration.version, migration.name, migration.checksum, duration_ms),
+    )
+
+
+def apply_migration(conn, migration):
+    started = time.monotonic()
+    cur = conn.cursor()
+    if migration.transactional:
+        conn.autocommit = False
+
+        def run():
+            cur.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+            cur.execute(migration.sql)
+            _record(cur, migration, int((time.monotonic() - started) * 1000))
+            conn.commit()
+
+        try:
+            _with_lock_retries(conn, run, str(migration))
+        except Exception:
+            # Leave no aborted transaction behind: the caller resets autocommit
+            # and releases the advisory lock on this connection.
+            conn.rollback()
+            raise
+    else:
+        conn.autocommit = True
+        cur.execute(f"SET lock_timeout = '{LOCK_TIMEOUT}'")
+        for statement in split_statements(migration.sql):
+            _drop_invalid_index(cur, statement)
+            _with_lock_retries(conn, lambda: cur.execute(statement), f"{migration}: {statement[:60]}...")
+        _record(cur, migration, int((time.monotonic() - started) * 1000))
+        cur.execute("RESET lock_timeout")
+    cur.close()
+    return time.monotonic() - started
+
+
+def migrate(conn, dry_run=False, target=None, migrations=None):
+    """Apply the pending migrations (up to target). Returns the ones applied, or pending with dry_run."""
+    migrations = load_migrations() if migrations is None else migrations
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("SELECT pg_advisory_lock(%s)", (ADVISORY_LOCK_KEY,))
+    try:
+        pending = pending_migrations(cur, migrations, target)
+        if not pending:
+            print("Schema is up to date.")
+            return []
+        if dry_run:
+            for m in pending:
+                mode = "transaction" if m.transactional else "no transaction"
+                print(f"[dry-run] would apply {m} ({mode}):")
+                for statement in (split_statements(m.sql) if not m.transactional else [m.sql.strip()]):
+                    print("    " + statement.replace("\n", "\n    "))
+            return pending
+        cur.execute(VERSION_TABLE_SQL)
+        for m in pending:
+            print(f"Applying {m}...")
+            elapsed = apply_migration(conn, m)
+            print(f"   done in {elapsed:.2f}s")
+        return pending
+    finally:
+        conn.autocommit = True
+        cur.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK_KEY,))
+        cur.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations")
+    parser.add_argument("--dsn", help="Postgres connection string (default: DATABASE_URL, then Supabase)")
+    parser.add_argument("--dry-run", action="store_true", help="print the pending migrations without applying them")
+    parser.add_argument("--target", type=int, help="stop after this version")
+    args = parser.parse_args()
+
+    conn = connect(args.dsn)
+    if conn is None:
+        sys.exit(1)
+    try:
+        migrate(conn, dry_run=args.dry_run, target=args.target)
+    except Exception as e:
+        print(f"Migration failed: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+-- Tables as they were before versioned migrations. Databases created from
+-- schema.sql at that time already have them: everything here is IF NOT EXISTS.
+
+CREATE TABLE IF NOT EXISTS users (
+    id UUID PRIMARY KEY,
+    username TEXT NOT NULL,
+    email TEXT UNIQUE NOT NULL,
+    password TEXT NOT NULL,
+    role TEXT DEFAULT 'USER',
+    status TEXT DEFAULT 'ACTIVE',
+    avatar TEXT,
+    "createdAt" TIMESTAMPTZ DEFAULT NOW(),
+    "lastLogin" TIMESTAMPTZ,
+    settings JSONB DEFAULT '{}'::jsonb,
+    "unlockedLevel" INTEGER DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS scores (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    "user" TEXT NOT NULL, -- Username at the time of the game (display only)
+    score INTEGER NOT NULL,
+    "correctCount" INTEGER NOT NULL,
+    "errorCount" INTEGER NOT NULL,
+    "avgTime" FLOAT NOT NULL,
+    date TIMESTAMPTZ DEFAULT NOW(),
+    category TEXT,
+    difficulty TEXT
+);
+
+CREATE TABLE IF NOT EXISTS user_category_progress (
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    category TEXT NOT NULL,
+    unlocked_level INTEGER DEFAULT 0,
+    total_games INTEGER DEFAULT 0,
+    total_score INTEGER DEFAULT 0,
+    total_correct INTEGER DEFAULT 0,
+    total_errors INTEGER DEFAULT 0,
+    total_time_seconds FLOAT DEFAULT 0,
+    last_played_at TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (user_id, category)
+);
+
+ALTER TABLE users ENABLE ROW LEVEL SECURITY;
+ALTER TABLE scores ENABLE ROW LEVEL SECURITY;
+ALTER TABLE user_category_progress ENABLE ROW LEVEL SECURITY;
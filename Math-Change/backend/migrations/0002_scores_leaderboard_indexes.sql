@@ -0,0 +1,16 @@
+-- migrate:no-transaction
+-- Leaderboard indexes (GET /leaderboard), built without blocking writes to scores.
+-- Each one matches a filter combination followed by the ranking order
+-- (score DESC, date DESC, id DESC), so a page is a bounded index range scan.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS scores_leaderboard_idx
+    ON scores (score DESC, date DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS scores_category_leaderboard_idx
+    ON scores (category, score DESC, date DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS scores_category_difficulty_leaderboard_idx
+    ON scores (category, difficulty, score DESC, date DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS scores_difficulty_leaderboard_idx
+    ON scores (difficulty, score DESC, date DESC, id DESC);
+-- Time windows (window=day|week|month) on sparse filters
+CREATE INDEX CONCURRENTLY IF NOT EXISTS scores_date_idx
+    ON scores (date DESC);
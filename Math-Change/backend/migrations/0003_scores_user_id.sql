@@ -0,0 +1,62 @@
+-- migrate:no-transaction
+-- Link scores to their user by id, online:
+--   1. nullable column and a NOT VALID foreign key (metadata only, no scan)
+--   2. fill user_id in batches of 5000 rows, each committed on its own
+--   3. (user_id, date DESC) index built CONCURRENTLY
+--   4. validate the foreign key (does not block reads or writes)
+-- scores."user" holds the username; it is resolved case-insensitively to the
+-- oldest account with that name. Rows whose username matches no account stay NULL.
+
+ALTER TABLE scores ADD COLUMN IF NOT EXISTS user_id UUID;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conrelid = 'scores'::regclass AND conname = 'scores_user_id_fkey'
+    ) THEN
+        ALTER TABLE scores ADD CONSTRAINT scores_user_id_fkey
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL NOT VALID;
+    END IF;
+END $$;
+
+DROP TABLE IF EXISTS pg_temp.username_map;
+
+CREATE TEMP TABLE username_map AS
+SELECT DISTINCT ON (lower(username)) lower(username) AS name, id
+FROM users
+ORDER BY lower(username), "createdAt";
+
+CREATE UNIQUE INDEX ON username_map (name);
+
+DO $$
+DECLARE
+    v_last UUID;
+    v_ids UUID[];
+BEGIN
+    LOOP
+        -- Keyset over the primary key: every batch is an index range scan
+        SELECT array_agg(b.id ORDER BY b.id) INTO v_ids
+        FROM (
+            SELECT s.id FROM scores s
+            WHERE s.user_id IS NULL AND (v_last IS NULL OR s.id > v_last)
+            ORDER BY s.id
+            LIMIT 5000
+        ) AS b;
+        EXIT WHEN v_ids IS NULL;
+
+        UPDATE scores s SET user_id = m.id
+        FROM username_map m
+        WHERE s.id = ANY (v_ids) AND s.user_id IS NULL AND m.name = lower(s."user");
+
+        v_last := v_ids[cardinality(v_ids)];
+        COMMIT;
+    END LOOP;
+END $$;
+
+DROP TABLE username_map;
+
+-- History of one user, newest first (GET /scores?user_id=, /users/me/scores)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS scores_user_date_idx
+    ON scores (user_id, date DESC);
+
+ALTER TABLE scores VALIDATE CONSTRAINT scores_user_id_fkey;
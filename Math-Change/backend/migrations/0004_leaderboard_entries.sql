@@ -0,0 +1,87 @@
+-- Materialized rankings: one row per (board, period, user) with the running
+-- totals of that user. Boards are 'global', 'category:<name>' and
+-- 'difficulty:<name>'; periods are 'day', 'week' (ISO, starting Monday) and
+-- 'all', with period_start = the UTC day/week ('1970-01-01' for 'all').
+-- record_score() keeps it up to date; rebuild_leaderboard() recomputes it.
+CREATE TABLE IF NOT EXISTS leaderboard_entries (
+    board TEXT NOT NULL,
+    period TEXT NOT NULL,
+    period_start DATE NOT NULL,
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    total_score BIGINT NOT NULL DEFAULT 0,
+    games INTEGER NOT NULL DEFAULT 0,
+    best_score INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (board, period, period_start, user_id)
+);
+
+-- Ranking order inside one (board, period, period_start): a page is an index
+-- range scan and a user's rank is an index-only count of the entries ahead.
+CREATE INDEX IF NOT EXISTS leaderboard_entries_rank_idx
+    ON leaderboard_entries (board, period, period_start, total_score DESC, user_id DESC);
+
+-- Every (board, period, period_start) a game played at p_date counts towards.
+CREATE OR REPLACE FUNCTION leaderboard_slots(p_category TEXT, p_difficulty TEXT, p_date TIMESTAMPTZ)
+RETURNS TABLE (board TEXT, period TEXT, period_start DATE)
+LANGUAGE sql IMMUTABLE
+AS $$
+    SELECT b.board, w.period, w.period_start
+    FROM (VALUES ('global'), ('category:' || p_category), ('difficulty:' || p_difficulty)) AS b(board)
+    CROSS JOIN (VALUES
+        ('all', DATE '1970-01-01'),
+        ('week', date_trunc('week', p_date AT TIME ZONE 'UTC')::date),
+        ('day', (p_date AT TIME ZONE 'UTC')::date)
+    ) AS w(period, period_start)
+    WHERE b.board IS NOT NULL;
+$$;
+
+-- GET /leaderboard/rankings/me: rank of one user inside a board and period.
+-- Ties on total_score are broken by user_id, the same order the ranking pages
+-- use. The count is a range scan of leaderboard_entries_rank_idx (index-only
+-- once autovacuum has marked the pages visible): one B-tree descent plus the
+-- entries ahead of the user, never the scores table.
+CREATE OR REPLACE FUNCTION leaderboard_rank(p_board TEXT, p_period TEXT, p_period_start DATE, p_user_id UUID)
+RETURNS TABLE (rank BIGINT, total_score BIGINT, games INTEGER, best_score INTEGER)
+LANGUAGE sql STABLE
+AS $$
+    SELECT (
+               SELECT count(*) + 1
+               FROM leaderboard_entries o
+               WHERE o.board = e.board AND o.period = e.period AND o.period_start = e.period_start
+                 AND (o.total_score, o.user_id) > (e.total_score, e.user_id)
+           ),
+           e.total_score, e.games, e.best_score
+    FROM leaderboard_entries e
+    WHERE e.board = p_board AND e.period = p_period AND e.period_start = p_period_start
+      AND e.user_id = p_user_id;
+$$;
+
+-- Full recompute of leaderboard_entries from scores (admin command). All-time
+-- rows cover every game; day/week rows only the last p_recent_days, which also
+-- drops the finished periods record_score() keeps accumulating. Readers keep
+-- seeing the previous rankings until the rebuild commits; saves wait for it.
+CREATE OR REPLACE FUNCTION rebuild_leaderboard(p_recent_days INTEGER DEFAULT 14)
+RETURNS BIGINT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    rebuilt BIGINT;
+BEGIN
+    LOCK TABLE leaderboard_entries IN EXCLUSIVE MODE;
+    DELETE FROM leaderboard_entries;
+
+    INSERT INTO leaderboard_entries (board, period, period_start, user_id, total_score, games, best_score)
+    SELECT k.board, k.period, k.period_start, s.user_id, sum(s.score), count(*), max(s.score)
+    FROM scores s
+    CROSS JOIN LATERAL leaderboard_slots(s.category, s.difficulty, s.date) AS k
+    WHERE s.user_id IS NOT NULL
+      AND (k.period = 'all'
+           OR s.date >= date_trunc('week', NOW() - make_interval(days => p_recent_days)))
+    GROUP BY k.board, k.period, k.period_start, s.user_id;
+
+    GET DIAGNOSTICS rebuilt = ROW_COUNT;
+    RETURN rebuilt;
+END;
+$$;
+
+ALTER TABLE leaderboard_entries ENABLE ROW LEVEL SECURITY;
@@ -0,0 +1,89 @@
+-- Progress of maintenance jobs that walk a table in batches, so they resume
+-- where they stopped. Advanced in the same transaction as each batch.
+CREATE TABLE IF NOT EXISTS maintenance_checkpoints (
+    job TEXT PRIMARY KEY,
+    last_id UUID,
+    processed BIGINT NOT NULL DEFAULT 0,
+    written BIGINT NOT NULL DEFAULT 0,
+    done BOOLEAN NOT NULL DEFAULT FALSE,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Backfill user_category_progress from the scores history, one batch of users
+-- (in id order) per call, resuming after the 'progress_backfill' checkpoint.
+-- Totals are recomputed from scratch and written with one bulk upsert;
+-- unlocked_level never goes down (it can also be raised by PATCH
+-- /users/me/progress/level). unlocked_level = 1 + the hardest difficulty
+-- passed with score >= 60, 0 when none.
+CREATE OR REPLACE FUNCTION backfill_progress(p_batch_size INTEGER DEFAULT 200, p_restart BOOLEAN DEFAULT FALSE)
+RETURNS TABLE (last_id UUID, users_processed INTEGER, rows_written INTEGER, done BOOLEAN)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_after UUID;
+    v_batch UUID[];
+    v_last UUID;
+    v_users INTEGER;
+    v_rows INTEGER;
+BEGIN
+    INSERT INTO maintenance_checkpoints (job) VALUES ('progress_backfill') ON CONFLICT (job) DO NOTHING;
+    IF p_restart THEN
+        UPDATE maintenance_checkpoints c
+        SET last_id = NULL, processed = 0, written = 0, done = FALSE, updated_at = NOW()
+        WHERE c.job = 'progress_backfill';
+    END IF;
+    -- Row lock: two runners never process the same batch
+    SELECT c.last_id INTO v_after FROM maintenance_checkpoints c WHERE c.job = 'progress_backfill' FOR UPDATE;
+
+    -- record_score() increments these totals. Holding this lock until commit
+    -- makes concurrent saves either finish before the recount (and be counted)
+    -- or wait and increment after it: no game is lost or counted twice.
+    -- Readers are not blocked; saves wait for one batch at most.
+    LOCK TABLE user_category_progress IN SHARE ROW EXCLUSIVE MODE;
+
+    SELECT array_agg(u.id ORDER BY u.id) INTO v_batch
+    FROM (
+        SELECT u.id FROM users u
+        WHERE v_after IS NULL OR u.id > v_after
+        ORDER BY u.id
+        LIMIT p_batch_size
+    ) AS u;
+    v_users := COALESCE(cardinality(v_batch), 0);
+    v_last := v_batch[v_users];
+
+    INSERT INTO user_category_progress AS p
+        (user_id, category, unlocked_level, total_games, total_score, total_correct, total_errors,
+         total_time_seconds, last_played_at, updated_at)
+    SELECT s.user_id, s.category,
+           COALESCE(max(array_position(ARRAY['easy', 'easy_medium', 'medium', 'medium_hard', 'hard'], s.difficulty))
+                    FILTER (WHERE s.score >= 60), 0),
+           count(*), sum(s.score), sum(s."correctCount"), sum(s."errorCount"),
+           sum(s."avgTime" * (s."correctCount" + s."errorCount")), max(s.date), NOW()
+    FROM scores s
+    WHERE s.user_id = ANY (v_batch)
+      AND s.category IS NOT NULL
+    GROUP BY s.user_id, s.category
+    ON CONFLICT (user_id, category) DO UPDATE SET
+        unlocked_level = GREATEST(p.unlocked_level, EXCLUDED.unlocked_level),
+        total_games = EXCLUDED.total_games,
+        total_score = EXCLUDED.total_score,
+        total_correct = EXCLUDED.total_correct,
+        total_errors = EXCLUDED.total_errors,
+        total_time_seconds = EXCLUDED.total_time_seconds,
+        last_played_at = EXCLUDED.last_played_at,
+        updated_at = EXCLUDED.updated_at;
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+
+    UPDATE maintenance_checkpoints c SET
+        last_id = COALESCE(v_last, c.last_id),
+        processed = c.processed + v_users,
+        written = c.written + v_rows,
+        done = v_users < p_batch_size,
+        updated_at = NOW()
+    WHERE c.job = 'progress_backfill';
+
+    RETURN QUERY SELECT v_last, v_users, v_rows, v_users < p_batch_size;
+END;
+$$;
+
+ALTER TABLE maintenance_checkpoints ENABLE ROW LEVEL SECURITY;
@@ -0,0 +1,43 @@
+-- POST /scores: insert the game and increment the category totals in ONE
+-- statement. The increment happens inside ON CONFLICT DO UPDATE, so the row lock
+-- serialises concurrent games of the same user and no increment is lost.
+-- Called from the API with supabase.rpc("record_score", {...}).
+CREATE OR REPLACE FUNCTION record_score(p_user_id UUID, p_score JSONB)
+RETURNS SETOF scores
+LANGUAGE sql
+AS $$
+    WITH inserted AS (
+        INSERT INTO scores (id, "user", user_id, score, "correctCount", "errorCount", "avgTime", date, category, difficulty)
+        SELECT COALESCE(r.id, gen_random_uuid()), r."user", p_user_id, r.score, r."correctCount", r."errorCount",
+               r."avgTime", COALESCE(r.date, NOW()), r.category, r.difficulty
+        FROM jsonb_populate_record(NULL::scores, p_score) AS r
+        RETURNING *
+    ), progress AS (
+        INSERT INTO user_category_progress AS p
+            (user_id, category, total_games, total_score, total_correct, total_errors, total_time_seconds, last_played_at)
+        SELECT p_user_id, i.category, 1, i.score, i."correctCount", i."errorCount",
+               i."avgTime" * (i."correctCount" + i."errorCount"), NOW()
+        FROM inserted i
+        WHERE p_user_id IS NOT NULL AND i.category IS NOT NULL
+        ON CONFLICT (user_id, category) DO UPDATE SET
+            total_games = p.total_games + EXCLUDED.total_games,
+            total_score = p.total_score + EXCLUDED.total_score,
+            total_correct = p.total_correct + EXCLUDED.total_correct,
+            total_errors = p.total_errors + EXCLUDED.total_errors,
+            total_time_seconds = p.total_time_seconds + EXCLUDED.total_time_seconds,
+            last_played_at = EXCLUDED.last_played_at
+    ), rankings AS (
+        INSERT INTO leaderboard_entries AS e
+            (board, period, period_start, user_id, total_score, games, best_score, updated_at)
+        SELECT k.board, k.period, k.period_start, p_user_id, i.score, 1, i.score, NOW()
+        FROM inserted i
+        CROSS JOIN LATERAL leaderboard_slots(i.category, i.difficulty, i.date) AS k
+        WHERE p_user_id IS NOT NULL
+        ON CONFLICT (board, period, period_start, user_id) DO UPDATE SET
+            total_score = e.total_score + EXCLUDED.total_score,
+            games = e.games + EXCLUDED.games,
+            best_score = GREATEST(e.best_score, EXCLUDED.best_score),
+            updated_at = EXCLUDED.updated_at
+    )
+    SELECT * FROM inserted;
+$$;
@@ -0,0 +1,244 @@
+-- Retention for the partitioned scores table (0008): per-user monthly
+-- summaries of archived months, partition maintenance functions, and the
+-- rankings/progress recomputes reading those summaries too.
+
+-- Per-user monthly totals of the scores partitions removed by
+-- archive_score_partition(). rebuild_leaderboard() and backfill_progress()
+-- add them to the games still in scores, so all-time rankings and category
+-- progress survive the retention policy. Games without user_id are not kept.
+CREATE TABLE IF NOT EXISTS score_monthly_summaries (
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    month DATE NOT NULL,
+    category TEXT,
+    difficulty TEXT,
+    games INTEGER NOT NULL,
+    total_score BIGINT NOT NULL,
+    best_score INTEGER NOT NULL,
+    total_correct BIGINT NOT NULL,
+    total_errors BIGINT NOT NULL,
+    total_time_seconds FLOAT NOT NULL,
+    last_played_at TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS score_monthly_summaries_user_idx
+    ON score_monthly_summaries (user_id, month);
+
+-- Create the monthly partitions of scores from p_from (default: this month)
+-- up to p_months_ahead months from now. Games of a new month that were saved
+-- before its partition existed are moved out of scores_default. Safe to run
+-- concurrently from every API worker; returns the number of partitions created.
+CREATE OR REPLACE FUNCTION ensure_score_partitions(p_months_ahead INTEGER DEFAULT 3, p_from DATE DEFAULT NULL)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_month DATE := date_trunc('month', COALESCE(p_from, (NOW() AT TIME ZONE 'UTC')::date))::date;
+    v_last DATE := (date_trunc('month', NOW() AT TIME ZONE 'UTC') + make_interval(months => p_months_ahead))::date;
+    v_start TIMESTAMPTZ;
+    v_end TIMESTAMPTZ;
+    v_name TEXT;
+    v_created INTEGER := 0;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('score_partitions'));
+    WHILE v_month <= v_last LOOP
+        v_name := 'scores_p' || to_char(v_month, 'YYYY_MM');
+        IF to_regclass(v_name) IS NULL THEN
+            v_start := v_month::timestamp AT TIME ZONE 'UTC';
+            v_end := (v_month + INTERVAL '1 month')::timestamp AT TIME ZONE 'UTC';
+            -- Filled and attached as a plain table: ATTACH only takes a SHARE
+            -- UPDATE EXCLUSIVE lock on scores, reads and saves keep going
+            EXECUTE format('CREATE TABLE %I (LIKE scores INCLUDING DEFAULTS)', v_name);
+            EXECUTE format(
+                'WITH moved AS (DELETE FROM scores_default WHERE date >= %L AND date < %L RETURNING *) '
+                'INSERT INTO %I SELECT * FROM moved',
+                v_start, v_end, v_name
+            );
+            EXECUTE format('ALTER TABLE scores ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', v_name, v_start, v_end);
+            EXECUTE format('ALTER TABLE %I ENABLE ROW LEVEL SECURITY', v_name);
+            v_created := v_created + 1;
+        END IF;
+        v_month := (v_month + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN v_created;
+END;
+$$;
+
+-- Retention: summarise the OLDEST monthly partition that ends before the last
+-- p_keep_months full months into score_monthly_summaries, then detach it
+-- (kept as a standalone table to dump, or dropped with p_drop). One partition
+-- per call, so the exclusive lock DETACH takes on scores is held for one short
+-- transaction; call it until it returns no row. Re-running on a month already
+-- summarised replaces its summaries.
+CREATE OR REPLACE FUNCTION archive_score_partition(p_keep_months INTEGER, p_drop BOOLEAN DEFAULT FALSE)
+RETURNS TABLE (partition_name TEXT, games BIGINT, summaries INTEGER)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_cutoff DATE := (date_trunc('month', NOW() AT TIME ZONE 'UTC') - make_interval(months => p_keep_months))::date;
+    v_name TEXT;
+    v_month DATE;
+BEGIN
+    IF p_keep_months < 1 THEN
+        RAISE EXCEPTION 'p_keep_months must be at least 1';
+    END IF;
+    PERFORM pg_advisory_xact_lock(hashtext('score_partitions'));
+
+    SELECT c.relname INTO v_name
+    FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'scores'::regclass AND c.relname ~ '^scores_p\d{4}_\d{2}$'
+    ORDER BY c.relname
+    LIMIT 1;
+    v_month := to_date(substr(v_name, 9), 'YYYY_MM');
+    IF v_name IS NULL OR v_month >= v_cutoff THEN
+        RETURN;
+    END IF;
+
+    -- No game can land in the month between the summary and the detach
+    EXECUTE format('LOCK TABLE %I IN SHARE MODE', v_name);
+    DELETE FROM score_monthly_summaries m WHERE m.month = v_month;
+    EXECUTE format(
+        'INSERT INTO score_monthly_summaries (user_id, month, category, difficulty, games, total_score, best_score, '
+        'total_correct, total_errors, total_time_seconds, last_played_at) '
+        'SELECT s.user_id, %L, s.category, s.difficulty, count(*), sum(s.score), max(s.score), sum(s."correctCount"), '
+        'sum(s."errorCount"), sum(s."avgTime" * (s."correctCount" + s."errorCount")), max(s.date) '
+        'FROM %I s WHERE s.user_id IS NOT NULL GROUP BY s.user_id, s.category, s.difficulty',
+        v_month, v_name
+    );
+    GET DIAGNOSTICS summaries = ROW_COUNT;
+    SELECT COALESCE(sum(m.games), 0) INTO games FROM score_monthly_summaries m WHERE m.month = v_month;
+
+    EXECUTE format('ALTER TABLE scores DETACH PARTITION %I', v_name);
+    IF p_drop THEN
+        EXECUTE format('DROP TABLE %I', v_name);
+    END IF;
+    partition_name := v_name;
+    RETURN NEXT;
+END;
+$$;
+
+ALTER TABLE score_monthly_summaries ENABLE ROW LEVEL SECURITY;
+
+-- Full recompute of leaderboard_entries from scores (admin command). All-time
+-- rows cover every game, archived months included; day/week rows only the last p_recent_days, which also
+-- drops the finished periods record_score() keeps accumulating. Readers keep
+-- seeing the previous rankings until the rebuild commits; saves wait for it.
+CREATE OR REPLACE FUNCTION rebuild_leaderboard(p_recent_days INTEGER DEFAULT 14)
+RETURNS BIGINT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    rebuilt BIGINT;
+BEGIN
+    LOCK TABLE leaderboard_entries IN EXCLUSIVE MODE;
+    DELETE FROM leaderboard_entries;
+
+    INSERT INTO leaderboard_entries (board, period, period_start, user_id, total_score, games, best_score)
+    SELECT g.board, g.period, g.period_start, g.user_id, sum(g.total_score), sum(g.games), max(g.best_score)
+    FROM (
+        SELECT k.board, k.period, k.period_start, s.user_id, s.score AS total_score, 1 AS games, s.score AS best_score
+        FROM scores s
+        CROSS JOIN LATERAL leaderboard_slots(s.category, s.difficulty, s.date) AS k
+        WHERE s.user_id IS NOT NULL
+          AND (k.period = 'all'
+               OR s.date >= date_trunc('week', NOW() - make_interval(days => p_recent_days)))
+        UNION ALL
+        -- Archived months (retention) only count towards the all-time rankings
+        SELECT k.board, k.period, k.period_start, m.user_id, m.total_score, m.games, m.best_score
+        FROM score_monthly_summaries m
+        CROSS JOIN LATERAL leaderboard_slots(m.category, m.difficulty, m.month) AS k
+        WHERE k.period = 'all'
+    ) AS g
+    GROUP BY g.board, g.period, g.period_start, g.user_id;
+
+    GET DIAGNOSTICS rebuilt = ROW_COUNT;
+    RETURN rebuilt;
+END;
+$$;
+
+-- Backfill user_category_progress from the scores history, one batch of users
+-- (in id order) per call, resuming after the 'progress_backfill' checkpoint.
+-- Totals are recomputed from scratch (games still in scores plus the archived
+-- score_monthly_summaries) and written with one bulk upsert;
+-- unlocked_level never goes down (it can also be raised by PATCH
+-- /users/me/progress/level). unlocked_level = 1 + the hardest difficulty
+-- passed with score >= 60, 0 when none.
+CREATE OR REPLACE FUNCTION backfill_progress(p_batch_size INTEGER DEFAULT 200, p_restart BOOLEAN DEFAULT FALSE)
+RETURNS TABLE (last_id UUID, users_processed INTEGER, rows_written INTEGER, done BOOLEAN)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_after UUID;
+    v_batch UUID[];
+    v_last UUID;
+    v_users INTEGER;
+    v_rows INTEGER;
+BEGIN
+    INSERT INTO maintenance_checkpoints (job) VALUES ('progress_backfill') ON CONFLICT (job) DO NOTHING;
+    IF p_restart THEN
+        UPDATE maintenance_checkpoints c
+        SET last_id = NULL, processed = 0, written = 0, done = FALSE, updated_at = NOW()
+        WHERE c.job = 'progress_backfill';
+    END IF;
+    -- Row lock: two runners never process the same batch
+    SELECT c.last_id INTO v_after FROM maintenance_checkpoints c WHERE c.job = 'progress_backfill' FOR UPDATE;
+
+    -- record_score() increments these totals. Holding this lock until commit
+    -- makes concurrent saves either finish before the recount (and be counted)
+    -- or wait and increment after it: no game is lost or counted twice.
+    -- Readers are not blocked; saves wait for one batch at most.
+    LOCK TABLE user_category_progress IN SHARE ROW EXCLUSIVE MODE;
+
+    SELECT array_agg(u.id ORDER BY u.id) INTO v_batch
+    FROM (
+        SELECT u.id FROM users u
+        WHERE v_after IS NULL OR u.id > v_after
+        ORDER BY u.id
+        LIMIT p_batch_size
+    ) AS u;
+    v_users := COALESCE(cardinality(v_batch), 0);
+    v_last := v_batch[v_users];
+
+    INSERT INTO user_category_progress AS p
+        (user_id, category, unlocked_level, total_games, total_score, total_correct, total_errors,
+         total_time_seconds, last_played_at, updated_at)
+    SELECT g.user_id, g.category,
+           COALESCE(max(array_position(ARRAY['easy', 'easy_medium', 'medium', 'medium_hard', 'hard'], g.difficulty))
+                    FILTER (WHERE g.best_score >= 60), 0),
+           sum(g.games), sum(g.total_score), sum(g.total_correct), sum(g.total_errors),
+           sum(g.total_time_seconds), max(g.last_played_at), NOW()
+    FROM (
+        SELECT s.user_id, s.category, s.difficulty, 1 AS games, s.score AS total_score, s.score AS best_score,
+               s."correctCount" AS total_correct, s."errorCount" AS total_errors,
+               s."avgTime" * (s."correctCount" + s."errorCount") AS total_time_seconds, s.date AS last_played_at
+        FROM scores s
+        WHERE s.user_id = ANY (v_batch)
+        UNION ALL
+        SELECT m.user_id, m.category, m.difficulty, m.games, m.total_score, m.best_score,
+               m.total_correct, m.total_errors, m.total_time_seconds, m.last_played_at
+        FROM score_monthly_summaries m
+        WHERE m.user_id = ANY (v_batch)
+    ) AS g
+    WHERE g.category IS NOT NULL
+    GROUP BY g.user_id, g.category
+    ON CONFLICT (user_id, category) DO UPDATE SET
+        unlocked_level = GREATEST(p.unlocked_level, EXCLUDED.unlocked_level),
+        total_games = EXCLUDED.total_games,
+        total_score = EXCLUDED.total_score,
+        total_correct = EXCLUDED.total_correct,
+        total_errors = EXCLUDED.total_errors,
+        total_time_seconds = EXCLUDED.total_time_seconds,
+        last_played_at = EXCLUDED.last_played_at,
+        updated_at = EXCLUDED.updated_at;
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+
+    UPDATE maintenance_checkpoints c SET
+        last_id = COALESCE(v_last, c.last_id),
+        processed = c.processed + v_users,
+        written = c.written + v_rows,
+        done = v_users < p_batch_size,
+        updated_at = NOW()
+    WHERE c.job = 'progress_backfill';
+
+    RETURN QUERY SELECT v_last, v_users, v_rows, v_users < p_batch_size;
+END;
+$$;
@@ -0,0 +1,208 @@
+-- migrate:no-transaction
+-- Convert scores to monthly range partitions on date, online:
+--   1. scores_partitioned: same columns in the same order, date NOT NULL,
+--      primary key (id, date), every index, and one partition per month from
+--      the oldest game (at most 10 years back) to 3 months ahead, plus
+--      scores_default
+--   2. a trigger on scores mirrors every insert, update and delete to it
+--   3. existing rows are copied in batches of 5000, each committed on its own;
+--      FOR SHARE makes a concurrent update or delete of a row wait for (and
+--      then be mirrored after) the batch copying it
+--   4. one short transaction (lock_timeout guarded) checks the row counts,
+--      renames the old table (and its indexes) to scores_unpartitioned and the
+--      new one to scores. record_score() is recreated in it, since its SETOF
+--      scores return type is bound to the old table. The old table is only
+--      renamed, not dropped: a record_score() call waiting on the lock still
+--      returns the old row type, which must outlive the swap (dropping it
+--      fails those calls with "cache lookup failed for type"). Its statements
+--      resolve scores by name once the lock is granted, so they write to the
+--      new table. 0016_drop_unpartitioned_scores.sql drops the old one.
+-- Each step checks whether scores is already partitioned, so an interrupted
+-- run resumes: the copy skips rows already there. Games without a date are
+-- stored at 1970-01-01 (scores_default).
+
+DO $$
+DECLARE
+    v_oldest TIMESTAMPTZ;
+    v_month DATE;
+    v_last DATE := (date_trunc('month', NOW() AT TIME ZONE 'UTC') + INTERVAL '3 months')::date;
+    v_name TEXT;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'scores'::regclass) = 'p' OR to_regclass('scores_partitioned') IS NOT NULL THEN
+        RETURN;
+    END IF;
+
+    -- Columns in the old table's order (user_id was appended by 0003), so a
+    -- record_score() call caught by the swap returns a matching row
+    CREATE TABLE scores_partitioned (
+        LIKE scores INCLUDING DEFAULTS,
+        CONSTRAINT scores_partitioned_pkey PRIMARY KEY (id, date),
+        CONSTRAINT scores_user_id_fkey FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL
+    ) PARTITION BY RANGE (date);
+
+    CREATE INDEX scores_partitioned_leaderboard_idx
+        ON scores_partitioned (score DESC, date DESC, id DESC);
+    CREATE INDEX scores_partitioned_category_leaderboard_idx
+        ON scores_partitioned (category, score DESC, date DESC, id DESC);
+    CREATE INDEX scores_partitioned_category_difficulty_leaderboard_idx
+        ON scores_partitioned (category, difficulty, score DESC, date DESC, id DESC);
+    CREATE INDEX scores_partitioned_difficulty_leaderboard_idx
+        ON scores_partitioned (difficulty, score DESC, date DESC, id DESC);
+    CREATE INDEX scores_partitioned_date_idx
+        ON scores_partitioned (date DESC);
+    CREATE INDEX scores_partitioned_user_date_idx
+        ON scores_partitioned (user_id, date DESC);
+
+    CREATE TABLE scores_default PARTITION OF scores_partitioned DEFAULT;
+    ALTER TABLE scores_default ENABLE ROW LEVEL SECURITY;
+
+    -- Oldest game from the date index: one index descent
+    SELECT min(date) INTO v_oldest FROM scores;
+    v_month := date_trunc('month', GREATEST(COALESCE(v_oldest, NOW()), NOW() - INTERVAL '10 years') AT TIME ZONE 'UTC')::date;
+    WHILE v_month <= v_last LOOP
+        v_name := 'scores_p' || to_char(v_month, 'YYYY_MM');
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF scores_partitioned FOR VALUES FROM (%L) TO (%L)',
+            v_name, v_month::timestamp AT TIME ZONE 'UTC', (v_month + INTERVAL '1 month')::timestamp AT TIME ZONE 'UTC'
+        );
+        EXECUTE format('ALTER TABLE %I ENABLE ROW LEVEL SECURITY', v_name);
+        v_month := (v_month + INTERVAL '1 month')::date;
+    END LOOP;
+END $$;
+
+CREATE OR REPLACE FUNCTION scores_sync_partitioned()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM scores_partitioned WHERE id = OLD.id AND date = COALESCE(OLD.date, 'epoch');
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO scores_partitioned (id, "user", user_id, score, "correctCount", "errorCount", "avgTime", date, category, difficulty)
+        VALUES (NEW.id, NEW."user", NEW.user_id, NEW.score, NEW."correctCount", NEW."errorCount",
+                NEW."avgTime", COALESCE(NEW.date, 'epoch'), NEW.category, NEW.difficulty)
+        ON CONFLICT (id, date) DO NOTHING;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'scores'::regclass) = 'r'
+       AND NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'scores_sync_partitioned' AND tgrelid = 'scores'::regclass) THEN
+        CREATE TRIGGER scores_sync_partitioned
+            AFTER INSERT OR UPDATE OR DELETE ON scores
+            FOR EACH ROW EXECUTE FUNCTION scores_sync_partitioned();
+    END IF;
+END $$;
+
+DO $$
+DECLARE
+    v_last UUID;
+    v_ids UUID[];
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'scores'::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+    LOOP
+        SELECT array_agg(b.id ORDER BY b.id) INTO v_ids
+        FROM (
+            SELECT s.id FROM scores s
+            WHERE v_last IS NULL OR s.id > v_last
+            ORDER BY s.id
+            LIMIT 5000
+            FOR SHARE
+        ) AS b;
+        EXIT WHEN v_ids IS NULL;
+
+        INSERT INTO scores_partitioned (id, "user", user_id, score, "correctCount", "errorCount", "avgTime", date, category, difficulty)
+        SELECT s.id, s."user", s.user_id, s.score, s."correctCount", s."errorCount",
+               s."avgTime", COALESCE(s.date, 'epoch'), s.category, s.difficulty
+        FROM scores s
+        WHERE s.id = ANY (v_ids)
+        ON CONFLICT (id, date) DO NOTHING;
+
+        v_last := v_ids[cardinality(v_ids)];
+        COMMIT;
+    END LOOP;
+END $$;
+
+DO $$
+DECLARE
+    v_old BIGINT;
+    v_new BIGINT;
+    v_index TEXT;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'scores'::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+    LOCK TABLE scores IN ACCESS EXCLUSIVE MODE;
+    SELECT count(*) INTO v_old FROM scores;
+    SELECT count(*) INTO v_new FROM scores_partitioned;
+    IF v_old <> v_new THEN
+        RAISE EXCEPTION 'scores has % rows but scores_partitioned %: not swapping', v_old, v_new;
+    END IF;
+
+    DROP TRIGGER scores_sync_partitioned ON scores;
+    DROP FUNCTION scores_sync_partitioned();
+    DROP FUNCTION record_score(UUID, JSONB);
+    -- Free the index names for the new table's indexes
+    FOR v_index IN SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                   WHERE i.indrelid = 'scores'::regclass LOOP
+        EXECUTE format('ALTER INDEX %I RENAME TO %I', v_index, v_index || '_unpartitioned');
+    END LOOP;
+    ALTER TABLE scores RENAME TO scores_unpartitioned;
+    ALTER TABLE scores_partitioned RENAME TO scores;
+    ALTER INDEX scores_partitioned_pkey RENAME TO scores_pkey;
+    ALTER INDEX scores_partitioned_leaderboard_idx RENAME TO scores_leaderboard_idx;
+    ALTER INDEX scores_partitioned_category_leaderboard_idx RENAME TO scores_category_leaderboard_idx;
+    ALTER INDEX scores_partitioned_category_difficulty_leaderboard_idx RENAME TO scores_category_difficulty_leaderboard_idx;
+    ALTER INDEX scores_partitioned_difficulty_leaderboard_idx RENAME TO scores_difficulty_leaderboard_idx;
+    ALTER INDEX scores_partitioned_date_idx RENAME TO scores_date_idx;
+    ALTER INDEX scores_partitioned_user_date_idx RENAME TO scores_user_date_idx;
+    ALTER TABLE scores ENABLE ROW LEVEL SECURITY;
+
+    -- POST /scores: insert the game and increment the category totals in ONE
+    -- statement (see 0006_record_score.sql)
+    CREATE FUNCTION record_score(p_user_id UUID, p_score JSONB)
+    RETURNS SETOF scores
+    LANGUAGE sql
+    AS $body$
+    WITH inserted AS (
+        INSERT INTO scores (id, "user", user_id, score, "correctCount", "errorCount", "avgTime", date, category, difficulty)
+        SELECT COALESCE(r.id, gen_random_uuid()), r."user", p_user_id, r.score, r."correctCount", r."errorCount",
+               r."avgTime", COALESCE(r.date, NOW()), r.category, r.difficulty
+        FROM jsonb_populate_record(NULL::scores, p_score) AS r
+        RETURNING *
+    ), progress AS (
+        INSERT INTO user_category_progress AS p
+            (user_id, category, total_games, total_score, total_correct, total_errors, total_time_seconds, last_played_at)
+        SELECT p_user_id, i.category, 1, i.score, i."correctCount", i."errorCount",
+               i."avgTime" * (i."correctCount" + i."errorCount"), NOW()
+        FROM inserted i
+        WHERE p_user_id IS NOT NULL AND i.category IS NOT NULL
+        ON CONFLICT (user_id, category) DO UPDATE SET
+            total_games = p.total_games + EXCLUDED.total_games,
+            total_score = p.total_score + EXCLUDED.total_score,
+            total_correct = p.total_correct + EXCLUDED.total_correct,
+            total_errors = p.total_errors + EXCLUDED.total_errors,
+            total_time_seconds = p.total_time_seconds + EXCLUDED.total_time_seconds,
+            last_played_at = EXCLUDED.last_played_at
+    ), rankings AS (
+        INSERT INTO leaderboard_entries AS e
+            (board, period, period_start, user_id, total_score, games, best_score, updated_at)
+        SELECT k.board, k.period, k.period_start, p_user_id, i.score, 1, i.score, NOW()
+        FROM inserted i
+        CROSS JOIN LATERAL leaderboard_slots(i.category, i.difficulty, i.date) AS k
+        WHERE p_user_id IS NOT NULL
+        ON CONFLICT (board, period, period_start, user_id) DO UPDATE SET
+            total_score = e.total_score + EXCLUDED.total_score,
+            games = e.games + EXCLUDED.games,
+            best_score = GREATEST(e.best_score, EXCLUDED.best_score),
+            updated_at = EXCLUDED.updated_at
+    )
+    SELECT * FROM inserted;
+$body$;
+END $$;
@@ -0,0 +1,93 @@
+-- POST /scores/batch: idempotency keys of accepted games and record_scores(),
+-- the multi-game version of record_score().
+
+-- Replayed batches: one row per (user, client idempotency key) ever accepted by
+-- record_scores(). scores itself cannot enforce it (its unique keys must
+-- contain the partition column, date). Purged after SCORE_IDEMPOTENCY_TTL_DAYS.
+CREATE TABLE IF NOT EXISTS score_idempotency_keys (
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    idempotency_key TEXT NOT NULL,
+    score_id UUID NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, idempotency_key)
+);
+
+CREATE INDEX IF NOT EXISTS score_idempotency_keys_created_idx
+    ON score_idempotency_keys (created_at);
+
+-- POST /scores/batch: record_score() for many games of one user in ONE
+-- statement: one multi-row insert into scores, one upsert per (user, category)
+-- into user_category_progress and one per ranking slot into
+-- leaderboard_entries, with the increments summed first. A game whose
+-- idempotency_key was already accepted for this user (or repeats one earlier
+-- in the batch) is skipped and reported as a duplicate with the id it got the
+-- first time (NULL while a concurrent request with that key is still running).
+-- Returns one row per input game, in input order.
+CREATE OR REPLACE FUNCTION record_scores(p_user_id UUID, p_scores JSONB)
+RETURNS TABLE (id UUID, idempotency_key TEXT, duplicate BOOLEAN)
+LANGUAGE sql
+AS $$
+    WITH input AS (
+        SELECT e.ord, e.value ->> 'idempotency_key' AS idempotency_key,
+               COALESCE(r.id, gen_random_uuid()) AS id, r."user", r.score, r."correctCount", r."errorCount",
+               r."avgTime", COALESCE(r.date, NOW()) AS date, r.category, r.difficulty
+        FROM jsonb_array_elements(p_scores) WITH ORDINALITY AS e(value, ord)
+        CROSS JOIN LATERAL jsonb_populate_record(NULL::scores, e.value) AS r
+    ), first_use AS (
+        -- First game of the batch carrying each key
+        SELECT DISTINCT ON (i.idempotency_key) i.idempotency_key, i.id
+        FROM input i
+        WHERE i.idempotency_key IS NOT NULL
+        ORDER BY i.idempotency_key, i.ord
+    ), claimed AS (
+        INSERT INTO score_idempotency_keys (user_id, idempotency_key, score_id)
+        SELECT p_user_id, f.idempotency_key, f.id FROM first_use f
+        ON CONFLICT (user_id, idempotency_key) DO NOTHING
+        RETURNING score_idempotency_keys.idempotency_key, score_idempotency_keys.score_id
+    ), accepted AS (
+        SELECT i.* FROM input i
+        WHERE i.idempotency_key IS NULL
+           OR i.id IN (SELECT c.score_id FROM claimed c)
+    ), inserted AS (
+        INSERT INTO scores (id, "user", user_id, score, "correctCount", "errorCount", "avgTime", date, category, difficulty)
+        SELECT a.id, a."user", p_user_id, a.score, a."correctCount", a."errorCount", a."avgTime", a.date, a.category, a.difficulty
+        FROM accepted a
+        RETURNING *
+    ), progress AS (
+        INSERT INTO user_category_progress AS p
+            (user_id, category, total_games, total_score, total_correct, total_errors, total_time_seconds, last_played_at)
+        SELECT p_user_id, i.category, count(*), sum(i.score), sum(i."correctCount"), sum(i."errorCount"),
+               sum(i."avgTime" * (i."correctCount" + i."errorCount")), NOW()
+        FROM inserted i
+        WHERE p_user_id IS NOT NULL AND i.category IS NOT NULL
+        GROUP BY i.category
+        ON CONFLICT (user_id, category) DO UPDATE SET
+            total_games = p.total_games + EXCLUDED.total_games,
+            total_score = p.total_score + EXCLUDED.total_score,
+            total_correct = p.total_correct + EXCLUDED.total_correct,
+            total_errors = p.total_errors + EXCLUDED.total_errors,
+            total_time_seconds = p.total_time_seconds + EXCLUDED.total_time_seconds,
+            last_played_at = EXCLUDED.last_played_at
+    ), rankings AS (
+        INSERT INTO leaderboard_entries AS e
+            (board, period, period_start, user_id, total_score, games, best_score, updated_at)
+        SELECT k.board, k.period, k.period_start, p_user_id, sum(i.score), count(*), max(i.score), NOW()
+        FROM inserted i
+        CROSS JOIN LATERAL leaderboard_slots(i.category, i.difficulty, i.date) AS k
+        WHERE p_user_id IS NOT NULL
+        GROUP BY k.board, k.period, k.period_start
+        ON CONFLICT (board, period, period_start, user_id) DO UPDATE SET
+            total_score = e.total_score + EXCLUDED.total_score,
+            games = e.games + EXCLUDED.games,
+            best_score = GREATEST(e.best_score, EXCLUDED.best_score),
+            updated_at = EXCLUDED.updated_at
+    )
+    SELECT COALESCE(ins.id, c.score_id, k.score_id), i.idempotency_key, ins.id IS NULL
+    FROM input i
+    LEFT JOIN inserted ins ON ins.id = i.id
+    LEFT JOIN claimed c ON c.idempotency_key = i.idempotency_key
+    LEFT JOIN score_idempotency_keys k ON k.user_id = p_user_id AND k.idempotency_key = i.idempotency_key
+    ORDER BY i.ord;
+$$;
+
+ALTER TABLE score_idempotency_keys ENABLE ROW LEVEL SECURITY;
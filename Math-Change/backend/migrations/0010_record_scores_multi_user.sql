@@ -0,0 +1,83 @@
+-- Write-behind buffer (app/score_buffer.py): record_scores() accepts games of
+-- several users in one call, each game carrying its own user_id.
+
+-- POST /scores/batch: record_score() for many games in ONE statement: one
+-- multi-row insert into scores, one upsert per (user, category) into
+-- user_category_progress and one per (user, ranking slot) into
+-- leaderboard_entries, with the increments summed first. Games belong to
+-- p_user_id unless they carry their own user_id (the write-behind buffer
+-- flushes games of many users together); the upserts run in key order so
+-- concurrent batches lock the same rows in the same order. A game whose
+-- idempotency_key was already accepted for its user (or repeats one earlier
+-- in the batch) is skipped and reported as a duplicate with the id it got the
+-- first time (NULL while a concurrent request with that key is still running).
+-- Returns one row per input game, in input order.
+CREATE OR REPLACE FUNCTION record_scores(p_user_id UUID, p_scores JSONB)
+RETURNS TABLE (id UUID, idempotency_key TEXT, duplicate BOOLEAN)
+LANGUAGE sql
+AS $$
+    WITH input AS (
+        SELECT e.ord, e.value ->> 'idempotency_key' AS idempotency_key, COALESCE(r.user_id, p_user_id) AS user_id,
+               COALESCE(r.id, gen_random_uuid()) AS id, r."user", r.score, r."correctCount", r."errorCount",
+               r."avgTime", COALESCE(r.date, NOW()) AS date, r.category, r.difficulty
+        FROM jsonb_array_elements(p_scores) WITH ORDINALITY AS e(value, ord)
+        CROSS JOIN LATERAL jsonb_populate_record(NULL::scores, e.value) AS r
+    ), first_use AS (
+        -- First game of the batch carrying each key of each user
+        SELECT DISTINCT ON (i.user_id, i.idempotency_key) i.user_id, i.idempotency_key, i.id
+        FROM input i
+        WHERE i.idempotency_key IS NOT NULL AND i.user_id IS NOT NULL
+        ORDER BY i.user_id, i.idempotency_key, i.ord
+    ), claimed AS (
+        INSERT INTO score_idempotency_keys (user_id, idempotency_key, score_id)
+        SELECT f.user_id, f.idempotency_key, f.id FROM first_use f
+        ORDER BY f.user_id, f.idempotency_key
+        ON CONFLICT (user_id, idempotency_key) DO NOTHING
+        RETURNING score_idempotency_keys.user_id, score_idempotency_keys.idempotency_key, score_idempotency_keys.score_id
+    ), accepted AS (
+        SELECT i.* FROM input i
+        WHERE i.idempotency_key IS NULL OR i.user_id IS NULL
+           OR i.id IN (SELECT c.score_id FROM claimed c)
+    ), inserted AS (
+        INSERT INTO scores (id, "user", user_id, score, "correctCount", "errorCount", "avgTime", date, category, difficulty)
+        SELECT a.id, a."user", a.user_id, a.score, a."correctCount", a."errorCount", a."avgTime", a.date, a.category, a.difficulty
+        FROM accepted a
+        RETURNING *
+    ), progress AS (
+        INSERT INTO user_category_progress AS p
+            (user_id, category, total_games, total_score, total_correct, total_errors, total_time_seconds, last_played_at)
+        SELECT i.user_id, i.category, count(*), sum(i.score), sum(i."correctCount"), sum(i."errorCount"),
+               sum(i."avgTime" * (i."correctCount" + i."errorCount")), NOW()
+        FROM inserted i
+        WHERE i.user_id IS NOT NULL AND i.category IS NOT NULL
+        GROUP BY i.user_id, i.category
+        ORDER BY i.user_id, i.category
+        ON CONFLICT (user_id, category) DO UPDATE SET
+            total_games = p.total_games + EXCLUDED.total_games,
+            total_score = p.total_score + EXCLUDED.total_score,
+            total_correct = p.total_correct + EXCLUDED.total_correct,
+            total_errors = p.total_errors + EXCLUDED.total_errors,
+            total_time_seconds = p.total_time_seconds + EXCLUDED.total_time_seconds,
+            last_played_at = EXCLUDED.last_played_at
+    ), rankings AS (
+        INSERT INTO leaderboard_entries AS e
+            (board, period, period_start, user_id, total_score, games, best_score, updated_at)
+        SELECT k.board, k.period, k.period_start, i.user_id, sum(i.score), count(*), max(i.score), NOW()
+        FROM inserted i
+        CROSS JOIN LATERAL leaderboard_slots(i.category, i.difficulty, i.date) AS k
+        WHERE i.user_id IS NOT NULL
+        GROUP BY k.board, k.period, k.period_start, i.user_id
+        ORDER BY k.board, k.period, k.period_start, i.user_id
+        ON CONFLICT (board, period, period_start, user_id) DO UPDATE SET
+            total_score = e.total_score + EXCLUDED.total_score,
+            games = e.games + EXCLUDED.games,
+            best_score = GREATEST(e.best_score, EXCLUDED.best_score),
+            updated_at = EXCLUDED.updated_at
+    )
+    SELECT COALESCE(ins.id, c.score_id, k.score_id), i.idempotency_key, ins.id IS NULL
+    FROM input i
+    LEFT JOIN inserted ins ON ins.id = i.id
+    LEFT JOIN claimed c ON c.user_id = i.user_id AND c.idempotency_key = i.idempotency_key
+    LEFT JOIN score_idempotency_keys k ON k.user_id = i.user_id AND k.idempotency_key = i.idempotency_key
+    ORDER BY i.ord;
+$$;
@@ -0,0 +1,92 @@
+-- GET /users/{id}/analytics: per-user aggregates computed in the database.
+
+-- GET /users/{id}/analytics: what the progress screen and the admin panel
+-- show for one user, aggregated here instead of downloading every game. The
+-- result has a fixed shape whatever the number of games: totals, one entry
+-- per category and per difficulty (one GROUPING SETS pass), the daily trend of
+-- the last p_trend_days days, play streaks (gaps and islands over the days
+-- played) and the latest p_recent games of each category. Archived months
+-- (score_monthly_summaries) count in totals and breakdowns; trend, streaks and
+-- recent games only see the games still in scores.
+CREATE OR REPLACE FUNCTION user_analytics(p_user_id UUID, p_trend_days INTEGER DEFAULT 30, p_recent INTEGER DEFAULT 10)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+    WITH games AS (
+        SELECT s.category, s.difficulty, 1 AS games, s.score AS total_score, s.score AS best_score,
+               s."correctCount" AS correct, s."errorCount" AS errors,
+               s."avgTime" * (s."correctCount" + s."errorCount") AS time_seconds, s.date AS last_played_at
+        FROM scores s
+        WHERE s.user_id = p_user_id
+        UNION ALL
+        SELECT m.category, m.difficulty, m.games, m.total_score, m.best_score, m.total_correct, m.total_errors,
+               m.total_time_seconds, m.last_played_at
+        FROM score_monthly_summaries m
+        WHERE m.user_id = p_user_id
+    ), breakdown AS (
+        -- level 1: per category, 2: per difficulty, 3: totals
+        SELECT g.category, g.difficulty, GROUPING(g.category, g.difficulty) AS level,
+               jsonb_build_object(
+                   'games', COALESCE(sum(g.games), 0),
+                   'avg_score', round(sum(g.total_score)::numeric / NULLIF(sum(g.games), 0)),
+                   'best_score', max(g.best_score),
+                   'correct', COALESCE(sum(g.correct), 0),
+                   'errors', COALESCE(sum(g.errors), 0),
+                   'accuracy', round(100.0 * sum(g.correct) / NULLIF(sum(g.correct) + sum(g.errors), 0)),
+                   'avg_time_per_question',
+                       round((sum(g.time_seconds) / NULLIF(sum(g.correct) + sum(g.errors), 0))::numeric, 2),
+                   'last_played_at', max(g.last_played_at)
+               ) AS stats
+        FROM games g
+        GROUP BY GROUPING SETS ((g.category), (g.difficulty), ())
+    ), days AS (
+        SELECT DISTINCT (s.date AT TIME ZONE 'UTC')::date AS day
+        FROM scores s
+        WHERE s.user_id = p_user_id
+    ), streaks AS (
+        -- Consecutive days share the same day - row_number()
+        SELECT max(i.day) AS last_day, count(*) AS length
+        FROM (SELECT d.day, d.day - ROW_NUMBER() OVER (ORDER BY d.day)::integer AS island FROM days d) i
+        GROUP BY i.island
+    ), trend AS (
+        SELECT (s.date AT TIME ZONE 'UTC')::date AS day, count(*) AS games, round(avg(s.score)) AS avg_score,
+               round(100.0 * sum(s."correctCount") / NULLIF(sum(s."correctCount" + s."errorCount"), 0)) AS accuracy
+        FROM scores s
+        WHERE s.user_id = p_user_id
+          AND s.date >= date_trunc('day', NOW() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC' - (p_trend_days - 1) * INTERVAL '1 day'
+        GROUP BY 1
+    ), recent AS (
+        SELECT r.*
+        FROM breakdown c
+        CROSS JOIN LATERAL (
+            SELECT s.id, s.category, s.difficulty, s.score, s."correctCount", s."errorCount", s."avgTime", s.date
+            FROM scores s
+            WHERE s.user_id = p_user_id AND s.category IS NOT DISTINCT FROM c.category
+            ORDER BY s.date DESC, s.id DESC
+            LIMIT p_recent
+        ) r
+        WHERE c.level = 1
+    )
+    SELECT jsonb_build_object(
+        'totals', (SELECT b.stats FROM breakdown b WHERE b.level = 3),
+        'by_category', COALESCE((
+            SELECT jsonb_agg(b.stats || jsonb_build_object('key', COALESCE(b.category, 'unknown')) ORDER BY b.category)
+            FROM breakdown b WHERE b.level = 1), '[]'::jsonb),
+        'by_difficulty', COALESCE((
+            SELECT jsonb_agg(b.stats || jsonb_build_object('key', COALESCE(b.difficulty, 'unknown')) ORDER BY b.difficulty)
+            FROM breakdown b WHERE b.level = 2), '[]'::jsonb),
+        'trend', COALESCE((
+            SELECT jsonb_agg(jsonb_build_object('day', t.day, 'games', t.games, 'avg_score', t.avg_score, 'accuracy', t.accuracy)
+                             ORDER BY t.day)
+            FROM trend t), '[]'::jsonb),
+        'streaks', jsonb_build_object(
+            -- Still current if the last day played is today or yesterday (UTC)
+            'current', COALESCE((SELECT s.length FROM streaks s
+                                 WHERE s.last_day >= (NOW() AT TIME ZONE 'UTC')::date - 1), 0),
+            'best', COALESCE((SELECT max(s.length) FROM streaks s), 0),
+            'days_played', (SELECT count(*) FROM days)
+        ),
+        'recent_games', COALESCE((SELECT jsonb_agg(to_jsonb(r) ORDER BY r.date DESC, r.id DESC) FROM recent r), '[]'::jsonb)
+    );
+$$;
@@ -0,0 +1,521 @@
+-- migrate:no-transaction
+-- Daily rollups of scores (score_daily_rollups), kept up to date by
+-- record_score()/record_scores() and read by the analytics, the admin panel
+-- and the rankings rebuild instead of the raw games. The functions are
+-- replaced first, so every game saved from then on is added to its day; the
+-- existing history is then filled in 7-day chunks, each committed on its own
+-- (rebuild_score_daily_rollups() replaces a chunk, so a re-run is harmless).
+
+-- Per-user daily totals of scores: one row per (user, category, difficulty,
+-- UTC day), NULL category/difficulty stored as ''. record_score() and
+-- record_scores() add each game as it is saved; rebuild_score_daily_rollups()
+-- recomputes a range of days. "Last N days" views (analytics, admin panel,
+-- rankings rebuild) read these instead of rescanning scores. The days of an
+-- archived month are removed with it (score_monthly_summaries keeps them).
+CREATE TABLE IF NOT EXISTS score_daily_rollups (
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    category TEXT NOT NULL,
+    difficulty TEXT NOT NULL,
+    day DATE NOT NULL,
+    games INTEGER NOT NULL,
+    total_score BIGINT NOT NULL,
+    best_score INTEGER NOT NULL,
+    total_correct BIGINT NOT NULL,
+    total_errors BIGINT NOT NULL,
+    total_time_seconds FLOAT NOT NULL,
+    last_played_at TIMESTAMPTZ,
+    PRIMARY KEY (user_id, category, difficulty, day)
+);
+
+-- Windows over every user (admin panel, rankings rebuild, rebuild chunks)
+CREATE INDEX IF NOT EXISTS score_daily_rollups_day_idx
+    ON score_daily_rollups (day);
+
+-- POST /scores: insert the game and increment the category totals, rankings
+-- and daily rollups in ONE statement. The increment happens inside ON CONFLICT
+-- DO UPDATE, so the row lock serialises concurrent games of the same user and
+-- no increment is lost.
+-- Called from the API with supabase.rpc("record_score", {...}).
+CREATE OR REPLACE FUNCTION record_score(p_user_id UUID, p_score JSONB)
+RETURNS SETOF scores
+LANGUAGE sql
+AS $$
+    WITH inserted AS (
+        INSERT INTO scores (id, "user", user_id, score, "correctCount", "errorCount", "avgTime", date, category, difficulty)
+        SELECT COALESCE(r.id, gen_random_uuid()), r."user", p_user_id, r.score, r."correctCount", r."errorCount",
+               r."avgTime", COALESCE(r.date, NOW()), r.category, r.difficulty
+        FROM jsonb_populate_record(NULL::scores, p_score) AS r
+        RETURNING *
+    ), progress AS (
+        INSERT INTO user_category_progress AS p
+            (user_id, category, total_games, total_score, total_correct, total_errors, total_time_seconds, last_played_at)
+        SELECT p_user_id, i.category, 1, i.score, i."correctCount", i."errorCount",
+               i."avgTime" * (i."correctCount" + i."errorCount"), NOW()
+        FROM inserted i
+        WHERE p_user_id IS NOT NULL AND i.category IS NOT NULL
+        ON CONFLICT (user_id, category) DO UPDATE SET
+            total_games = p.total_games + EXCLUDED.total_games,
+            total_score = p.total_score + EXCLUDED.total_score,
+            total_correct = p.total_correct + EXCLUDED.total_correct,
+            total_errors = p.total_errors + EXCLUDED.total_errors,
+            total_time_seconds = p.total_time_seconds + EXCLUDED.total_time_seconds,
+            last_played_at = EXCLUDED.last_played_at
+    ), rankings AS (
+        INSERT INTO leaderboard_entries AS e
+            (board, period, period_start, user_id, total_score, games, best_score, updated_at)
+        SELECT k.board, k.period, k.period_start, p_user_id, i.score, 1, i.score, NOW()
+        FROM inserted i
+        CROSS JOIN LATERAL leaderboard_slots(i.category, i.difficulty, i.date) AS k
+        WHERE p_user_id IS NOT NULL
+        ON CONFLICT (board, period, period_start, user_id) DO UPDATE SET
+            total_score = e.total_score + EXCLUDED.total_score,
+            games = e.games + EXCLUDED.games,
+            best_score = GREATEST(e.best_score, EXCLUDED.best_score),
+            updated_at = EXCLUDED.updated_at
+    ), daily AS (
+        INSERT INTO score_daily_rollups AS d
+            (user_id, category, difficulty, day, games, total_score, best_score, total_correct, total_errors,
+             total_time_seconds, last_played_at)
+        SELECT p_user_id, COALESCE(i.category, ''), COALESCE(i.difficulty, ''), (i.date AT TIME ZONE 'UTC')::date,
+               count(*), COALESCE(sum(i.score), 0), COALESCE(max(i.score), 0), COALESCE(sum(i."correctCount"), 0),
+               COALESCE(sum(i."errorCount"), 0), COALESCE(sum(i."avgTime" * (i."correctCount" + i."errorCount")), 0),
+               max(i.date)
+        FROM inserted i
+        WHERE p_user_id IS NOT NULL
+        GROUP BY 1, 2, 3, 4
+        ORDER BY 1, 2, 3, 4
+        ON CONFLICT (user_id, category, difficulty, day) DO UPDATE SET
+            games = d.games + EXCLUDED.games,
+            total_score = d.total_score + EXCLUDED.total_score,
+            best_score = GREATEST(d.best_score, EXCLUDED.best_score),
+            total_correct = d.total_correct + EXCLUDED.total_correct,
+            total_errors = d.total_errors + EXCLUDED.total_errors,
+            total_time_seconds = d.total_time_seconds + EXCLUDED.total_time_seconds,
+            last_played_at = GREATEST(d.last_played_at, EXCLUDED.last_played_at)
+    )
+    SELECT * FROM inserted;
+$$;
+
+-- POST /scores/batch: record_score() for many games in ONE statement: one
+-- multi-row insert into scores, one upsert per (user, category) into
+-- user_category_progress, one per (user, ranking slot) into
+-- leaderboard_entries and one per (user, category, difficulty, day) into
+-- score_daily_rollups, with the increments summed first. Games belong to
+-- p_user_id unless they carry their own user_id (the write-behind buffer
+-- flushes games of many users together); the upserts run in key order so
+-- concurrent batches lock the same rows in the same order. A game whose
+-- idempotency_key was already accepted for its user (or repeats one earlier
+-- in the batch) is skipped and reported as a duplicate with the id it got the
+-- first time (NULL while a concurrent request with that key is still running).
+-- Returns one row per input game, in input order.
+CREATE OR REPLACE FUNCTION record_scores(p_user_id UUID, p_scores JSONB)
+RETURNS TABLE (id UUID, idempotency_key TEXT, duplicate BOOLEAN)
+LANGUAGE sql
+AS $$
+    WITH input AS (
+        SELECT e.ord, e.value ->> 'idempotency_key' AS idempotency_key, COALESCE(r.user_id, p_user_id) AS user_id,
+               COALESCE(r.id, gen_random_uuid()) AS id, r."user", r.score, r."correctCount", r."errorCount",
+               r."avgTime", COALESCE(r.date, NOW()) AS date, r.category, r.difficulty
+        FROM jsonb_array_elements(p_scores) WITH ORDINALITY AS e(value, ord)
+        CROSS JOIN LATERAL jsonb_populate_record(NULL::scores, e.value) AS r
+    ), first_use AS (
+        -- First game of the batch carrying each key of each user
+        SELECT DISTINCT ON (i.user_id, i.idempotency_key) i.user_id, i.idempotency_key, i.id
+        FROM input i
+        WHERE i.idempotency_key IS NOT NULL AND i.user_id IS NOT NULL
+        ORDER BY i.user_id, i.idempotency_key, i.ord
+    ), claimed AS (
+        INSERT INTO score_idempotency_keys (user_id, idempotency_key, score_id)
+        SELECT f.user_id, f.idempotency_key, f.id FROM first_use f
+        ORDER BY f.user_id, f.idempotency_key
+        ON CONFLICT (user_id, idempotency_key) DO NOTHING
+        RETURNING score_idempotency_keys.user_id, score_idempotency_keys.idempotency_key, score_idempotency_keys.score_id
+    ), accepted AS (
+        SELECT i.* FROM input i
+        WHERE i.idempotency_key IS NULL OR i.user_id IS NULL
+           OR i.id IN (SELECT c.score_id FROM claimed c)
+    ), inserted AS (
+        INSERT INTO scores (id, "user", user_id, score, "correctCount", "errorCount", "avgTime", date, category, difficulty)
+        SELECT a.id, a."user", a.user_id, a.score, a."correctCount", a."errorCount", a."avgTime", a.date, a.category, a.difficulty
+        FROM accepted a
+        RETURNING *
+    ), progress AS (
+        INSERT INTO user_category_progress AS p
+            (user_id, category, total_games, total_score, total_correct, total_errors, total_time_seconds, last_played_at)
+        SELECT i.user_id, i.category, count(*), sum(i.score), sum(i."correctCount"), sum(i."errorCount"),
+               sum(i."avgTime" * (i."correctCount" + i."errorCount")), NOW()
+        FROM inserted i
+        WHERE i.user_id IS NOT NULL AND i.category IS NOT NULL
+        GROUP BY i.user_id, i.category
+        ORDER BY i.user_id, i.category
+        ON CONFLICT (user_id, category) DO UPDATE SET
+            total_games = p.total_games + EXCLUDED.total_games,
+            total_score = p.total_score + EXCLUDED.total_score,
+            total_correct = p.total_correct + EXCLUDED.total_correct,
+            total_errors = p.total_errors + EXCLUDED.total_errors,
+            total_time_seconds = p.total_time_seconds + EXCLUDED.total_time_seconds,
+            last_played_at = EXCLUDED.last_played_at
+    ), rankings AS (
+        INSERT INTO leaderboard_entries AS e
+            (board, period, period_start, user_id, total_score, games, best_score, updated_at)
+        SELECT k.board, k.period, k.period_start, i.user_id, sum(i.score), count(*), max(i.score), NOW()
+        FROM inserted i
+        CROSS JOIN LATERAL leaderboard_slots(i.category, i.difficulty, i.date) AS k
+        WHERE i.user_id IS NOT NULL
+        GROUP BY k.board, k.period, k.period_start, i.user_id
+        ORDER BY k.board, k.period, k.period_start, i.user_id
+        ON CONFLICT (board, period, period_start, user_id) DO UPDATE SET
+            total_score = e.total_score + EXCLUDED.total_score,
+            games = e.games + EXCLUDED.games,
+            best_score = GREATEST(e.best_score, EXCLUDED.best_score),
+            updated_at = EXCLUDED.updated_at
+    ), daily AS (
+        INSERT INTO score_daily_rollups AS d
+            (user_id, category, difficulty, day, games, total_score, best_score, total_correct, total_errors,
+             total_time_seconds, last_played_at)
+        SELECT i.user_id, COALESCE(i.category, ''), COALESCE(i.difficulty, ''), (i.date AT TIME ZONE 'UTC')::date,
+               count(*), COALESCE(sum(i.score), 0), COALESCE(max(i.score), 0), COALESCE(sum(i."correctCount"), 0),
+               COALESCE(sum(i."errorCount"), 0), COALESCE(sum(i."avgTime" * (i."correctCount" + i."errorCount")), 0),
+               max(i.date)
+        FROM inserted i
+        WHERE i.user_id IS NOT NULL
+        GROUP BY 1, 2, 3, 4
+        ORDER BY 1, 2, 3, 4
+        ON CONFLICT (user_id, category, difficulty, day) DO UPDATE SET
+            games = d.games + EXCLUDED.games,
+            total_score = d.total_score + EXCLUDED.total_score,
+            best_score = GREATEST(d.best_score, EXCLUDED.best_score),
+            total_correct = d.total_correct + EXCLUDED.total_correct,
+            total_errors = d.total_errors + EXCLUDED.total_errors,
+            total_time_seconds = d.total_time_seconds + EXCLUDED.total_time_seconds,
+            last_played_at = GREATEST(d.last_played_at, EXCLUDED.last_played_at)
+    )
+    SELECT COALESCE(ins.id, c.score_id, k.score_id), i.idempotency_key, ins.id IS NULL
+    FROM input i
+    LEFT JOIN inserted ins ON ins.id = i.id
+    LEFT JOIN claimed c ON c.user_id = i.user_id AND c.idempotency_key = i.idempotency_key
+    LEFT JOIN score_idempotency_keys k ON k.user_id = i.user_id AND k.idempotency_key = i.idempotency_key
+    ORDER BY i.ord;
+$$;
+
+-- Full recompute of leaderboard_entries (admin command) from the daily
+-- rollups plus the archived months, never from the raw scores. All-time rows
+-- cover every game; day/week rows only the last p_recent_days, which also
+-- drops the finished periods record_score() keeps accumulating. Readers keep
+-- seeing the previous rankings until the rebuild commits; saves wait for it.
+-- After deleting scores outside the API, run rebuild_score_daily_rollups()
+-- for those days first.
+CREATE OR REPLACE FUNCTION rebuild_leaderboard(p_recent_days INTEGER DEFAULT 14)
+RETURNS BIGINT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    rebuilt BIGINT;
+BEGIN
+    LOCK TABLE leaderboard_entries IN EXCLUSIVE MODE;
+    DELETE FROM leaderboard_entries;
+
+    INSERT INTO leaderboard_entries (board, period, period_start, user_id, total_score, games, best_score)
+    SELECT g.board, g.period, g.period_start, g.user_id, sum(g.total_score), sum(g.games), max(g.best_score)
+    FROM (
+        SELECT k.board, k.period, k.period_start, r.user_id, r.total_score, r.games, r.best_score
+        FROM score_daily_rollups r
+        CROSS JOIN LATERAL leaderboard_slots(NULLIF(r.category, ''), NULLIF(r.difficulty, ''),
+                                             r.day::timestamp AT TIME ZONE 'UTC') AS k
+        WHERE k.period = 'all'
+           OR r.day >= date_trunc('week', (NOW() AT TIME ZONE 'UTC') - make_interval(days => p_recent_days))::date
+        UNION ALL
+        -- Archived months (retention) only count towards the all-time rankings
+        SELECT k.board, k.period, k.period_start, m.user_id, m.total_score, m.games, m.best_score
+        FROM score_monthly_summaries m
+        CROSS JOIN LATERAL leaderboard_slots(m.category, m.difficulty, m.month) AS k
+        WHERE k.period = 'all'
+    ) AS g
+    GROUP BY g.board, g.period, g.period_start, g.user_id;
+
+    GET DIAGNOSTICS rebuilt = ROW_COUNT;
+    RETURN rebuilt;
+END;
+$$;
+
+-- Retention: summarise the OLDEST monthly partition that ends before the last
+-- p_keep_months full months into score_monthly_summaries, then detach it
+-- (kept as a standalone table to dump, or dropped with p_drop). One partition
+-- per call, so the exclusive lock DETACH takes on scores is held for one short
+-- transaction; call it until it returns no row. Re-running on a month already
+-- summarised replaces its summaries.
+CREATE OR REPLACE FUNCTION archive_score_partition(p_keep_months INTEGER, p_drop BOOLEAN DEFAULT FALSE)
+RETURNS TABLE (partition_name TEXT, games BIGINT, summaries INTEGER)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_cutoff DATE := (date_trunc('month', NOW() AT TIME ZONE 'UTC') - make_interval(months => p_keep_months))::date;
+    v_name TEXT;
+    v_month DATE;
+BEGIN
+    IF p_keep_months < 1 THEN
+        RAISE EXCEPTION 'p_keep_months must be at least 1';
+    END IF;
+    PERFORM pg_advisory_xact_lock(hashtext('score_partitions'));
+
+    SELECT c.relname INTO v_name
+    FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'scores'::regclass AND c.relname ~ '^scores_p\d{4}_\d{2}$'
+    ORDER BY c.relname
+    LIMIT 1;
+    v_month := to_date(substr(v_name, 9), 'YYYY_MM');
+    IF v_name IS NULL OR v_month >= v_cutoff THEN
+        RETURN;
+    END IF;
+
+    -- No game can land in the month between the summary and the detach
+    EXECUTE format('LOCK TABLE %I IN SHARE MODE', v_name);
+    DELETE FROM score_monthly_summaries m WHERE m.month = v_month;
+    EXECUTE format(
+        'INSERT INTO score_monthly_summaries (user_id, month, category, difficulty, games, total_score, best_score, '
+        'total_correct, total_errors, total_time_seconds, last_played_at) '
+        'SELECT s.user_id, %L, s.category, s.difficulty, count(*), sum(s.score), max(s.score), sum(s."correctCount"), '
+        'sum(s."errorCount"), sum(s."avgTime" * (s."correctCount" + s."errorCount")), max(s.date) '
+        'FROM %I s WHERE s.user_id IS NOT NULL GROUP BY s.user_id, s.category, s.difficulty',
+        v_month, v_name
+    );
+    GET DIAGNOSTICS summaries = ROW_COUNT;
+    SELECT COALESCE(sum(m.games), 0) INTO games FROM score_monthly_summaries m WHERE m.month = v_month;
+    -- The summaries now hold the month: keep its games counted once
+    DELETE FROM score_daily_rollups r
+    WHERE r.day >= v_month AND r.day < (v_month + INTERVAL '1 month')::date;
+
+    EXECUTE format('ALTER TABLE scores DETACH PARTITION %I', v_name);
+    IF p_drop THEN
+        EXECUTE format('DROP TABLE %I', v_name);
+    END IF;
+    partition_name := v_name;
+    RETURN NEXT;
+END;
+$$;
+
+-- Recompute score_daily_rollups for the UTC days p_from..p_to (inclusive) from
+-- scores, for every user or only p_user_id. Each call is one transaction and
+-- blocks the saves it could race with until it commits: the whole scores
+-- table (SHARE lock) for a range of every user, that user's games (their
+-- users row, which saving a game KEY SHARE-locks for the foreign key) for one
+-- user. The new totals then include every game committed before, and every
+-- later game is added on top. Returns the rollup rows written.
+CREATE OR REPLACE FUNCTION rebuild_score_daily_rollups(p_from DATE, p_to DATE, p_user_id UUID DEFAULT NULL)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    written INTEGER;
+BEGIN
+    IF p_user_id IS NULL THEN
+        LOCK TABLE scores IN SHARE MODE;
+    ELSE
+        PERFORM 1 FROM users u WHERE u.id = p_user_id FOR UPDATE;
+    END IF;
+
+    DELETE FROM score_daily_rollups r
+    WHERE r.day BETWEEN p_from AND p_to
+      AND (p_user_id IS NULL OR r.user_id = p_user_id);
+
+    INSERT INTO score_daily_rollups
+        (user_id, category, difficulty, day, games, total_score, best_score, total_correct, total_errors,
+         total_time_seconds, last_played_at)
+    SELECT s.user_id, COALESCE(s.category, ''), COALESCE(s.difficulty, ''), (s.date AT TIME ZONE 'UTC')::date,
+           count(*), COALESCE(sum(s.score), 0), COALESCE(max(s.score), 0), COALESCE(sum(s."correctCount"), 0),
+           COALESCE(sum(s."errorCount"), 0), COALESCE(sum(s."avgTime" * (s."correctCount" + s."errorCount")), 0),
+           max(s.date)
+    FROM scores s
+    WHERE s.user_id IS NOT NULL
+      AND (p_user_id IS NULL OR s.user_id = p_user_id)
+      AND s.date >= p_from::timestamp AT TIME ZONE 'UTC'
+      AND s.date < (p_to + 1)::timestamp AT TIME ZONE 'UTC'
+    GROUP BY 1, 2, 3, 4;
+
+    GET DIAGNOSTICS written = ROW_COUNT;
+    RETURN written;
+END;
+$$;
+
+-- Consistency check: every (user, category, difficulty, day) of p_from..p_to
+-- whose rollup differs from the totals recomputed from scores, missing rows
+-- included (expected or actual games 0). One snapshot for both sides, so
+-- saves running meanwhile cannot show up as differences. At most p_limit rows.
+CREATE OR REPLACE FUNCTION check_score_daily_rollups(p_from DATE, p_to DATE, p_limit INTEGER DEFAULT 100)
+RETURNS TABLE (user_id UUID, category TEXT, difficulty TEXT, day DATE, expected_games BIGINT, actual_games BIGINT,
+               expected_score BIGINT, actual_score BIGINT)
+LANGUAGE sql
+STABLE
+AS $$
+    WITH expected AS (
+        SELECT s.user_id, COALESCE(s.category, '') AS category, COALESCE(s.difficulty, '') AS difficulty,
+               (s.date AT TIME ZONE 'UTC')::date AS day, count(*) AS games, COALESCE(sum(s.score), 0) AS total_score,
+               COALESCE(max(s.score), 0) AS best_score, COALESCE(sum(s."correctCount"), 0) AS total_correct,
+               COALESCE(sum(s."errorCount"), 0) AS total_errors,
+               COALESCE(sum(s."avgTime" * (s."correctCount" + s."errorCount")), 0) AS total_time_seconds
+        FROM scores s
+        WHERE s.user_id IS NOT NULL
+          AND s.date >= p_from::timestamp AT TIME ZONE 'UTC'
+          AND s.date < (p_to + 1)::timestamp AT TIME ZONE 'UTC'
+        GROUP BY 1, 2, 3, 4
+    ), actual AS (
+        SELECT r.* FROM score_daily_rollups r WHERE r.day BETWEEN p_from AND p_to
+    )
+    SELECT COALESCE(e.user_id, a.user_id), COALESCE(e.category, a.category), COALESCE(e.difficulty, a.difficulty),
+           COALESCE(e.day, a.day), COALESCE(e.games, 0), COALESCE(a.games, 0),
+           COALESCE(e.total_score, 0), COALESCE(a.total_score, 0)
+    FROM expected e
+    FULL JOIN actual a
+      ON a.user_id = e.user_id AND a.category = e.category AND a.difficulty = e.difficulty AND a.day = e.day
+    WHERE e.games IS DISTINCT FROM a.games
+       OR e.total_score IS DISTINCT FROM a.total_score
+       OR e.best_score IS DISTINCT FROM a.best_score
+       OR e.total_correct IS DISTINCT FROM a.total_correct
+       OR e.total_errors IS DISTINCT FROM a.total_errors
+       OR abs(e.total_time_seconds - a.total_time_seconds) > 0.001
+    ORDER BY 4, 1, 2, 3
+    LIMIT p_limit;
+$$;
+
+-- GET /users/{id}/analytics: what the progress screen and the admin panel
+-- show for one user, aggregated here instead of downloading every game. The
+-- result has a fixed shape whatever the number of games: totals, one entry
+-- per category and per difficulty (one GROUPING SETS pass), the daily trend of
+-- the last p_trend_days days, play streaks (gaps and islands over the days
+-- played) and the latest p_recent games of each category. Everything but the
+-- latest games comes from the daily rollups plus the archived months
+-- (score_monthly_summaries); trend and streaks only see the days in rollups.
+CREATE OR REPLACE FUNCTION user_analytics(p_user_id UUID, p_trend_days INTEGER DEFAULT 30, p_recent INTEGER DEFAULT 10)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+    WITH games AS (
+        SELECT NULLIF(r.category, '') AS category, NULLIF(r.difficulty, '') AS difficulty, r.games, r.total_score,
+               r.best_score, r.total_correct AS correct, r.total_errors AS errors,
+               r.total_time_seconds AS time_seconds, r.last_played_at
+        FROM score_daily_rollups r
+        WHERE r.user_id = p_user_id
+        UNION ALL
+        SELECT m.category, m.difficulty, m.games, m.total_score, m.best_score, m.total_correct, m.total_errors,
+               m.total_time_seconds, m.last_played_at
+        FROM score_monthly_summaries m
+        WHERE m.user_id = p_user_id
+    ), breakdown AS (
+        -- level 1: per category, 2: per difficulty, 3: totals
+        SELECT g.category, g.difficulty, GROUPING(g.category, g.difficulty) AS level,
+               jsonb_build_object(
+                   'games', COALESCE(sum(g.games), 0),
+                   'avg_score', round(sum(g.total_score)::numeric / NULLIF(sum(g.games), 0)),
+                   'best_score', max(g.best_score),
+                   'correct', COALESCE(sum(g.correct), 0),
+                   'errors', COALESCE(sum(g.errors), 0),
+                   'accuracy', round(100.0 * sum(g.correct) / NULLIF(sum(g.correct) + sum(g.errors), 0)),
+                   'avg_time_per_question',
+                       round((sum(g.time_seconds) / NULLIF(sum(g.correct) + sum(g.errors), 0))::numeric, 2),
+                   'last_played_at', max(g.last_played_at)
+               ) AS stats
+        FROM games g
+        GROUP BY GROUPING SETS ((g.category), (g.difficulty), ())
+    ), daily AS (
+        SELECT r.day, sum(r.games) AS games, sum(r.total_score) AS total_score,
+               sum(r.total_correct) AS correct, sum(r.total_errors) AS errors
+        FROM score_daily_rollups r
+        WHERE r.user_id = p_user_id
+        GROUP BY r.day
+    ), streaks AS (
+        -- Consecutive days share the same day - row_number()
+        SELECT max(i.day) AS last_day, count(*) AS length
+        FROM (SELECT d.day, d.day - ROW_NUMBER() OVER (ORDER BY d.day)::integer AS island FROM daily d) i
+        GROUP BY i.island
+    ), trend AS (
+        SELECT d.day, d.games, round(d.total_score::numeric / d.games) AS avg_score,
+               round(100.0 * d.correct / NULLIF(d.correct + d.errors, 0)) AS accuracy
+        FROM daily d
+        WHERE d.day > (NOW() AT TIME ZONE 'UTC')::date - p_trend_days
+    ), recent AS (
+        SELECT r.*
+        FROM breakdown c
+        CROSS JOIN LATERAL (
+            SELECT s.id, s.category, s.difficulty, s.score, s."correctCount", s."errorCount", s."avgTime", s.date
+            FROM scores s
+            WHERE s.user_id = p_user_id AND s.category IS NOT DISTINCT FROM c.category
+            ORDER BY s.date DESC, s.id DESC
+            LIMIT p_recent
+        ) r
+        WHERE c.level = 1
+    )
+    SELECT jsonb_build_object(
+        'totals', (SELECT b.stats FROM breakdown b WHERE b.level = 3),
+        'by_category', COALESCE((
+            SELECT jsonb_agg(b.stats || jsonb_build_object('key', COALESCE(b.category, 'unknown')) ORDER BY b.category)
+            FROM breakdown b WHERE b.level = 1), '[]'::jsonb),
+        'by_difficulty', COALESCE((
+            SELECT jsonb_agg(b.stats || jsonb_build_object('key', COALESCE(b.difficulty, 'unknown')) ORDER BY b.difficulty)
+            FROM breakdown b WHERE b.level = 2), '[]'::jsonb),
+        'trend', COALESCE((
+            SELECT jsonb_agg(jsonb_build_object('day', t.day, 'games', t.games, 'avg_score', t.avg_score, 'accuracy', t.accuracy)
+                             ORDER BY t.day)
+            FROM trend t), '[]'::jsonb),
+        'streaks', jsonb_build_object(
+            -- Still current if the last day played is today or yesterday (UTC)
+            'current', COALESCE((SELECT s.length FROM streaks s
+                                 WHERE s.last_day >= (NOW() AT TIME ZONE 'UTC')::date - 1), 0),
+            'best', COALESCE((SELECT max(s.length) FROM streaks s), 0),
+            'days_played', (SELECT count(*) FROM daily)
+        ),
+        'recent_games', COALESCE((SELECT jsonb_agg(to_jsonb(r) ORDER BY r.date DESC, r.id DESC) FROM recent r), '[]'::jsonb)
+    );
+$$;
+
+-- GET /admin/stats: activity of every user over the last p_days UTC days (today
+-- included), from the daily rollups: games, active users and average score,
+-- per day and per category. Fixed size: p_days rows plus one per category.
+CREATE OR REPLACE FUNCTION score_activity(p_days INTEGER DEFAULT 30)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+    WITH recent AS (
+        SELECT r.*
+        FROM score_daily_rollups r
+        WHERE r.day > (NOW() AT TIME ZONE 'UTC')::date - p_days
+    )
+    SELECT jsonb_build_object(
+        'days', p_days,
+        'games', (SELECT COALESCE(sum(r.games), 0) FROM recent r),
+        'active_users', (SELECT count(DISTINCT r.user_id) FROM recent r),
+        'by_day', COALESCE((
+            SELECT jsonb_agg(jsonb_build_object('day', d.day, 'games', d.games, 'active_users', d.active_users)
+                             ORDER BY d.day)
+            FROM (SELECT r.day, sum(r.games) AS games, count(DISTINCT r.user_id) AS active_users
+                  FROM recent r GROUP BY r.day) d), '[]'::jsonb),
+        'by_category', COALESCE((
+            SELECT jsonb_agg(jsonb_build_object(
+                       'key', COALESCE(NULLIF(c.category, ''), 'unknown'), 'games', c.games,
+                       'active_users', c.active_users, 'avg_score', round(c.total_score::numeric / c.games))
+                   ORDER BY c.category)
+            FROM (SELECT r.category, sum(r.games) AS games, count(DISTINCT r.user_id) AS active_users,
+                         sum(r.total_score) AS total_score
+                  FROM recent r GROUP BY r.category) c), '[]'::jsonb)
+    );
+$$;
+
+ALTER TABLE score_daily_rollups ENABLE ROW LEVEL SECURITY;
+
+DO $$
+DECLARE
+    v_day DATE;
+    v_last DATE;
+BEGIN
+    SELECT (min(s.date) AT TIME ZONE 'UTC')::date, (max(s.date) AT TIME ZONE 'UTC')::date
+    INTO v_day, v_last
+    FROM scores s
+    WHERE s.user_id IS NOT NULL;
+
+    WHILE v_day <= v_last LOOP
+        PERFORM rebuild_score_daily_rollups(v_day, LEAST(v_day + 6, v_last));
+        v_day := v_day + 7;
+        COMMIT;
+    END LOOP;
+END $$;
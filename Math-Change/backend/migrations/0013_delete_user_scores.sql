@@ -0,0 +1,71 @@
+-- DELETE /scores and DELETE /scores/{id} through delete_user_scores(), so a
+-- deleted game also leaves the daily rollups and the rankings
+-- (leaderboard_entries) of the user.
+
+-- DELETE /scores and DELETE /scores/{id}: delete one user's games (all of
+-- them, or only p_score_id) and take them out of what record_score() added
+-- them to, in one transaction. The rollups of the days they were played are
+-- recomputed (the whole history takes the user's rollups and archived months
+-- with it), then the user's rankings of the slots they counted towards are
+-- recounted from those rollups plus the archived months, as
+-- rebuild_leaderboard() does: best_score cannot be decremented. The users row
+-- is locked first, so the user's saves wait instead of racing with the
+-- recount. Returns the games deleted (0 if p_score_id is not theirs).
+CREATE OR REPLACE FUNCTION delete_user_scores(p_user_id UUID, p_score_id UUID DEFAULT NULL)
+RETURNS BIGINT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    deleted BIGINT;
+    v_days DATE[];
+    v_weeks DATE[];
+BEGIN
+    PERFORM 1 FROM users u WHERE u.id = p_user_id FOR UPDATE;
+
+    WITH gone AS (
+        DELETE FROM scores s
+        WHERE s.user_id = p_user_id AND (p_score_id IS NULL OR s.id = p_score_id)
+        RETURNING (s.date AT TIME ZONE 'UTC')::date AS day
+    )
+    SELECT count(*), array_agg(DISTINCT g.day), array_agg(DISTINCT date_trunc('week', g.day)::date)
+    INTO deleted, v_days, v_weeks
+    FROM gone g;
+    IF deleted = 0 THEN
+        RETURN 0;
+    END IF;
+
+    IF p_score_id IS NULL THEN
+        DELETE FROM score_daily_rollups r WHERE r.user_id = p_user_id;
+        DELETE FROM score_monthly_summaries m WHERE m.user_id = p_user_id;
+    ELSE
+        PERFORM rebuild_score_daily_rollups(v_days[1], v_days[1], p_user_id);
+    END IF;
+
+    DELETE FROM leaderboard_entries e
+    WHERE e.user_id = p_user_id
+      AND (e.period = 'all'
+           OR (e.period = 'week' AND e.period_start = ANY (v_weeks))
+           OR (e.period = 'day' AND e.period_start = ANY (v_days)));
+
+    INSERT INTO leaderboard_entries (board, period, period_start, user_id, total_score, games, best_score)
+    SELECT g.board, g.period, g.period_start, p_user_id, sum(g.total_score), sum(g.games), max(g.best_score)
+    FROM (
+        SELECT k.board, k.period, k.period_start, r.total_score, r.games, r.best_score
+        FROM score_daily_rollups r
+        CROSS JOIN LATERAL leaderboard_slots(NULLIF(r.category, ''), NULLIF(r.difficulty, ''),
+                                             r.day::timestamp AT TIME ZONE 'UTC') AS k
+        WHERE r.user_id = p_user_id
+          AND (k.period = 'all'
+               OR (k.period = 'week' AND k.period_start = ANY (v_weeks))
+               OR (k.period = 'day' AND k.period_start = ANY (v_days)))
+        UNION ALL
+        SELECT k.board, k.period, k.period_start, m.total_score, m.games, m.best_score
+        FROM score_monthly_summaries m
+        CROSS JOIN LATERAL leaderboard_slots(m.category, m.difficulty, m.month) AS k
+        WHERE m.user_id = p_user_id AND k.period = 'all'
+    ) AS g
+    GROUP BY g.board, g.period, g.period_start;
+
+    RETURN deleted;
+END;
+$$;
@@ -0,0 +1,127 @@
+-- migrate:no-transaction
+-- GET /users/{id}/analytics: user_analytics() in PL/pgSQL, so its plan is
+-- cached per connection; the user's daily rollups are read once, from a
+-- covering index built without blocking saves; the latest games of each
+-- category read only the partitions of the days that hold them.
+
+-- One user's days with every total (user_analytics): an index-only scan reads
+-- a few leaf pages instead of one heap page per day played. Saves cannot
+-- update rollups as HOT anymore; scores and leaderboard_entries already add
+-- index entries on every save.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS score_daily_rollups_user_idx
+    ON score_daily_rollups (user_id, day)
+    INCLUDE (category, difficulty, games, total_score, best_score, total_correct, total_errors,
+             total_time_seconds, last_played_at);
+
+-- GET /users/{id}/analytics: what the progress screen and the admin panel
+-- show for one user, aggregated here instead of downloading every game. The
+-- result has a fixed shape whatever the number of games: totals, one entry
+-- per category and per difficulty (one GROUPING SETS pass), the daily trend of
+-- the last p_trend_days days, play streaks (gaps and islands over the days
+-- played) and the latest p_recent games of each category. Everything but the
+-- latest games comes from the daily rollups plus the archived months
+-- (score_monthly_summaries); trend and streaks only see the days in rollups.
+-- The latest games of a category are only looked for from the day the rollups
+-- reach p_recent games back, so only those months' partitions are read.
+-- The user's rollup rows are read once, not once per CTE that needs them.
+-- PL/pgSQL rather than SQL: the statement's plan is cached per connection
+-- instead of being planned again, over every partition, on each call.
+CREATE OR REPLACE FUNCTION user_analytics(p_user_id UUID, p_trend_days INTEGER DEFAULT 30, p_recent INTEGER DEFAULT 10)
+RETURNS JSONB
+LANGUAGE plpgsql
+STABLE
+AS $$
+BEGIN
+    RETURN (
+    WITH rollups AS MATERIALIZED (
+        -- Read once, from score_daily_rollups_user_idx alone (index-only scan)
+        SELECT r.category, r.difficulty, r.day, r.games, r.total_score, r.best_score, r.total_correct,
+               r.total_errors, r.total_time_seconds, r.last_played_at
+        FROM score_daily_rollups r
+        WHERE r.user_id = p_user_id
+    ), games AS (
+        SELECT NULLIF(r.category, '') AS category, NULLIF(r.difficulty, '') AS difficulty, r.games, r.total_score,
+               r.best_score, r.total_correct AS correct, r.total_errors AS errors,
+               r.total_time_seconds AS time_seconds, r.last_played_at
+        FROM rollups r
+        UNION ALL
+        SELECT m.category, m.difficulty, m.games, m.total_score, m.best_score, m.total_correct, m.total_errors,
+               m.total_time_seconds, m.last_played_at
+        FROM score_monthly_summaries m
+        WHERE m.user_id = p_user_id
+    ), breakdown AS (
+        -- level 1: per category, 2: per difficulty, 3: totals
+        SELECT g.category, g.difficulty, GROUPING(g.category, g.difficulty) AS level,
+               jsonb_build_object(
+                   'games', COALESCE(sum(g.games), 0),
+                   'avg_score', round(sum(g.total_score)::numeric / NULLIF(sum(g.games), 0)),
+                   'best_score', max(g.best_score),
+                   'correct', COALESCE(sum(g.correct), 0),
+                   'errors', COALESCE(sum(g.errors), 0),
+                   'accuracy', round(100.0 * sum(g.correct) / NULLIF(sum(g.correct) + sum(g.errors), 0)),
+                   'avg_time_per_question',
+                       round((sum(g.time_seconds) / NULLIF(sum(g.correct) + sum(g.errors), 0))::numeric, 2),
+                   'last_played_at', max(g.last_played_at)
+               ) AS stats
+        FROM games g
+        GROUP BY GROUPING SETS ((g.category), (g.difficulty), ())
+    ), daily AS (
+        SELECT r.day, sum(r.games) AS games, sum(r.total_score) AS total_score,
+               sum(r.total_correct) AS correct, sum(r.total_errors) AS errors
+        FROM rollups r
+        GROUP BY r.day
+    ), streaks AS (
+        -- Consecutive days share the same day - row_number()
+        SELECT max(i.day) AS last_day, count(*) AS length
+        FROM (SELECT d.day, d.day - ROW_NUMBER() OVER (ORDER BY d.day)::integer AS island FROM daily d) i
+        GROUP BY i.island
+    ), trend AS (
+        SELECT d.day, d.games, round(d.total_score::numeric / d.games) AS avg_score,
+               round(100.0 * d.correct / NULLIF(d.correct + d.errors, 0)) AS accuracy
+        FROM daily d
+        WHERE d.day > (NOW() AT TIME ZONE 'UTC')::date - p_trend_days
+    ), recent_since AS (
+        -- Per category, the latest day with p_recent games on or after it (NULL: fewer in the rollups)
+        SELECT NULLIF(d.category, '') AS category, max(d.day) FILTER (WHERE d.games_since >= p_recent) AS day
+        FROM (
+            SELECT r.category, r.day, sum(r.games) OVER (PARTITION BY r.category ORDER BY r.day DESC) AS games_since
+            FROM rollups r
+        ) d
+        GROUP BY d.category
+    ), recent AS (
+        SELECT r.*
+        FROM breakdown c
+        LEFT JOIN recent_since rs ON rs.category IS NOT DISTINCT FROM c.category
+        CROSS JOIN LATERAL (
+            SELECT s.id, s.category, s.difficulty, s.score, s."correctCount", s."errorCount", s."avgTime", s.date
+            FROM scores s
+            WHERE s.user_id = p_user_id AND s.category IS NOT DISTINCT FROM c.category
+              AND s.date >= COALESCE(rs.day::timestamp AT TIME ZONE 'UTC', '-infinity')
+            ORDER BY s.date DESC, s.id DESC
+            LIMIT p_recent
+        ) r
+        WHERE c.level = 1
+    )
+    SELECT jsonb_build_object(
+        'totals', (SELECT b.stats FROM breakdown b WHERE b.level = 3),
+        'by_category', COALESCE((
+            SELECT jsonb_agg(b.stats || jsonb_build_object('key', COALESCE(b.category, 'unknown')) ORDER BY b.category)
+            FROM breakdown b WHERE b.level = 1), '[]'::jsonb),
+        'by_difficulty', COALESCE((
+            SELECT jsonb_agg(b.stats || jsonb_build_object('key', COALESCE(b.difficulty, 'unknown')) ORDER BY b.difficulty)
+            FROM breakdown b WHERE b.level = 2), '[]'::jsonb),
+        'trend', COALESCE((
+            SELECT jsonb_agg(jsonb_build_object('day', t.day, 'games', t.games, 'avg_score', t.avg_score, 'accuracy', t.accuracy)
+                             ORDER BY t.day)
+            FROM trend t), '[]'::jsonb),
+        'streaks', jsonb_build_object(
+            -- Still current if the last day played is today or yesterday (UTC)
+            'current', COALESCE((SELECT s.length FROM streaks s
+                                 WHERE s.last_day >= (NOW() AT TIME ZONE 'UTC')::date - 1), 0),
+            'best', COALESCE((SELECT max(s.length) FROM streaks s), 0),
+            'days_played', (SELECT count(*) FROM daily)
+        ),
+        'recent_games', COALESCE((SELECT jsonb_agg(to_jsonb(r) ORDER BY r.date DESC, r.id DESC) FROM recent r), '[]'::jsonb)
+    ));
+END;
+$$;
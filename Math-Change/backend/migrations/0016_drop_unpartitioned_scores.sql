@@ -0,0 +1,5 @@
+-- Drop the unpartitioned scores table that 0008_partition_scores.sql renamed
+-- out of the way instead of dropping, once no record_score() call from
+-- before the swap can still be using its row type.
+
+DROP TABLE IF EXISTS scores_unpartitioned;
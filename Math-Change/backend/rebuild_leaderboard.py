@@ -0,0 +1,33 @@
+import os
+import sys
+from dotenv import load_dotenv
+from supabase import create_client
+
+# Recomputes the materialized rankings (leaderboard_entries) from the daily
+# rollups. record_score() keeps them current; run this after bulk imports,
+# seed_data.py, deleted scores (rebuild_rollups.py first), or on a schedule to
+# drop finished day/week periods.
+#
+# Usage: python rebuild_leaderboard.py [recent_days]
+
+load_dotenv()
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_KEY")
+
+if not SUPABASE_URL or not SUPABASE_KEY:
+    print("Error: SUPABASE_URL or SUPABASE_KEY not found.")
+    exit(1)
+
+
+def rebuild(recent_days: int = 14) -> int:
+    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    res = supabase.rpc("rebuild_leaderboard", {"p_recent_days": recent_days}).execute()
+    return res.data
+
+
+if __name__ == "__main__":
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 14
+    print(f"Rebuilding leaderboard rankings (day/week periods of the last {days} days)...")
+    entries = rebuild(days)
+    print(f"Leaderboard rebuilt: {entries} ranking entries.")
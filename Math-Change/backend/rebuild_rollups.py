@@ -0,0 +1,81 @@
+import argparse
+import asyncio
+from datetime import date
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.rollups import (  # noqa: E402
+    ROLLUP_CHUNK_DAYS, ROLLUP_WORKERS, check_rollups, chunks, history_range, rebuild_rollups,
+)
+from app.database import close_database  # noqa: E402
+
+# Recomputes the daily rollups (score_daily_rollups) from the scores history,
+# in chunks of days rebuilt in parallel. record_score() keeps them current;
+# run this after bulk imports, seed_data.py or scores deleted outside the API.
+# --check only compares the rollups with scores and lists the differences.
+#
+# Usage: python rebuild_rollups.py [--from 2024-01-01] [--to 2024-12-31]
+#                                  [--chunk-days 7] [--workers 4] [--check]
+
+
+def report(status: dict) -> None:
+    print(
+        f"  chunk {status['chunks_done']:>5}/{status['chunks']}  {status['last_chunk']}  "
+        f"rows={status['rows_written']:>8}  {status['elapsed_seconds']:>7.1f}s"
+    )
+
+
+async def check(start: date, end: date, chunk_days: int, workers: int) -> int:
+    semaphore = asyncio.Semaphore(workers)
+
+    async def check_chunk(first: date, last: date) -> list:
+        async with semaphore:
+            return await check_rollups(first, last)
+
+    results = await asyncio.gather(*(check_chunk(first, last) for first, last in chunks(start, end, chunk_days)))
+    differences = [row for rows in results for row in rows]
+    for row in differences[:50]:
+        print(
+            f"  {row['day']}  user={row['user_id']}  {row['category'] or '-'}/{row['difficulty'] or '-'}  "
+            f"games {row['expected_games']} != {row['actual_games']}  "
+            f"score {row['expected_score']} != {row['actual_score']}"
+        )
+    return len(differences)
+
+
+async def main(args) -> int:
+    try:
+        start, end = args.start, args.end
+        if start is None or end is None:
+            history = await history_range()
+            if history is None:
+                print("No games in scores, nothing to do.")
+                return 0
+            start, end = start or history[0], end or history[1]
+        if args.check:
+            print(f"Checking daily rollups from {start} to {end}...")
+            differences = await check(start, end, args.chunk_days, args.workers)
+            if differences:
+                print(f"Found {differences} rollup rows that differ from scores (run without --check to fix them).")
+                return 1
+            print("Daily rollups match scores.")
+            return 0
+        print(f"Rebuilding daily rollups from {start} to {end} "
+              f"({args.chunk_days}-day chunks, {args.workers} at a time)...")
+        status = await rebuild_rollups(start, end, args.chunk_days, args.workers, report=report)
+        print(f"Rollups rebuilt: {status['rows_written']} rows in {status['chunks']} chunks "
+              f"({status['elapsed_seconds']}s).")
+        return 0
+    finally:
+        await close_database()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild or check score_daily_rollups from scores")
+    parser.add_argument("--from", dest="start", type=date.fromisoformat, help="first UTC day (default: oldest game)")
+    parser.add_argument("--to", dest="end", type=date.fromisoformat, help="last UTC day (default: newest game)")
+    parser.add_argument("--chunk-days", type=int, default=ROLLUP_CHUNK_DAYS)
+    parser.add_argument("--workers", type=int, default=ROLLUP_WORKERS)
+    parser.add_argument("--check", action="store_true", help="only compare the rollups with scores")
+    exit(asyncio.run(main(parser.parse_args())))
@@ -1,4 +1,8 @@
 -- Run this in Supabase SQL Editor
+--
+-- Full schema of a NEW database. Existing databases are upgraded with the
+-- versioned files in migrations/ (python migrate.py); every change goes into a
+-- new migration AND here, tests/test_migrations.py checks both stay identical.
 
 CREATE TABLE IF NOT EXISTS users (
     id UUID PRIMARY KEY,
@@ -14,22 +18,920 @@ CREATE TABLE IF NOT EXISTS users (
     "unlockedLevel" INTEGER DEFAULT 0
 );
 
+-- Partitioned by month on date: one scores_pYYYY_MM table per UTC month, plus
+-- scores_default for dates no partition covers. A query filtered on date only
+-- reads the months in range. ensure_score_partitions() creates the upcoming
+-- months; archive_score_partition() applies the retention policy.
+-- The primary key must contain the partition key: it is (id, date).
 CREATE TABLE IF NOT EXISTS scores (
-    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-    "user" TEXT NOT NULL, -- Stores username
+    id UUID NOT NULL DEFAULT gen_random_uuid(),
+    "user" TEXT NOT NULL, -- Username at the time of the game (display only)
+    user_id UUID REFERENCES users(id) ON DELETE SET NULL,
     score INTEGER NOT NULL,
     "correctCount" INTEGER NOT NULL,
     "errorCount" INTEGER NOT NULL,
     "avgTime" FLOAT NOT NULL,
-    date TIMESTAMPTZ DEFAULT NOW(),
+    date TIMESTAMPTZ NOT NULL DEFAULT NOW(),
     category TEXT,
-    difficulty TEXT
+    difficulty TEXT,
+    PRIMARY KEY (id, date)
+) PARTITION BY RANGE (date);
+
+CREATE TABLE IF NOT EXISTS scores_default PARTITION OF scores DEFAULT;
+
+-- Leaderboard indexes (GET /leaderboard)
+-- Each one matches a filter combination followed by the ranking order
+-- (score DESC, date DESC, id DESC), so a page is a bounded index range scan
+-- that stops after LIMIT rows instead of sorting the whole table.
+CREATE INDEX IF NOT EXISTS scores_leaderboard_idx
+    ON scores (score DESC, date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS scores_category_leaderboard_idx
+    ON scores (category, score DESC, date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS scores_category_difficulty_leaderboard_idx
+    ON scores (category, difficulty, score DESC, date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS scores_difficulty_leaderboard_idx
+    ON scores (difficulty, score DESC, date DESC, id DESC);
+-- Time windows (window=day|week|month) on sparse filters
+CREATE INDEX IF NOT EXISTS scores_date_idx
+    ON scores (date DESC);
+-- History of one user, newest first (GET /scores?user_id=, /users/me/scores)
+CREATE INDEX IF NOT EXISTS scores_user_date_idx
+    ON scores (user_id, date DESC);
+
+CREATE TABLE IF NOT EXISTS user_category_progress (
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    category TEXT NOT NULL,
+    unlocked_level INTEGER DEFAULT 0,
+    total_games INTEGER DEFAULT 0,
+    total_score INTEGER DEFAULT 0,
+    total_correct INTEGER DEFAULT 0,
+    total_errors INTEGER DEFAULT 0,
+    total_time_seconds FLOAT DEFAULT 0,
+    last_played_at TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (user_id, category)
+);
+
+-- Materialized rankings: one row per (board, period, user) with the running
+-- totals of that user. Boards are 'global', 'category:<name>' and
+-- 'difficulty:<name>'; periods are 'day', 'week' (ISO, starting Monday) and
+-- 'all', with period_start = the UTC day/week ('1970-01-01' for 'all').
+-- record_score() keeps it up to date; rebuild_leaderboard() recomputes it.
+CREATE TABLE IF NOT EXISTS leaderboard_entries (
+    board TEXT NOT NULL,
+    period TEXT NOT NULL,
+    period_start DATE NOT NULL,
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    total_score BIGINT NOT NULL DEFAULT 0,
+    games INTEGER NOT NULL DEFAULT 0,
+    best_score INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (board, period, period_start, user_id)
+);
+
+-- Ranking order inside one (board, period, period_start): a page is an index
+-- range scan and a user's rank is an index-only count of the entries ahead.
+CREATE INDEX IF NOT EXISTS leaderboard_entries_rank_idx
+    ON leaderboard_entries (board, period, period_start, total_score DESC, user_id DESC);
+
+-- Every (board, period, period_start) a game played at p_date counts towards.
+CREATE OR REPLACE FUNCTION leaderboard_slots(p_category TEXT, p_difficulty TEXT, p_date TIMESTAMPTZ)
+RETURNS TABLE (board TEXT, period TEXT, period_start DATE)
+LANGUAGE sql IMMUTABLE
+AS $$
+    SELECT b.board, w.period, w.period_start
+    FROM (VALUES ('global'), ('category:' || p_category), ('difficulty:' || p_difficulty)) AS b(board)
+    CROSS JOIN (VALUES
+        ('all', DATE '1970-01-01'),
+        ('week', date_trunc('week', p_date AT TIME ZONE 'UTC')::date),
+        ('day', (p_date AT TIME ZONE 'UTC')::date)
+    ) AS w(period, period_start)
+    WHERE b.board IS NOT NULL;
+$$;
+
+-- Per-user daily totals of scores: one row per (user, category, difficulty,
+-- UTC day), NULL category/difficulty stored as ''. record_score() and
+-- record_scores() add each game as it is saved; rebuild_score_daily_rollups()
+-- recomputes a range of days. "Last N days" views (analytics, admin panel,
+-- rankings rebuild) read these instead of rescanning scores. The days of an
+-- archived month are removed with it (score_monthly_summaries keeps them).
+CREATE TABLE IF NOT EXISTS score_daily_rollups (
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    category TEXT NOT NULL,
+    difficulty TEXT NOT NULL,
+    day DATE NOT NULL,
+    games INTEGER NOT NULL,
+    total_score BIGINT NOT NULL,
+    best_score INTEGER NOT NULL,
+    total_correct BIGINT NOT NULL,
+    total_errors BIGINT NOT NULL,
+    total_time_seconds FLOAT NOT NULL,
+    last_played_at TIMESTAMPTZ,
+    PRIMARY KEY (user_id, category, difficulty, day)
+);
+
+-- Windows over every user (admin panel, rankings rebuild, rebuild chunks)
+CREATE INDEX IF NOT EXISTS score_daily_rollups_day_idx
+    ON score_daily_rollups (day);
+-- One user's days with every total (user_analytics): an index-only scan reads
+-- a few leaf pages instead of one heap page per day played. Saves cannot
+-- update rollups as HOT anymore; scores and leaderboard_entries already add
+-- index entries on every save.
+CREATE INDEX IF NOT EXISTS score_daily_rollups_user_idx
+    ON score_daily_rollups (user_id, day)
+    INCLUDE (category, difficulty, games, total_score, best_score, total_correct, total_errors,
+             total_time_seconds, last_played_at);
+
+-- POST /scores: insert the game and increment the category totals, rankings
+-- and daily rollups in ONE statement. The increment happens inside ON CONFLICT
+-- DO UPDATE, so the row lock serialises concurrent games of the same user and
+-- no increment is lost.
+-- Called from the API with supabase.rpc("record_score", {...}).
+CREATE OR REPLACE FUNCTION record_score(p_user_id UUID, p_score JSONB)
+RETURNS SETOF scores
+LANGUAGE sql
+AS $$
+    WITH inserted AS (
+        INSERT INTO scores (id, "user", user_id, score, "correctCount", "errorCount", "avgTime", date, category, difficulty)
+        SELECT COALESCE(r.id, gen_random_uuid()), r."user", p_user_id, r.score, r."correctCount", r."errorCount",
+               r."avgTime", COALESCE(r.date, NOW()), r.category, r.difficulty
+        FROM jsonb_populate_record(NULL::scores, p_score) AS r
+        RETURNING *
+    ), progress AS (
+        INSERT INTO user_category_progress AS p
+            (user_id, category, total_games, total_score, total_correct, total_errors, total_time_seconds, last_played_at)
+        SELECT p_user_id, i.category, 1, i.score, i."correctCount", i."errorCount",
+               i."avgTime" * (i."correctCount" + i."errorCount"), NOW()
+        FROM inserted i
+        WHERE p_user_id IS NOT NULL AND i.category IS NOT NULL
+        ON CONFLICT (user_id, category) DO UPDATE SET
+            total_games = p.total_games + EXCLUDED.total_games,
+            total_score = p.total_score + EXCLUDED.total_score,
+            total_correct = p.total_correct + EXCLUDED.total_correct,
+            total_errors = p.total_errors + EXCLUDED.total_errors,
+            total_time_seconds = p.total_time_seconds + EXCLUDED.total_time_seconds,
+            last_played_at = EXCLUDED.last_played_at
+    ), rankings AS (
+        INSERT INTO leaderboard_entries AS e
+            (board, period, period_start, user_id, total_score, games, best_score, updated_at)
+        SELECT k.board, k.period, k.period_start, p_user_id, i.score, 1, i.score, NOW()
+        FROM inserted i
+        CROSS JOIN LATERAL leaderboard_slots(i.category, i.difficulty, i.date) AS k
+        WHERE p_user_id IS NOT NULL
+        ON CONFLICT (board, period, period_start, user_id) DO UPDATE SET
+            total_score = e.total_score + EXCLUDED.total_score,
+            games = e.games + EXCLUDED.games,
+            best_score = GREATEST(e.best_score, EXCLUDED.best_score),
+            updated_at = EXCLUDED.updated_at
+    ), daily AS (
+        INSERT INTO score_daily_rollups AS d
+            (user_id, category, difficulty, day, games, total_score, best_score, total_correct, total_errors,
+             total_time_seconds, last_played_at)
+        SELECT p_user_id, COALESCE(i.category, ''), COALESCE(i.difficulty, ''), (i.date AT TIME ZONE 'UTC')::date,
+               count(*), COALESCE(sum(i.score), 0), COALESCE(max(i.score), 0), COALESCE(sum(i."correctCount"), 0),
+               COALESCE(sum(i."errorCount"), 0), COALESCE(sum(i."avgTime" * (i."correctCount" + i."errorCount")), 0),
+               max(i.date)
+        FROM inserted i
+        WHERE p_user_id IS NOT NULL
+        GROUP BY 1, 2, 3, 4
+        ORDER BY 1, 2, 3, 4
+        ON CONFLICT (user_id, category, difficulty, day) DO UPDATE SET
+            games = d.games + EXCLUDED.games,
+            total_score = d.total_score + EXCLUDED.total_score,
+            best_score = GREATEST(d.best_score, EXCLUDED.best_score),
+            total_correct = d.total_correct + EXCLUDED.total_correct,
+            total_errors = d.total_errors + EXCLUDED.total_errors,
+            total_time_seconds = d.total_time_seconds + EXCLUDED.total_time_seconds,
+            last_played_at = GREATEST(d.last_played_at, EXCLUDED.last_played_at)
+    )
+    SELECT * FROM inserted;
+$$;
+
+-- Replayed batches: one row per (user, client idempotency key) ever accepted by
+-- record_scores(). scores itself cannot enforce it (its unique keys must
+-- contain the partition column, date). Purged after SCORE_IDEMPOTENCY_TTL_DAYS.
+CREATE TABLE IF NOT EXISTS score_idempotency_keys (
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    idempotency_key TEXT NOT NULL,
+    score_id UUID NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, idempotency_key)
 );
 
+CREATE INDEX IF NOT EXISTS score_idempotency_keys_created_idx
+    ON score_idempotency_keys (created_at);
+
+-- POST /scores/batch: record_score() for many games in ONE statement: one
+-- multi-row insert into scores, one upsert per (user, category) into
+-- user_category_progress, one per (user, ranking slot) into
+-- leaderboard_entries and one per (user, category, difficulty, day) into
+-- score_daily_rollups, with the increments summed first. Games belong to
+-- p_user_id unless they carry their own user_id (the write-behind buffer
+-- flushes games of many users together); the upserts run in key order so
+-- concurrent batches lock the same rows in the same order. A game whose
+-- idempotency_key was already accepted for its user (or repeats one earlier
+-- in the batch) is skipped and reported as a duplicate with the id it got the
+-- first time (NULL while a concurrent request with that key is still running).
+-- Returns one row per input game, in input order.
+CREATE OR REPLACE FUNCTION record_scores(p_user_id UUID, p_scores JSONB)
+RETURNS TABLE (id UUID, idempotency_key TEXT, duplicate BOOLEAN)
+LANGUAGE sql
+AS $$
+    WITH input AS (
+        SELECT e.ord, e.value ->> 'idempotency_key' AS idempotency_key, COALESCE(r.user_id, p_user_id) AS user_id,
+               COALESCE(r.id, gen_random_uuid()) AS id, r."user", r.score, r."correctCount", r."errorCount",
+               r."avgTime", COALESCE(r.date, NOW()) AS date, r.category, r.difficulty
+        FROM jsonb_array_elements(p_scores) WITH ORDINALITY AS e(value, ord)
+        CROSS JOIN LATERAL jsonb_populate_record(NULL::scores, e.value) AS r
+    ), first_use AS (
+        -- First game of the batch carrying each key of each user
+        SELECT DISTINCT ON (i.user_id, i.idempotency_key) i.user_id, i.idempotency_key, i.id
+        FROM input i
+        WHERE i.idempotency_key IS NOT NULL AND i.user_id IS NOT NULL
+        ORDER BY i.user_id, i.idempotency_key, i.ord
+    ), claimed AS (
+        INSERT INTO score_idempotency_keys (user_id, idempotency_key, score_id)
+        SELECT f.user_id, f.idempotency_key, f.id FROM first_use f
+        ORDER BY f.user_id, f.idempotency_key
+        ON CONFLICT (user_id, idempotency_key) DO NOTHING
+        RETURNING score_idempotency_keys.user_id, score_idempotency_keys.idempotency_key, score_idempotency_keys.score_id
+    ), accepted AS (
+        SELECT i.* FROM input i
+        WHERE i.idempotency_key IS NULL OR i.user_id IS NULL
+           OR i.id IN (SELECT c.score_id FROM claimed c)
+    ), inserted AS (
+        INSERT INTO scores (id, "user", user_id, score, "correctCount", "errorCount", "avgTime", date, category, difficulty)
+        SELECT a.id, a."user", a.user_id, a.score, a."correctCount", a."errorCount", a."avgTime", a.date, a.category, a.difficulty
+        FROM accepted a
+        RETURNING *
+    ), progress AS (
+        INSERT INTO user_category_progress AS p
+            (user_id, category, total_games, total_score, total_correct, total_errors, total_time_seconds, last_played_at)
+        SELECT i.user_id, i.category, count(*), sum(i.score), sum(i."correctCount"), sum(i."errorCount"),
+               sum(i."avgTime" * (i."correctCount" + i."errorCount")), NOW()
+        FROM inserted i
+        WHERE i.user_id IS NOT NULL AND i.category IS NOT NULL
+        GROUP BY i.user_id, i.category
+        ORDER BY i.user_id, i.category
+        ON CONFLICT (user_id, category) DO UPDATE SET
+            total_games = p.total_games + EXCLUDED.total_games,
+            total_score = p.total_score + EXCLUDED.total_score,
+            total_correct = p.total_correct + EXCLUDED.total_correct,
+            total_errors = p.total_errors + EXCLUDED.total_errors,
+            total_time_seconds = p.total_time_seconds + EXCLUDED.total_time_seconds,
+            last_played_at = EXCLUDED.last_played_at
+    ), rankings AS (
+        INSERT INTO leaderboard_entries AS e
+            (board, period, period_start, user_id, total_score, games, best_score, updated_at)
+        SELECT k.board, k.period, k.period_start, i.user_id, sum(i.score), count(*), max(i.score), NOW()
+        FROM inserted i
+        CROSS JOIN LATERAL leaderboard_slots(i.category, i.difficulty, i.date) AS k
+        WHERE i.user_id IS NOT NULL
+        GROUP BY k.board, k.period, k.period_start, i.user_id
+        ORDER BY k.board, k.period, k.period_start, i.user_id
+        ON CONFLICT (board, period, period_start, user_id) DO UPDATE SET
+            total_score = e.total_score + EXCLUDED.total_score,
+            games = e.games + EXCLUDED.games,
+            best_score = GREATEST(e.best_score, EXCLUDED.best_score),
+            updated_at = EXCLUDED.updated_at
+    ), daily AS (
+        INSERT INTO score_daily_rollups AS d
+            (user_id, category, difficulty, day, games, total_score, best_score, total_correct, total_errors,
+             total_time_seconds, last_played_at)
+        SELECT i.user_id, COALESCE(i.category, ''), COALESCE(i.difficulty, ''), (i.date AT TIME ZONE 'UTC')::date,
+               count(*), COALESCE(sum(i.score), 0), COALESCE(max(i.score), 0), COALESCE(sum(i."correctCount"), 0),
+               COALESCE(sum(i."errorCount"), 0), COALESCE(sum(i."avgTime" * (i."correctCount" + i."errorCount")), 0),
+               max(i.date)
+        FROM inserted i
+        WHERE i.user_id IS NOT NULL
+        GROUP BY 1, 2, 3, 4
+        ORDER BY 1, 2, 3, 4
+        ON CONFLICT (user_id, category, difficulty, day) DO UPDATE SET
+            games = d.games + EXCLUDED.games,
+            total_score = d.total_score + EXCLUDED.total_score,
+            best_score = GREATEST(d.best_score, EXCLUDED.best_score),
+            total_correct = d.total_correct + EXCLUDED.total_correct,
+            total_errors = d.total_errors + EXCLUDED.total_errors,
+            total_time_seconds = d.total_time_seconds + EXCLUDED.total_time_seconds,
+            last_played_at = GREATEST(d.last_played_at, EXCLUDED.last_played_at)
+    )
+    SELECT COALESCE(ins.id, c.score_id, k.score_id), i.idempotency_key, ins.id IS NULL
+    FROM input i
+    LEFT JOIN inserted ins ON ins.id = i.id
+    LEFT JOIN claimed c ON c.user_id = i.user_id AND c.idempotency_key = i.idempotency_key
+    LEFT JOIN score_idempotency_keys k ON k.user_id = i.user_id AND k.idempotency_key = i.idempotency_key
+    ORDER BY i.ord;
+$$;
+
+-- GET /leaderboard/rankings/me: rank of one user inside a board and period.
+-- Ties on total_score are broken by user_id, the same order the ranking pages
+-- use. The count is a range scan of leaderboard_entries_rank_idx (index-only
+-- once autovacuum has marked the pages visible): one B-tree descent plus the
+-- entries ahead of the user, never the scores table.
+CREATE OR REPLACE FUNCTION leaderboard_rank(p_board TEXT, p_period TEXT, p_period_start DATE, p_user_id UUID)
+RETURNS TABLE (rank BIGINT, total_score BIGINT, games INTEGER, best_score INTEGER)
+LANGUAGE sql STABLE
+AS $$
+    SELECT (
+               SELECT count(*) + 1
+               FROM leaderboard_entries o
+               WHERE o.board = e.board AND o.period = e.period AND o.period_start = e.period_start
+                 AND (o.total_score, o.user_id) > (e.total_score, e.user_id)
+           ),
+           e.total_score, e.games, e.best_score
+    FROM leaderboard_entries e
+    WHERE e.board = p_board AND e.period = p_period AND e.period_start = p_period_start
+      AND e.user_id = p_user_id;
+$$;
+
+-- Full recompute of leaderboard_entries (admin command) from the daily
+-- rollups plus the archived months, never from the raw scores. All-time rows
+-- cover every game; day/week rows only the last p_recent_days, which also
+-- drops the finished periods record_score() keeps accumulating. Readers keep
+-- seeing the previous rankings until the rebuild commits; saves wait for it.
+-- After deleting scores outside the API, run rebuild_score_daily_rollups()
+-- for those days first.
+CREATE OR REPLACE FUNCTION rebuild_leaderboard(p_recent_days INTEGER DEFAULT 14)
+RETURNS BIGINT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    rebuilt BIGINT;
+BEGIN
+    LOCK TABLE leaderboard_entries IN EXCLUSIVE MODE;
+    DELETE FROM leaderboard_entries;
+
+    INSERT INTO leaderboard_entries (board, period, period_start, user_id, total_score, games, best_score)
+    SELECT g.board, g.period, g.period_start, g.user_id, sum(g.total_score), sum(g.games), max(g.best_score)
+    FROM (
+        SELECT k.board, k.period, k.period_start, r.user_id, r.total_score, r.games, r.best_score
+        FROM score_daily_rollups r
+        CROSS JOIN LATERAL leaderboard_slots(NULLIF(r.category, ''), NULLIF(r.difficulty, ''),
+                                             r.day::timestamp AT TIME ZONE 'UTC') AS k
+        WHERE k.period = 'all'
+           OR r.day >= date_trunc('week', (NOW() AT TIME ZONE 'UTC') - make_interval(days => p_recent_days))::date
+        UNION ALL
+        -- Archived months (retention) only count towards the all-time rankings
+        SELECT k.board, k.period, k.period_start, m.user_id, m.total_score, m.games, m.best_score
+        FROM score_monthly_summaries m
+        CROSS JOIN LATERAL leaderboard_slots(m.category, m.difficulty, m.month) AS k
+        WHERE k.period = 'all'
+    ) AS g
+    GROUP BY g.board, g.period, g.period_start, g.user_id;
+
+    GET DIAGNOSTICS rebuilt = ROW_COUNT;
+    RETURN rebuilt;
+END;
+$$;
+
+-- Progress of maintenance jobs that walk a table in batches, so they resume
+-- where they stopped. Advanced in the same transaction as each batch.
+CREATE TABLE IF NOT EXISTS maintenance_checkpoints (
+    job TEXT PRIMARY KEY,
+    last_id UUID,
+    processed BIGINT NOT NULL DEFAULT 0,
+    written BIGINT NOT NULL DEFAULT 0,
+    done BOOLEAN NOT NULL DEFAULT FALSE,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Backfill user_category_progress from the scores history, one batch of users
+-- (in id order) per call, resuming after the 'progress_backfill' checkpoint.
+-- Totals are recomputed from scratch (games still in scores plus the archived
+-- score_monthly_summaries) and written with one bulk upsert;
+-- unlocked_level never goes down (it can also be raised by PATCH
+-- /users/me/progress/level). unlocked_level = 1 + the hardest difficulty
+-- passed with score >= 60, 0 when none.
+CREATE OR REPLACE FUNCTION backfill_progress(p_batch_size INTEGER DEFAULT 200, p_restart BOOLEAN DEFAULT FALSE)
+RETURNS TABLE (last_id UUID, users_processed INTEGER, rows_written INTEGER, done BOOLEAN)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_after UUID;
+    v_batch UUID[];
+    v_last UUID;
+    v_users INTEGER;
+    v_rows INTEGER;
+BEGIN
+    INSERT INTO maintenance_checkpoints (job) VALUES ('progress_backfill') ON CONFLICT (job) DO NOTHING;
+    IF p_restart THEN
+        UPDATE maintenance_checkpoints c
+        SET last_id = NULL, processed = 0, written = 0, done = FALSE, updated_at = NOW()
+        WHERE c.job = 'progress_backfill';
+    END IF;
+    -- Row lock: two runners never process the same batch
+    SELECT c.last_id INTO v_after FROM maintenance_checkpoints c WHERE c.job = 'progress_backfill' FOR UPDATE;
+
+    -- record_score() increments these totals. Holding this lock until commit
+    -- makes concurrent saves either finish before the recount (and be counted)
+    -- or wait and increment after it: no game is lost or counted twice.
+    -- Readers are not blocked; saves wait for one batch at most.
+    LOCK TABLE user_category_progress IN SHARE ROW EXCLUSIVE MODE;
+
+    SELECT array_agg(u.id ORDER BY u.id) INTO v_batch
+    FROM (
+        SELECT u.id FROM users u
+        WHERE v_after IS NULL OR u.id > v_after
+        ORDER BY u.id
+        LIMIT p_batch_size
+    ) AS u;
+    v_users := COALESCE(cardinality(v_batch), 0);
+    v_last := v_batch[v_users];
+
+    INSERT INTO user_category_progress AS p
+        (user_id, category, unlocked_level, total_games, total_score, total_correct, total_errors,
+         total_time_seconds, last_played_at, updated_at)
+    SELECT g.user_id, g.category,
+           COALESCE(max(array_position(ARRAY['easy', 'easy_medium', 'medium', 'medium_hard', 'hard'], g.difficulty))
+                    FILTER (WHERE g.best_score >= 60), 0),
+           sum(g.games), sum(g.total_score), sum(g.total_correct), sum(g.total_errors),
+           sum(g.total_time_seconds), max(g.last_played_at), NOW()
+    FROM (
+        SELECT s.user_id, s.category, s.difficulty, 1 AS games, s.score AS total_score, s.score AS best_score,
+               s."correctCount" AS total_correct, s."errorCount" AS total_errors,
+               s."avgTime" * (s."correctCount" + s."errorCount") AS total_time_seconds, s.date AS last_played_at
+        FROM scores s
+        WHERE s.user_id = ANY (v_batch)
+        UNION ALL
+        SELECT m.user_id, m.category, m.difficulty, m.games, m.total_score, m.best_score,
+               m.total_correct, m.total_errors, m.total_time_seconds, m.last_played_at
+        FROM score_monthly_summaries m
+        WHERE m.user_id = ANY (v_batch)
+    ) AS g
+    WHERE g.category IS NOT NULL
+    GROUP BY g.user_id, g.category
+    ON CONFLICT (user_id, category) DO UPDATE SET
+        unlocked_level = GREATEST(p.unlocked_level, EXCLUDED.unlocked_level),
+        total_games = EXCLUDED.total_games,
+        total_score = EXCLUDED.total_score,
+        total_correct = EXCLUDED.total_correct,
+        total_errors = EXCLUDED.total_errors,
+        total_time_seconds = EXCLUDED.total_time_seconds,
+        last_played_at = EXCLUDED.last_played_at,
+        updated_at = EXCLUDED.updated_at;
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+
+    UPDATE maintenance_checkpoints c SET
+        last_id = COALESCE(v_last, c.last_id),
+        processed = c.processed + v_users,
+        written = c.written + v_rows,
+        done = v_users < p_batch_size,
+        updated_at = NOW()
+    WHERE c.job = 'progress_backfill';
+
+    RETURN QUERY SELECT v_last, v_users, v_rows, v_users < p_batch_size;
+END;
+$$;
+
+-- Per-user monthly totals of the scores partitions removed by
+-- archive_score_partition(). rebuild_leaderboard() and backfill_progress()
+-- add them to the games still in scores, so all-time rankings and category
+-- progress survive the retention policy. Games without user_id are not kept.
+CREATE TABLE IF NOT EXISTS score_monthly_summaries (
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    month DATE NOT NULL,
+    category TEXT,
+    difficulty TEXT,
+    games INTEGER NOT NULL,
+    total_score BIGINT NOT NULL,
+    best_score INTEGER NOT NULL,
+    total_correct BIGINT NOT NULL,
+    total_errors BIGINT NOT NULL,
+    total_time_seconds FLOAT NOT NULL,
+    last_played_at TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS score_monthly_summaries_user_idx
+    ON score_monthly_summaries (user_id, month);
+
+-- Create the monthly partitions of scores from p_from (default: this month)
+-- up to p_months_ahead months from now. Games of a new month that were saved
+-- before its partition existed are moved out of scores_default. Safe to run
+-- concurrently from every API worker; returns the number of partitions created.
+CREATE OR REPLACE FUNCTION ensure_score_partitions(p_months_ahead INTEGER DEFAULT 3, p_from DATE DEFAULT NULL)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_month DATE := date_trunc('month', COALESCE(p_from, (NOW() AT TIME ZONE 'UTC')::date))::date;
+    v_last DATE := (date_trunc('month', NOW() AT TIME ZONE 'UTC') + make_interval(months => p_months_ahead))::date;
+    v_start TIMESTAMPTZ;
+    v_end TIMESTAMPTZ;
+    v_name TEXT;
+    v_created INTEGER := 0;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('score_partitions'));
+    WHILE v_month <= v_last LOOP
+        v_name := 'scores_p' || to_char(v_month, 'YYYY_MM');
+        IF to_regclass(v_name) IS NULL THEN
+            v_start := v_month::timestamp AT TIME ZONE 'UTC';
+            v_end := (v_month + INTERVAL '1 month')::timestamp AT TIME ZONE 'UTC';
+            -- Filled and attached as a plain table: ATTACH only takes a SHARE
+            -- UPDATE EXCLUSIVE lock on scores, reads and saves keep going
+            EXECUTE format('CREATE TABLE %I (LIKE scores INCLUDING DEFAULTS)', v_name);
+            EXECUTE format(
+                'WITH moved AS (DELETE FROM scores_default WHERE date >= %L AND date < %L RETURNING *) '
+                'INSERT INTO %I SELECT * FROM moved',
+                v_start, v_end, v_name
+            );
+            EXECUTE format('ALTER TABLE scores ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', v_name, v_start, v_end);
+            EXECUTE format('ALTER TABLE %I ENABLE ROW LEVEL SECURITY', v_name);
+            v_created := v_created + 1;
+        END IF;
+        v_month := (v_month + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN v_created;
+END;
+$$;
+
+-- Retention: summarise the OLDEST monthly partition that ends before the last
+-- p_keep_months full months into score_monthly_summaries, then detach it
+-- (kept as a standalone table to dump, or dropped with p_drop). One partition
+-- per call, so the exclusive lock DETACH takes on scores is held for one short
+-- transaction; call it until it returns no row. Re-running on a month already
+-- summarised replaces its summaries.
+CREATE OR REPLACE FUNCTION archive_score_partition(p_keep_months INTEGER, p_drop BOOLEAN DEFAULT FALSE)
+RETURNS TABLE (partition_name TEXT, games BIGINT, summaries INTEGER)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_cutoff DATE := (date_trunc('month', NOW() AT TIME ZONE 'UTC') - make_interval(months => p_keep_months))::date;
+    v_name TEXT;
+    v_month DATE;
+BEGIN
+    IF p_keep_months < 1 THEN
+        RAISE EXCEPTION 'p_keep_months must be at least 1';
+    END IF;
+    PERFORM pg_advisory_xact_lock(hashtext('score_partitions'));
+
+    SELECT c.relname INTO v_name
+    FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'scores'::regclass AND c.relname ~ '^scores_p\d{4}_\d{2}$'
+    ORDER BY c.relname
+    LIMIT 1;
+    v_month := to_date(substr(v_name, 9), 'YYYY_MM');
+    IF v_name IS NULL OR v_month >= v_cutoff THEN
+        RETURN;
+    END IF;
+
+    -- No game can land in the month between the summary and the detach
+    EXECUTE format('LOCK TABLE %I IN SHARE MODE', v_name);
+    DELETE FROM score_monthly_summaries m WHERE m.month = v_month;
+    EXECUTE format(
+        'INSERT INTO score_monthly_summaries (user_id, month, category, difficulty, games, total_score, best_score, '
+        'total_correct, total_errors, total_time_seconds, last_played_at) '
+        'SELECT s.user_id, %L, s.category, s.difficulty, count(*), sum(s.score), max(s.score), sum(s."correctCount"), '
+        'sum(s."errorCount"), sum(s."avgTime" * (s."correctCount" + s."errorCount")), max(s.date) '
+        'FROM %I s WHERE s.user_id IS NOT NULL GROUP BY s.user_id, s.category, s.difficulty',
+        v_month, v_name
+    );
+    GET DIAGNOSTICS summaries = ROW_COUNT;
+    SELECT COALESCE(sum(m.games), 0) INTO games FROM score_monthly_summaries m WHERE m.month = v_month;
+    -- The summaries now hold the month: keep its games counted once
+    DELETE FROM score_daily_rollups r
+    WHERE r.day >= v_month AND r.day < (v_month + INTERVAL '1 month')::date;
+
+    EXECUTE format('ALTER TABLE scores DETACH PARTITION %I', v_name);
+    IF p_drop THEN
+        EXECUTE format('DROP TABLE %I', v_name);
+    END IF;
+    partition_name := v_name;
+    RETURN NEXT;
+END;
+$$;
+
+-- Recompute score_daily_rollups for the UTC days p_from..p_to (inclusive) from
+-- scores, for every user or only p_user_id. Each call is one transaction and
+-- blocks the saves it could race with until it commits: the whole scores
+-- table (SHARE lock) for a range of every user, that user's games (their
+-- users row, which saving a game KEY SHARE-locks for the foreign key) for one
+-- user. The new totals then include every game committed before, and every
+-- later game is added on top. Returns the rollup rows written.
+CREATE OR REPLACE FUNCTION rebuild_score_daily_rollups(p_from DATE, p_to DATE, p_user_id UUID DEFAULT NULL)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    written INTEGER;
+BEGIN
+    IF p_user_id IS NULL THEN
+        LOCK TABLE scores IN SHARE MODE;
+    ELSE
+        PERFORM 1 FROM users u WHERE u.id = p_user_id FOR UPDATE;
+    END IF;
+
+    DELETE FROM score_daily_rollups r
+    WHERE r.day BETWEEN p_from AND p_to
+      AND (p_user_id IS NULL OR r.user_id = p_user_id);
+
+    INSERT INTO score_daily_rollups
+        (user_id, category, difficulty, day, games, total_score, best_score, total_correct, total_errors,
+         total_time_seconds, last_played_at)
+    SELECT s.user_id, COALESCE(s.category, ''), COALESCE(s.difficulty, ''), (s.date AT TIME ZONE 'UTC')::date,
+           count(*), COALESCE(sum(s.score), 0), COALESCE(max(s.score), 0), COALESCE(sum(s."correctCount"), 0),
+           COALESCE(sum(s."errorCount"), 0), COALESCE(sum(s."avgTime" * (s."correctCount" + s."errorCount")), 0),
+           max(s.date)
+    FROM scores s
+    WHERE s.user_id IS NOT NULL
+      AND (p_user_id IS NULL OR s.user_id = p_user_id)
+      AND s.date >= p_from::timestamp AT TIME ZONE 'UTC'
+      AND s.date < (p_to + 1)::timestamp AT TIME ZONE 'UTC'
+    GROUP BY 1, 2, 3, 4;
+
+    GET DIAGNOSTICS written = ROW_COUNT;
+    RETURN written;
+END;
+$$;
+
+-- DELETE /scores and DELETE /scores/{id}: delete one user's games (all of
+-- them, or only p_score_id) and take them out of what record_score() added
+-- them to, in one transaction. The rollups of the days they were played are
+-- recomputed (the whole history takes the user's rollups and archived months
+-- with it), then the user's rankings of the slots they counted towards are
+-- recounted from those rollups plus the archived months, as
+-- rebuild_leaderboard() does: best_score cannot be decremented. So are the
+-- totals of their categories in user_category_progress; unlocked_level
+-- stays, a level once unlocked is never locked again. The users row is
+-- locked first, so the user's saves wait instead of racing with the
+-- recount. Returns the games deleted (0 if p_score_id is not theirs).
+CREATE OR REPLACE FUNCTION delete_user_scores(p_user_id UUID, p_score_id UUID DEFAULT NULL)
+RETURNS BIGINT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    deleted BIGINT;
+    v_days DATE[];
+    v_weeks DATE[];
+    v_categories TEXT[];
+BEGIN
+    PERFORM 1 FROM users u WHERE u.id = p_user_id FOR UPDATE;
+
+    WITH gone AS (
+        DELETE FROM scores s
+        WHERE s.user_id = p_user_id AND (p_score_id IS NULL OR s.id = p_score_id)
+        RETURNING (s.date AT TIME ZONE 'UTC')::date AS day, s.category
+    )
+    SELECT count(*), array_agg(DISTINCT g.day), array_agg(DISTINCT date_trunc('week', g.day)::date),
+           array_agg(DISTINCT g.category)
+    INTO deleted, v_days, v_weeks, v_categories
+    FROM gone g;
+    IF deleted = 0 THEN
+        RETURN 0;
+    END IF;
+
+    IF p_score_id IS NULL THEN
+        DELETE FROM score_daily_rollups r WHERE r.user_id = p_user_id;
+        DELETE FROM score_monthly_summaries m WHERE m.user_id = p_user_id;
+    ELSE
+        PERFORM rebuild_score_daily_rollups(v_days[1], v_days[1], p_user_id);
+    END IF;
+
+    DELETE FROM leaderboard_entries e
+    WHERE e.user_id = p_user_id
+      AND (e.period = 'all'
+           OR (e.period = 'week' AND e.period_start = ANY (v_weeks))
+           OR (e.period = 'day' AND e.period_start = ANY (v_days)));
+
+    INSERT INTO leaderboard_entries (board, period, period_start, user_id, total_score, games, best_score)
+    SELECT g.board, g.period, g.period_start, p_user_id, sum(g.total_score), sum(g.games), max(g.best_score)
+    FROM (
+        SELECT k.board, k.period, k.period_start, r.total_score, r.games, r.best_score
+        FROM score_daily_rollups r
+        CROSS JOIN LATERAL leaderboard_slots(NULLIF(r.category, ''), NULLIF(r.difficulty, ''),
+                                             r.day::timestamp AT TIME ZONE 'UTC') AS k
+        WHERE r.user_id = p_user_id
+          AND (k.period = 'all'
+               OR (k.period = 'week' AND k.period_start = ANY (v_weeks))
+               OR (k.period = 'day' AND k.period_start = ANY (v_days)))
+        UNION ALL
+        SELECT k.board, k.period, k.period_start, m.total_score, m.games, m.best_score
+        FROM score_monthly_summaries m
+        CROSS JOIN LATERAL leaderboard_slots(m.category, m.difficulty, m.month) AS k
+        WHERE m.user_id = p_user_id AND k.period = 'all'
+    ) AS g
+    GROUP BY g.board, g.period, g.period_start;
+
+    UPDATE user_category_progress p SET
+        (total_games, total_score, total_correct, total_errors, total_time_seconds, last_played_at, updated_at) = (
+            SELECT COALESCE(sum(g.games), 0), COALESCE(sum(g.total_score), 0), COALESCE(sum(g.total_correct), 0),
+                   COALESCE(sum(g.total_errors), 0), COALESCE(sum(g.total_time_seconds), 0), max(g.last_played_at),
+                   NOW()
+            FROM (
+                SELECT r.games, r.total_score, r.total_correct, r.total_errors, r.total_time_seconds, r.last_played_at
+                FROM score_daily_rollups r
+                WHERE r.user_id = p.user_id AND r.category = p.category
+                UNION ALL
+                SELECT m.games, m.total_score, m.total_correct, m.total_errors, m.total_time_seconds, m.last_played_at
+                FROM score_monthly_summaries m
+                WHERE m.user_id = p.user_id AND m.category = p.category
+            ) AS g
+        )
+    WHERE p.user_id = p_user_id AND (p_score_id IS NULL OR p.category = ANY (v_categories));
+
+    RETURN deleted;
+END;
+$$;
+
+-- Consistency check: every (user, category, difficulty, day) of p_from..p_to
+-- whose rollup differs from the totals recomputed from scores, missing rows
+-- included (expected or actual games 0). One snapshot for both sides, so
+-- saves running meanwhile cannot show up as differences. At most p_limit rows.
+CREATE OR REPLACE FUNCTION check_score_daily_rollups(p_from DATE, p_to DATE, p_limit INTEGER DEFAULT 100)
+RETURNS TABLE (user_id UUID, category TEXT, difficulty TEXT, day DATE, expected_games BIGINT, actual_games BIGINT,
+               expected_score BIGINT, actual_score BIGINT)
+LANGUAGE sql
+STABLE
+AS $$
+    WITH expected AS (
+        SELECT s.user_id, COALESCE(s.category, '') AS category, COALESCE(s.difficulty, '') AS difficulty,
+               (s.date AT TIME ZONE 'UTC')::date AS day, count(*) AS games, COALESCE(sum(s.score), 0) AS total_score,
+               COALESCE(max(s.score), 0) AS best_score, COALESCE(sum(s."correctCount"), 0) AS total_correct,
+               COALESCE(sum(s."errorCount"), 0) AS total_errors,
+               COALESCE(sum(s."avgTime" * (s."correctCount" + s."errorCount")), 0) AS total_time_seconds
+        FROM scores s
+        WHERE s.user_id IS NOT NULL
+          AND s.date >= p_from::timestamp AT TIME ZONE 'UTC'
+          AND s.date < (p_to + 1)::timestamp AT TIME ZONE 'UTC'
+        GROUP BY 1, 2, 3, 4
+    ), actual AS (
+        SELECT r.* FROM score_daily_rollups r WHERE r.day BETWEEN p_from AND p_to
+    )
+    SELECT COALESCE(e.user_id, a.user_id), COALESCE(e.category, a.category), COALESCE(e.difficulty, a.difficulty),
+           COALESCE(e.day, a.day), COALESCE(e.games, 0), COALESCE(a.games, 0),
+           COALESCE(e.total_score, 0), COALESCE(a.total_score, 0)
+    FROM expected e
+    FULL JOIN actual a
+      ON a.user_id = e.user_id AND a.category = e.category AND a.difficulty = e.difficulty AND a.day = e.day
+    WHERE e.games IS DISTINCT FROM a.games
+       OR e.total_score IS DISTINCT FROM a.total_score
+       OR e.best_score IS DISTINCT FROM a.best_score
+       OR e.total_correct IS DISTINCT FROM a.total_correct
+       OR e.total_errors IS DISTINCT FROM a.total_errors
+       OR abs(e.total_time_seconds - a.total_time_seconds) > 0.001
+    ORDER BY 4, 1, 2, 3
+    LIMIT p_limit;
+$$;
+
+-- GET /users/{id}/analytics: what the progress screen and the admin panel
+-- show for one user, aggregated here instead of downloading every game. The
+-- result has a fixed shape whatever the number of games: totals, one entry
+-- per category and per difficulty (one GROUPING SETS pass), the daily trend of
+-- the last p_trend_days days, play streaks (gaps and islands over the days
+-- played) and the latest p_recent games of each category. Everything but the
+-- latest games comes from the daily rollups plus the archived months
+-- (score_monthly_summaries); trend and streaks only see the days in rollups.
+-- The latest games of a category are only looked for from the day the rollups
+-- reach p_recent games back, so only those months' partitions are read.
+-- The user's rollup rows are read once, not once per CTE that needs them.
+-- PL/pgSQL rather than SQL: the statement's plan is cached per connection
+-- instead of being planned again, over every partition, on each call.
+CREATE OR REPLACE FUNCTION user_analytics(p_user_id UUID, p_trend_days INTEGER DEFAULT 30, p_recent INTEGER DEFAULT 10)
+RETURNS JSONB
+LANGUAGE plpgsql
+STABLE
+AS $$
+BEGIN
+    RETURN (
+    WITH rollups AS MATERIALIZED (
+        -- Read once, from score_daily_rollups_user_idx alone (index-only scan)
+        SELECT r.category, r.difficulty, r.day, r.games, r.total_score, r.best_score, r.total_correct,
+               r.total_errors, r.total_time_seconds, r.last_played_at
+        FROM score_daily_rollups r
+        WHERE r.user_id = p_user_id
+    ), games AS (
+        SELECT NULLIF(r.category, '') AS category, NULLIF(r.difficulty, '') AS difficulty, r.games, r.total_score,
+               r.best_score, r.total_correct AS correct, r.total_errors AS errors,
+               r.total_time_seconds AS time_seconds, r.last_played_at
+        FROM rollups r
+        UNION ALL
+        SELECT m.category, m.difficulty, m.games, m.total_score, m.best_score, m.total_correct, m.total_errors,
+               m.total_time_seconds, m.last_played_at
+        FROM score_monthly_summaries m
+        WHERE m.user_id = p_user_id
+    ), breakdown AS (
+        -- level 1: per category, 2: per difficulty, 3: totals
+        SELECT g.category, g.difficulty, GROUPING(g.category, g.difficulty) AS level,
+               jsonb_build_object(
+                   'games', COALESCE(sum(g.games), 0),
+                   'avg_score', round(sum(g.total_score)::numeric / NULLIF(sum(g.games), 0)),
+                   'best_score', max(g.best_score),
+                   'correct', COALESCE(sum(g.correct), 0),
+                   'errors', COALESCE(sum(g.errors), 0),
+                   'accuracy', round(100.0 * sum(g.correct) / NULLIF(sum(g.correct) + sum(g.errors), 0)),
+                   'avg_time_per_question',
+                       round((sum(g.time_seconds) / NULLIF(sum(g.correct) + sum(g.errors), 0))::numeric, 2),
+                   'last_played_at', max(g.last_played_at)
+               ) AS stats
+        FROM games g
+        GROUP BY GROUPING SETS ((g.category), (g.difficulty), ())
+    ), daily AS (
+        SELECT r.day, sum(r.games) AS games, sum(r.total_score) AS total_score,
+               sum(r.total_correct) AS correct, sum(r.total_errors) AS errors
+        FROM rollups r
+        GROUP BY r.day
+    ), streaks AS (
+        -- Consecutive days share the same day - row_number()
+        SELECT max(i.day) AS last_day, count(*) AS length
+        FROM (SELECT d.day, d.day - ROW_NUMBER() OVER (ORDER BY d.day)::integer AS island FROM daily d) i
+        GROUP BY i.island
+    ), trend AS (
+        SELECT d.day, d.games, round(d.total_score::numeric / d.games) AS avg_score,
+               round(100.0 * d.correct / NULLIF(d.correct + d.errors, 0)) AS accuracy
+        FROM daily d
+        WHERE d.day > (NOW() AT TIME ZONE 'UTC')::date - p_trend_days
+    ), recent_since AS (
+        -- Per category, the latest day with p_recent games on or after it (NULL: fewer in the rollups)
+        SELECT NULLIF(d.category, '') AS category, max(d.day) FILTER (WHERE d.games_since >= p_recent) AS day
+        FROM (
+            SELECT r.category, r.day, sum(r.games) OVER (PARTITION BY r.category ORDER BY r.day DESC) AS games_since
+            FROM rollups r
+        ) d
+        GROUP BY d.category
+    ), recent AS (
+        SELECT r.*
+        FROM breakdown c
+        LEFT JOIN recent_since rs ON rs.category IS NOT DISTINCT FROM c.category
+        CROSS JOIN LATERAL (
+            SELECT s.id, s.category, s.difficulty, s.score, s."correctCount", s."errorCount", s."avgTime", s.date
+            FROM scores s
+            WHERE s.user_id = p_user_id AND s.category IS NOT DISTINCT FROM c.category
+              AND s.date >= COALESCE(rs.day::timestamp AT TIME ZONE 'UTC', '-infinity')
+            ORDER BY s.date DESC, s.id DESC
+            LIMIT p_recent
+        ) r
+        WHERE c.level = 1
+    )
+    SELECT jsonb_build_object(
+        'totals', (SELECT b.stats FROM breakdown b WHERE b.level = 3),
+        'by_category', COALESCE((
+            SELECT jsonb_agg(b.stats || jsonb_build_object('key', COALESCE(b.category, 'unknown')) ORDER BY b.category)
+            FROM breakdown b WHERE b.level = 1), '[]'::jsonb),
+        'by_difficulty', COALESCE((
+            SELECT jsonb_agg(b.stats || jsonb_build_object('key', COALESCE(b.difficulty, 'unknown')) ORDER BY b.difficulty)
+            FROM breakdown b WHERE b.level = 2), '[]'::jsonb),
+        'trend', COALESCE((
+            SELECT jsonb_agg(jsonb_build_object('day', t.day, 'games', t.games, 'avg_score', t.avg_score, 'accuracy', t.accuracy)
+                             ORDER BY t.day)
+            FROM trend t), '[]'::jsonb),
+        'streaks', jsonb_build_object(
+            -- Still current if the last day played is today or yesterday (UTC)
+            'current', COALESCE((SELECT s.length FROM streaks s
+                                 WHERE s.last_day >= (NOW() AT TIME ZONE 'UTC')::date - 1), 0),
+            'best', COALESCE((SELECT max(s.length) FROM streaks s), 0),
+            'days_played', (SELECT count(*) FROM daily)
+        ),
+        'recent_games', COALESCE((SELECT jsonb_agg(to_jsonb(r) ORDER BY r.date DESC, r.id DESC) FROM recent r), '[]'::jsonb)
+    ));
+END;
+$$;
+
+-- GET /admin/stats: activity of every user over the last p_days UTC days (today
+-- included), from the daily rollups: games, active users and average score,
+-- per day and per category. Fixed size: p_days rows plus one per category.
+CREATE OR REPLACE FUNCTION score_activity(p_days INTEGER DEFAULT 30)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+    WITH recent AS (
+        SELECT r.*
+        FROM score_daily_rollups r
+        WHERE r.day > (NOW() AT TIME ZONE 'UTC')::date - p_days
+    )
+    SELECT jsonb_build_object(
+        'days', p_days,
+        'games', (SELECT COALESCE(sum(r.games), 0) FROM recent r),
+        'active_users', (SELECT count(DISTINCT r.user_id) FROM recent r),
+        'by_day', COALESCE((
+            SELECT jsonb_agg(jsonb_build_object('day', d.day, 'games', d.games, 'active_users', d.active_users)
+                             ORDER BY d.day)
+            FROM (SELECT r.day, sum(r.games) AS games, count(DISTINCT r.user_id) AS active_users
+                  FROM recent r GROUP BY r.day) d), '[]'::jsonb),
+        'by_category', COALESCE((
+            SELECT jsonb_agg(jsonb_build_object(
+                       'key', COALESCE(NULLIF(c.category, ''), 'unknown'), 'games', c.games,
+                       'active_users', c.active_users, 'avg_score', round(c.total_score::numeric / c.games))
+                   ORDER BY c.category)
+            FROM (SELECT r.category, sum(r.games) AS games, count(DISTINCT r.user_id) AS active_users,
+                         sum(r.total_score) AS total_score
+                  FROM recent r GROUP BY r.category) c), '[]'::jsonb)
+    );
+$$;
+
 -- Enable Row Level Security (RLS) if needed, but for now we leave it open or public for the API key to access.
 -- Ideally, you should enable RLS and add policies.
 ALTER TABLE users ENABLE ROW LEVEL SECURITY;
 ALTER TABLE scores ENABLE ROW LEVEL SECURITY;
+ALTER TABLE user_category_progress ENABLE ROW LEVEL SECURITY;
+ALTER TABLE leaderboard_entries ENABLE ROW LEVEL SECURITY;
+ALTER TABLE maintenance_checkpoints ENABLE ROW LEVEL SECURITY;
+ALTER TABLE score_monthly_summaries ENABLE ROW LEVEL SECURITY;
+ALTER TABLE scores_default ENABLE ROW LEVEL SECURITY;
+ALTER TABLE score_idempotency_keys ENABLE ROW LEVEL SECURITY;
+ALTER TABLE score_daily_rollups ENABLE ROW LEVEL SECURITY;
+
+-- This month and the next 3 (the API creates the following ones as time passes)
+SELECT ensure_score_partitions();
 
 -- Allow public access (Anon key) for now since we are managing auth via our own backend endpoints or just direct client usage
 -- Actually, since backend uses Service Key or Anon Key, it will work. 
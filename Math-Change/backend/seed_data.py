@@ -2,7 +2,7 @@
 import os
 import uuid
 import random
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 from supabase import create_client
 
@@ -118,7 +118,7 @@ def generate_score(user, date_offset_days):
     date = (datetime.now() - timedelta(days=date_offset_days)).isoformat()
 
     return {
-        # "user_id": user["id"], # Removed as column does not exist
+        "user_id": user["id"],
         "user": user["username"], 
         "score": base_score,
         "correctCount": correct,
@@ -156,4 +156,13 @@ def seed_scores(users):
 if __name__ == "__main__":
     users = create_users()
     seed_scores(users)
+    # Scores were inserted directly, not through record_score(): rebuild the
+    # daily rollups, refresh the rankings (read from them) and recompute the
+    # category progress (one batch covers the seed users)
+    today = datetime.now(timezone.utc).date()
+    supabase.rpc("rebuild_score_daily_rollups", {
+        "p_from": (today - timedelta(days=32)).isoformat(), "p_to": (today + timedelta(days=1)).isoformat()
+    }).execute()
+    supabase.rpc("rebuild_leaderboard", {"p_recent_days": 31}).execute()
+    supabase.rpc("backfill_progress", {"p_batch_size": 1000, "p_restart": True}).execute()
     print("Seeding complete!")
@@ -0,0 +1,78 @@
+import logging
+import os
+import sys
+import tempfile
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import uvicorn  # noqa: E402
+
+# Production server: WEB_CONCURRENCY uvicorn worker processes sharing the port.
+# Each worker runs the lifespan of app/main.py (warm-up of Supabase, S3 and the
+# Google keys before its first request) and has its own pools and caches.
+# Several workers need CACHE_URL=redis://...: with memory, an invalidation
+# (role change, new game) only reaches the worker that made it, and the others
+# would serve stale identities and responses until their TTL. So the default
+# is one worker per CPU with a shared cache, one worker without it, and
+# WEB_CONCURRENCY > 1 with CACHE_URL=memory refuses to start.
+#
+# On SIGTERM each worker answers 503 on /health/ready for SHUTDOWN_DELAY
+# seconds, stops accepting connections and gives in-flight requests
+# GRACEFUL_TIMEOUT seconds to finish before the shutdown (score buffer flush,
+# clients closed). Keep SHUTDOWN_DELAY + GRACEFUL_TIMEOUT below the
+# orchestrator's kill timeout (docker stop: 10s, Kubernetes: 30s).
+#
+# Usage: python serve.py   (WEB_CONCURRENCY=4 PORT=8000 python serve.py)
+
+logger = logging.getLogger(__name__)
+
+
+def cpu_count() -> int:
+    # CPUs this container may run on, not those of the host
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def main() -> None:
+    cpus = cpu_count()
+    shared_cache = os.environ.get("CACHE_URL", "memory") not in ("", "memory")
+    workers = int(os.environ.get("WEB_CONCURRENCY") or (cpus if shared_cache else 1))
+    if workers > 1 and not shared_cache:
+        sys.exit(f"WEB_CONCURRENCY={workers} needs a cache shared by the workers: set CACHE_URL=redis://...")
+    # Every worker starts its own Pillow process pool: split the cores between
+    # them instead of starting workers x cores image processes
+    os.environ.setdefault("IMAGE_WORKERS", str(max(cpus // workers, 1)))
+    if workers > 1 and not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        # Workers write their metrics there so /metrics adds them up (app/metrics.py);
+        # a fresh directory, samples of a previous run must not be counted
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="prometheus-")
+    # Imported once PROMETHEUS_MULTIPROC_DIR is set: app.logs loads app.metrics
+    from app.logs import setup_logging, shutdown_logging
+
+    # Same format (LOG_FORMAT) as the workers' records
+    setup_logging()
+    logger.info("Starting %d worker(s) on %d CPU(s)", workers, cpus)
+    uvicorn.run(
+        "app.main:app",
+        host=os.environ.get("HOST", "0.0.0.0"),
+        port=int(os.environ.get("PORT", "8000")),
+        workers=workers,
+        # uvloop and httptools (uvicorn[standard]); "auto" falls back to asyncio/h11
+        loop=os.environ.get("UVICORN_LOOP", "auto"),
+        http=os.environ.get("UVICORN_HTTP", "auto"),
+        timeout_graceful_shutdown=int(os.environ.get("GRACEFUL_TIMEOUT", "20")),
+        # Longer than the proxy's idle timeout, so it never reuses a connection we closed
+        timeout_keep_alive=int(os.environ.get("KEEP_ALIVE_TIMEOUT", "75")),
+        # Client IP and scheme from Traefik's X-Forwarded-* headers
+        proxy_headers=True,
+        forwarded_allow_ips=os.environ.get("FORWARDED_ALLOW_IPS", "*"),
+        log_level=os.environ.get("LOG_LEVEL", "info").lower(),
+    )
+    shutdown_logging()
+
+
+if __name__ == "__main__":
+    main()
@@ -25,12 +25,19 @@ DB_PORT = "6543" # Default pooler port, or 5432 for direct if allowed
 DIRECT_HOST = "db.ixbgoxinxmntqcyrkusx.supabase.co"
 DIRECT_PORT = "5432"
 
-def run_schema():
+# Full connection string, when set it takes precedence (e.g. a local Postgres)
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+def get_connection():
+    """Connect to the Supabase database: direct host first, then the pooler. None if both fail."""
+    if DATABASE_URL:
+        return psycopg2.connect(DATABASE_URL)
+
     print("Attempting to connect to Supabase Database...")
     
     try:
         # Try direct connection first (better for DDL)
-        conn = psycopg2.connect(
+        return psycopg2.connect(
             host=DIRECT_HOST,
             database=DB_NAME,
             user="postgres", # Direct connection often uses just 'postgres' with the password
@@ -41,7 +48,7 @@ def run_schema():
         print(f"Direct connection failed: {e}")
         print("Retrying with Pooler connection settings...")
         try:
-             conn = psycopg2.connect(
+             return psycopg2.connect(
                 host=DB_HOST,
                 database=DB_NAME,
                 user=DB_USER,
@@ -50,25 +57,26 @@ def run_schema():
             )
         except Exception as e2:
             print(f"Connection failed: {e2}")
-            return
+            return None
+
+def run_schema():
+    # Versioned migrations (migrate.py): only the ones this database has not
+    # applied yet run, indexes are built without blocking writes.
+    from migrate import migrate
+
+    conn = get_connection()
+    if conn is None:
+        return
+
+    print("Connected successfully. Applying migrations...")
 
-    print("Connected successfully. Applying schema...")
-    
     try:
-        cursor = conn.cursor()
-        
-        # Read schema file
-        with open("schema.sql", "r") as f:
-            schema_sql = f.read()
-            
-        cursor.execute(schema_sql)
-        conn.commit()
+        migrate(conn)
         print("Schema applied successfully!")
-        
-        cursor.close()
-        conn.close()
     except Exception as e:
         print(f"Error applying schema: {e}")
+    finally:
+        conn.close()
 
 if __name__ == "__main__":
     run_schema()
@@ -0,0 +1,140 @@
+"""
+Load test: blocking supabase client in `def` handlers vs the pooled async
+client (app/database.py) in `async def` handlers.
+
+A local stub PostgREST answers every call after a fixed delay, standing in for
+the network round-trip to Supabase. Both apps serve the same route
+(`users` lookup by id); the blocking one is capped by Starlette's threadpool
+(40 threads), the async one by the connection pool limits. Run it on a
+multi-core machine: the load generator shares the process with the app.
+
+Usage:
+    python tests/bench_async_db.py
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import time
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Route
+
+STUB_LATENCY = float(os.getenv("BENCH_STUB_LATENCY", "0.1"))
+CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", "200"))
+DURATION = float(os.getenv("BENCH_DURATION", "10"))
+
+
+async def stub_postgrest(request):
+    await asyncio.sleep(STUB_LATENCY)
+    body = json.dumps([{"id": "00000000-0000-0000-0000-000000000001", "username": "bench"}])
+    return Response(body, media_type="application/json")
+
+
+def serve_stub(port):
+    app = Starlette(routes=[Route("/rest/v1/{path:path}", stub_postgrest, methods=["GET", "POST", "PATCH", "DELETE"])])
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning", backlog=4096)
+
+
+def start_stub():
+    # Separate process so the stub does not compete for the GIL with the app under test
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    multiprocessing.Process(target=serve_stub, args=(port,), daemon=True).start()
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            httpx.get(f"{url}/rest/v1/ping")
+            return url
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError("Stub PostgREST did not start")
+
+
+def blocking_app(stub_url):
+    from supabase import create_client
+
+    client = create_client(stub_url, "bench-key")
+    app = FastAPI()
+
+    @app.get("/users/{user_id}")
+    def get_user(user_id: str):
+        return client.table("users").select("*").eq("id", user_id).execute().data
+
+    return app
+
+
+def async_app(stub_url):
+    os.environ["SUPABASE_URL"] = stub_url
+    os.environ["SUPABASE_KEY"] = "bench-key"
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+    from app.database import supabase
+
+    app = FastAPI()
+
+    @app.get("/users/{user_id}")
+    async def get_user(user_id: str):
+        return (await supabase.table("users").select("*").eq("id", user_id).execute()).data
+
+    return app
+
+
+async def drive(app):
+    transport = httpx.ASGITransport(app=app)
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + DURATION
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        async def worker(n):
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    r = await client.get(f"/users/{n}")
+                    r.raise_for_status()
+                    latencies.append(time.perf_counter() - start)
+                except Exception:
+                    errors += 1
+
+        await asyncio.gather(*[worker(n) for n in range(CONCURRENCY)])
+
+    latencies.sort()
+    return {
+        "rps": len(latencies) / DURATION,
+        "p50": latencies[len(latencies) // 2] * 1000 if latencies else 0,
+        "p99": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0,
+        "errors": errors,
+    }
+
+
+def main():
+    print("--- 📊 Async DB Layer Load Test ---")
+    stub_url = start_stub()
+    print(f"Stub PostgREST: {stub_url} (latency {STUB_LATENCY * 1000:.0f} ms)")
+    print(f"Concurrency: {CONCURRENCY}, duration: {DURATION:.0f}s per run")
+
+    results = {}
+    for name, factory in [("before (sync def + blocking client)", blocking_app), ("after (async def + pooled client)", async_app)]:
+        print(f"\nRunning {name}...")
+        results[name] = asyncio.run(drive(factory(stub_url)))
+        r = results[name]
+        print(f"   {r['rps']:8.1f} req/s  p50={r['p50']:.1f} ms  p99={r['p99']:.1f} ms  errors={r['errors']}")
+
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN")
+    print("=" * 60)
+    for name, r in results.items():
+        print(f"  {name:40s} {r['rps']:8.1f} req/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark: avatar processing with concurrent 12MP uploads.
+
+Compares the previous inline processing (full-size decode on the event loop)
+with app/images.py (JPEG draft decode inside the bounded process pool).
+Reports wall time, per-upload latency and the worst event-loop stall seen by a
+heartbeat task, which is what every other request on the worker experiences.
+
+Usage:
+    python tests/bench_avatar_processing.py
+"""
+import asyncio
+import io
+import os
+import sys
+import time
+
+from PIL import Image, ImageOps
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from app.images import ImageProcessor, render_avatar  # noqa: E402
+
+UPLOADS = int(os.getenv("BENCH_UPLOADS", "16"))
+WIDTH, HEIGHT = 4000, 3000  # 12MP
+
+
+def make_photo() -> bytes:
+    # Gradient plus noise so the JPEG is photo-sized (~3-5 MB), not a flat color
+    base = Image.linear_gradient("L").resize((WIDTH, HEIGHT))
+    noise = Image.effect_noise((WIDTH, HEIGHT), 64)
+    image = Image.merge("RGB", (base, noise, base.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def render_inline(content: bytes) -> bytes:
+    # Previous upload_avatar processing, kept here for comparison
+    image = Image.open(io.BytesIO(content))
+    if image.mode in ("RGBA", "P"):
+        image = image.convert("RGB")
+    image = ImageOps.fit(image, (500, 500), method=Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format="WEBP", quality=80, optimize=True)
+    return buffer.getvalue()
+
+
+async def heartbeat(stop, lags):
+    # Measures how late a 10ms sleep wakes up: the event-loop stall other requests see
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append((time.perf_counter() - start - 0.01) * 1000)
+
+
+async def run(name, process, photo):
+    lags, latencies = [], []
+    stop = asyncio.Event()
+    beat = asyncio.create_task(heartbeat(stop, lags))
+
+    async def upload():
+        start = time.perf_counter()
+        await process(photo)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[upload() for _ in range(UPLOADS)])
+    wall = time.perf_counter() - start
+    stop.set()
+    await beat
+
+    latencies.sort()
+    print(f"\n{name}")
+    print(f"   wall={wall:6.2f} s  p50={latencies[len(latencies) // 2]:8.1f} ms  max={latencies[-1]:8.1f} ms")
+    print(f"   worst event-loop stall={max(lags or [0]):8.1f} ms")
+    return wall, max(lags or [0])
+
+
+async def main():
+    print("--- 📊 Avatar Processing Benchmark ---")
+    photo = make_photo()
+    print(f"Input: {WIDTH}x{HEIGHT} JPEG, {len(photo) / 1024 / 1024:.1f} MB, {UPLOADS} concurrent uploads")
+
+    async def inline(content):
+        return render_inline(content)
+
+    processor = ImageProcessor(queue_limit=UPLOADS)
+    processor.start()
+    await processor.submit(render_avatar, photo)  # warm up the worker processes
+
+    async def pooled(content):
+        return await processor.submit(render_avatar, content)
+
+    before = await run("before (inline on event loop, full decode)", inline, photo)
+    after = await run(f"after (process pool x{processor.workers}, draft decode)", pooled, photo)
+    processor.shutdown()
+
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN")
+    print("=" * 60)
+    print(f"  wall time:          {before[0]:6.2f} s -> {after[0]:6.2f} s")
+    print(f"  event-loop stall:   {before[1]:8.1f} ms -> {after[1]:8.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,236 @@
+"""
+Request latency with print() on the hot path versus the structured logging
+of app/logs.py (queue handler + writer thread).
+
+Every mode runs in a child process whose stdout is a pipe read by this
+process, like the container log driver. The child serves a copy of
+POST /scores (one database round-trip of BENCH_DB_LATENCY seconds) with the
+real RequestContextMiddleware and drives it in-process with BENCH_CONCURRENCY
+concurrent clients:
+  - none:          no logging at all (baseline)
+  - print:         what the app had: the full payload printed before and the
+                   result after every save, plus uvicorn's access line written
+                   by a StreamHandler on the event loop
+  - logging-info:  LOG_LEVEL=info, the default: DEBUG records dropped before
+                   being queued, one JSON access record per request
+  - logging-debug: LOG_LEVEL=debug with LOG_DEBUG_SAMPLE=1, every record kept
+Each mode runs twice: with a reader that keeps up and with a slow one
+(BENCH_SLOW_READER bytes/s). print() writes from the event loop, so a slow
+reader stalls every request; the queue handler drops records instead.
+
+It also checks that the logging output is one JSON object per line and
+that the records of one request carry the id echoed in X-Request-ID.
+
+Usage:
+    python tests/bench_logging.py
+"""
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+BACKEND = os.path.join(os.path.dirname(__file__), "..")
+REQUESTS = int(os.getenv("BENCH_REQUESTS", "5000"))
+CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", "50"))
+DB_LATENCY = float(os.getenv("BENCH_DB_LATENCY", "0.005"))
+SLOW_READER = int(os.getenv("BENCH_SLOW_READER", "200000"))
+MODES = ["none", "print", "logging-info", "logging-debug"]
+
+SCORE = {
+    "score": 850, "category": "multiplication", "difficulty": "hard", "date": "2026-01-01T00:00:00+00:00",
+    "correctCount": 17, "errorCount": 3, "avgTime": 2.4, "mode": "classic", "idempotency_key": None,
+    "details": [{"question": f"{n} x 7", "answer": n * 7, "correct": True, "time": 2.1} for n in range(20)],
+}
+
+
+def child(mode):
+    """Serve and drive the app in this process; stdout is the pipe, the results go to stderr."""
+    sys.path.insert(0, BACKEND)
+    import logging
+
+    import httpx
+    from fastapi import Body, FastAPI
+
+    from app.logs import RequestContextMiddleware, setup_logging, shutdown_logging, stats
+
+    app = FastAPI()
+    logger = logging.getLogger("app.main")
+
+    @app.post("/scores")
+    async def save_score(record: dict = Body(...)):
+        data = {**record, "id": str(uuid.uuid4())}
+        if mode == "print":
+            print(f"DEBUG: Attempting to save score: {data}")
+        else:
+            logger.debug("Saving score %s", data["id"], extra={"user_id": "u1", "category": data["category"]})
+        await asyncio.sleep(DB_LATENCY)
+        saved = {**data, "duplicate": False}
+        if mode == "print":
+            print(f"DEBUG: Save score success: {[saved]}")
+        else:
+            logger.debug("Saved score %s", data["id"])
+        return {"id": saved["id"]}
+
+    if mode.startswith("logging"):
+        level = mode.split("-")[1]
+        setup_logging(level=level, fmt="json", sample=1.0)
+        app.add_middleware(RequestContextMiddleware, sample=1.0)
+        # The load generator's own "HTTP Request: ..." records are not the app's
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+    elif mode == "print":
+        access = logging.getLogger("uvicorn.access")
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("%(levelname)s:     %(message)s"))
+        access.addHandler(handler)
+        access.setLevel(logging.INFO)
+
+        @app.middleware("http")
+        async def access_log(request, call_next):
+            response = await call_next(request)
+            access.info('%s - "%s %s HTTP/1.1" %d', "127.0.0.1:50000", request.method, request.url.path,
+                        response.status_code)
+            return response
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        latencies = []
+        echoed = set()
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            queue = asyncio.Queue()
+            for _ in range(REQUESTS):
+                queue.put_nowait(None)
+
+            async def worker():
+                while not queue.empty():
+                    queue.get_nowait()
+                    started = time.perf_counter()
+                    res = await client.post("/scores", json=SCORE)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    if "x-request-id" in res.headers:
+                        echoed.add(res.headers["x-request-id"])
+
+            started = time.perf_counter()
+            await asyncio.gather(*[worker() for _ in range(CONCURRENCY)])
+            elapsed = time.perf_counter() - started
+        return latencies, elapsed, len(echoed)
+
+    latencies, elapsed, echoed = asyncio.run(run())
+    dropped = stats()["dropped"]
+    shutdown_logging()
+    sys.stdout.flush()
+    latencies.sort()
+    sys.stderr.write(json.dumps({
+        "rps": len(latencies) / elapsed,
+        "p50": statistics.median(latencies),
+        "p99": latencies[int(len(latencies) * 0.99) - 1],
+        "dropped": dropped,
+        "echoed": echoed,
+    }) + "\n")
+
+
+def read_pipe(pipe, rate, lines):
+    """The log driver: reads the child's stdout, at `rate` bytes/s if given."""
+    started = time.perf_counter()
+    received = 0
+    pending = b""
+    while True:
+        chunk = pipe.read1(4096) if hasattr(pipe, "read1") else pipe.read(4096)
+        if not chunk:
+            break
+        received += len(chunk)
+        pending += chunk
+        *complete, pending = pending.split(b"\n")
+        lines.extend(complete)
+        if rate:
+            ahead = received / rate - (time.perf_counter() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+
+def run_mode(mode, rate):
+    process = subprocess.Popen(
+        [sys.executable, __file__, "--child", mode],
+        cwd=BACKEND,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    lines = []
+    reader = threading.Thread(target=read_pipe, args=(process.stdout, rate, lines))
+    reader.start()
+    stderr = process.stderr.read().decode()
+    process.wait()
+    reader.join()
+    if process.returncode != 0:
+        raise RuntimeError(f"{mode} failed:\n{stderr}")
+    result = json.loads(stderr.strip().splitlines()[-1])
+    result["lines"] = lines
+    return result
+
+
+def check_output(failures, mode, result):
+    records = []
+    for line in result["lines"]:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            failures.append(f"{mode}: not a JSON line: {line[:80]!r}")
+            return
+    access = [r for r in records if r["logger"] == "app.access"]
+    if len(access) + result["dropped"] < REQUESTS:
+        failures.append(f"{mode}: {len(access)} access records for {REQUESTS} requests")
+    if result["echoed"] != REQUESTS:
+        failures.append(f"{mode}: X-Request-ID echoed on {result['echoed']}/{REQUESTS} responses")
+    by_request = {}
+    for record in records:
+        if not record["logger"].startswith("app."):
+            continue  # e.g. asyncio's "Using selector" at startup, outside any request
+        if "request_id" not in record:
+            failures.append(f"{mode}: record without request_id: {record}")
+            return
+        by_request.setdefault(record["request_id"], []).append(record["msg"])
+    if mode == "logging-debug" and not result["dropped"]:
+        complete = sum(1 for msgs in by_request.values() if len(msgs) == 3)
+        if complete != REQUESTS:
+            failures.append(f"{mode}: {complete}/{REQUESTS} requests with their 3 records under one id")
+
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "--child":
+        child(sys.argv[2])
+        return
+
+    print("--- 🪵 Logging overhead benchmark ---")
+    print(f"{REQUESTS} requests | {CONCURRENCY} concurrent | db {DB_LATENCY * 1000:.0f}ms | "
+          f"slow reader {SLOW_READER // 1000} KB/s")
+    failures = []
+    rows = []
+    for reader, rate in [("fast", 0), ("slow", SLOW_READER)]:
+        for mode in MODES:
+            result = run_mode(mode, rate)
+            volume = sum(len(line) + 1 for line in result["lines"])
+            print(f"   [{reader} reader] {mode:<14} {result['rps']:>6,.0f} req/s  p50 {result['p50']:>6.1f}ms  "
+                  f"p99 {result['p99']:>7.1f}ms  {volume / REQUESTS:>5.0f} B/request  dropped {result['dropped']}")
+            if mode.startswith("logging"):
+                check_output(failures, mode, result)
+            rows.append((reader, mode, result))
+
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN")
+    print("=" * 60)
+    print(f"{'reader':>6} | {'mode':<14} | {'req/s':>7} | {'p50 ms':>7} | {'p99 ms':>8} | {'dropped':>7}")
+    for reader, mode, r in rows:
+        print(f"{reader:>6} | {mode:<14} | {r['rps']:>7,.0f} | {r['p50']:>7.1f} | {r['p99']:>8.1f} | {r['dropped']:>7}")
+    if failures:
+        for failure in failures:
+            print(f"❌ {failure}")
+        sys.exit(1)
+    print("✅ JSON records carry the request id; a slow log reader never blocks the requests")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark: avatar uploads to S3 with 50 concurrent requests.
+
+Compares the previous behaviour (a new boto3 client per upload, blocking
+upload_fileobj on the event loop) with the shared pooled client of
+app/storage.py (put_object on a dedicated thread pool). Runs against a local
+moto S3 server by default, or a local MinIO if BENCH_S3_ENDPOINT is set.
+
+Usage:
+    python tests/bench_s3_upload.py
+    # MinIO: docker run --rm -p 9000:9000 minio/minio server /data
+    BENCH_S3_ENDPOINT=http://localhost:9000 BENCH_S3_ACCESS_KEY=minioadmin \
+        BENCH_S3_SECRET_KEY=minioadmin python tests/bench_s3_upload.py
+"""
+import asyncio
+import io
+import logging
+import os
+import sys
+import time
+import uuid
+
+import boto3
+
+UPLOADS = int(os.getenv("BENCH_UPLOADS", "50"))
+PAYLOAD = os.urandom(40 * 1024)  # typical encoded 500x500 WEBP avatar
+BUCKET = os.getenv("BENCH_S3_BUCKET", "bench-avatars")
+
+
+def start_s3():
+    endpoint = os.getenv("BENCH_S3_ENDPOINT")
+    if endpoint:
+        return endpoint, os.getenv("BENCH_S3_ACCESS_KEY"), os.getenv("BENCH_S3_SECRET_KEY"), None
+    from moto.server import ThreadedMotoServer
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    return f"http://{host}:{port}", "testing", "testing", server
+
+
+def summarize(name, wall, latencies):
+    latencies.sort()
+    print(f"\n{name}")
+    print(
+        f"   wall={wall:6.2f} s  throughput={len(latencies) / wall:7.1f} uploads/s  "
+        f"p50={latencies[len(latencies) // 2]:7.1f} ms  p99={latencies[int(len(latencies) * 0.99)]:7.1f} ms"
+    )
+    return len(latencies) / wall
+
+
+async def before(endpoint, access_key, secret_key):
+    latencies = []
+
+    async def upload():
+        # Previous upload_avatar: new client per request, blocking call on the loop
+        start = time.perf_counter()
+        s3 = boto3.client("s3", endpoint_url=endpoint, aws_access_key_id=access_key,
+                          aws_secret_access_key=secret_key, region_name="us-east-1")
+        s3.upload_fileobj(io.BytesIO(PAYLOAD), BUCKET, f"before/{uuid.uuid4()}.webp",
+                          ExtraArgs={"ContentType": "image/webp"})
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[upload() for _ in range(UPLOADS)])
+    return summarize("before (client per upload, blocking on event loop)", time.perf_counter() - start, latencies)
+
+
+async def after():
+    from app.storage import storage
+
+    await storage.start()
+    latencies = []
+
+    async def upload():
+        start = time.perf_counter()
+        await storage.put_object(f"after/{uuid.uuid4()}.webp", PAYLOAD, "image/webp")
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[upload() for _ in range(UPLOADS)])
+    result = summarize("after (shared pooled client, off-loop)", time.perf_counter() - start, latencies)
+    storage.shutdown()
+    return result
+
+
+def main():
+    print("--- 📊 S3 Avatar Upload Benchmark ---")
+    endpoint, access_key, secret_key, server = start_s3()
+    print(f"Endpoint: {endpoint}, bucket: {BUCKET}, {UPLOADS} concurrent uploads of {len(PAYLOAD) // 1024} KB")
+
+    boto3.client("s3", endpoint_url=endpoint, aws_access_key_id=access_key,
+                 aws_secret_access_key=secret_key, region_name="us-east-1").create_bucket(Bucket=BUCKET)
+
+    # app.storage reads its configuration from the environment at import time
+    os.environ.update({"S3_ENDPOINT_URL": endpoint, "S3_ACCESS_KEY": access_key,
+                       "S3_SECRET_KEY": secret_key, "S3_BUCKET_NAME": BUCKET})
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+    rate_before = asyncio.run(before(endpoint, access_key, secret_key))
+    rate_after = asyncio.run(after())
+
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN")
+    print("=" * 60)
+    print(f"  throughput: {rate_before:7.1f} -> {rate_after:7.1f} uploads/s")
+    if server:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Throughput of the production server (serve.py) with 1, 2, 4 and 8 workers.
+
+Runs the real app (app.main) through `python serve.py` against local stubs:
+a PostgREST that answers after BENCH_STUB_LATENCY seconds (the round-trip to
+Supabase) and a Google key server whose key signs the test tokens. For every
+worker count it:
+  1. waits until /health/ready answers 200 from every worker (lifespan
+     warm-up done: database, Google keys)
+  2. drives GET /users/me/scores (token verification + a database call, with
+     the response cache off) with BENCH_CONCURRENCY connections spread over
+     BENCH_CLIENTS load-generator processes for BENCH_DURATION seconds
+  3. sends SIGTERM while BENCH_DRAIN_REQUESTS slow requests are in flight and
+     checks that every one of them completes (graceful drain)
+
+Workers only add throughput up to the number of cores: run it on a machine
+with at least 8 of them, the load generators need some as well. serve.py only
+starts several workers with a shared cache: BENCH_REDIS_URL (default
+redis://localhost:6379/15) must be reachable.
+
+Usage:
+    pip install "uvicorn[standard]"
+    docker run --rm -p 6379:6379 redis:7
+    python tests/bench_workers.py
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+import uvicorn
+from jose import jwt
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Route
+
+sys.path.insert(0, os.path.dirname(__file__))
+from test_google_keys_singleflight import KID, StubKeyServer, make_key_pair  # noqa: E402
+
+BACKEND = os.path.join(os.path.dirname(__file__), "..")
+WORKER_COUNTS = [int(n) for n in os.getenv("BENCH_WORKER_COUNTS", "1,2,4,8").split(",")]
+STUB_LATENCY = float(os.getenv("BENCH_STUB_LATENCY", "0.02"))
+CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", "200"))
+CLIENTS = int(os.getenv("BENCH_CLIENTS", "4"))
+DURATION = float(os.getenv("BENCH_DURATION", "10"))
+USERS = int(os.getenv("BENCH_USERS", "100"))
+DRAIN_REQUESTS = int(os.getenv("BENCH_DRAIN_REQUESTS", "50"))
+DRAIN_LATENCY = 2.0
+REDIS_URL = os.getenv("BENCH_REDIS_URL", "redis://localhost:6379/15")
+PROJECT = "bench-project"
+
+SCORES = json.dumps([
+    {"id": f"00000000-0000-0000-0000-{n:012d}", "user_id": "u", "score": n, "category": "addition",
+     "difficulty": "easy", "date": "2026-01-01T00:00:00+00:00", "correctCount": 10, "errorCount": 1, "avgTime": 2.5}
+    for n in range(50)
+])
+
+
+def free_port() -> int:
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def serve_stub(port, latency, received):
+    async def postgrest(request):
+        if request.path_params["path"] == "scores":
+            with received.get_lock():
+                received.value += 1
+        await asyncio.sleep(latency.value)
+        if request.path_params["path"] == "users":
+            email = request.query_params.get("email", "eq.bench@example.com")[3:]
+            body = json.dumps([{"id": email.split("@")[0], "username": email, "email": email, "role": "student"}])
+        else:
+            body = SCORES
+        return Response(body, media_type="application/json")
+
+    app = Starlette(routes=[Route("/rest/v1/{path:path}", postgrest, methods=["GET", "POST", "PATCH", "DELETE"])])
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning", backlog=4096)
+
+
+def make_tokens(private_pem):
+    now = int(time.time())
+    return [
+        jwt.encode(
+            {"sub": f"user{n}", "email": f"user{n}@example.com", "aud": PROJECT, "iat": now, "exp": now + 3600},
+            private_pem,
+            algorithm="RS256",
+            headers={"kid": KID},
+        )
+        for n in range(USERS)
+    ]
+
+
+def start_server(workers, stub_url, keys_url):
+    port = free_port()
+    env = {
+        **os.environ,
+        "WEB_CONCURRENCY": str(workers),
+        "PORT": str(port),
+        "HOST": "127.0.0.1",
+        "SUPABASE_URL": stub_url,
+        "SUPABASE_KEY": "bench",
+        "SUPABASE_SERVICE_ROLE_KEY": "bench",
+        "GOOGLE_KEYS_URL": keys_url,
+        "FIREBASE_PROJECT_ID": PROJECT,
+        "RESPONSE_CACHE": "false",
+        "CACHE_URL": REDIS_URL,
+        "S3_BUCKET_NAME": "",
+        "LOG_LEVEL": "warning",
+        "GRACEFUL_TIMEOUT": "10",
+        "SHUTDOWN_DELAY": "0",
+    }
+    process = subprocess.Popen(
+        [sys.executable, "serve.py"], cwd=BACKEND, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{port}"
+    ready = set()
+    deadline = time.time() + 60
+    while len(ready) < workers and time.time() < deadline:
+        try:
+            res = httpx.get(f"{url}/health/ready", timeout=5)
+            if res.status_code == 200:
+                ready.add(res.json()["pid"])
+        except httpx.TransportError:
+            time.sleep(0.2)
+    if len(ready) < workers:
+        process.kill()
+        raise RuntimeError(f"only {len(ready)}/{workers} workers became ready")
+    return process, url
+
+
+def load_client(url, tokens, connections, duration, queue):
+    async def run():
+        latencies = []
+        errors = 0
+        limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+        async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+            deadline = time.perf_counter() + duration
+
+            async def worker(n):
+                nonlocal errors
+                headers = {"Authorization": f"Bearer {tokens[n % len(tokens)]}"}
+                while time.perf_counter() < deadline:
+                    started = time.perf_counter()
+                    try:
+                        res = await client.get("/users/me/scores", headers=headers)
+                        if res.status_code != 200:
+                            errors += 1
+                            continue
+                    except httpx.HTTPError:
+                        errors += 1
+                        continue
+                    latencies.append((time.perf_counter() - started) * 1000)
+
+            await asyncio.gather(*[worker(n) for n in range(connections)])
+        return latencies, errors
+
+    queue.put(asyncio.run(run()))
+
+
+def drive(url, tokens):
+    queue = multiprocessing.Queue()
+    per_client = max(CONCURRENCY // CLIENTS, 1)
+    clients = [
+        multiprocessing.Process(target=load_client, args=(url, tokens[i::CLIENTS], per_client, DURATION, queue))
+        for i in range(CLIENTS)
+    ]
+    for client in clients:
+        client.start()
+    latencies, errors = [], 0
+    for _ in clients:
+        part, failed = queue.get()
+        latencies.extend(part)
+        errors += failed
+    for client in clients:
+        client.join()
+    latencies.sort()
+    return {
+        "rps": len(latencies) / DURATION,
+        "p50": statistics.median(latencies) if latencies else 0.0,
+        "p99": latencies[max(int(len(latencies) * 0.99) - 1, 0)] if latencies else 0.0,
+        "errors": errors,
+    }
+
+
+async def drain(process, url, tokens, latency, received):
+    """SIGTERM while slow requests are in flight: all of them must still get 200."""
+    latency.value = DRAIN_LATENCY
+    before = received.value
+    async with httpx.AsyncClient(base_url=url, timeout=30) as client:
+        tasks = [
+            asyncio.create_task(client.get("/users/me/scores", headers={"Authorization": f"Bearer {token}"}))
+            for token in tokens[:DRAIN_REQUESTS]
+        ]
+        # Every request has reached its database call (a worker accepted it)
+        while received.value - before < DRAIN_REQUESTS:
+            await asyncio.sleep(0.05)
+        process.send_signal(signal.SIGTERM)
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    latency.value = STUB_LATENCY
+    completed = sum(1 for r in results if not isinstance(r, Exception) and r.status_code == 200)
+    return completed
+
+
+def main():
+    print("--- 🏭 serve.py workers benchmark ---")
+    print(f"{multiprocessing.cpu_count()} CPUs | stub latency {STUB_LATENCY * 1000:.0f}ms | "
+          f"{CONCURRENCY} connections from {CLIENTS} processes | {DURATION:.0f}s per run")
+    private_pem, cert_pem = make_key_pair()
+    keys = StubKeyServer({KID: cert_pem})
+    latency = multiprocessing.Value("d", STUB_LATENCY)
+    received = multiprocessing.Value("i", 0)
+    stub_port = free_port()
+    multiprocessing.Process(target=serve_stub, args=(stub_port, latency, received), daemon=True).start()
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    tokens = make_tokens(private_pem)
+
+    results = []
+    failures = []
+    for workers in WORKER_COUNTS:
+        print(f"\n[{workers} worker(s)]")
+        started = time.perf_counter()
+        process, url = start_server(workers, stub_url, keys.url)
+        print(f"   ready in {time.perf_counter() - started:.1f}s")
+        result = drive(url, tokens)
+        print(f"   {result['rps']:,.0f} req/s  p50 {result['p50']:.1f}ms  p99 {result['p99']:.1f}ms  "
+              f"errors {result['errors']}")
+        stopping = time.perf_counter()
+        completed = asyncio.run(drain(process, url, tokens, latency, received))
+        process.wait(timeout=30)
+        print(f"   SIGTERM with {DRAIN_REQUESTS} requests in flight: {completed} completed, "
+              f"stopped in {time.perf_counter() - stopping:.1f}s")
+        if completed != DRAIN_REQUESTS:
+            failures.append(f"{workers} workers: {DRAIN_REQUESTS - completed} requests lost on SIGTERM")
+        if result["errors"]:
+            failures.append(f"{workers} workers: {result['errors']} failed requests under load")
+        results.append((workers, result))
+
+    keys.server.shutdown()
+
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN")
+    print("=" * 60)
+    base = results[0][1]["rps"] or 1
+    print(f"{'workers':>8} | {'req/s':>8} | {'speedup':>7} | {'p50 ms':>7} | {'p99 ms':>7}")
+    for workers, r in results:
+        print(f"{workers:>8} | {r['rps']:>8,.0f} | {r['rps'] / base:>6.2f}x | {r['p50']:>7.1f} | {r['p99']:>7.1f}")
+    if failures:
+        for failure in failures:
+            print(f"❌ {failure}")
+        sys.exit(1)
+    print("✅ Every worker warmed up before serving and SIGTERM drained every in-flight request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Streaming export test: 2M score rows through app/exports.py with a bounded RSS.
+
+A stub PostgREST (separate process) generates `scores` rows on the fly and
+answers the keyset queries the export sends (id=gt.<last>&order=id&limit=N),
+so no database with 2M rows is needed. The export is consumed chunk by chunk,
+like StreamingResponse does, and the peak RSS of this process must stay under
+EXPORT_RSS_CEILING_MB above the baseline for both NDJSON and CSV.
+
+Usage:
+    python tests/test_export_streaming.py
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import socket
+import sys
+import time
+from urllib.parse import parse_qs
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Route
+
+TOTAL_ROWS = int(os.getenv("EXPORT_TEST_ROWS", "2000000"))
+PAGE_SIZE = int(os.getenv("EXPORT_TEST_PAGE_SIZE", "1000"))
+RSS_CEILING_MB = float(os.getenv("EXPORT_RSS_CEILING_MB", "64"))
+
+
+def row_id(n: int) -> str:
+    return f"00000000-0000-0000-0000-{n:012d}"
+
+
+async def stub_scores(request):
+    params = parse_qs(request.url.query)
+    after = int(params["id"][0].split("-")[-1]) if "id" in params else 0
+    limit = int(params["limit"][0])
+    rows = [
+        {
+            "id": row_id(n),
+            "user": f"student{n % 5000}",
+            "score": n % 100,
+            "correctCount": n % 10,
+            "errorCount": n % 3,
+            "avgTime": 2.5,
+            "date": "2024-01-01T12:00:00+00:00",
+            "category": "sumas",
+            "difficulty": "easy",
+        }
+        for n in range(after + 1, min(after + limit, TOTAL_ROWS) + 1)
+    ]
+    return Response(json.dumps(rows), media_type="application/json")
+
+
+def serve_stub(port):
+    app = Starlette(routes=[Route("/rest/v1/scores", stub_scores)])
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def start_stub():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    multiprocessing.Process(target=serve_stub, args=(port,), daemon=True).start()
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            httpx.get(f"{url}/rest/v1/scores?limit=1")
+            return url
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError("Stub PostgREST did not start")
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KB on Linux (bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+async def export(stream_export, fmt):
+    rows = 0
+    size = 0
+    async for chunk in stream_export("scores", fmt, page_size=PAGE_SIZE):
+        size += len(chunk)
+        rows += chunk.count(b"\n")
+    if fmt == "csv":
+        rows -= 1  # header
+    return rows, size
+
+
+async def warm_up(stream_export):
+    # Imports, the connection pool and the encoders allocate once, before the baseline
+    for fmt in ("ndjson", "csv"):
+        chunks = stream_export("scores", fmt, page_size=PAGE_SIZE)
+        await chunks.__anext__()
+        await chunks.aclose()
+
+
+async def run_exports(stream_export):
+    # One event loop for everything: the shared httpx pool is bound to it
+    await warm_up(stream_export)
+    baseline = peak_rss_mb()
+    print(f"Rows: {TOTAL_ROWS:,} (page size {PAGE_SIZE}), baseline RSS {baseline:.1f} MB")
+
+    results = {}
+    for fmt in ("ndjson", "csv"):
+        start = time.perf_counter()
+        rows, size = await export(stream_export, fmt)
+        elapsed = time.perf_counter() - start
+        growth = peak_rss_mb() - baseline
+        results[fmt] = rows == TOTAL_ROWS and growth <= RSS_CEILING_MB
+        print(f"\n[{fmt}] {rows:,} rows, {size / 1024 / 1024:.0f} MB in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s)")
+        print(f"   peak RSS growth: {growth:.1f} MB (ceiling {RSS_CEILING_MB:.0f} MB)")
+    return results
+
+
+def run_test():
+    print("--- 🚀 Streaming Export Test ---")
+    stub_url = start_stub()
+    os.environ["SUPABASE_URL"] = stub_url
+    os.environ["SUPABASE_KEY"] = "test-key"
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+    from app.exports import stream_export
+
+    results = asyncio.run(run_exports(stream_export))
+
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN")
+    print("=" * 60)
+    for fmt, passed in results.items():
+        print(f"  {fmt}: {'✅ PASS' if passed else '❌ FAIL'}")
+
+    if all(results.values()):
+        print("\n✅ TEST PASSED: export memory is independent of the row count")
+        sys.exit(0)
+    print("\n❌ TEST FAILED: wrong row count or RSS above the ceiling")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    run_test()
@@ -0,0 +1,161 @@
+"""
+Single-flight test for GoogleKeyStore (Firebase signing keys).
+
+Starts a local stub key server that counts requests and answers slowly, then
+checks that N concurrent lookups cause exactly ONE fetch: on a cold cache, on an
+unknown `kid` storm, and when the keys expire under tasks arriving while the
+refresh is in flight. Finally verifies that a token signed with the stub key
+decodes with the cached, pre-parsed key.
+
+Usage:
+    python tests/test_google_keys_singleflight.py
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from jose import jwt
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from app.keys import GoogleKeyStore  # noqa: E402
+
+CONCURRENCY = 200
+KID = "stub-kid-1"
+FETCH_DELAY = 0.3
+
+
+def make_key_pair():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "stub-securetoken")])
+    now = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(private_key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=1))
+        .sign(private_key, hashes.SHA256())
+    )
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    return private_pem, cert.public_bytes(serialization.Encoding.PEM).decode()
+
+
+class StubKeyServer:
+    def __init__(self, certs):
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                time.sleep(FETCH_DELAY)  # make overlapping fetches likely if single-flight is broken
+                body = json.dumps(certs).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Cache-Control", "public, max-age=3600, must-revalidate, no-transform")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/keys"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+async def cold_cache(url):
+    store = GoogleKeyStore(url)
+    keys = await asyncio.gather(*[store.get_key(KID) for _ in range(CONCURRENCY)])
+    return store, all(k is not None for k in keys)
+
+
+async def unknown_kid_storm(store):
+    store.min_refresh_interval = 0  # allow the rotation refetch immediately
+    before = store.fetch_count
+    keys = await asyncio.gather(*[store.get_key("rotated-kid") for _ in range(CONCURRENCY)])
+    return store.fetch_count - before, all(k is None for k in keys)
+
+
+async def expired_keys(store):
+    store._expires_at = 0  # keys expired: the next lookups must refresh them
+
+    async def late_lookup():
+        # Spread over the fetch: later tasks join the refresh already in flight
+        await asyncio.sleep(random.uniform(0, FETCH_DELAY / 2))
+        return await store.get_key(KID)
+
+    before = store.fetch_count
+    keys = await asyncio.gather(*[late_lookup() for _ in range(CONCURRENCY)])
+    return store.fetch_count - before, all(k is not None for k in keys)
+
+
+def run_test():
+    print("--- 🚀 GoogleKeyStore Single-Flight Test ---")
+    private_pem, cert_pem = make_key_pair()
+    stub = StubKeyServer({KID: cert_pem})
+    print(f"Stub key server: {stub.url}")
+    results = {}
+
+    print(f"\n[1/4] {CONCURRENCY} concurrent lookups on a cold cache...")
+    store, all_found = asyncio.run(cold_cache(stub.url))
+    results["Cold cache"] = store.fetch_count == 1 and stub.requests == 1 and all_found
+    print(f"   fetches={store.fetch_count} server_requests={stub.requests} all_found={all_found}")
+
+    print(f"\n[2/4] {CONCURRENCY} concurrent lookups of an unknown kid...")
+    refetches, none_found = asyncio.run(unknown_kid_storm(store))
+    results["Unknown kid storm"] = refetches == 1 and none_found
+    print(f"   refetches={refetches} server_requests={stub.requests}")
+
+    print(f"\n[3/4] {CONCURRENCY} lookups arriving while expired keys are refreshed...")
+    fetches, all_found = asyncio.run(expired_keys(store))
+    results["Expired keys"] = fetches == 1 and all_found
+    print(f"   fetches={fetches} all_found={all_found}")
+
+    print("\n[4/4] Decoding a token with the cached key...")
+    token = jwt.encode(
+        {"sub": "stub", "aud": "stub-project", "exp": int(time.time()) + 60},
+        private_pem,
+        algorithm="RS256",
+        headers={"kid": KID},
+    )
+    try:
+        key = store._keys[KID]
+        payload = jwt.decode(token, key, algorithms=["RS256"], audience="stub-project")
+        results["Decode with cached key"] = payload["sub"] == "stub"
+    except Exception as e:
+        print(f"   ❌ Decode failed: {e}")
+        results["Decode with cached key"] = False
+
+    stub.server.shutdown()
+
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN DE RESULTADOS")
+    print("=" * 60)
+    for name, ok in results.items():
+        print(f"  {name}: {'✅ PASS' if ok else '❌ FAIL'}")
+
+    if all(results.values()):
+        print("\n✅ TEST PASSED: exactly one fetch per refresh")
+        sys.exit(0)
+    print("\n❌ TEST FAILED")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    run_test()
@@ -0,0 +1,148 @@
+"""
+Test of the verified-identity cache against users rows that change while a
+request is reading them (get_current_user and invalidate_user, app/auth.py).
+
+Calls get_current_user() against a local stub PostgREST and a stub Google key
+server (test_google_keys_singleflight.py). The stub answers a users lookup with
+the row as it was when the request arrived, and can hold the answer back while
+the test changes the row and calls invalidate_user(), as save_user() and
+delete_user() do. Checks that:
+  - a row read BEFORE the invalidation is returned to its request but not
+    cached: the next request reads the new role from the database
+  - a row read after the invalidation is cached again (no database call)
+  - an identity cached before a change is dropped by invalidate_user()
+
+Usage:
+    python tests/test_identity_invalidation.py
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from jose import jwt
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+from test_google_keys_singleflight import KID, StubKeyServer, make_key_pair  # noqa: E402
+from test_metrics import check  # noqa: E402
+
+PROJECT = "identity-project"
+USER = {"id": "u1", "username": "ana", "email": "ana@example.com", "role": "USER", "status": "ACTIVE"}
+
+
+class StubPostgrest:
+    """users lookups answer the row read on arrival; `hold` delays the answer until `release`."""
+
+    def __init__(self):
+        self.row = dict(USER)
+        self.lookups = 0
+        self.hold = False
+        self.arrived = threading.Event()
+        self.release = threading.Event()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = []
+                if self.path.startswith("/rest/v1/users"):
+                    stub.lookups += 1
+                    body = [dict(stub.row)]
+                    if stub.hold:
+                        stub.arrived.set()
+                        stub.release.wait(10)
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+async def run(failures, private_pem, keys_url, postgrest):
+    from app.auth import get_current_user, google_keys, identity_cache, invalidate_user
+
+    # app.keys was imported (with the default URL) by test_google_keys_singleflight
+    google_keys.url = keys_url
+    token = jwt.encode(
+        {"sub": "ana", "email": USER["email"], "aud": PROJECT, "exp": int(time.time()) + 600},
+        private_pem,
+        algorithm="RS256",
+        headers={"kid": KID},
+    )
+
+    # 1. Cached, then dropped by invalidate_user()
+    user = await get_current_user(token)
+    await get_current_user(token)
+    check(failures, user["role"] == "USER" and postgrest.lookups == 1,
+          f"identity not cached ({postgrest.lookups} lookups)")
+    postgrest.row["role"] = "TEACHER"
+    await invalidate_user("u1")
+    user = await get_current_user(token)
+    check(failures, user["role"] == "TEACHER", f"role after invalidate_user: {user['role']}")
+    print(f"   cached identity dropped by invalidate_user(): role {user['role']}")
+
+    # 2. The row is read, then changed and invalidated before the request caches it
+    identity_cache.clear()
+    postgrest.hold = True
+    request = asyncio.create_task(get_current_user(token))
+    await asyncio.to_thread(postgrest.arrived.wait, 10)
+    postgrest.row["role"] = "ADMIN"
+    await invalidate_user("u1")
+    postgrest.hold = False
+    postgrest.release.set()
+    user = await request
+    check(failures, user["role"] == "TEACHER", f"the request in flight got {user['role']}")
+    lookups = postgrest.lookups
+    user = await get_current_user(token)
+    check(failures, user["role"] == "ADMIN", f"stale row cached after the invalidation: role {user['role']}")
+    check(failures, postgrest.lookups == lookups + 1, "the next request did not read the users row again")
+    print(f"   row read before the invalidation: not cached, next request sees role {user['role']}")
+
+    # 3. Read after the invalidation: cached as usual
+    lookups = postgrest.lookups
+    user = await get_current_user(token)
+    check(failures, user["role"] == "ADMIN" and postgrest.lookups == lookups,
+          f"row read after the invalidation not cached ({postgrest.lookups - lookups} lookups)")
+
+
+def run_test():
+    print("--- 🪪 Identity cache invalidation Test ---")
+    private_pem, cert_pem = make_key_pair()
+    keys = StubKeyServer({KID: cert_pem})
+    postgrest = StubPostgrest()
+    os.environ.update({
+        "SUPABASE_URL": postgrest.url,
+        "SUPABASE_KEY": "test",
+        "FIREBASE_PROJECT_ID": PROJECT,
+        "CACHE_URL": "memory",
+    })
+
+    failures = []
+    asyncio.run(run(failures, private_pem, keys.url, postgrest))
+    keys.server.shutdown()
+    postgrest.server.shutdown()
+
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN")
+    print("=" * 60)
+    if failures:
+        for failure in failures:
+            print(f"  ❌ {failure}")
+        print(f"\n❌ TEST FAILED ({len(failures)} problems)")
+        sys.exit(1)
+    print("✅ TEST PASSED: identities read before a change are never cached after it")
+
+
+if __name__ == "__main__":
+    run_test()
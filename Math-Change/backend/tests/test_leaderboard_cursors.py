@@ -0,0 +1,120 @@
+"""
+Test of the keyset cursors of GET /leaderboard, GET /leaderboard/rankings and
+GET /users/me/scores (app/leaderboard.py).
+
+Cursors are base64 JSON sent back by the client, and their values end up in
+PostgREST `or=(...)` filters. Checks that:
+  - cursors of real rows decode to the same position (dates with 0 to 6
+    fractional digits, as PostgREST returns them, and a trailing Z)
+  - a cursor whose id, user id or date is not a UUID / ISO timestamp (extra
+    filter terms, quotes, parentheses) is refused with 400 by every decoder
+  - the filters built from a decoded cursor only hold the rebuilt values
+
+Usage:
+    python tests/test_leaderboard_cursors.py
+"""
+import base64
+import json
+import os
+import sys
+import uuid
+from datetime import datetime, timezone
+
+from fastapi import HTTPException
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+from app.leaderboard import (  # noqa: E402
+    decode_cursor, decode_history_cursor, decode_ranking_cursor, encode_cursor, encode_history_cursor,
+    encode_ranking_cursor, history_keyset_filter, keyset_filter, ranking_keyset_filter,
+)
+from test_metrics import check  # noqa: E402
+
+UTC = timezone.utc
+# Row dates as PostgREST returns them, and the instant each one is
+DATES = {
+    "2026-01-01T10:00:00+00:00": datetime(2026, 1, 1, 10, tzinfo=UTC),
+    "2026-01-01T10:00:00.1+00:00": datetime(2026, 1, 1, 10, 0, 0, 100000, tzinfo=UTC),
+    "2026-01-01T10:00:00.12345+00:00": datetime(2026, 1, 1, 10, 0, 0, 123450, tzinfo=UTC),
+    "2026-01-01T10:00:00.123456+00:00": datetime(2026, 1, 1, 10, 0, 0, 123456, tzinfo=UTC),
+    "2026-01-01T10:00:00.5Z": datetime(2026, 1, 1, 10, 0, 0, 500000, tzinfo=UTC),
+    "2026-01-01T10:00:00.25-03:00": datetime(2026, 1, 1, 13, 0, 0, 250000, tzinfo=UTC),
+}
+INJECTIONS = [
+    "x,score.gt.0",
+    '2026-01-01",id.gt.0',
+    "1),or(role.eq.ADMIN",
+    "00000000-0000-0000-0000-000000000000)",
+    "",
+]
+
+
+def raw_cursor(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def refused(decode, payload):
+    try:
+        decode(raw_cursor(payload))
+    except HTTPException as e:
+        return e.status_code == 400
+    return False
+
+
+def run(failures):
+    # 1. Real rows round-trip
+    for date, expected in DATES.items():
+        row = {"id": str(uuid.uuid4()), "score": 90, "date": date, "user_id": str(uuid.uuid4()), "total_score": 500}
+        position = decode_cursor(encode_cursor(row, 7))
+        check(failures, position["i"] == row["id"] and position["s"] == 90 and position["r"] == 7,
+              f"scores cursor of {date}: {position}")
+        check(failures, datetime.fromisoformat(position["d"]) == expected, f"date {date} decoded as {position['d']}")
+        history = decode_history_cursor(encode_history_cursor(row, 3))
+        check(failures, history["d"] == position["d"] and history["i"] == row["id"], f"history cursor of {date}")
+        ranking = decode_ranking_cursor(encode_ranking_cursor(row, 2))
+        check(failures, ranking == {"t": 500, "u": row["user_id"], "r": 2}, f"ranking cursor: {ranking}")
+    print(f"   {len(DATES)} row dates round-trip through the three cursors")
+
+    # 2. Crafted values are refused, never put into a filter
+    good_id, good_date = str(uuid.uuid4()), "2026-01-01T10:00:00.12345+00:00"
+    cases = 0
+    for value in INJECTIONS:
+        cases += 4
+        check(failures, refused(decode_cursor, {"s": 1, "d": good_date, "i": value, "r": 1}), f"scores id {value!r}")
+        check(failures, refused(decode_cursor, {"s": 1, "d": value, "i": good_id, "r": 1}), f"scores date {value!r}")
+        check(failures, refused(decode_history_cursor, {"d": value, "i": good_id, "r": 1}), f"history date {value!r}")
+        check(failures, refused(decode_ranking_cursor, {"t": 1, "u": value, "r": 1}), f"ranking user {value!r}")
+    check(failures, refused(decode_cursor, {"s": "1,id.gt.0", "d": good_date, "i": good_id, "r": 1}), "scores score")
+    check(failures, refused(decode_cursor, "not base64 json"), "garbage cursor")
+    print(f"   {cases + 2} crafted cursors refused with 400")
+
+    # 3. Filters only hold rebuilt values
+    position = decode_cursor(raw_cursor({"s": 5, "d": good_date, "i": good_id.upper(), "r": 1}))
+    expected = (f'score.lt.5,and(score.eq.5,date.lt."{position["d"]}"),'
+                f'and(score.eq.5,date.eq."{position["d"]}",id.lt.{good_id})')
+    check(failures, keyset_filter(position) == expected, f"keyset filter: {keyset_filter(position)}")
+    history = decode_history_cursor(raw_cursor({"d": good_date, "i": good_id, "r": 1}))
+    check(failures, history_keyset_filter(history).count(",") == 2, f"history filter: {history_keyset_filter(history)}")
+    ranking = decode_ranking_cursor(raw_cursor({"t": 5, "u": good_id, "r": 1}))
+    check(failures, ranking_keyset_filter(ranking) == f"total_score.lt.5,and(total_score.eq.5,user_id.lt.{good_id})",
+          f"ranking filter: {ranking_keyset_filter(ranking)}")
+
+
+def run_test():
+    print("--- 🔖 Leaderboard cursors Test ---")
+    failures = []
+    run(failures)
+
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN")
+    print("=" * 60)
+    if failures:
+        for failure in failures:
+            print(f"  ❌ {failure}")
+        print(f"\n❌ TEST FAILED ({len(failures)} problems)")
+        sys.exit(1)
+    print("✅ TEST PASSED: cursors round-trip and crafted ones never reach a PostgREST filter")
+
+
+if __name__ == "__main__":
+    run_test()
@@ -0,0 +1,251 @@
+"""
+Test of the Prometheus metrics (app/metrics.py, GET /metrics).
+
+Runs the real app (app.main) in a TestClient against a local stub PostgREST
+and a stub Google key server (test_google_keys_singleflight.py), then checks
+the exposition after a few requests:
+  - http_request_duration_seconds per route template and status, with
+    unknown paths grouped as "unmatched" and nothing left in flight
+  - supabase_request_duration_seconds per table and operation (select,
+    insert, upsert, update, delete, rpc)
+  - identity cache hits/misses and token verifications
+  - image_processing_seconds and image_queue_wait_seconds from the pool
+  - with PROMETHEUS_MULTIPROC_DIR, samples of several processes added up
+  - METRICS_TOKEN protects the endpoint
+and prints the cost of the middleware per request.
+
+Usage:
+    python tests/test_metrics.py
+"""
+import asyncio
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from jose import jwt
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+from test_google_keys_singleflight import KID, StubKeyServer, make_key_pair  # noqa: E402
+
+BACKEND = os.path.join(os.path.dirname(__file__), "..")
+PROJECT = "metrics-project"
+OVERHEAD_REQUESTS = int(os.getenv("TEST_OVERHEAD_REQUESTS", "2000"))
+
+
+class StubPostgrest:
+    def __init__(self):
+        class Handler(BaseHTTPRequestHandler):
+            def _answer(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+                if self.path.startswith("/rest/v1/users"):
+                    body = [{"id": "u1", "username": "ana", "email": "ana@example.com", "role": "student"}]
+                else:
+                    body = []
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PATCH = do_DELETE = _answer
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+def sample(text, name, **labels):
+    """Value of one sample of the exposition (0 if absent)."""
+    for line in text.splitlines():
+        if not line.startswith(name + "{") and not line.startswith(name + " "):
+            continue
+        found = dict(re.findall(r'(\w+)="([^"]*)"', line.split("}")[0])) if "{" in line else {}
+        if all(found.get(k) == v for k, v in labels.items()):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+def check(failures, condition, message):
+    if not condition:
+        failures.append(message)
+
+
+def test_app(failures, private_pem, keys_url):
+    from app.auth import google_keys
+    from app.database import supabase
+    from app.main import app
+
+    # app.keys was imported (with the default URL) by test_google_keys_singleflight
+    google_keys.url = keys_url
+
+    token = jwt.encode(
+        {"sub": "ana", "email": "ana@example.com", "aud": PROJECT, "exp": int(time.time()) + 600},
+        private_pem,
+        algorithm="RS256",
+        headers={"kid": KID},
+    )
+    with TestClient(app) as client:
+        requests(failures, client, token, supabase)
+
+
+def requests(failures, client, token, supabase):
+    headers = {"Authorization": f"Bearer {token}"}
+    for _ in range(2):
+        res = client.get("/users/me/scores", headers=headers)
+        check(failures, res.status_code == 200, f"/users/me/scores: {res.status_code} {res.text[:100]}")
+    client.get("/no/such/path/123")
+
+    async def writes():
+        await supabase.table("scores").insert({"id": "x"}).execute()
+        await supabase.table("users").upsert({"id": "u1"}).execute()
+        await supabase.table("users").update({"username": "b"}).eq("id", "u1").execute()
+        await supabase.table("scores").delete().eq("id", "x").execute()
+        await supabase.rpc("score_activity", {"p_days": 30}).execute()
+
+    client.portal.call(writes)
+
+    text = client.get("/metrics").text
+    route = dict(route="/users/me/scores", method="GET", status="200")
+    check(failures, sample(text, "http_request_duration_seconds_count", **route) == 2, "route histogram count")
+    check(failures, sample(text, "http_request_duration_seconds_count", route="unmatched", status="404") == 1,
+          "404 not grouped as unmatched")
+    check(failures, "/no/such/path" not in text, "raw path used as a label")
+    check(failures, sample(text, "http_requests_in_flight", method="GET") == 1, "in-flight gauge (only /metrics)")
+    print(f"   /users/me/scores: {sample(text, 'http_request_duration_seconds_sum', **route) * 1000 / 2:.1f}ms avg")
+
+    for table, operation in [("users", "select"), ("scores", "select"), ("scores", "insert"), ("users", "upsert"),
+                             ("users", "update"), ("scores", "delete"), ("score_activity", "rpc")]:
+        count = sample(text, "supabase_request_duration_seconds_count", table=table, operation=operation)
+        check(failures, count >= 1, f"supabase {table} {operation} not counted")
+    print(f"   supabase users select: {sample(text, 'supabase_request_duration_seconds_count', table='users', operation='select'):.0f} calls")
+
+    hits = sample(text, "cache_lookups_total", cache="identity", result="hit")
+    misses = sample(text, "cache_lookups_total", cache="identity", result="miss")
+    check(failures, (hits, misses) == (1, 1), f"identity cache hits/misses {hits}/{misses}")
+    check(failures, sample(text, "auth_token_verifications_total", result="valid") == 1, "token verifications")
+    check(failures, sample(text, "google_key_fetches_total", source="google") == 1, "google key fetches")
+
+    import app.main as main
+
+    main.METRICS_TOKEN = "s3cret"
+    check(failures, client.get("/metrics").status_code == 401, "/metrics open with METRICS_TOKEN set")
+    ok = client.get("/metrics", headers={"Authorization": "Bearer s3cret"})
+    check(failures, ok.status_code == 200, "/metrics rejects the right token")
+    main.METRICS_TOKEN = ""
+
+
+def test_images(failures):
+    from app.images import ImageProcessor, render_avatar
+    from app.metrics import render
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (800, 600), "red").save(buffer, "JPEG")
+    processor = ImageProcessor(workers=1, queue_limit=2)
+    try:
+        asyncio.run(processor.submit(render_avatar, buffer.getvalue()))
+    finally:
+        processor.shutdown()
+    text = render()[0].decode()
+    processed = sample(text, "image_processing_seconds_count", function="render_avatar")
+    waited = sample(text, "image_queue_wait_seconds_count")
+    check(failures, processed == 1 and waited == 1, f"image metrics {processed}/{waited}")
+    print(f"   render_avatar: {sample(text, 'image_processing_seconds_sum', function='render_avatar') * 1000:.0f}ms in the pool")
+
+
+def test_multiprocess(failures):
+    directory = tempfile.mkdtemp(prefix="prometheus-test-")
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": directory}
+    code = "from app.metrics import CACHE_LOOKUPS; CACHE_LOOKUPS.labels('identity', 'hit').inc(3)"
+    for _ in range(2):
+        subprocess.run([sys.executable, "-c", code], cwd=BACKEND, env=env, check=True)
+    out = subprocess.run(
+        [sys.executable, "-c", "from app.metrics import render; print(render()[0].decode())"],
+        cwd=BACKEND, env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    total = sample(out, "cache_lookups_total", cache="identity", result="hit")
+    check(failures, total == 6, f"multiprocess total {total}, expected 6")
+    print(f"   2 processes x 3 hits -> {total:.0f} in one scrape")
+
+
+def overhead():
+    from app.metrics import MetricsMiddleware
+
+    def build(instrumented):
+        app = FastAPI()
+
+        @app.get("/ping/{n}")
+        async def ping(n: int):
+            return {"n": n}
+
+        if instrumented:
+            app.add_middleware(MetricsMiddleware)
+        return app
+
+    async def run(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://t") as client:
+            for n in range(200):
+                await client.get(f"/ping/{n}")
+            started = time.perf_counter()
+            for n in range(OVERHEAD_REQUESTS):
+                await client.get(f"/ping/{n}")
+            return (time.perf_counter() - started) / OVERHEAD_REQUESTS * 1e6
+
+    plain = asyncio.run(run(build(False)))
+    instrumented = asyncio.run(run(build(True)))
+    print(f"   middleware: {plain:.0f}µs -> {instrumented:.0f}µs per request ({instrumented - plain:+.0f}µs)")
+
+
+def run_test():
+    print("--- 📈 Prometheus metrics Test ---")
+    private_pem, cert_pem = make_key_pair()
+    keys = StubKeyServer({KID: cert_pem})
+    postgrest = StubPostgrest()
+    os.environ.update({
+        "SUPABASE_URL": postgrest.url,
+        "SUPABASE_KEY": "test",
+        "FIREBASE_PROJECT_ID": PROJECT,
+        "RESPONSE_CACHE": "false",
+        "CACHE_URL": "memory",
+    })
+    os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+
+    failures = []
+    test_app(failures, private_pem, keys.url)
+    test_images(failures)
+    test_multiprocess(failures)
+    overhead()
+    keys.server.shutdown()
+    postgrest.server.shutdown()
+
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN")
+    print("=" * 60)
+    if failures:
+        for failure in failures:
+            print(f"  ❌ {failure}")
+        print(f"\n❌ TEST FAILED ({len(failures)} problems)")
+        sys.exit(1)
+    print("✅ TEST PASSED: routes, Supabase calls, caches and the image pool are measured")
+
+
+if __name__ == "__main__":
+    run_test()
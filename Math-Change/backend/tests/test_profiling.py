@@ -0,0 +1,286 @@
+"""
+Test of the built-in profiler (app/profiling.py, /admin/profile).
+
+Runs the real app (app.main) in a TestClient against a stub PostgREST whose
+scores table returns BENCH-sized pages (so serialising them costs CPU) and a
+stub Google key server, and checks:
+  - POST /admin/profile is for admins only and returns collapsed stacks
+    ("frame;frame;frame count") of the requests served meanwhile
+  - ?requests=N ends the profile after N requests instead of the seconds
+  - image jobs are sampled inside the pool process ("image-pool;...PIL...")
+  - a request sent with the token of POST /admin/profile/requests in
+    X-Profile is profiled on its own: concurrent requests to other routes
+    do not show up in its stacks, and the token works once
+  - with TEST_REDIS_URL (default redis://localhost:6379/15, skipped if not
+    reachable), `python serve.py` with 2 workers: one call profiles both
+
+Usage:
+    python tests/test_profiling.py
+"""
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+from fastapi.testclient import TestClient
+from jose import jwt
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+from test_google_keys_singleflight import KID, StubKeyServer, make_key_pair  # noqa: E402
+from test_metrics import check  # noqa: E402
+
+BACKEND = os.path.join(os.path.dirname(__file__), "..")
+PROJECT = "profiling-project"
+REDIS_URL = os.getenv("TEST_REDIS_URL", "redis://localhost:6379/15")
+
+SCORES = json.dumps([
+    {"id": f"00000000-0000-0000-0000-{n:012d}", "user_id": "u1", "score": n, "category": "addition",
+     "difficulty": "easy", "date": "2026-01-01T00:00:00+00:00", "correctCount": 10, "errorCount": 1, "avgTime": 2.5}
+    for n in range(3000)
+]).encode()
+
+
+class StubPostgrest:
+    """users: admin@example.com is an ADMIN, anyone else a student; scores: a large page."""
+
+    def __init__(self):
+        class Handler(BaseHTTPRequestHandler):
+            def _answer(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+                if self.path.startswith("/rest/v1/users"):
+                    admin = "admin%40example.com" in self.path or "admin@example.com" in self.path
+                    name = "admin" if admin else "ana"
+                    data = json.dumps([{"id": name, "username": name, "email": f"{name}@example.com",
+                                        "role": "ADMIN" if admin else "student"}]).encode()
+                elif self.path.startswith("/rest/v1/scores"):
+                    data = SCORES
+                else:
+                    data = b"[]"
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PATCH = do_DELETE = do_HEAD = _answer
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+def make_token(private_pem, name):
+    return jwt.encode(
+        {"sub": name, "email": f"{name}@example.com", "aud": PROJECT, "exp": int(time.time()) + 600},
+        private_pem,
+        algorithm="RS256",
+        headers={"kid": KID},
+    )
+
+
+def parse(text):
+    """{stack: count} of a collapsed-stack file."""
+    stacks = {}
+    for line in text.splitlines():
+        stack, count = line.rsplit(" ", 1)
+        stacks[stack] = int(count)
+    return stacks
+
+
+def frames(stacks, name):
+    return sum(count for stack, count in stacks.items() if name in stack)
+
+
+class Load:
+    """Requests sent in a loop from another thread until stopped."""
+
+    def __init__(self, client, path, headers):
+        self.sent = 0
+        self._stop = threading.Event()
+
+        def run():
+            while not self._stop.is_set():
+                client.get(path, headers=headers)
+                self.sent += 1
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def test_app(failures, private_pem, keys_url):
+    from app.auth import google_keys
+    from app.images import image_processor, render_avatar
+    from app.main import app
+
+    # app.keys was imported (with the default URL) by test_google_keys_singleflight
+    google_keys.url = keys_url
+    admin = {"Authorization": f"Bearer {make_token(private_pem, 'admin')}"}
+    student = {"Authorization": f"Bearer {make_token(private_pem, 'ana')}"}
+    buffer = io.BytesIO()
+    Image.new("RGB", (2000, 1500), "red").save(buffer, "JPEG")
+
+    with TestClient(app) as client:
+        res = client.post("/admin/profile?seconds=0.5", headers=student)
+        check(failures, res.status_code == 403, f"students may profile: {res.status_code}")
+
+        # 1. Whole worker for one second while /users/me/scores is served
+        load = Load(client, "/users/me/scores", student)
+        res = client.post("/admin/profile?seconds=1", headers=admin)
+        load.stop()
+        check(failures, res.status_code == 200, f"/admin/profile: {res.status_code} {res.text[:100]}")
+        stacks = parse(res.text)
+        samples = int(res.headers.get("x-profile-samples", 0))
+        in_route = frames(stacks, "app.main:get_my_scores")
+        check(failures, in_route > 0, "get_my_scores not in the profile")
+        check(failures, all(stack.split(";")[0] for stack in stacks), "stack without thread name")
+        print(f"   1s profile: {samples} samples, {len(stacks)} stacks, {in_route} in get_my_scores, "
+              f"{load.sent} requests served")
+
+        # 2. Until 20 requests were served, well before the 30 seconds
+        load = Load(client, "/users/me/scores", student)
+        started = time.perf_counter()
+        res = client.post("/admin/profile?seconds=30&requests=20", headers=admin)
+        elapsed = time.perf_counter() - started
+        load.stop()
+        check(failures, res.status_code == 200 and elapsed < 20, f"requests=20 profile took {elapsed:.1f}s")
+        print(f"   requests=20 profile ended after {elapsed:.1f}s")
+
+        # 3. Image jobs are sampled in the pool process
+        image_job = threading.Thread(
+            target=lambda: [client.portal.call(image_processor.submit, render_avatar, buffer.getvalue())
+                            for _ in range(3)]
+        )
+        image_job.start()
+        res = client.post("/admin/profile?seconds=2", headers=admin)
+        image_job.join()
+        stacks = parse(res.text)
+        pool = {stack: count for stack, count in stacks.items() if stack.startswith("image-pool;")}
+        check(failures, frames(pool, "app.images:render_avatar") > 0, "render_avatar not sampled in the pool")
+        check(failures, frames(pool, "PIL.") > 0, "Pillow frames missing from the pool stacks")
+        print(f"   image pool: {sum(pool.values())} samples, {frames(pool, 'PIL.')} inside Pillow")
+
+        # 4. One request on its own, with other routes served concurrently
+        token = client.post("/admin/profile/requests", headers=admin).json()["token"]
+        load = Load(client, "/users/me", student)
+        res = client.get("/users/me/scores", headers={**student, "X-Profile": token})
+        load.stop()
+        check(failures, res.status_code == 200, f"profiled request: {res.status_code}")
+        res = client.get(f"/admin/profile/requests/{token}", headers=admin)
+        check(failures, res.status_code == 200, f"request profile: {res.status_code} {res.text[:100]}")
+        stacks = parse(res.text)
+        check(failures, frames(stacks, "app.main:get_my_scores") > 0, "request profile without its route")
+        check(failures, frames(stacks, "app.main:get_me") == 0, "concurrent requests in the request profile")
+        print(f"   X-Profile: {res.headers.get('x-profile-request')} in {res.headers.get('x-profile-duration-ms')}ms, "
+              f"{res.headers.get('x-profile-samples')} samples, {len(stacks)} stacks")
+
+        client.get("/users/me/scores", headers={**student, "X-Profile": token})
+        check(failures, client.get("/admin/profile/requests/unknown", headers=admin).status_code == 404,
+              "unknown token has a profile")
+        check(failures, client.post("/admin/profile?seconds=600", headers=admin).status_code == 400,
+              "profile longer than PROFILE_MAX_SECONDS accepted")
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_workers(failures, private_pem, keys_url, postgrest_url):
+    try:
+        import redis
+
+        redis.Redis.from_url(REDIS_URL).ping()
+    except Exception as e:
+        print(f"   ⚠️  {REDIS_URL} not reachable ({e}): 2-worker profile skipped")
+        return
+    port = free_port()
+    env = {
+        **os.environ,
+        "WEB_CONCURRENCY": "2",
+        "PORT": str(port),
+        "HOST": "127.0.0.1",
+        "SUPABASE_URL": postgrest_url,
+        "GOOGLE_KEYS_URL": keys_url,
+        "CACHE_URL": REDIS_URL,
+        "CACHE_PREFIX": f"profiling-test-{port}:",
+        "S3_BUCKET_NAME": "",
+        "LOG_LEVEL": "warning",
+    }
+    process = subprocess.Popen([sys.executable, "serve.py"], cwd=BACKEND, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        ready = set()
+        deadline = time.time() + 60
+        while len(ready) < 2 and time.time() < deadline:
+            try:
+                res = httpx.get(f"{url}/health/ready", timeout=5)
+                if res.status_code == 200:
+                    ready.add(res.json()["pid"])
+            except httpx.TransportError:
+                time.sleep(0.2)
+        if len(ready) < 2:
+            failures.append(f"only {len(ready)}/2 workers became ready")
+            return
+        admin = {"Authorization": f"Bearer {make_token(private_pem, 'admin')}"}
+        res = httpx.post(f"{url}/admin/profile?seconds=1", headers=admin, timeout=30)
+        workers = res.headers.get("x-profile-workers")
+        check(failures, res.status_code == 200 and workers == "2", f"2-worker profile: {res.status_code}, {workers} workers")
+        print(f"   serve.py, 2 workers: profile from {workers} workers, {res.headers.get('x-profile-samples')} samples")
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def run_test():
+    print("--- 🔥 Profiler Test ---")
+    private_pem, cert_pem = make_key_pair()
+    keys = StubKeyServer({KID: cert_pem})
+    postgrest = StubPostgrest()
+    os.environ.update({
+        "SUPABASE_URL": postgrest.url,
+        "SUPABASE_KEY": "test",
+        "FIREBASE_PROJECT_ID": PROJECT,
+        "RESPONSE_CACHE": "false",
+        "CACHE_URL": "memory",
+    })
+
+    failures = []
+    test_app(failures, private_pem, keys.url)
+    test_workers(failures, private_pem, keys.url, postgrest.url)
+    keys.server.shutdown()
+    postgrest.server.shutdown()
+
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN")
+    print("=" * 60)
+    if failures:
+        for failure in failures:
+            print(f"  ❌ {failure}")
+        print(f"\n❌ TEST FAILED ({len(failures)} problems)")
+        sys.exit(1)
+    print("✅ TEST PASSED: workers, the image pool and single requests can be profiled by admins")
+
+
+if __name__ == "__main__":
+    run_test()
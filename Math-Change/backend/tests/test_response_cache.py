@@ -0,0 +1,200 @@
+"""
+Test for the response cache (app/response_cache.py): ETag / If-None-Match and
+invalidation by version on the polled GET endpoints.
+
+Mounts a ResponseCache on a small FastAPI app whose "database" is a counter
+with a FETCH_DELAY_MS sleep, then checks:
+  - the first GET fetches and returns a strong ETag; repeats are cache hits
+  - If-None-Match (also W/ and lists) gets 304 with no body and no fetch
+  - bump() makes the next GET fetch again; the ETag only changes if the body did
+  - a bump while a fetch is running never lets that older body be served
+  - versions evicted from a tiny LRU never resurrect old entries
+  - the bytes are the ones FastAPI's JSONResponse would have sent
+and finally simulates POLLS screen changes of USERS users with a write every
+WRITE_EVERY polls, printing the hit ratio and the database calls saved.
+
+Usage:
+    python tests/test_response_cache.py
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from app.response_cache import MemoryBackend, ResponseCache  # noqa: E402
+
+FETCH_DELAY_MS = float(os.getenv("TEST_FETCH_DELAY_MS", "2"))
+USERS = int(os.getenv("TEST_USERS", "50"))
+POLLS = int(os.getenv("TEST_POLLS", "2000"))
+WRITE_EVERY = int(os.getenv("TEST_WRITE_EVERY", "10"))
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.calls = 0
+        self.rows = {}
+        self.gate = None  # asyncio.Event: when set, fetches wait for it
+
+    async def progress(self, user_id):
+        self.calls += 1
+        snapshot = list(self.rows.get(user_id, []))
+        await asyncio.sleep(FETCH_DELAY_MS / 1000)
+        if self.gate is not None:
+            await self.gate.wait()
+        return [{"category": "addition", "games": len(snapshot), "scores": snapshot, "name": "Ñandú"}]
+
+
+def build_app(cache, db):
+    app = FastAPI()
+
+    @app.get("/users/{user_id}/progress")
+    async def progress(request: Request, user_id: str):
+        return await cache.respond(request, user_id, "progress", lambda: db.progress(user_id))
+
+    @app.post("/users/{user_id}/scores")
+    async def save(user_id: str, score: int = 1):
+        db.rows.setdefault(user_id, []).append(score)
+        await cache.bump(user_id)
+        return {"ok": True}
+
+    @app.post("/users/{user_id}/touch")
+    async def touch(user_id: str):
+        # A write that does not change what /progress returns
+        await cache.bump(user_id)
+        return {"ok": True}
+
+    @app.get("/me")
+    async def me(request: Request):
+        return cache.conditional(request, {"id": "u1", "avatar": None})
+
+    return app
+
+
+def check(failures, condition, message):
+    if not condition:
+        failures.append(message)
+
+
+def test_etags(failures):
+    db = FakeDatabase()
+    cache = ResponseCache(MemoryBackend(), ttl=60, enabled=True)
+    client = TestClient(build_app(cache, db))
+
+    first = client.get("/users/u1/progress")
+    etag = first.headers.get("etag")
+    check(failures, first.status_code == 200 and etag and not etag.startswith("W/"), "first GET: no strong ETag")
+    check(failures, first.content == JSONResponse(first.json()).body, "body differs from FastAPI's JSONResponse")
+    check(failures, "no-cache" in first.headers.get("cache-control", ""), "Cache-Control without no-cache")
+
+    again = client.get("/users/u1/progress")
+    check(failures, again.headers.get("etag") == etag and db.calls == 1, f"repeat GET fetched ({db.calls} calls)")
+
+    for header in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+        res = client.get("/users/u1/progress", headers={"If-None-Match": header})
+        check(failures, res.status_code == 304 and not res.content, f"If-None-Match {header}: {res.status_code}")
+    check(failures, db.calls == 1, f"304s touched the database ({db.calls} calls)")
+    res = client.get("/users/u1/progress", headers={"If-None-Match": '"stale"'})
+    check(failures, res.status_code == 200, "non-matching If-None-Match did not get 200")
+
+    client.post("/users/u1/touch")
+    res = client.get("/users/u1/progress", headers={"If-None-Match": etag})
+    check(failures, res.status_code == 304 and db.calls == 2, "bump without changes: expected a fetch and 304")
+
+    client.post("/users/u1/scores?score=7")
+    res = client.get("/users/u1/progress", headers={"If-None-Match": etag})
+    check(failures, res.status_code == 200 and res.json()[0]["games"] == 1, "write not visible after bump")
+    check(failures, res.headers.get("etag") != etag and db.calls == 3, "ETag unchanged after the body changed")
+
+    other = client.get("/users/u2/progress")
+    check(failures, other.json()[0]["games"] == 0 and db.calls == 4, "users share cache entries")
+
+    me = client.get("/me")
+    res = client.get("/me", headers={"If-None-Match": me.headers["etag"]})
+    check(failures, res.status_code == 304, "conditional(): no 304")
+    return cache
+
+
+async def race(failures):
+    """A write lands while a read is still fetching the old rows."""
+    db = FakeDatabase()
+    cache = ResponseCache(MemoryBackend(), ttl=60, enabled=True)
+    request = Request({"type": "http", "headers": []})
+    db.gate = asyncio.Event()
+    slow = asyncio.create_task(cache.respond(request, "u1", "progress", lambda: db.progress("u1")))
+    await asyncio.sleep(0.05)
+    db.rows["u1"] = [5]
+    await cache.bump("u1")
+    db.gate.set()
+    await slow
+    db.gate = None
+    res = await cache.respond(request, "u1", "progress", lambda: db.progress("u1"))
+    check(failures, b'"games":1' in res.body, "a body fetched before the bump was served after it")
+
+
+async def eviction(failures):
+    """Versions pushed out of a tiny LRU must not bring back older entries."""
+    db = FakeDatabase()
+    cache = ResponseCache(MemoryBackend(maxsize=3), ttl=60, enabled=True)
+    request = Request({"type": "http", "headers": []})
+    await cache.respond(request, "u1", "progress", lambda: db.progress("u1"))
+    db.rows["u1"] = [1, 2]
+    await cache.bump("u1")
+    for n in range(10):
+        await cache.respond(request, f"x{n}", "progress", lambda: db.progress("x"))
+    res = await cache.respond(request, "u1", "progress", lambda: db.progress("u1"))
+    check(failures, b'"games":2' in res.body, "stale entry served after its version was evicted")
+
+
+def simulate(failures):
+    db = FakeDatabase()
+    cache = ResponseCache(MemoryBackend(), ttl=60, enabled=True)
+    client = TestClient(build_app(cache, db))
+    etags = {}
+    statuses = {200: 0, 304: 0}
+    started = time.perf_counter()
+    for poll in range(POLLS):
+        user = f"user{random.randrange(USERS)}"
+        if poll % WRITE_EVERY == 0:
+            client.post(f"/users/{user}/scores?score={poll}")
+        headers = {"If-None-Match": etags[user]} if user in etags else {}
+        res = client.get(f"/users/{user}/progress", headers=headers)
+        statuses[res.status_code] += 1
+        etags[user] = res.headers["etag"]
+        if res.status_code == 200:
+            check(failures, res.json()[0]["games"] == len(db.rows.get(user, [])), f"stale body for {user}")
+    elapsed = time.perf_counter() - started
+    stats = cache.stats()
+    print(f"   {POLLS:,} polls of {USERS} users, a write every {WRITE_EVERY}: {db.calls:,} database calls "
+          f"({POLLS - db.calls:,} saved), hit ratio {stats['hit_ratio']:.2%}, "
+          f"{statuses[304]:,} x 304 / {statuses[200]:,} x 200, {elapsed:.1f}s")
+    check(failures, db.calls < POLLS, "the cache saved no database call")
+
+
+def run_test():
+    print("--- 🏷️  Response cache (ETag / If-None-Match) Test ---")
+    failures = []
+    cache = test_etags(failures)
+    print(f"   ETag checks: {cache.stats()}")
+    asyncio.run(race(failures))
+    asyncio.run(eviction(failures))
+    simulate(failures)
+
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN")
+    print("=" * 60)
+    if failures:
+        for failure in failures[:20]:
+            print(f"  ❌ {failure}")
+        print(f"\n❌ TEST FAILED ({len(failures)} problems)")
+        sys.exit(1)
+    print("✅ TEST PASSED: 304s skip the database and every write is visible on the next poll")
+
+
+if __name__ == "__main__":
+    run_test()
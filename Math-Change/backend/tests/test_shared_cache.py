@@ -0,0 +1,222 @@
+"""
+Test of the shared cache backend (app/shared_cache.py) with several workers.
+
+Every "worker" is its own RedisBackend on the same LOCAL Redis (isolated by a
+random CACHE_PREFIX), as separate uvicorn processes would be, and checks:
+  - get/set/add/incr/delete and TTLs behave like the in-memory backend
+  - invalidate() runs the handlers of every other worker (pub/sub), which is
+    how identity_cache and analytics_cache copies are dropped
+  - a write on one worker (ResponseCache.bump) is seen by the next poll on
+    another, and a 304 on the second one needs no database call
+  - WORKERS GoogleKeyStores sharing the cache make ONE request to the key
+    server between them (stub server of test_google_keys_singleflight.py),
+    and a store that stopped waiting for the fetch lock leaves the holder's
+    lock in place (delete_if)
+  - an X-Profile token sent to every worker at once is claimed by exactly
+    one of them (pop)
+  - a cache that cannot be reached degrades to misses instead of errors
+
+Usage:
+    docker run --rm -p 6379:6379 redis:7
+    TEST_REDIS_URL=redis://localhost:6379/15 python tests/test_shared_cache.py
+"""
+import asyncio
+import os
+import sys
+import time
+import uuid
+
+from fastapi import Request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+from app.cache import TTLCache  # noqa: E402
+from app.keys import SHARED_KEYS, SHARED_LOCK, GoogleKeyStore  # noqa: E402
+from app.profiling import Profiler  # noqa: E402
+from app.response_cache import ResponseCache  # noqa: E402
+from app.shared_cache import MemoryBackend, RedisBackend, new_version  # noqa: E402
+from test_google_keys_singleflight import KID, StubKeyServer, make_key_pair  # noqa: E402
+
+REDIS_URL = os.getenv("TEST_REDIS_URL", "redis://localhost:6379/15")
+WORKERS = int(os.getenv("TEST_WORKERS", "4"))
+PREFIX = f"test-{uuid.uuid4().hex[:8]}:"
+
+
+def check(failures, condition, message):
+    if not condition:
+        failures.append(message)
+
+
+async def operations(failures, backend, name):
+    await backend.set("a", {"x": [1, "ñ"]})
+    check(failures, await backend.get("a") == {"x": [1, "ñ"]}, f"{name}: set/get")
+    check(failures, await backend.add("a", 2) is False, f"{name}: add over an existing key")
+    check(failures, await backend.add("b", 2) is True, f"{name}: add of a new key")
+    check(failures, await backend.incr("b") == 3, f"{name}: incr")
+    await backend.delete("a")
+    check(failures, await backend.get("a") is None, f"{name}: delete")
+    await backend.set("lock", "mine")
+    check(failures, await backend.delete_if("lock", "other") is False, f"{name}: delete_if of another value")
+    check(failures, await backend.get("lock") == "mine", f"{name}: delete_if deleted another owner's key")
+    check(failures, await backend.delete_if("lock", "mine") is True, f"{name}: delete_if of our value")
+    check(failures, await backend.get("lock") is None, f"{name}: delete_if left the key")
+    await backend.set("once", {"n": 1})
+    check(failures, await backend.pop("once") == {"n": 1}, f"{name}: pop value")
+    check(failures, await backend.pop("once") is None, f"{name}: pop left the key")
+    await backend.set("short", 1, ttl=0.2)
+    await asyncio.sleep(0.3)
+    check(failures, await backend.get("short") is None, f"{name}: TTL not applied")
+    version = await new_version(backend, "v:new")
+    check(failures, version > time.time_ns() - 10**10, f"{name}: a missing version restarted low ({version})")
+
+
+async def invalidations(failures, workers):
+    """Every worker keeps a local identity copy; one write must drop all of them."""
+    locals_ = []
+    for worker in workers:
+        local = TTLCache(maxsize=10, ttl=60)
+        local.set("token-sha", ("claims", {"id": "u1"}), tag="u1")
+        worker.on_invalidate("user", local.invalidate_tag)
+        locals_.append(local)
+    await asyncio.sleep(0.2)  # subscriptions are up
+    await workers[0].invalidate("user", "u1")
+    await asyncio.sleep(0.3)
+    dropped = sum(local.get("token-sha") is None for local in locals_)
+    print(f"   invalidation from worker 0: dropped in {dropped}/{len(workers)} workers")
+    check(failures, dropped == len(workers), f"invalidation reached {dropped}/{len(workers)} workers")
+    received = [w.stats()["invalidations_received"] for w in workers]
+    check(failures, received[0] == 0 and all(r == 1 for r in received[1:]), f"messages received: {received}")
+
+
+async def responses(failures, workers):
+    calls = {"n": 0}
+    rows = []
+
+    async def fetch():
+        calls["n"] += 1
+        return {"games": len(rows)}
+
+    caches = [ResponseCache(worker, ttl=60, enabled=True) for worker in workers]
+    plain = Request({"type": "http", "headers": []})
+    first = await caches[0].respond(plain, "u1", "progress", fetch)
+    etag = first.headers["etag"]
+    again = await caches[1].respond(
+        Request({"type": "http", "headers": [(b"if-none-match", etag.encode())]}), "u1", "progress", fetch
+    )
+    check(failures, again.status_code == 304 and calls["n"] == 1, "worker 1 did not reuse worker 0's response")
+
+    rows.append(1)
+    await caches[2 % len(caches)].bump("u1")
+    after = await caches[1].respond(plain, "u1", "progress", fetch)
+    check(failures, b'"games":1' in after.body, "a write on one worker was not visible on another")
+    print(f"   response cache across workers: {calls['n']} fetches for 3 polls and a write")
+
+
+async def google_keys(failures, workers, url, stub):
+    stores = [GoogleKeyStore(url, shared=worker) for worker in workers]
+    keys = await asyncio.gather(*[store.get_key(KID) for store in stores for _ in range(50)])
+    fetches = sum(store.fetch_count for store in stores)
+    loads = sum(store.shared_loads for store in stores)
+    print(f"   {len(stores)} key stores: {stub.requests} key server requests, {loads} copies from the shared cache")
+    check(failures, all(k is not None for k in keys), "a store has no key")
+    check(failures, stub.requests == 1 and fetches == 1, f"key server called {stub.requests} times")
+
+    # A token with a bogus kid refetches once, not once per worker
+    for store in stores:
+        store.min_refresh_interval = 0
+    await asyncio.gather(*[store.get_key("bogus-kid") for store in stores])
+    check(failures, stub.requests == 2, f"bogus kid: {stub.requests - 1} refetches")
+    check(failures, await workers[0].get(SHARED_LOCK) is None, "fetch lock left behind")
+
+    # A store that gave up waiting fetches without the lock: it must not release the holder's lock
+    await workers[0].delete(SHARED_KEYS)
+    await workers[1].add(SHARED_LOCK, workers[1].origin, ttl=30)
+    waiting = GoogleKeyStore(url, shared=workers[0], timeout=0.3)
+    await waiting.refresh()
+    check(failures, waiting.fetch_count == 1, "store did not fetch after its wait timed out")
+    check(failures, await workers[0].get(SHARED_LOCK) == workers[1].origin, "another worker's fetch lock was deleted")
+    await workers[1].delete_if(SHARED_LOCK, workers[1].origin)
+
+
+async def profile_tokens(failures, workers):
+    """The same token sent to every worker at once: one request is profiled."""
+    profilers = []
+    for worker in workers:
+        profiler = Profiler()
+        profiler.start(worker)
+        profilers.append(profiler)
+    rounds = 50
+    wins = []
+    for _ in range(rounds):
+        token = await profilers[0].issue_token()
+        claims = await asyncio.gather(*[profiler.claim(token) for profiler in profilers for _ in range(5)])
+        wins.append(sum(claims))
+    check(failures, all(n == 1 for n in wins), f"tokens claimed {sorted(set(wins))} times")
+    print(f"   X-Profile tokens: {rounds} tokens, {len(profilers) * 5} concurrent claims each, "
+          f"{sum(wins)} accepted")
+
+
+async def unreachable(failures):
+    backend = RedisBackend("redis://127.0.0.1:1/0", prefix=PREFIX)
+    cache = ResponseCache(backend, ttl=60, enabled=True)
+    res = await cache.respond(Request({"type": "http", "headers": []}), "u1", "progress", _static)
+    check(failures, res.status_code == 200, "an unreachable cache failed the request")
+    check(failures, backend.stats()["errors"] > 0, "errors not counted")
+    await backend.stop()
+
+
+async def _static():
+    return {"ok": True}
+
+
+async def run(failures):
+    await operations(failures, MemoryBackend(), "memory")
+    workers = [RedisBackend(REDIS_URL, prefix=PREFIX) for _ in range(WORKERS)]
+    try:
+        await operations(failures, workers[0], "redis")
+        for worker in workers:
+            worker.start()
+        await invalidations(failures, workers)
+        await responses(failures, workers)
+        await profile_tokens(failures, workers)
+
+        private_pem, cert_pem = make_key_pair()
+        stub = StubKeyServer({KID: cert_pem})
+        await google_keys(failures, workers, stub.url, stub)
+        stub.server.shutdown()
+        await unreachable(failures)
+    finally:
+        keys = [key async for key in workers[0]._redis.scan_iter(f"{PREFIX}*")]
+        if keys:
+            await workers[0]._redis.delete(*keys)
+        for worker in workers:
+            await worker.stop()
+
+
+def run_test():
+    print("--- 🔁 Shared cache backend Test ---")
+    print(f"Target: {REDIS_URL} ({WORKERS} workers)")
+    try:
+        import redis
+
+        redis.Redis.from_url(REDIS_URL).ping()
+    except Exception as e:
+        print(f"❌ CRITICAL: Could not connect to Redis: {e}")
+        sys.exit(1)
+
+    failures = []
+    asyncio.run(run(failures))
+
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN")
+    print("=" * 60)
+    if failures:
+        for failure in failures:
+            print(f"  ❌ {failure}")
+        print(f"\n❌ TEST FAILED ({len(failures)} problems)")
+        sys.exit(1)
+    print("✅ TEST PASSED: workers share keys, identities and responses, and invalidations reach all of them")
+
+
+if __name__ == "__main__":
+    run_test()
@@ -0,0 +1,207 @@
+"""
+Test of the opt-in tracing (app/tracing.py, TRACE_EXPORTER=file).
+
+Runs the real app (app.main) in a TestClient against the stub PostgREST of
+test_metrics.py and a stub Google key server, with spans written to a
+temporary file, and checks:
+  - one SERVER span per request named after the route template, whose trace
+    id is returned in X-Trace-ID
+  - child spans for the token verification and every Supabase call, in
+    order (table and operation as attributes)
+  - a request sending a W3C traceparent continues the caller's trace
+  - the Google key fetch of the warm-up is traced
+  - image jobs get one span per Pillow step, timed in the pool process
+  - a failing S3 call is a span with an error status
+and prints the cost per request with tracing off and on.
+
+Usage:
+    python tests/test_tracing.py
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from jose import jwt
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+from test_google_keys_singleflight import KID, StubKeyServer, make_key_pair  # noqa: E402
+from test_metrics import StubPostgrest, check  # noqa: E402
+
+PROJECT = "tracing-project"
+OVERHEAD_REQUESTS = int(os.getenv("TEST_OVERHEAD_REQUESTS", "2000"))
+PARENT_TRACE = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_SPAN = "00f067aa0ba902b7"
+
+
+def load_spans(path):
+    spans = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            span = json.loads(line)
+            span["trace"] = span["context"]["trace_id"][2:]
+            span["id"] = span["context"]["span_id"][2:]
+            span["parent"] = (span["parent_id"] or "0x")[2:]
+            spans.append(span)
+    return spans
+
+
+def children(spans, parent):
+    return [s for s in spans if s["parent"] == parent["id"]]
+
+
+def test_app(failures, private_pem, keys_url, trace_file):
+    from app.auth import google_keys
+    from app.images import image_processor, render_avatar
+    from app.main import app
+    from app.storage import storage
+    from app.tracing import tracing
+
+    # app.keys and app.tracing were imported (with their defaults) by test_google_keys_singleflight
+    google_keys.url = keys_url
+    tracing.exporter = "file"
+    tracing.path = trace_file
+
+    token = jwt.encode(
+        {"sub": "ana", "email": "ana@example.com", "aud": PROJECT, "exp": int(time.time()) + 600},
+        private_pem,
+        algorithm="RS256",
+        headers={"kid": KID},
+    )
+    headers = {"Authorization": f"Bearer {token}"}
+    buffer = io.BytesIO()
+    Image.new("RGB", (800, 600), "red").save(buffer, "JPEG")
+
+    async def background_work():
+        with tracing.span("job"):
+            await image_processor.submit(render_avatar, buffer.getvalue())
+            try:
+                await storage.call("head_bucket", Bucket="missing")
+            except Exception:
+                pass
+
+    with TestClient(app) as client:
+        res = client.get("/users/me/scores", headers=headers)
+        check(failures, res.status_code == 200, f"/users/me/scores: {res.status_code} {res.text[:100]}")
+        trace_id = res.headers.get("x-trace-id")
+        continued = client.get(
+            "/users/me/scores", headers={**headers, "traceparent": f"00-{PARENT_TRACE}-{PARENT_SPAN}-01"}
+        )
+        check(failures, continued.headers.get("x-trace-id") == PARENT_TRACE, "traceparent not continued")
+        client.portal.call(background_work)
+
+    spans = load_spans(trace_file)
+    print(f"   {len(spans)} spans written")
+    by_trace = [s for s in spans if s["trace"] == trace_id]
+    roots = [s for s in by_trace if s["kind"] == "SpanKind.SERVER"]
+    check(failures, len(roots) == 1, f"request spans of trace {trace_id}: {len(roots)}")
+    if roots:
+        root = roots[0]
+        check(failures, root["name"] == "GET /users/me/scores", f"request span named {root['name']}")
+        check(failures, root["attributes"].get("http.response.status_code") == 200, "status not on the request span")
+        steps = sorted(children(spans, root), key=lambda s: s["start_time"])
+        names = [s["name"] for s in steps]
+        expected = ["auth.verify_token", "supabase select users", "supabase select scores"]
+        check(failures, names == expected, f"request children {names}")
+        if names == expected:
+            check(failures, steps[1]["attributes"].get("db.collection.name") == "users", "table attribute")
+        print(f"   GET /users/me/scores: {', '.join(names)}")
+
+    outer = [s for s in spans if s["trace"] == PARENT_TRACE and s["kind"] == "SpanKind.SERVER"]
+    check(failures, len(outer) == 1 and outer[0]["parent"] == PARENT_SPAN, "request span not under the caller's span")
+
+    fetches = [s for s in spans if s["name"] == "google_keys.fetch"]
+    check(failures, len(fetches) == 1, f"google key fetch spans: {len(fetches)}")
+
+    image = [s for s in spans if s["name"] == "image.render_avatar"]
+    check(failures, len(image) == 1, "image span")
+    if image:
+        steps = [s["name"] for s in children(spans, image[0])]
+        for step in ("pillow.decode", "pillow.fit", "pillow.resize_64", "pillow.encode_500.webp"):
+            check(failures, step in steps, f"{step} missing from {steps}")
+        print(f"   image.render_avatar: {len(steps)} Pillow steps")
+
+    s3 = [s for s in spans if s["name"] == "s3.head_bucket"]
+    check(failures, len(s3) == 1 and s3[0]["status"]["status_code"] == "ERROR", "failed S3 call not an error span")
+
+
+def overhead():
+    from app.tracing import TracingMiddleware, tracing
+
+    def build(instrumented):
+        app = FastAPI()
+
+        @app.get("/ping/{n}")
+        async def ping(n: int):
+            with tracing.span("work"):
+                return {"n": n}
+
+        if instrumented:
+            app.add_middleware(TracingMiddleware)
+        return app
+
+    async def run(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://t") as client:
+            for n in range(200):
+                await client.get(f"/ping/{n}")
+            started = time.perf_counter()
+            for n in range(OVERHEAD_REQUESTS):
+                await client.get(f"/ping/{n}")
+            return (time.perf_counter() - started) / OVERHEAD_REQUESTS * 1e6
+
+    plain = asyncio.run(run(build(False)))
+    disabled = asyncio.run(run(build(True)))
+    tracing.path = os.devnull
+    tracing.start()
+    enabled = asyncio.run(run(build(True)))
+    tracing.stop()
+    print(f"   per request: {plain:.0f}µs, tracing off {disabled:.0f}µs ({disabled - plain:+.0f}µs), "
+          f"on {enabled:.0f}µs ({enabled - plain:+.0f}µs)")
+
+
+def run_test():
+    print("--- 🧵 Tracing Test ---")
+    private_pem, cert_pem = make_key_pair()
+    keys = StubKeyServer({KID: cert_pem})
+    postgrest = StubPostgrest()
+    os.environ.update({
+        "SUPABASE_URL": postgrest.url,
+        "SUPABASE_KEY": "test",
+        "FIREBASE_PROJECT_ID": PROJECT,
+        "RESPONSE_CACHE": "false",
+        "CACHE_URL": "memory",
+        # Nothing listens there: the S3 call fails fast
+        "S3_ENDPOINT_URL": "http://127.0.0.1:1",
+        "S3_ACCESS_KEY": "test",
+        "S3_SECRET_KEY": "test",
+    })
+    trace_file = os.path.join(tempfile.mkdtemp(prefix="traces-"), "traces.jsonl")
+
+    failures = []
+    test_app(failures, private_pem, keys.url, trace_file)
+    overhead()
+    keys.server.shutdown()
+    postgrest.server.shutdown()
+
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN")
+    print("=" * 60)
+    if failures:
+        for failure in failures:
+            print(f"  ❌ {failure}")
+        print(f"\n❌ TEST FAILED ({len(failures)} problems)")
+        sys.exit(1)
+    print("✅ TEST PASSED: requests, Supabase, auth, Google keys, Pillow and S3 are traced")
+
+
+if __name__ == "__main__":
+    run_test()
@@ -0,0 +1,116 @@
+"""
+Test of the avatar size limit before the upload is received
+(UploadLimitMiddleware in app/images.py, POST /upload-avatar).
+
+Calls the real app (app.main) as an ASGI app, counting the body messages it
+pulls from the client, and checks:
+  - a Content-Length above AVATAR_MAX_BYTES gets 413 without reading a byte
+    of the body, before authentication
+  - a chunked body (no Content-Length) gets 413 once the limit is passed,
+    without reading the rest
+  - a small upload and other routes go through (401 without a token)
+
+Usage:
+    python tests/test_upload_limit.py
+"""
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+from test_metrics import check  # noqa: E402
+
+CHUNK = 64 * 1024
+BOUNDARY = "limit-test"
+
+
+def multipart(size):
+    """Body of a form with one `file` field of size bytes."""
+    head = (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.jpg\"\r\n"
+            "Content-Type: image/jpeg\r\n\r\n").encode()
+    return head + b"x" * size + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+async def call(app, path, body, content_length=True):
+    """(status, detail, body chunks read) of a POST of body, sent in CHUNK pieces."""
+    chunks = [body[offset:offset + CHUNK] for offset in range(0, len(body), CHUNK)]
+    headers = [(b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode())]
+    if content_length:
+        headers.append((b"content-length", str(len(body)).encode()))
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "root_path": "", "headers": headers, "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80),
+    }
+    read = 0
+    sent = []
+
+    async def receive():
+        nonlocal read
+        if read < len(chunks):
+            read += 1
+            return {"type": "http.request", "body": chunks[read - 1], "more_body": read < len(chunks)}
+        await asyncio.sleep(3600)  # no disconnect while the app answers
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    status = next(m["status"] for m in sent if m["type"] == "http.response.start")
+    body = b"".join(m.get("body", b"") for m in sent if m["type"] == "http.response.body")
+    try:
+        detail = json.loads(body).get("detail")
+    except ValueError:
+        detail = None
+    return status, detail, read
+
+
+async def run(failures):
+    from app.images import AVATAR_MAX_BYTES
+    from app.main import AVATAR_TOO_LARGE, app
+
+    too_large = multipart(AVATAR_MAX_BYTES + 1024 * 1024)
+    total = -(-len(too_large) // CHUNK)
+
+    # 1. Announced size over the limit: refused before the body and the token are read
+    status, detail, read = await call(app, "/upload-avatar", too_large)
+    check(failures, status == 413 and detail == AVATAR_TOO_LARGE, f"Content-Length over the limit: {status} {detail}")
+    check(failures, read == 0, f"{read} body chunks read before refusing")
+    print(f"   Content-Length {len(too_large):,}: {status}, {read} body chunks read")
+
+    # 2. Chunked: refused once the limit is passed, the rest is never read
+    status, detail, read = await call(app, "/upload-avatar", too_large, content_length=False)
+    check(failures, status == 413 and detail == AVATAR_TOO_LARGE, f"chunked body over the limit: {status} {detail}")
+    check(failures, read < total, f"chunked body read to the end ({read}/{total} chunks)")
+    print(f"   chunked {len(too_large):,}: {status}, {read}/{total} body chunks read")
+
+    # 3. Below the limit, and other routes, reach the route (no token: 401)
+    status, _, _ = await call(app, "/upload-avatar", multipart(10 * 1024))
+    check(failures, status == 401, f"small upload: {status}")
+    status, _, _ = await call(app, "/scores/batch", too_large)
+    check(failures, status != 413, f"another route limited: {status}")
+
+
+def run_test():
+    print("--- 📏 Upload size limit Test ---")
+    os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:1")
+    os.environ.setdefault("SUPABASE_KEY", "test")
+
+    failures = []
+    asyncio.run(run(failures))
+
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN")
+    print("=" * 60)
+    if failures:
+        for failure in failures:
+            print(f"  ❌ {failure}")
+        print(f"\n❌ TEST FAILED ({len(failures)} problems)")
+        sys.exit(1)
+    print("✅ TEST PASSED: oversized avatars are refused before their body is received")
+
+
+if __name__ == "__main__":
+    run_test()
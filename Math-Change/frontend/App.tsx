@@ -8,7 +8,7 @@ import StudyTablesScreen from './components/StudyTablesScreen';
 import LoginScreen from './components/LoginScreen';
 import ProfileScreen from './components/ProfileScreen';
 import AdminPanel from './components/AdminPanel';
-import { saveScore, saveUser, getCurrentUserFull } from './services/storageService';
+import { saveScore, saveUser, getCurrentUserFull, queuePendingScore, flushPendingScores, isRetryableError } from './services/storageService';
 import * as firebaseAuth from './services/firebaseAuthService';
 import { User as FirebaseUser } from 'firebase/auth';
 
@@ -65,6 +65,15 @@ const App: React.FC = () => {
     return () => unsubscribe();
   }, []);
 
+  // Replay the games saved offline as soon as the user and the connection are back
+  useEffect(() => {
+    if (!currentUser) return;
+    const flush = () => { flushPendingScores(currentUser.id); };
+    flush();
+    window.addEventListener('online', flush);
+    return () => window.removeEventListener('online', flush);
+  }, [currentUser?.id]);
+
   // Difficulty Mapping for Progression
   const difficultyOrder: Difficulty[] = ['easy', 'easy_medium', 'medium', 'medium_hard', 'hard', 'random_tables'];
 
@@ -121,14 +130,22 @@ const App: React.FC = () => {
       avgTime: avgTime,
       date: new Date().toISOString(),
       category: category,
-      difficulty: category === 'challenge' ? 'mixed' : difficulty
+      difficulty: category === 'challenge' ? 'mixed' : difficulty,
+      // Same key on every retry of this game, so the server saves it only once
+      idempotency_key: `${Date.now()}-${Math.random().toString(36).slice(2)}`
     };
 
     try {
       await saveScore(record);
     } catch (error: any) {
       console.error("Failed to save score:", error);
-      alert(`Error guardando puntuación: ${error.message || 'Error desconocido'}`);
+      if (currentUser && isRetryableError(error)) {
+        // Kept on this device and sent again with the next batch
+        queuePendingScore(currentUser.id, record);
+        alert('Sin conexión con el servidor: la partida se guardará cuando vuelva la conexión.');
+      } else {
+        alert(`Error guardando puntuación: ${error.message || 'Error desconocido'}`);
+      }
     }
 
     // --- LEVEL PROGRESSION LOGIC ---
@@ -1,7 +1,7 @@
 
 import React, { useState, useEffect } from 'react';
 import { User, UserRole } from '../types';
-import { getAllUsers, saveUser, deleteUser, getStorageUsage, getAllScores, getUserDetailedAnalytics } from '../services/storageService';
+import { getAllUsers, saveUser, deleteUser, getStorageUsage, getAdminStats, getUserDetailedAnalytics, avatarUrl } from '../services/storageService';
 import {
   ArrowLeft, Users, Shield, Activity, Database, Search,
   Edit, Trash2, UserX, UserCheck, Plus, X, Key, Check, BarChart2, Calendar, Target, Trophy, Clock, Zap
@@ -75,6 +75,8 @@ const AdminPanel: React.FC<Props> = ({ onBack }) => {
     totalUsers: 0,
     activeUsers: 0,
     totalGamesPlayed: 0,
+    gamesLast30Days: 0,
+    playersLast30Days: 0,
     storage: '0 KB'
   });
 
@@ -92,8 +94,7 @@ const AdminPanel: React.FC<Props> = ({ onBack }) => {
   }, []);
 
   const loadData = async () => {
-    const allUsers = await getAllUsers();
-    const allScores = await getAllScores();
+    const [allUsers, adminStats] = await Promise.all([getAllUsers(), getAdminStats()]);
 
     setUsers(allUsers);
 
@@ -101,7 +102,9 @@ const AdminPanel: React.FC<Props> = ({ onBack }) => {
     setStats({
       totalUsers: allUsers.length,
       activeUsers: allUsers.filter(u => u.status === 'ACTIVE').length,
-      totalGamesPlayed: allScores.length,
+      totalGamesPlayed: adminStats.total_games,
+      gamesLast30Days: adminStats.last_30_days?.games ?? 0,
+      playersLast30Days: adminStats.last_30_days?.active_users ?? 0,
       storage: getStorageUsage()
     });
   };
@@ -126,7 +129,7 @@ const AdminPanel: React.FC<Props> = ({ onBack }) => {
 
   const handleViewStats = async (user: User) => {
     setStatsUser(user);
-    const data = await getUserDetailedAnalytics(user.username);
+    const data = await getUserDetailedAnalytics(user.id);
     setUserStatsData(data);
     setShowStatsModal(true);
   };
@@ -192,11 +195,11 @@ const AdminPanel: React.FC<Props> = ({ onBack }) => {
           <Users className="text-blue-400 opacity-50" />
         </div>
         <div className="bg-black/30 border border-white/10 p-4 rounded-xl flex items-center justify-between">
-          <div><p className="text-gray-400 text-xs uppercase">Partidas</p><p className="text-2xl font-bold text-green-400">{stats.totalGamesPlayed}</p></div>
+          <div><p className="text-gray-400 text-xs uppercase">Partidas</p><p className="text-2xl font-bold text-green-400">{stats.totalGamesPlayed}</p><p className="text-gray-500 text-xs">{stats.gamesLast30Days} en 30 días</p></div>
           <Activity className="text-green-400 opacity-50" />
         </div>
         <div className="bg-black/30 border border-white/10 p-4 rounded-xl flex items-center justify-between">
-          <div><p className="text-gray-400 text-xs uppercase">Activos</p><p className="text-2xl font-bold text-yellow-400">{stats.activeUsers}</p></div>
+          <div><p className="text-gray-400 text-xs uppercase">Activos</p><p className="text-2xl font-bold text-yellow-400">{stats.activeUsers}</p><p className="text-gray-500 text-xs">{stats.playersLast30Days} jugaron en 30 días</p></div>
           <UserCheck className="text-yellow-400 opacity-50" />
         </div>
         <div className="bg-black/30 border border-white/10 p-4 rounded-xl flex items-center justify-between">
@@ -240,7 +243,7 @@ const AdminPanel: React.FC<Props> = ({ onBack }) => {
                   <td className="p-4">
                     <div className="flex items-center gap-3">
                       <div className="w-10 h-10 rounded-full bg-slate-700 flex items-center justify-center overflow-hidden border border-white/10 shrink-0">
-                        {user.avatar ? <img src={user.avatar} className="w-full h-full object-cover" /> : <span className="font-bold text-gray-400">{user.username[0]}</span>}
+                        {user.avatar ? <img src={avatarUrl(user.avatar, 64)} className="w-full h-full object-cover" /> : <span className="font-bold text-gray-400">{user.username[0]}</span>}
                       </div>
                       <div>
                         <div className="font-bold text-white">{user.username}</div>
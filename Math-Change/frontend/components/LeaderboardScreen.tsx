@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { ScoreRecord, CategoryProgress, GameCategory } from '../types';
-import { getTopScoresByUser, getUserProgress, deleteScoreById } from '../services/storageService';
-import { ArrowLeft, Calendar, CheckCircle, XCircle, ChevronDown, ChevronUp, Plus, Minus, X, Divide, Hash, Zap, BrainCircuit, Calculator, TrendingUp, Target, Gamepad2, Trash2 } from 'lucide-react';
+import { getUserAnalytics, getUserProgress, deleteScoreById, getRankings, getMyRanking, UserAnalytics, RankingEntry, RankingPeriod, MyRanking } from '../services/storageService';
+import { ArrowLeft, Calendar, CheckCircle, XCircle, ChevronDown, ChevronUp, Plus, Minus, X, Divide, Hash, Zap, BrainCircuit, Calculator, TrendingUp, Target, Gamepad2, Trash2, Trophy } from 'lucide-react';
 
 interface Props {
   username: string;
@@ -28,47 +28,73 @@ const DIFFICULTY_LABELS: Record<string, string> = {
   mixed: 'Mix'
 };
 
+const RANKING_PERIODS: { key: RankingPeriod; label: string }[] = [
+  { key: 'day', label: 'Hoy' },
+  { key: 'week', label: 'Semana' },
+  { key: 'all', label: 'Siempre' }
+];
+
+const RANKING_SIZE = 10;
+
 const ProgressScreen: React.FC<Props> = ({ username, onBack }) => {
-  const [scores, setScores] = useState<ScoreRecord[]>([]);
+  const [analytics, setAnalytics] = useState<UserAnalytics | null>(null);
   const [progress, setProgress] = useState<CategoryProgress[]>([]);
   const [expandedCategory, setExpandedCategory] = useState<string | null>(null);
+  const [rankingPeriod, setRankingPeriod] = useState<RankingPeriod>('week');
+  const [ranking, setRanking] = useState<RankingEntry[]>([]);
+  const [myRanking, setMyRanking] = useState<MyRanking | null>(null);
 
   const fetchData = async () => {
-    const [scoresData, progressData] = await Promise.all([
-      getTopScoresByUser(username),
+    const [analyticsData, progressData] = await Promise.all([
+      getUserAnalytics('me'),
       getUserProgress()
     ]);
-    setScores(scoresData);
+    setAnalytics(analyticsData);
     setProgress(progressData);
   };
 
+  // Top players of the period and our own position (materialized server-side)
+  const fetchRanking = async (period: RankingPeriod) => {
+    const [page, mine] = await Promise.all([
+      getRankings({ period, limit: RANKING_SIZE }),
+      getMyRanking({ period })
+    ]);
+    setRanking(page.items);
+    setMyRanking(mine);
+  };
+
   useEffect(() => {
     fetchData();
   }, [username]);
 
+  useEffect(() => {
+    fetchRanking(rankingPeriod);
+  }, [username, rankingPeriod]);
+
   const handleDeleteScore = async (scoreId: string) => {
     if (!window.confirm("¿Eliminar este registro?")) return;
     try {
       await deleteScoreById(scoreId);
-      await fetchData(); // Refresh data to see updated stats
+      await Promise.all([fetchData(), fetchRanking(rankingPeriod)]); // Refresh data to see updated stats
     } catch (e) {
       alert("Error eliminando: " + e);
     }
   };
 
-  // Calculate overall stats
-  const totalGames = scores.length;
-  const totalCorrect = scores.reduce((sum, s) => sum + s.correctCount, 0);
-  const totalErrors = scores.reduce((sum, s) => sum + s.errorCount, 0);
-  const avgScore = totalGames > 0 ? Math.round(scores.reduce((sum, s) => sum + s.score, 0) / totalGames) : 0;
+  // Overall stats, aggregated by the server
+  const totalGames = analytics?.totals.games ?? 0;
+  const totalCorrect = analytics?.totals.correct ?? 0;
+  const avgScore = analytics?.totals.avg_score ?? 0;
 
-  // Group scores by category
+  // Latest games of each category (the server sends the last few per category)
   const scoresByCategory: Record<string, ScoreRecord[]> = {};
-  scores.forEach(s => {
+  (analytics?.recent_games ?? []).forEach(s => {
     const cat = s.category || 'unknown';
     if (!scoresByCategory[cat]) scoresByCategory[cat] = [];
     scoresByCategory[cat].push(s);
   });
+  const statsByCategory: Record<string, { games: number; avg_score: number | null }> = {};
+  (analytics?.by_category ?? []).forEach(c => { statsByCategory[c.key] = c; });
 
   // Get categories with history (from progress or scores)
   const playedCategories = [...new Set([
@@ -110,6 +136,53 @@ const ProgressScreen: React.FC<Props> = ({ username, onBack }) => {
 
       {/* Category Progress Cards */}
       <div className="flex-1 overflow-y-auto space-y-3 pr-1 custom-scrollbar">
+        {/* Ranking */}
+        <div className="bg-white/5 border border-white/10 rounded-xl p-3">
+          <div className="flex items-center justify-between mb-2">
+            <h3 className="flex items-center text-xs text-gray-500 uppercase tracking-wider font-semibold">
+              <Trophy className="text-yellow-400 mr-2" size={14} />Ranking
+            </h3>
+            <div className="flex bg-black/20 rounded-lg p-0.5">
+              {RANKING_PERIODS.map(p => (
+                <button
+                  key={p.key}
+                  onClick={() => setRankingPeriod(p.key)}
+                  className={`px-2 py-0.5 rounded-md text-xs transition-colors ${rankingPeriod === p.key ? 'bg-white/20 text-white' : 'text-gray-400 hover:text-white'}`}
+                >
+                  {p.label}
+                </button>
+              ))}
+            </div>
+          </div>
+
+          {ranking.length === 0 ? (
+            <p className="text-center text-sm text-gray-500 py-2">Nadie ha jugado todavía en este periodo.</p>
+          ) : (
+            <div className="space-y-1">
+              {ranking.map(entry => {
+                const name = entry.users?.username ?? '—';
+                const isMe = myRanking?.rank === entry.rank;
+                return (
+                  <div key={entry.user_id} className={`flex items-center justify-between text-sm px-2 py-1 rounded-lg ${isMe ? 'bg-yellow-400/10 text-yellow-300' : 'text-gray-300'}`}>
+                    <div className="flex items-center space-x-2 min-w-0">
+                      <span className="w-6 text-right text-xs text-gray-500">{entry.rank}</span>
+                      <span className="truncate">{name}</span>
+                    </div>
+                    <span className="text-xs text-gray-400 whitespace-nowrap">{entry.total_score} pts • {entry.games} partidas</span>
+                  </div>
+                );
+              })}
+            </div>
+          )}
+
+          {myRanking && myRanking.rank !== null && myRanking.rank > ranking.length && (
+            <div className="flex items-center justify-between text-sm px-2 py-1 mt-1 rounded-lg bg-yellow-400/10 text-yellow-300 border-t border-white/5">
+              <span>Tu posición: {myRanking.rank}</span>
+              <span className="text-xs whitespace-nowrap">{myRanking.total_score} pts • {myRanking.games} partidas</span>
+            </div>
+          )}
+        </div>
+
         <h3 className="text-xs text-gray-500 uppercase tracking-wider font-semibold mb-2">Progreso por Categoría</h3>
 
         {playedCategories.length === 0 ? (
@@ -124,13 +197,12 @@ const ProgressScreen: React.FC<Props> = ({ username, onBack }) => {
             const catScores = scoresByCategory[catKey] || [];
             const isExpanded = expandedCategory === catKey;
 
-            const catTotalGames = catProgress?.total_games ?? catScores.length; // Use stats from DB or fallback
+            const catStats = statsByCategory[catKey];
+            const catTotalGames = catProgress?.total_games ?? catStats?.games ?? 0; // Use stats from DB or fallback
             // Prioritize DB stats because they are accurate (synced)
             const catAccuracy = catProgress && (catProgress.total_correct + catProgress.total_errors > 0)
               ? Math.round((catProgress.total_correct / (catProgress.total_correct + catProgress.total_errors)) * 100)
-              : catScores.length > 0
-                ? Math.round(catScores.reduce((sum, s) => sum + s.score, 0) / catScores.length)
-                : 0;
+              : catStats?.avg_score ?? 0;
 
             const unlockedLevel = catProgress?.unlocked_level ?? 0;
 
@@ -2,6 +2,7 @@
 import React, { useState, useEffect } from 'react';
 import { GameCategory, Difficulty, User } from '../types';
 import { Trophy, Play, Calculator, Plus, Minus, X, Divide, Signal, Hash, Zap, BrainCircuit, BookOpen, Settings, Shield, LogOut, Lock } from 'lucide-react';
+import { avatarUrl } from '../services/storageService';
 
 interface Props {
   user: User | null;
@@ -125,7 +126,7 @@ const WelcomeScreen: React.FC<Props> = ({ user, onStart, onLeaderboard, onStudy,
         {user?.avatar && !imgError ? (
           <div className="w-16 h-16 rounded-full overflow-hidden border-2 border-blue-400 relative z-10 shadow-lg">
             <img
-              src={user.avatar}
+              src={avatarUrl(user.avatar, 128)}
               alt="User"
               className="w-full h-full object-cover"
               onError={() => setImgError(true)}
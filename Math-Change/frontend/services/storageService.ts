@@ -6,6 +6,23 @@ const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
 // --- FIREBASE TOKEN MANAGEMENT ---
 // Deprecated: We now obtain token directly from Firebase SDK per request to ensure freshness
 
+// Error answered by the API, with its HTTP status (a failed fetch throws a TypeError instead)
+export class ApiError extends Error {
+  status: number;
+
+  constructor(message: string, status: number) {
+    super(message);
+    this.name = 'ApiError';
+    this.status = status;
+  }
+}
+
+// Worth sending again later: no answer at all (offline), a server error, a
+// timeout or a rate limit. Any other 4xx (422 invalid game, 413 too large)
+// would be refused the same way on every retry.
+export const isRetryableError = (error: unknown): boolean =>
+  !(error instanceof ApiError) || error.status >= 500 || error.status === 408 || error.status === 429;
+
 // HELPER with Firebase Auth
 async function apiRequest<T>(endpoint: string, method: string = 'GET', body?: any): Promise<T> {
   // Always get a fresh token from the SDK
@@ -29,7 +46,7 @@ async function apiRequest<T>(endpoint: string, method: string = 'GET', body?: an
 
   if (!response.ok) {
     const err = await response.json().catch(() => ({}));
-    throw new Error(err.detail || err.message || 'API Error');
+    throw new ApiError(err.detail || err.message || 'API Error', response.status);
   }
 
   return response.json() as Promise<T>;
@@ -48,24 +65,139 @@ export const saveScore = async (record: ScoreRecord): Promise<void> => {
   }
 };
 
-export const getTopScoresByUser = async (username: string): Promise<ScoreRecord[]> => {
+// --- OFFLINE QUEUE ---
+// Games that could not be saved (no connection, server error) wait in
+// localStorage, per user, and are sent together with POST /scores/batch.
+// Each game keeps its idempotency_key, so a batch that reached the server
+// but whose response was lost can be replayed without saving anything twice.
+// Games the server refuses (4xx, see isRetryableError) are never queued, and
+// a queued one refused on replay is dropped so it cannot block the rest.
+
+const PENDING_SCORES_PREFIX = 'pendingScores:';
+const SCORE_BATCH_SIZE = 500;
+
+export interface BatchSavedScore {
+  id: string | null;
+  idempotency_key: string | null;
+  duplicate: boolean;
+}
+
+export const saveScoresBatch = async (records: ScoreRecord[]): Promise<BatchSavedScore[]> => {
+  const res = await apiRequest<{ results: BatchSavedScore[] }>('/scores/batch', 'POST', { scores: records });
+  return res.results;
+};
+
+const readPendingScores = (userId: string): ScoreRecord[] => {
   try {
-    const scores = await apiRequest<ScoreRecord[]>(`/scores?user=${encodeURIComponent(username)}`);
-    // Return all scores sorted by date (newest first)
-    return scores.sort((a, b) => new Date(b.date).getTime() - new Date(a.date).getTime());
+    return JSON.parse(localStorage.getItem(PENDING_SCORES_PREFIX + userId) || '[]');
+  } catch {
+    return [];
+  }
+};
+
+export const queuePendingScore = (userId: string, record: ScoreRecord): void => {
+  const pending = readPendingScores(userId);
+  pending.push(record);
+  localStorage.setItem(PENDING_SCORES_PREFIX + userId, JSON.stringify(pending));
+};
+
+// Sends the queued games of this user; returns how many were saved
+export const flushPendingScores = async (userId: string): Promise<number> => {
+  let pending = readPendingScores(userId);
+  let sent = 0;
+  // Games of a refused batch still to be sent one by one
+  let oneByOne = 0;
+  while (pending.length > 0) {
+    const chunk = pending.slice(0, oneByOne > 0 ? 1 : SCORE_BATCH_SIZE);
+    oneByOne = Math.max(oneByOne - 1, 0);
+    try {
+      await saveScoresBatch(chunk);
+      sent += chunk.length;
+    } catch (error) {
+      if (isRetryableError(error)) {
+        // Still offline or the server is failing: keep the queue for the next flush
+        console.error("Error replaying pending scores:", error);
+        break;
+      }
+      if (chunk.length > 1) {
+        // One refused game fails its whole batch: send its games one by one to find it
+        oneByOne = chunk.length;
+        continue;
+      }
+      console.warn("Dropping a pending score refused by the server:", chunk[0], error);
+    }
+    // Re-read: a game may have been queued while the request was in flight
+    pending = readPendingScores(userId).slice(chunk.length);
+    if (pending.length > 0) {
+      localStorage.setItem(PENDING_SCORES_PREFIX + userId, JSON.stringify(pending));
+    } else {
+      localStorage.removeItem(PENDING_SCORES_PREFIX + userId);
+    }
+  }
+  return sent;
+};
+
+// History of the logged-in user, newest first (sorted by the server)
+export const getMyScores = async (): Promise<ScoreRecord[]> => {
+  try {
+    return await apiRequest<ScoreRecord[]>('/users/me/scores');
   } catch (error) {
     console.error("Error fetching scores:", error);
     return [];
   }
 };
 
-// NEW: Get all scores for admin analytics
-export const getAllScores = async (): Promise<ScoreRecord[]> => {
+// Users ranked by total points per period (materialized, see GET /leaderboard/rankings)
+export type RankingPeriod = 'day' | 'week' | 'all';
+
+export interface RankingEntry {
+  user_id: string;
+  total_score: number;
+  games: number;
+  best_score: number;
+  users: { username: string; avatar?: string | null } | null;
+  rank: number;
+}
+
+export interface RankingPage {
+  items: RankingEntry[];
+  next_cursor: string | null;
+}
+
+export interface MyRanking {
+  rank: number | null;
+  total_score: number;
+  games: number;
+  best_score: number;
+}
+
+const rankingParams = (options: Record<string, string | number | undefined>): string => {
+  const params = new URLSearchParams();
+  Object.entries(options).forEach(([key, value]) => {
+    if (value !== undefined && value !== null) params.append(key, String(value));
+  });
+  return params.toString();
+};
+
+export const getRankings = async (
+  options: { category?: string; difficulty?: string; period?: RankingPeriod; limit?: number; cursor?: string } = {}
+): Promise<RankingPage> => {
   try {
-    return await apiRequest<ScoreRecord[]>('/scores');
+    return await apiRequest<RankingPage>(`/leaderboard/rankings?${rankingParams(options)}`);
   } catch (error) {
-    console.error("Error fetching all scores:", error);
-    return [];
+    console.error("Error fetching rankings:", error);
+    return { items: [], next_cursor: null };
+  }
+};
+
+export const getMyRanking = async (
+  options: { category?: string; difficulty?: string; period?: RankingPeriod } = {}
+): Promise<MyRanking | null> => {
+  try {
+    return await apiRequest<MyRanking>(`/leaderboard/rankings/me?${rankingParams(options)}`);
+  } catch (error) {
+    console.error("Error fetching my ranking:", error);
+    return null;
   }
 };
 
@@ -73,92 +205,109 @@ export const deleteScoreById = async (scoreId: string): Promise<void> => {
   await apiRequest(`/scores/${scoreId}`, { method: 'DELETE' });
 };
 
-// NEW: Get basic stats (used in table list)
-export const getUserStatsSummary = async (username: string) => {
-  const userScores = await apiRequest<ScoreRecord[]>(`/scores?user=${encodeURIComponent(username)}`); // Optimized to fetch only user scores
+// Per-user analytics aggregated by the server (GET /users/{id}/analytics).
+// Fixed-size payload: it does not grow with the number of games played.
+export interface AnalyticsStats {
+  games: number;
+  avg_score: number | null;
+  best_score: number | null;
+  correct: number;
+  errors: number;
+  accuracy: number | null;
+  avg_time_per_question: number | null;
+  last_played_at: string | null;
+}
 
-  const totalGames = userScores.length;
-  if (totalGames === 0) {
-    return { totalGames: 0, avgScore: 0, accuracy: 0, recentGames: [] };
-  }
+export interface AnalyticsBreakdown extends AnalyticsStats {
+  key: string;
+}
 
-  const totalScore = userScores.reduce((acc, curr) => acc + curr.score, 0);
-  const totalCorrect = userScores.reduce((acc, curr) => acc + curr.correctCount, 0);
-  const totalQuestions = userScores.reduce((acc, curr) => acc + (curr.correctCount + curr.errorCount), 0);
+export interface UserAnalytics {
+  totals: AnalyticsStats;
+  by_category: AnalyticsBreakdown[];
+  by_difficulty: AnalyticsBreakdown[];
+  trend: { day: string; games: number; avg_score: number; accuracy: number | null }[];
+  streaks: { current: number; best: number; days_played: number };
+  recent_games: ScoreRecord[];
+}
 
-  const avgScore = Math.round(totalScore / totalGames);
-  const accuracy = totalQuestions > 0 ? Math.round((totalCorrect / totalQuestions) * 100) : 0;
+// userId 'me' = the logged-in user
+export const getUserAnalytics = async (userId: string): Promise<UserAnalytics | null> => {
+  try {
+    return await apiRequest<UserAnalytics>(`/users/${encodeURIComponent(userId)}/analytics`);
+  } catch (error) {
+    console.error("Error fetching analytics:", error);
+    return null;
+  }
+};
 
-  // Sort by date descending
-  const recentGames = userScores.sort((a, b) => new Date(b.date).getTime() - new Date(a.date).getTime()).slice(0, 5);
+// Activity of every user over the last days, from the daily rollups
+export interface ScoreActivity {
+  days: number;
+  games: number;
+  active_users: number;
+  by_day: { day: string; games: number; active_users: number }[];
+  by_category: { key: string; games: number; active_users: number; avg_score: number }[];
+}
 
-  return { totalGames, avgScore, accuracy, recentGames };
-};
+export interface AdminStats {
+  total_games: number;
+  last_30_days: ScoreActivity | null;
+}
 
-// NEW: Advanced Analytics for Charts and Breakdowns
-export const getUserDetailedAnalytics = async (username: string) => {
-  // Can optimize by fetching only user scores if backend supports it (which it does now)
-  const userScores = await apiRequest<ScoreRecord[]>(`/scores?user=${encodeURIComponent(username)}`);
+// Global counters of the admin panel
+export const getAdminStats = async (): Promise<AdminStats> => {
+  try {
+    return await apiRequest<AdminStats>('/admin/stats');
+  } catch (error) {
+    console.error("Error fetching admin stats:", error);
+    return { total_games: 0, last_30_days: null };
+  }
+};
 
-  // Filter and Sort by Date Ascending for the Graph
-  userScores.sort((a, b) => new Date(a.date).getTime() - new Date(b.date).getTime());
+// NEW: Get basic stats (used in table list)
+export const getUserStatsSummary = async (userId: string) => {
+  const analytics = await getUserAnalytics(userId);
+  if (!analytics || analytics.totals.games === 0) {
+    return { totalGames: 0, avgScore: 0, accuracy: 0, recentGames: [] };
+  }
 
-  if (userScores.length === 0) return null;
+  return {
+    totalGames: analytics.totals.games,
+    avgScore: analytics.totals.avg_score ?? 0,
+    accuracy: analytics.totals.accuracy ?? 0,
+    recentGames: analytics.recent_games.slice(0, 5) // newest first
+  };
+};
 
-  // 1. History for Graph
-  const history = userScores.map(s => ({
-    date: new Date(s.date).toLocaleDateString(undefined, { month: 'short', day: 'numeric', hour: '2-digit', minute: '2-digit' }),
-    score: s.score,
-    category: s.category || 'N/A',
-    difficulty: s.difficulty || 'N/A'
+// NEW: Advanced Analytics for Charts and Breakdowns
+export const getUserDetailedAnalytics = async (userId: string) => {
+  const analytics = await getUserAnalytics(userId);
+  if (!analytics || analytics.totals.games === 0) return null;
+
+  // 1. Daily average of the last days for the Graph
+  const history = analytics.trend.map(t => ({
+    date: new Date(t.day).toLocaleDateString(undefined, { month: 'short', day: 'numeric' }),
+    score: t.avg_score,
+    games: t.games
   }));
 
-  // 2. Breakdown by Category
-  const byCategory: Record<string, { games: number; totalScore: number; totalTime: number; correct: number; totalQ: number }> = {};
-
-  // 3. Breakdown by Difficulty
-  const byDifficulty: Record<string, { games: number; totalScore: number; totalTime: number; correct: number; totalQ: number }> = {};
-
-  userScores.forEach(s => {
-    // Init Category
-    const cat = s.category || 'Unknown';
-    if (!byCategory[cat]) byCategory[cat] = { games: 0, totalScore: 0, totalTime: 0, correct: 0, totalQ: 0 };
-    byCategory[cat].games++;
-    byCategory[cat].totalScore += s.score;
-    byCategory[cat].totalTime += s.avgTime; // Storing sum of averages to average later
-    byCategory[cat].correct += s.correctCount;
-    byCategory[cat].totalQ += (s.correctCount + s.errorCount);
-
-    // Init Difficulty
-    const diff = s.difficulty || 'Unknown';
-    if (!byDifficulty[diff]) byDifficulty[diff] = { games: 0, totalScore: 0, totalTime: 0, correct: 0, totalQ: 0 };
-    byDifficulty[diff].games++;
-    byDifficulty[diff].totalScore += s.score;
-    byDifficulty[diff].totalTime += s.avgTime;
-    byDifficulty[diff].correct += s.correctCount;
-    byDifficulty[diff].totalQ += (s.correctCount + s.errorCount);
-  });
-
-  // Helper to process aggregations
-  const processBreakdown = (obj: any) => {
-    return Object.keys(obj).map(key => {
-      const d = obj[key];
-      return {
-        key,
-        games: d.games,
-        avgScore: Math.round(d.totalScore / d.games),
-        avgTimePerQuestion: parseFloat((d.totalTime / d.games).toFixed(2)),
-        accuracy: d.totalQ > 0 ? Math.round((d.correct / d.totalQ) * 100) : 0,
-        errors: d.totalQ - d.correct
-      };
-    });
-  };
+  // 2. Breakdown by Category / 3. by Difficulty
+  const processBreakdown = (items: AnalyticsBreakdown[]) => items.map(d => ({
+    key: d.key,
+    games: d.games,
+    avgScore: d.avg_score ?? 0,
+    avgTimePerQuestion: d.avg_time_per_question ?? 0,
+    accuracy: d.accuracy ?? 0,
+    errors: d.errors
+  }));
 
   return {
     history, // For Chart
-    byCategory: processBreakdown(byCategory),
-    byDifficulty: processBreakdown(byDifficulty),
-    totalGames: userScores.length
+    byCategory: processBreakdown(analytics.by_category),
+    byDifficulty: processBreakdown(analytics.by_difficulty),
+    totalGames: analytics.totals.games,
+    streaks: analytics.streaks
   };
 };
 
@@ -238,6 +387,14 @@ export const uploadAvatar = async (file: File): Promise<string> => {
   return result.url;
 };
 
+// Avatars uploaded by the backend live at .../avatars/<user>/<hash>/<size>.webp
+// with 64, 128 and 500 px renditions. Pick the smallest one that fits the
+// element instead of downloading the 500px image for a thumbnail.
+export const avatarUrl = (url: string | undefined, size: 64 | 128 | 500 = 500): string | undefined => {
+  if (!url) return url;
+  return url.replace(/\/(64|128|500)\.(webp|avif)$/, `/${size}.$2`);
+};
+
 // --- PROGRESS MANAGEMENT (NEW) ---
 
 export const getUserProgress = async (): Promise<import('../types').CategoryProgress[]> => {
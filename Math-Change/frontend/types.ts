@@ -30,6 +30,7 @@ export interface Question {
 export interface ScoreRecord {
   id: string;
   user: string;
+  user_id?: string; // set by the server from the authenticated user
   score: number;
   correctCount: number;
   errorCount: number;
@@ -37,6 +38,7 @@ export interface ScoreRecord {
   date: string;
   category?: string;
   difficulty?: string;
+  idempotency_key?: string; // client key of the game, a replay with the same key is not saved twice
 }
 
 export interface GameStats {